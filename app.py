@@ -24,6 +24,7 @@ Requirements:
 
 #
 # Library Imports
+import json
 import logging
 import os
 import sys
@@ -34,12 +35,15 @@ import certifi
 from dotenv import load_dotenv
 from flask import (
     Flask,
+    Response,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
     send_file,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_bcrypt import Bcrypt
@@ -53,6 +57,7 @@ from package.auth_functions import (
     query_user_by_id,
     register_user,
 )
+from package.cache_functions import clear_request_cache, document_cache_stats
 from package.chain_functions import (
     add_chain_to_data,
     add_rule_to_data,
@@ -61,11 +66,18 @@ from package.chain_functions import (
     delete_rule_from_data,
     reorder_chain_rule_in_data,
 )
+from package.collection_functions import (
+    delete_collection_profile,
+    get_collection_profile,
+    list_collection_profiles,
+    save_collection_profile,
+)
 from package.data_file_functions import (
     add_extra_items,
     add_hostname,
     create_backup,
     delete_user_data_file,
+    ensure_user_indexes,
     get_extra_items,
     get_system_name,
     initialize_data_dir,
@@ -73,14 +85,17 @@ from package.data_file_functions import (
     list_snapshots,
     list_user_files,
     list_user_keys,
+    migrate_user_snapshots,
     process_upload,
     read_user_data_file,
+    restore_snapshot,
     tag_snapshot,
+    upgrade_user_data,
+    upgrade_user_data_files,
     validate_mongodb_connection,
-    write_user_command_conf_file,
     write_user_data_file,
 )
-from package.diff_functions import process_diff
+from package.diff_functions import process_diff, snapshot_timeline
 from package.filter_functions import (
     add_filter_rule_to_data,
     add_filter_to_data,
@@ -89,29 +104,44 @@ from package.filter_functions import (
     delete_filter_rule_from_data,
     reorder_filter_rule_in_data,
 )
+from package.fleet_functions import FLEET_ACTIONS, fleet_push, list_fleet_targets
 from package.flowtable_functions import (
     add_flowtable_to_data,
     delete_flowtable_from_data,
     list_flowtables,
 )
-from package.generate_config import download_json_data, generate_config
+from package.generate_config import (
+    download_json_data,
+    generate_config,
+    iter_config,
+    iter_config_text,
+)
 from package.group_funtions import (
     add_group_to_data,
     assemble_detail_list_of_groups,
     delete_group_from_data,
 )
+from package.import_functions import fetch_firewall_commands, import_firewall_config
 from package.interface_functions import (
     add_interface_to_data,
     delete_interface_from_data,
     list_interfaces,
 )
+from package.job_functions import DEVICE_ACTIONS, get_device_job, submit_device_job
 from package.mongo_converter import mongo_converter
 from package.napalm_ssh_functions import (
-    commit_to_firewall,
-    get_diffs_from_firewall,
-    run_operational_command,
+    sse_event,
+    stream_operational_command,
     test_connection,
 )
+from package.reachability_functions import check_reachability
+from package.rule_stats_functions import (
+    never_hit_rules,
+    rank_rules_by_hits,
+    rule_hit_collector_status,
+    start_rule_hit_collector,
+    stop_rule_hit_collector,
+)
 from package.telemetry_functions import telemetry_instance
 
 # Set SSL certificate file path
@@ -209,6 +239,20 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(80), nullable=False)
 
 
+@app.teardown_request
+def teardown_request_cache(exception):
+    """
+    Drop the per-request firewall document cache at the end of each request.
+
+    Args:
+        exception: Unhandled exception raised by the request, if any
+
+    Returns:
+        None
+    """
+    clear_request_cache()
+
+
 @login_manager.user_loader
 def load_user(user_id):
     """
@@ -1398,9 +1442,10 @@ def configuration_push():
 
     For POST requests:
     - Creates connection string with credentials
-    - Generates and writes config file
-    - Performs requested action (show usage, view diffs, commit)
-    - Renders push template with results
+    - Submits the requested action (show usage, view diffs, commit, run a
+      collection profile) as a background job, with the generated
+      configuration written to the job's own command file
+    - Renders push template, which polls /device_job for the results
 
     For GET requests:
     - Checks if hostname is configured
@@ -1430,21 +1475,34 @@ def configuration_push():
         if "ssh_key_name" in request.form and request.form["ssh_key_name"]:
             session["ssh_keyname"] = request.form["ssh_key_name"].replace(".key", "")
 
-        # Include 'delete firewall' before set commands
-        message, config = generate_config(session)
-        if "delete_before_set" in request.form:
-            write_user_command_conf_file(session, config, delete=True)
-        else:
-            write_user_command_conf_file(session, config, delete=False)
-
-        if request.form["action"] == "Run Operational Command":
-            message = run_operational_command(
-                connection_string, session, request.form["op_command"]
+        # A collection profile runs all of its commands over one session.
+        op_commands = request.form.get("op_command")
+        if request.form["action"] == "Run Collection Profile":
+            op_commands = get_collection_profile(
+                session, request.form.get("profile_name", "")
             )
-        elif request.form["action"] == "View Diffs":
-            message = get_diffs_from_firewall(connection_string, session)
-        elif request.form["action"] == "Commit":
-            message = commit_to_firewall(connection_string, session)
+            if op_commands is None:
+                flash("Select a collection profile.", "warning")
+                return redirect(url_for("configuration_push"))
+
+        # Device actions run as background jobs polled by the page, so the
+        #   request returns without waiting for the firewall.
+        job_id = None
+        if request.form["action"] in DEVICE_ACTIONS:
+            # The configuration is streamed to the job's own command file as
+            #   it is generated, optionally after 'delete firewall'.
+            job_id = submit_device_job(
+                request.form["action"],
+                connection_string,
+                dict(session),
+                op_commands,
+                delta="delta_push" in request.form,
+                command_list=iter_config(session),
+                delete="delete_before_set" in request.form,
+            )
+            message = f"{request.form['action']} queued."
+        else:
+            message, config = generate_config(session)
         file_list = list_user_files(session)
         key_list = list_user_keys(session)
         snapshot_list = list_snapshots(session)
@@ -1466,7 +1524,10 @@ def configuration_push():
             ssh_pass=session["ssh_pass"],
             ssh_keyname=session.get("ssh_keyname", ""),
             key_list=key_list,
+            collection_profiles=list_collection_profiles(session),
+            profile_name=request.form.get("profile_name", ""),
             message=message,
+            job_id=job_id,
             username=session["username"],
         )
 
@@ -1493,11 +1554,320 @@ def configuration_push():
             ssh_pass=session.get("ssh_pass", ""),
             ssh_keyname=session.get("ssh_keyname", ""),
             key_list=key_list,
+            collection_profiles=list_collection_profiles(session),
             message=message,
             username=session["username"],
         )
 
 
+@app.route("/collection_profile_save", methods=["POST"])
+@login_required
+def collection_profile_save():
+    """
+    Handle saving of a collection profile.
+
+    Endpoint that saves a named list of operational commands to run
+    together over one SSH session.  Supports POST method only.
+    Requires user to be logged in.
+
+    Args:
+        None
+
+    Returns:
+        Response: Redirect to configuration push page
+    """
+    save_collection_profile(session, request)
+
+    return redirect(url_for("configuration_push"))
+
+
+@app.route("/collection_profile_delete", methods=["POST"])
+@login_required
+def collection_profile_delete():
+    """
+    Handle deletion of a saved collection profile.
+
+    Endpoint that deletes one of the user's collection profiles.  Supports
+    POST method only.  Requires user to be logged in.
+
+    Args:
+        None
+
+    Returns:
+        Response: Redirect to configuration push page
+    """
+    delete_collection_profile(session, request)
+
+    return redirect(url_for("configuration_push"))
+
+
+@app.route("/device_job/<job_id>", methods=["GET"])
+@login_required
+def device_job(job_id):
+    """
+    Handle device job polling requests.
+
+    Endpoint that returns the state of a background device job submitted by
+    the current user.  Supports GET method only.
+    Requires user to be logged in.
+
+    Args:
+        job_id (str): Job identifier
+
+    Returns:
+        Response: JSON job state and result, or 404 if the job does not exist
+    """
+    job = get_device_job(job_id, session["username"])
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+
+    return jsonify(job)
+
+
+@app.route("/firewall_reachability", methods=["GET"])
+@login_required
+def firewall_reachability():
+    """
+    Handle firewall reachability polling requests.
+
+    Endpoint that returns the cached reachability of the selected firewall,
+    for the push page to update its connection status once the background
+    probe has finished.  Supports GET method only.
+    Requires user to be logged in.
+
+    Args:
+        None
+
+    Returns:
+        Response: JSON {"hostname", "port", "reachable"} with reachable
+                  null until the firewall has been probed
+    """
+    hostname = session.get("hostname", "None")
+    port = session.get("port", "None")
+    reachable = None
+    if hostname != "None":
+        reachable = check_reachability(hostname, port)
+
+    return jsonify({"hostname": hostname, "port": port, "reachable": reachable})
+
+
+@app.route("/operational_command_stream", methods=["POST"])
+@login_required
+def operational_command_stream():
+    """
+    Handle streamed operational command requests.
+
+    Endpoint that runs an operational command on the firewall and streams its
+    output as Server-Sent Events while it arrives.  Supports POST method
+    only, so a link or image on another site cannot run a command.
+    Requires user to be logged in.
+
+    The credentials are taken from the form, never from the session, and
+    are cached to the session as configuration_push does.  The output is
+    capped by OP_STREAM_MAX_BYTES and OP_STREAM_MAX_SECONDS.
+
+    Args:
+        None
+
+    Returns:
+        Response: text/event-stream of output, truncated, error and done
+                  events, or 400 if no command or credentials are given
+    """
+    op_command = request.form.get("op_command", "").strip()
+
+    if not op_command or not request.form.get("username"):
+        return jsonify({"error": "Command and SSH credentials are required."}), 400
+
+    session["ssh_user"] = request.form["username"]
+    session["ssh_pass"] = request.form.get("password", "")
+    if request.form.get("ssh_key_name"):
+        session["ssh_keyname"] = request.form["ssh_key_name"].replace(".key", "")
+    ssh_key_name = request.form.get("ssh_key_name")
+
+    connection_string = {
+        "hostname": session["hostname"],
+        "username": session["ssh_user"],
+        "password": session.get("ssh_pass", ""),
+        "port": session["port"],
+    }
+    if ssh_key_name:
+        connection_string["ssh_key_name"] = ssh_key_name
+
+    events = stream_operational_command(connection_string, dict(session), op_command)
+
+    return Response(
+        stream_with_context(sse_event(event, data) for event, data in events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/fleet_push", methods=["GET", "POST"])
+@login_required
+def fleet_push_view():
+    """
+    Handle fleet push requests.
+
+    Endpoint that views diffs or commits the configurations of several
+    firewalls at once.  Supports both GET and POST methods.
+    Requires user to be logged in.
+
+    For POST requests:
+    - Validates that firewalls and a View Diffs or Commit action are selected
+    - Caches the SSH credentials to the session
+    - Streams one JSON line per firewall as each device finishes
+
+    For GET requests:
+    - Renders the fleet push template with the firewalls and their hostnames
+
+    Args:
+        None
+
+    Returns:
+        Response: Rendered fleet push template, streamed results or redirect
+    """
+    if request.method == "POST":
+        firewalls = request.form.getlist("firewalls")
+        action = request.form.get("action")
+
+        if not firewalls or action not in FLEET_ACTIONS:
+            flash("Select at least one firewall and an action.", "warning")
+            return redirect(url_for("fleet_push_view"))
+
+        connection_string = {
+            "username": request.form["username"],
+            "password": request.form["password"],
+        }
+        if "ssh_key_name" in request.form and request.form["ssh_key_name"]:
+            connection_string["ssh_key_name"] = request.form["ssh_key_name"]
+
+        # Cache SSH user/pass to session.
+        session["ssh_user"] = request.form["username"]
+        session["ssh_pass"] = request.form["password"]
+        if "ssh_key_name" in request.form and request.form["ssh_key_name"]:
+            session["ssh_keyname"] = request.form["ssh_key_name"].replace(".key", "")
+
+        results = fleet_push(
+            connection_string,
+            dict(session),
+            firewalls,
+            action,
+            delete="delete_before_set" in request.form,
+            delta="delta_push" in request.form,
+        )
+
+        return Response(
+            stream_with_context(json.dumps(result) + "\n" for result in results),
+            mimetype="application/x-ndjson",
+        )
+
+    else:
+        file_list = list_user_files(session)
+        key_list = list_user_keys(session)
+        snapshot_list = list_snapshots(session)
+
+        return render_template(
+            "fleet_push.html",
+            file_list=file_list,
+            snapshot_list=snapshot_list,
+            firewall_name=session.get("firewall_name"),
+            targets=list_fleet_targets(session),
+            ssh_user_name=session.get("ssh_user", ""),
+            ssh_pass=session.get("ssh_pass", ""),
+            ssh_keyname=session.get("ssh_keyname", ""),
+            key_list=key_list,
+            username=session["username"],
+        )
+
+
+@app.route("/rule_hits", methods=["GET", "POST"])
+@login_required
+def rule_hits():
+    """
+    Handle rule hit requests.
+
+    Endpoint that shows the rules of the user's firewalls ranked by hits and
+    the rules that were never hit, from the collected rule counters.
+    Supports both GET and POST methods.  Requires user to be logged in.
+
+    For POST requests:
+    - Starts collecting the rule counters of every configured firewall with
+      the submitted credentials, or stops collecting
+    - Caches the SSH credentials to the session
+
+    For GET requests:
+    - Renders the rule hits template for the last 'hours' hours (24, 168 or
+      720, default 24)
+
+    Args:
+        None
+
+    Returns:
+        Response: Rendered rule hits template or redirect
+    """
+    if request.method == "POST":
+        if request.form.get("action") == "Stop Collecting":
+            stop_rule_hit_collector(session["username"])
+            flash("Stopped collecting rule counters.", "success")
+            return redirect(url_for("rule_hits"))
+
+        connection_string = {
+            "username": request.form["username"],
+            "password": request.form["password"],
+        }
+        if "ssh_key_name" in request.form and request.form["ssh_key_name"]:
+            connection_string["ssh_key_name"] = request.form["ssh_key_name"]
+
+        # Cache SSH user/pass to session.
+        session["ssh_user"] = request.form["username"]
+        session["ssh_pass"] = request.form["password"]
+        if "ssh_key_name" in request.form and request.form["ssh_key_name"]:
+            session["ssh_keyname"] = request.form["ssh_key_name"].replace(".key", "")
+
+        start_rule_hit_collector(connection_string, dict(session))
+        flash(
+            "Collecting rule counters.  The first collection sets the baseline; "
+            "hits are shown from the second one.",
+            "success",
+        )
+        return redirect(url_for("rule_hits"))
+
+    else:
+        try:
+            hours = int(request.args.get("hours", 24))
+        except ValueError:
+            hours = 24
+        if hours not in (24, 168, 720):
+            hours = 24
+        since = int((datetime.now() - timedelta(hours=hours)).timestamp())
+
+        status = rule_hit_collector_status(session["username"])
+        if status["time"] is not None:
+            status["time"] = datetime.fromtimestamp(status["time"]).strftime(
+                "%m-%d-%Y %H:%M:%S"
+            )
+
+        file_list = list_user_files(session)
+        key_list = list_user_keys(session)
+        snapshot_list = list_snapshots(session)
+
+        return render_template(
+            "rule_hits.html",
+            file_list=file_list,
+            snapshot_list=snapshot_list,
+            firewall_name=session.get("firewall_name"),
+            hours=hours,
+            ranked_rules=rank_rules_by_hits(session["username"], since, limit=50),
+            unused_rules=never_hit_rules(session["username"], since),
+            collector=status,
+            ssh_user_name=session.get("ssh_user", ""),
+            ssh_pass=session.get("ssh_pass", ""),
+            ssh_keyname=session.get("ssh_keyname", ""),
+            key_list=key_list,
+            username=session["username"],
+        )
+
+
 @app.route("/create_config", methods=["POST"])
 @login_required
 def create_config():
@@ -1520,6 +1890,7 @@ def create_config():
         return redirect(url_for("index"))
     else:
         user_data = {}
+        upgrade_user_data(user_data)
 
         session["firewall_name"] = request.form["config_name"]
         write_user_data_file(
@@ -1561,7 +1932,6 @@ def display_config():
         )
 
     else:
-        snapshot_list = list_snapshots(session)
         message, config = generate_config(session)
 
         return render_template(
@@ -1601,7 +1971,6 @@ def snapshot_diff_choose():
         )
 
     else:
-        snapshot_list = list_snapshots(session)
         message, config = generate_config(session)
 
         return render_template(
@@ -1639,6 +2008,9 @@ def snapshot_diff_display():
         return render_template(
             "snapshot_diff_display.html",
             message=html,
+            snapshot_1=request.form["snapshot_1"],
+            snapshot_2=request.form["snapshot_2"],
+            view=request.form.get("view", "structural"),
         )
     else:
         file_list = list_user_files(session)
@@ -1667,6 +2039,31 @@ def snapshot_diff_display():
         )
 
 
+@app.route("/snapshot_timeline")
+@login_required
+def snapshot_timeline_summary():
+    """
+    Summarise how the selected firewall changed across its latest snapshots.
+
+    Endpoint that diffs each pair of consecutive snapshots in one pass.
+    Requires user to be logged in.
+
+    Query parameters:
+        last: Number of latest snapshots to include (default 50, 2 to 500)
+
+    Returns:
+        Response: JSON with the firewall name and one change summary per step,
+                  or an error if no firewall is selected
+    """
+    if "firewall_name" not in session:
+        return jsonify({"error": "No firewall selected."}), 400
+
+    last = min(max(request.args.get("last", 50, type=int), 2), 500)
+    steps = snapshot_timeline(session, last=last)
+
+    return jsonify({"firewall": session["firewall_name"], "steps": steps})
+
+
 @app.route("/snapshot_tag_create", methods=["GET", "POST"])
 @login_required
 def snapshot_tag_create():
@@ -1736,12 +2133,15 @@ def download_config():
     """
     Download the current firewall configuration as a text file.
 
+    The configuration is streamed to the client in chunks as it is generated,
+    so large rule sets are never held in memory as one string.
+
     Returns:
-        str: The configuration text with HTML line breaks converted to newlines
+        Response: Streamed plain text configuration, one command per line
     """
-    message, config = generate_config(session)
-
-    return message.replace("<br>", "\n")
+    return Response(
+        stream_with_context(iter_config_text(dict(session))), mimetype="text/plain"
+    )
 
 
 @app.route("/download_json")
@@ -1758,6 +2158,18 @@ def download_json():
     return json_data
 
 
+@app.route("/cache_stats")
+@login_required
+def cache_stats():
+    """
+    Report the process-wide firewall document cache counters.
+
+    Returns:
+        dict: JSON with hits, misses, evictions, entries, bytes and max_bytes
+    """
+    return document_cache_stats()
+
+
 @app.route("/select_firewall_config", methods=["POST"])
 @login_required
 def select_firewall_config():
@@ -1770,8 +2182,9 @@ def select_firewall_config():
     - Deleting snapshots
     - Viewing snapshot diffs
 
-    The function updates the session with the selected firewall name and
-    handles reading/writing snapshot data as needed.
+    The function updates the session with the selected firewall name,
+    restores a selected snapshot as the current configuration and creates
+    or deletes snapshots as needed.
 
     Returns:
         Response: Redirects to either snapshot diff view or config display
@@ -1794,8 +2207,12 @@ def select_firewall_config():
         session["firewall_name"] = request.form["file"]
         snapshot = "current"
 
-    # Execute a read to read the "snapshot" version into "current"
-    read_user_data_file(f"{session['data_dir']}/{session['firewall_name']}", snapshot)
+    # Restore the selected snapshot as "current"
+    if snapshot not in ["current", "create", "delete"]:
+        if not restore_snapshot(
+            f"{session['data_dir']}/{session['firewall_name']}", snapshot
+        ):
+            flash(f"Snapshot {snapshot} not found.", "danger")
 
     # If snapshot name is "create", then create a snapshot with date/time stamp
     if snapshot == "create":
@@ -1820,6 +2237,8 @@ def select_firewall_config():
 
     # Load firewall values to session
     session["hostname"], session["port"] = get_system_name(session)
+    if session["hostname"] != "None":
+        check_reachability(session["hostname"], session["port"])
 
     # Clear any previously cached values for SSH
     # B105 -- Intentional hardcoding of password to ""
@@ -1846,6 +2265,87 @@ def upload_json():
     return redirect(url_for("index"))
 
 
+@app.route("/configuration_import", methods=["GET", "POST"])
+@login_required
+def configuration_import():
+    """
+    Handle import of a running VyOS firewall configuration.
+
+    Endpoint that imports 'show configuration commands | match firewall'
+    output as a firewall configuration.  Supports both GET and POST methods.
+    Requires user to be logged in.
+
+    For POST requests:
+    - Validates the configuration name
+    - Fetches the commands from the router over SSH for the "Fetch from
+      Router" action, or takes the pasted commands
+    - Imports the commands and selects the imported configuration; an
+      existing configuration of the same name is only replaced when
+      "Replace existing configuration" is checked
+
+    For GET requests:
+    - Renders the import template
+
+    Args:
+        None
+
+    Returns:
+        Response: Rendered import template or redirect
+    """
+    if request.method == "POST":
+        firewall_name = request.form.get("config_name", "").strip()
+        if firewall_name == "" or "/" in firewall_name:
+            flash("Config name cannot be empty or contain '/'.", "danger")
+            return redirect(url_for("configuration_import"))
+
+        hostname = port = None
+        if request.form.get("action") == "Fetch from Router":
+            hostname = request.form["hostname"].strip()
+            port = request.form["port"].strip()
+            connection_string = {
+                "hostname": hostname,
+                "username": request.form["username"],
+                "password": request.form["password"],
+                "port": port,
+            }
+            if "ssh_key_name" in request.form and request.form["ssh_key_name"]:
+                connection_string["ssh_key_name"] = request.form["ssh_key_name"]
+
+            try:
+                lines = fetch_firewall_commands(connection_string, dict(session))
+            except Exception as e:
+                logging.exception(" |--X Could not fetch firewall configuration")
+                flash(f"Could not fetch configuration from {hostname}: {e}", "danger")
+                return redirect(url_for("configuration_import"))
+        else:
+            lines = request.form.get("config_commands", "").splitlines()
+
+        overwrite = request.form.get("overwrite") == "true"
+        if not import_firewall_config(
+            session, firewall_name, lines, hostname, port, overwrite
+        ):
+            return redirect(url_for("configuration_import"))
+
+        session["firewall_name"] = firewall_name
+        session["hostname"], session["port"] = get_system_name(session)
+
+        return redirect(url_for("display_config"))
+
+    else:
+        file_list = list_user_files(session)
+        key_list = list_user_keys(session)
+        snapshot_list = list_snapshots(session)
+
+        return render_template(
+            "configuration_import.html",
+            file_list=file_list,
+            snapshot_list=snapshot_list,
+            firewall_name=session.get("firewall_name"),
+            key_list=key_list,
+            username=session["username"],
+        )
+
+
 if __name__ == "__main__":
     # Read version from .version and display
     with open(".version", "r") as f:
@@ -1879,6 +2379,9 @@ if __name__ == "__main__":
     # If connection is successful, run converter to migrate data
     if validate_mongodb_connection(os.environ.get("MONGODB_URI")):
         mongo_converter()
+        ensure_user_indexes()
+        upgrade_user_data_files()
+        migrate_user_snapshots()
 
     # Convert all existing JSON config files to MongoDB format
 
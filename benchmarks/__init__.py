@@ -0,0 +1,5 @@
+"""
+    Benchmarks for the FW-GUI configuration pipeline.
+
+    See benchmarks/run_benchmarks.py.
+"""
@@ -0,0 +1,492 @@
+"""
+    Configuration Pipeline Benchmarks
+
+    This module times the configuration pipeline on synthetic firewall
+    documents so performance regressions can be measured.
+
+    Contains functions for:
+    - Generating synthetic firewall documents in the examples/example.json
+      schema with a given number of rules across chains, filters and groups
+    - Loading them into a mongomock-backed data store
+    - Timing generate_config, process_diff, update_schema,
+      parse_firewall_commands and the assemble_* helpers at each size
+    - Writing the results as JSON and comparing them against a baseline
+
+    Usage:
+        python -m benchmarks.run_benchmarks
+        python -m benchmarks.run_benchmarks --sizes 10,1000 --output results.json
+        python -m benchmarks.run_benchmarks --baseline baseline.json
+
+    With --baseline the exit status is 1 when the median time of any case
+    regressed by more than --max-regression (default 1.5x), so CI can gate on
+    it.
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import mongomock
+
+import package.data_file_functions as data_file_functions
+from package.cache_functions import (
+    document_cache_clear,
+    keyframe_cache_clear,
+    section_cache_clear,
+    sidebar_cache_clear,
+)
+from package.chain_functions import (
+    assemble_detail_list_of_chains,
+    assemble_list_of_chains,
+    assemble_list_of_rules,
+)
+from package.data_file_functions import update_schema, write_user_data_file
+from package.diff_functions import process_diff
+from package.filter_functions import (
+    assemble_detail_list_of_filters,
+    assemble_list_of_filter_rules,
+    assemble_list_of_filters,
+)
+from package.generate_config import generate_config, iter_config_lines
+from package.group_funtions import (
+    assemble_detail_list_of_groups,
+    assemble_list_of_groups,
+)
+from package.import_functions import parse_firewall_commands
+
+DEFAULT_SIZES = (10, 1000, 10000, 100000)
+DEFAULT_MAX_REGRESSION = 1.5
+
+BENCHMARK_USER = "benchmark"
+BENCHMARK_FIREWALL = "benchmark_fw"
+
+GROUP_TYPES = (
+    ("address-group", "10.{a}.{b}.1"),
+    ("network-group", "10.{a}.{b}.0/24"),
+    ("port-group", "{port}"),
+)
+FILTERS = ("input", "forward", "output")
+
+
+def _chain_rule(n):
+    """
+    Builds a chain rule exercising addresses, groups, ports and states.
+    """
+    rule = {
+        "description": f"Synthetic rule {n}.",
+        "action": ("accept", "drop", "reject")[n % 3],
+        "dest_address": f"10.{n // 256 % 256}.{n % 256}.0/24",
+        "dest_address_type": "address",
+        "dest_port": str(1024 + n % 60000),
+        "dest_port_type": "port",
+        "source_address": "",
+        "source_address_type": "address",
+        "source_port": "",
+        "source_port_type": "port",
+        "protocol": ("tcp", "udp", "icmp")[n % 3],
+    }
+    if n % 5 == 0:
+        rule["dest_address"] = f"group_{n % 7}"
+        rule["dest_address_type"] = "network_group"
+    if n % 4 == 0:
+        rule["state_est"] = True
+        rule["state_rel"] = True
+    if n % 10 == 0:
+        rule["logging"] = True
+
+    return rule
+
+
+def make_user_data(rules):
+    """
+    Generates a synthetic firewall document.
+
+    Args:
+        rules (int): Total number of rules.  Roughly 80% are chain rules,
+            10% filter rules and 10% group entries, split between IPv4 and
+            IPv6 and over one chain per 100 chain rules.
+
+    Returns:
+        dict: Firewall configuration in the examples/example.json schema
+    """
+    group_rules = max(1, rules // 10)
+    filter_rules = max(1, rules // 10)
+    chain_rules = max(1, rules - group_rules - filter_rules)
+    chains_count = max(1, chain_rules // 100)
+
+    user_data = {
+        "version": "1",
+        "system": {"hostname": "192.0.2.1", "port": "22"},
+        "extra-items": ["set system host-name 'benchmark'"],
+    }
+
+    for ip_version in ("ipv4", "ipv6"):
+        user_data[ip_version] = {"chains": {}, "groups": {}, "filters": {}}
+
+    # Chains and their rules
+    for n in range(chain_rules):
+        ip_version = "ipv4" if n % 4 else "ipv6"
+        chain_name = f"CHAIN_{n % chains_count}"
+        chains = user_data[ip_version]["chains"]
+        if chain_name not in chains:
+            chains[chain_name] = {
+                "rule-order": [],
+                "default": {
+                    "description": f"Synthetic chain {chain_name}.",
+                    "default_action": "drop",
+                },
+            }
+        rule_number = str((len(chains[chain_name]["rule-order"]) + 1) * 10)
+        chains[chain_name]["rule-order"].append(rule_number)
+        chains[chain_name][rule_number] = _chain_rule(n)
+
+    # Groups, several values each
+    for n in range(0, group_rules, 4):
+        ip_version = "ipv4" if n % 8 else "ipv6"
+        group_type, template = GROUP_TYPES[n // 4 % len(GROUP_TYPES)]
+        user_data[ip_version]["groups"][f"group_{n // 4}"] = {
+            "group_desc": f"Synthetic group {n // 4}",
+            "group_type": group_type,
+            "group_value": [
+                template.format(a=n // 256 % 256, b=(n + i) % 256, port=1024 + n + i)
+                for i in range(min(4, group_rules - n))
+            ],
+        }
+
+    # Filters jumping to the chains
+    for n in range(filter_rules):
+        ip_version = "ipv4" if n % 4 else "ipv6"
+        filter_name = FILTERS[n % len(FILTERS)]
+        filters = user_data[ip_version]["filters"]
+        if filter_name not in filters:
+            filters[filter_name] = {
+                "rule-order": [],
+                "description": f"{filter_name.capitalize()} Filter",
+                "default-action": "accept",
+                "log": False,
+                "rules": {},
+            }
+        rule_number = str((len(filters[filter_name]["rule-order"]) + 1) * 10)
+        filters[filter_name]["rule-order"].append(rule_number)
+        filters[filter_name]["rules"][rule_number] = {
+            "ip_version": ip_version,
+            "filter": filter_name,
+            "fw_chain": f"CHAIN_{n % chains_count}",
+            "description": f"Jump {n}",
+            "action": "jump",
+            "interface": f"eth{n % 4}",
+            "direction": "inbound",
+        }
+
+    return user_data
+
+
+def make_legacy_user_data(rules):
+    """
+    Generates a synthetic firewall document in the version 0 schema
+    ("tables" and "fw_table"), as converted by update_schema.
+
+    Args:
+        rules (int): Total number of rules, as for make_user_data
+
+    Returns:
+        dict: Firewall configuration in the version 0 schema
+    """
+    user_data = make_user_data(rules)
+    user_data["version"] = "0"
+    for ip_version in ("ipv4", "ipv6"):
+        user_data[ip_version]["tables"] = user_data[ip_version].pop("chains")
+        for filter_data in user_data[ip_version]["filters"].values():
+            for rule in filter_data["rules"].values():
+                rule["fw_table"] = rule.pop("fw_chain")
+
+    return user_data
+
+
+def _count_rules(user_data):
+    """
+    Counts chain rules, filter rules and group values of a document.
+    """
+    count = 0
+    for ip_version in ("ipv4", "ipv6"):
+        for chain in user_data[ip_version]["chains"].values():
+            count += len(chain["rule-order"])
+        for filter_data in user_data[ip_version]["filters"].values():
+            count += len(filter_data["rule-order"])
+        for group in user_data[ip_version]["groups"].values():
+            count += len(group["group_value"])
+
+    return count
+
+
+def _clear_caches():
+    document_cache_clear()
+    keyframe_cache_clear()
+    section_cache_clear()
+    sidebar_cache_clear()
+
+
+def setup_store(user_data):
+    """
+    Points the data store at a fresh mongomock client holding the document
+    as the current configuration and two snapshots that differ in one rule.
+
+    Args:
+        user_data (dict): Firewall configuration
+
+    Returns:
+        dict: Session for the benchmark firewall
+    """
+    os.environ["MONGODB_DATABASE"] = "benchmark"
+    data_file_functions._mongo_client = mongomock.MongoClient()
+    data_file_functions._indexed_collections.clear()
+    _clear_caches()
+
+    filename = f"data/{BENCHMARK_USER}/{BENCHMARK_FIREWALL}"
+    write_user_data_file(filename, copy.deepcopy(user_data))
+    write_user_data_file(filename, copy.deepcopy(user_data), "before")
+
+    changed = copy.deepcopy(user_data)
+    chain = next(iter(changed["ipv4"]["chains"].values()), None)
+    if chain is not None and chain["rule-order"]:
+        chain[chain["rule-order"][0]]["description"] = "Changed."
+    write_user_data_file(filename, changed, "after")
+
+    return {
+        "data_dir": f"data/{BENCHMARK_USER}",
+        "firewall_name": BENCHMARK_FIREWALL,
+        "username": BENCHMARK_USER,
+    }
+
+
+def _cases(session, rules):
+    """
+    Lists the benchmark cases for one document size.
+
+    Returns:
+        list: (name, function, setup) tuples; setup runs before every
+              timed call and is not timed
+    """
+    diff_request = SimpleNamespace(form={"snapshot_1": "before", "snapshot_2": "after"})
+    legacy = make_legacy_user_data(rules)
+    legacy_copy = {}
+    command_lines = "\n".join(iter_config_lines(make_user_data(rules))).splitlines()
+
+    def copy_legacy():
+        legacy_copy["data"] = copy.deepcopy(legacy)
+
+    return [
+        ("generate_config (cold)", lambda: generate_config(session), _clear_caches),
+        ("generate_config (warm)", lambda: generate_config(session), None),
+        ("process_diff", lambda: process_diff(session, diff_request), _clear_caches),
+        ("update_schema", lambda: update_schema(legacy_copy["data"]), copy_legacy),
+        (
+            "parse_firewall_commands",
+            lambda: parse_firewall_commands(command_lines),
+            None,
+        ),
+        (
+            "assemble_detail_list_of_chains",
+            lambda: assemble_detail_list_of_chains(session),
+            None,
+        ),
+        ("assemble_list_of_chains", lambda: assemble_list_of_chains(session), None),
+        ("assemble_list_of_rules", lambda: assemble_list_of_rules(session), None),
+        (
+            "assemble_detail_list_of_filters",
+            lambda: assemble_detail_list_of_filters(session),
+            None,
+        ),
+        ("assemble_list_of_filters", lambda: assemble_list_of_filters(session), None),
+        (
+            "assemble_list_of_filter_rules",
+            lambda: assemble_list_of_filter_rules(session),
+            None,
+        ),
+        (
+            "assemble_detail_list_of_groups",
+            lambda: assemble_detail_list_of_groups(session),
+            None,
+        ),
+        ("assemble_list_of_groups", lambda: assemble_list_of_groups(session), None),
+    ]
+
+
+def time_case(function, setup=None, repeat=5):
+    """
+    Times a function.
+
+    Args:
+        function: Function to time
+        setup (optional): Function run untimed before every call
+        repeat (int, optional): Number of timed calls. Defaults to 5.
+
+    Returns:
+        dict: min, median and mean seconds and the number of calls
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=None, cases=None):
+    """
+    Runs every benchmark case at every size.
+
+    Args:
+        sizes (list, optional): Rule counts. Defaults to DEFAULT_SIZES.
+        repeat (int, optional): Timed calls per case. Defaults to 5 below
+            10k rules and 1 above.
+        cases (list, optional): Only run cases whose name contains one of
+            these strings. Defaults to None (all cases).
+
+    Returns:
+        dict: "metadata" and a "results" list with one entry per case and
+              size (name, size, generated rule count, repeat, and min, median
+              and mean seconds)
+    """
+    results = []
+    for rules in sizes:
+        user_data = make_user_data(rules)
+        session = setup_store(user_data)
+        case_repeat = repeat or (5 if rules < 10000 else 1)
+
+        for name, function, setup in _cases(session, rules):
+            if cases and not any(case in name for case in cases):
+                continue
+            timing = time_case(function, setup, case_repeat)
+            results.append(
+                {
+                    "name": name,
+                    "size": rules,
+                    "rules": _count_rules(user_data),
+                    **timing,
+                }
+            )
+            print(
+                f"{name:<34} {rules:>7} rules  median {timing['median'] * 1000:10.2f} ms",
+                file=sys.stderr,
+            )
+
+    return {
+        "metadata": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": list(sizes),
+        },
+        "results": results,
+    }
+
+
+def compare_to_baseline(report, baseline, max_regression=DEFAULT_MAX_REGRESSION):
+    """
+    Compares benchmark results against a baseline report.
+
+    Args:
+        report (dict): Output of run_benchmarks
+        baseline (dict): Earlier output of run_benchmarks
+        max_regression (float, optional): Allowed ratio of the new median to
+            the baseline median. Defaults to DEFAULT_MAX_REGRESSION.
+
+    Returns:
+        list: One dict per regressed case (name, size, baseline, median and
+              ratio); cases missing from the baseline are skipped
+    """
+    baseline_medians = {
+        (result["name"], result["size"]): result["median"]
+        for result in baseline["results"]
+    }
+
+    regressions = []
+    for result in report["results"]:
+        previous = baseline_medians.get((result["name"], result["size"]))
+        if not previous:
+            continue
+        ratio = result["median"] / previous
+        if ratio > max_regression:
+            regressions.append(
+                {
+                    "name": result["name"],
+                    "size": result["size"],
+                    "baseline": previous,
+                    "median": result["median"],
+                    "ratio": ratio,
+                }
+            )
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the FW-GUI configuration pipeline on synthetic rulesets."
+    )
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="Comma separated rule counts (default: %(default)s)",
+    )
+    parser.add_argument("--repeat", type=int, help="Timed calls per case")
+    parser.add_argument(
+        "--case",
+        action="append",
+        dest="cases",
+        help="Only run cases whose name contains this string (repeatable)",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=DEFAULT_MAX_REGRESSION,
+        help="Allowed median slowdown against the baseline (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    report = run_benchmarks(sizes, args.repeat, args.cases)
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.max_regression)
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['name']} ({regression['size']} rules): "
+                f"{regression['ratio']:.2f}x baseline",
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,780 @@
+"""
+    Cache Support Functions
+
+    This module provides the caches shared by the data access functions so that
+    repeated reads of the same firewall document do not each cost a MongoDB
+    round trip.
+
+    Contains functions for:
+    - Building cache keys from data file paths
+    - Storing and retrieving documents in the per-request cache (flask.g)
+    - Storing and retrieving documents in the process-wide LRU cache
+    - Invalidating cached documents when a firewall is written or deleted
+    - Reporting hit/miss counters for the process-wide cache
+    - Storing materialized snapshot keyframes for snapshot reconstruction
+    - Storing the sidebar model (firewall and snapshot lists) per user and
+      firewall
+    - Storing generated configuration lines per configuration section
+    - Storing rendered snapshot diffs keyed by the content of both snapshots
+    - Storing decrypted SSH keys in memory for a short time
+    - Storing the result of the last reachability probe of each firewall
+
+    Documents are stored BSON encoded so every reader gets its own copy to
+    mutate without affecting the cached value or other readers.
+
+    The process-wide cache is validated against the document revision
+    ("rev_epoch", "rev") kept in MongoDB by write_user_data_file, so an entry
+    is only served while it matches the revision stored in the database.
+"""
+
+import copy
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+from flask import g, has_request_context
+
+# Process-wide LRU of parsed firewall documents, bounded by total bytes.
+#   key -> (revision, BSON bytes)
+_document_cache = OrderedDict()
+_document_cache_bytes = 0
+_document_cache_lock = threading.Lock()
+_document_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+# Small LRU of materialized snapshot keyframes, bounded by entry count.
+#   key -> BSON bytes
+_keyframe_cache = OrderedDict()
+_keyframe_cache_lock = threading.Lock()
+
+# Sidebar model (file_list, snapshot_list) per (collection_name, firewall).
+#   Entries expire after SIDEBAR_CACHE_TTL seconds so a change made by
+#   another process is picked up.
+#   key -> (expires, model)
+_sidebar_cache = {}
+_sidebar_cache_lock = threading.Lock()
+
+# LRU of generated configuration lines, keyed by a content hash of the
+#   section they were generated from, bounded by entry count.
+#   key -> tuple of lines
+_section_cache = OrderedDict()
+_section_cache_lock = threading.Lock()
+
+# LRU of rendered snapshot diffs, keyed by a hash of the content of both
+#   snapshots, bounded by total characters.
+#   key -> html
+_diff_cache = OrderedDict()
+_diff_cache_size = 0
+_diff_cache_lock = threading.Lock()
+
+# Decrypted SSH private keys, kept for SSH_KEY_CACHE_TTL seconds so repeated
+#   connections do not decrypt the key file again.  Entries are keyed by an
+#   HMAC of the key file and the passphrase that decrypted it, with a key
+#   unique to this process, so only a caller holding the passphrase can hit.
+#   key -> (expires, key bytes)
+_ssh_key_cache = {}
+_ssh_key_cache_lock = threading.Lock()
+_ssh_key_cache_secret = os.urandom(32)
+
+# Result of the last TCP reachability probe per (hostname, port), kept for
+#   REACHABILITY_CACHE_TTL seconds (see reachability_functions).
+#   key -> (expires, reachable, checked)
+_reachability_cache = {}
+_reachability_cache_lock = threading.Lock()
+
+
+def _diff_cache_max_size():
+    try:
+        return int(os.environ.get("DIFF_CACHE_MAX_BYTES"))
+    except Exception:
+        return 32 * 1024 * 1024
+
+
+def _document_cache_max_bytes():
+    try:
+        return int(os.environ.get("DOCUMENT_CACHE_MAX_BYTES"))
+    except Exception:
+        return 64 * 1024 * 1024
+
+
+def _keyframe_cache_max_entries():
+    try:
+        return int(os.environ.get("SNAPSHOT_KEYFRAME_CACHE_SIZE"))
+    except Exception:
+        return 16
+
+
+def _section_cache_max_entries():
+    try:
+        return int(os.environ.get("CONFIG_SECTION_CACHE_SIZE"))
+    except Exception:
+        return 4096
+
+
+def _sidebar_cache_ttl():
+    try:
+        return float(os.environ.get("SIDEBAR_CACHE_TTL"))
+    except Exception:
+        return 30.0
+
+
+def _reachability_cache_ttl():
+    try:
+        return float(os.environ.get("REACHABILITY_CACHE_TTL"))
+    except Exception:
+        return 90.0
+
+
+def _ssh_key_cache_ttl():
+    try:
+        return float(os.environ.get("SSH_KEY_CACHE_TTL"))
+    except Exception:
+        return 60.0
+
+
+def cache_key(filename, snapshot="current"):
+    """
+    Builds the cache key for a firewall document.
+
+    Args:
+        filename (str): Path in format 'data/<user>/<firewall_name>[/<snapshot>]'
+        snapshot (str, optional): Snapshot name. Defaults to "current".
+
+    Returns:
+        tuple: (collection_name, firewall, snapshot)
+    """
+    parts = filename.split("/")
+
+    return (parts[1], parts[2], snapshot)
+
+
+def get_request_cache():
+    """
+    Gets the document cache for the current request.
+
+    Returns:
+        dict: Cache stored on flask.g, or None when called outside of a
+              request (startup, converters, background threads).
+    """
+    if not has_request_context():
+        return None
+
+    if "user_data_cache" not in g:
+        g.user_data_cache = {}
+
+    return g.user_data_cache
+
+
+def request_cache_get(key):
+    """
+    Gets a copy of a document from the per-request cache.
+
+    Args:
+        key (tuple): Key built by cache_key()
+
+    Returns:
+        dict: Copy of the cached document, or None if not cached
+    """
+    cache = get_request_cache()
+    if cache is None or key not in cache:
+        return None
+
+    return bson.decode(cache[key])
+
+
+def request_cache_set(key, data):
+    """
+    Stores a document in the per-request cache.
+
+    Args:
+        key (tuple): Key built by cache_key()
+        data (dict): Document to cache
+
+    Returns:
+        None
+    """
+    cache = get_request_cache()
+    if cache is not None:
+        cache[key] = bson.encode(data)
+
+    return
+
+
+def clear_request_cache():
+    """
+    Drops the per-request cache. Registered as a teardown handler so a cache
+    never outlives the request that filled it.
+
+    Returns:
+        None
+    """
+    g.pop("user_data_cache", None)
+
+    return
+
+
+def invalidate_firewall(collection_name, firewall):
+    """
+    Removes every cached document (current and snapshots) for a firewall.
+
+    Args:
+        collection_name (str): User's collection name
+        firewall (str): Firewall name
+
+    Returns:
+        None
+    """
+    cache = get_request_cache()
+    if cache is not None:
+        for key in list(cache):
+            if key[0] == collection_name and key[1] == firewall:
+                del cache[key]
+
+    return
+
+
+def document_cache_get(key, revision):
+    """
+    Gets a copy of a document from the process-wide cache.
+
+    Args:
+        key (tuple): Key built by cache_key()
+        revision (tuple): Revision currently stored in MongoDB
+
+    Returns:
+        dict: Copy of the cached document if it is cached at the given
+              revision, otherwise None
+    """
+    with _document_cache_lock:
+        entry = _document_cache.get(key)
+        if entry is None or entry[0] != revision:
+            _document_cache_stats["misses"] += 1
+            return None
+        _document_cache.move_to_end(key)
+        _document_cache_stats["hits"] += 1
+        raw = entry[1]
+
+    return bson.decode(raw)
+
+
+def document_cache_peek(key):
+    """
+    Gets the revision and a copy of a cached document without touching the
+    hit/miss counters or the LRU order.
+
+    Args:
+        key (tuple): Key built by cache_key()
+
+    Returns:
+        tuple: (revision, document), or (None, None) if not cached
+    """
+    with _document_cache_lock:
+        entry = _document_cache.get(key)
+        if entry is None:
+            return None, None
+        revision, raw = entry
+
+    return revision, bson.decode(raw)
+
+
+def document_cache_set(key, revision, data):
+    """
+    Stores a document in the process-wide cache, evicting the least recently
+    used documents until the cache fits in DOCUMENT_CACHE_MAX_BYTES.
+
+    Args:
+        key (tuple): Key built by cache_key()
+        revision (tuple): Revision of the document in MongoDB
+        data (dict): Document to cache
+
+    Returns:
+        None
+    """
+    global _document_cache_bytes
+
+    raw = bson.encode(data)
+    max_bytes = _document_cache_max_bytes()
+
+    with _document_cache_lock:
+        old = _document_cache.pop(key, None)
+        if old is not None:
+            _document_cache_bytes -= len(old[1])
+
+        if len(raw) > max_bytes:
+            return
+
+        _document_cache[key] = (revision, raw)
+        _document_cache_bytes += len(raw)
+
+        while _document_cache_bytes > max_bytes:
+            _, (_, evicted) = _document_cache.popitem(last=False)
+            _document_cache_bytes -= len(evicted)
+            _document_cache_stats["evictions"] += 1
+
+    return
+
+
+def document_cache_invalidate(collection_name, firewall):
+    """
+    Removes every document for a firewall (current and snapshots) from the
+    process-wide cache.
+
+    Args:
+        collection_name (str): User's collection name
+        firewall (str): Firewall name
+
+    Returns:
+        None
+    """
+    global _document_cache_bytes
+
+    with _document_cache_lock:
+        for key in list(_document_cache):
+            if key[0] == collection_name and key[1] == firewall:
+                _document_cache_bytes -= len(_document_cache.pop(key)[1])
+
+    return
+
+
+def document_cache_clear():
+    """
+    Empties the process-wide cache and resets its counters.
+
+    Returns:
+        None
+    """
+    global _document_cache_bytes
+
+    with _document_cache_lock:
+        _document_cache.clear()
+        _document_cache_bytes = 0
+        for counter in _document_cache_stats:
+            _document_cache_stats[counter] = 0
+
+    return
+
+
+def document_cache_stats():
+    """
+    Gets the process-wide cache counters.
+
+    Returns:
+        dict: hits, misses, evictions, entries, bytes and max_bytes
+    """
+    with _document_cache_lock:
+        stats = dict(_document_cache_stats)
+        stats["entries"] = len(_document_cache)
+        stats["bytes"] = _document_cache_bytes
+    stats["max_bytes"] = _document_cache_max_bytes()
+
+    return stats
+
+
+def keyframe_cache_get(key):
+    """
+    Gets a copy of a materialized snapshot keyframe.
+
+    Args:
+        key (tuple): (collection_name, keyframe document id)
+
+    Returns:
+        dict: Copy of the keyframe configuration, or None if not cached
+    """
+    with _keyframe_cache_lock:
+        raw = _keyframe_cache.get(key)
+        if raw is None:
+            return None
+        _keyframe_cache.move_to_end(key)
+
+    return bson.decode(raw)
+
+
+def keyframe_cache_set(key, data):
+    """
+    Stores a materialized snapshot keyframe, evicting the least recently used
+    keyframe when more than SNAPSHOT_KEYFRAME_CACHE_SIZE are cached.
+
+    Args:
+        key (tuple): (collection_name, keyframe document id)
+        data (dict): Keyframe configuration
+
+    Returns:
+        None
+    """
+    raw = bson.encode(data)
+    max_entries = _keyframe_cache_max_entries()
+
+    with _keyframe_cache_lock:
+        _keyframe_cache[key] = raw
+        _keyframe_cache.move_to_end(key)
+        while len(_keyframe_cache) > max_entries:
+            _keyframe_cache.popitem(last=False)
+
+    return
+
+
+def keyframe_cache_invalidate(key):
+    """
+    Removes a keyframe whose document was rewritten or deleted.
+
+    Args:
+        key (tuple): (collection_name, keyframe document id)
+
+    Returns:
+        None
+    """
+    with _keyframe_cache_lock:
+        _keyframe_cache.pop(key, None)
+
+    return
+
+
+def keyframe_cache_clear():
+    """
+    Empties the keyframe cache.
+
+    Returns:
+        None
+    """
+    with _keyframe_cache_lock:
+        _keyframe_cache.clear()
+
+    return
+
+
+def sidebar_cache_get(collection_name, firewall, field):
+    """
+    Gets a copy of one list of the sidebar model.
+
+    Args:
+        collection_name (str): User's collection name
+        firewall (str): Selected firewall name, or None
+        field (str): "file_list" or "snapshot_list"
+
+    Returns:
+        list: Copy of the cached list, or None if not cached or expired
+    """
+    with _sidebar_cache_lock:
+        entry = _sidebar_cache.get((collection_name, firewall))
+        if entry is None or entry[0] < time.monotonic() or field not in entry[1]:
+            return None
+        value = entry[1][field]
+
+    return copy.deepcopy(value)
+
+
+def sidebar_cache_set(collection_name, firewall, field, value):
+    """
+    Stores one list of the sidebar model.  The expiry of an entry is set when
+    its first list is stored, so both lists expire together.
+
+    Args:
+        collection_name (str): User's collection name
+        firewall (str): Selected firewall name, or None
+        field (str): "file_list" or "snapshot_list"
+        value (list): List to cache
+
+    Returns:
+        None
+    """
+    key = (collection_name, firewall)
+    now = time.monotonic()
+
+    with _sidebar_cache_lock:
+        entry = _sidebar_cache.get(key)
+        if entry is None or entry[0] < now:
+            entry = (now + _sidebar_cache_ttl(), {})
+            _sidebar_cache[key] = entry
+        entry[1][field] = copy.deepcopy(value)
+
+    return
+
+
+def sidebar_cache_invalidate(collection_name, firewall=None):
+    """
+    Removes sidebar models of a user.
+
+    Args:
+        collection_name (str): User's collection name
+        firewall (str, optional): Only remove the model for this firewall.
+            Defaults to None (every model of the user, as the firewall list
+            is shared by all of them).
+
+    Returns:
+        None
+    """
+    with _sidebar_cache_lock:
+        for key in list(_sidebar_cache):
+            if key[0] == collection_name and firewall in (None, key[1]):
+                del _sidebar_cache[key]
+
+    return
+
+
+def sidebar_cache_clear():
+    """
+    Empties the sidebar cache.
+
+    Returns:
+        None
+    """
+    with _sidebar_cache_lock:
+        _sidebar_cache.clear()
+
+    return
+
+
+def section_cache_get(key):
+    """
+    Gets the configuration lines generated for a section.
+
+    Args:
+        key (str): Content hash of the section
+
+    Returns:
+        tuple: Generated lines, or None if not cached
+    """
+    with _section_cache_lock:
+        lines = _section_cache.get(key)
+        if lines is not None:
+            _section_cache.move_to_end(key)
+
+    return lines
+
+
+def section_cache_set(key, lines):
+    """
+    Stores the configuration lines generated for a section, evicting the
+    least recently used sections beyond CONFIG_SECTION_CACHE_SIZE.
+
+    Args:
+        key (str): Content hash of the section
+        lines (list): Generated lines
+
+    Returns:
+        None
+    """
+    max_entries = _section_cache_max_entries()
+
+    with _section_cache_lock:
+        _section_cache[key] = tuple(lines)
+        _section_cache.move_to_end(key)
+        while len(_section_cache) > max_entries:
+            _section_cache.popitem(last=False)
+
+    return
+
+
+def section_cache_clear():
+    """
+    Empties the configuration section cache.
+
+    Returns:
+        None
+    """
+    with _section_cache_lock:
+        _section_cache.clear()
+
+    return
+
+
+def diff_cache_get(key):
+    """
+    Gets a rendered snapshot diff.
+
+    Args:
+        key (str): Hash of the diff view and the content of both snapshots
+
+    Returns:
+        str: Rendered diff, or None if not cached
+    """
+    with _diff_cache_lock:
+        html = _diff_cache.get(key)
+        if html is not None:
+            _diff_cache.move_to_end(key)
+
+    return html
+
+
+def diff_cache_set(key, html):
+    """
+    Stores a rendered snapshot diff, evicting the least recently used diffs
+    until the cache fits in DIFF_CACHE_MAX_BYTES.
+
+    Args:
+        key (str): Hash of the diff view and the content of both snapshots
+        html (str): Rendered diff
+
+    Returns:
+        None
+    """
+    global _diff_cache_size
+
+    max_size = _diff_cache_max_size()
+
+    with _diff_cache_lock:
+        old = _diff_cache.pop(key, None)
+        if old is not None:
+            _diff_cache_size -= len(old)
+
+        if len(html) > max_size:
+            return
+
+        _diff_cache[key] = html
+        _diff_cache_size += len(html)
+
+        while _diff_cache_size > max_size:
+            _, evicted = _diff_cache.popitem(last=False)
+            _diff_cache_size -= len(evicted)
+
+    return
+
+
+def diff_cache_clear():
+    """
+    Empties the snapshot diff cache.
+
+    Returns:
+        None
+    """
+    global _diff_cache_size
+
+    with _diff_cache_lock:
+        _diff_cache.clear()
+        _diff_cache_size = 0
+
+    return
+
+
+def _ssh_key_cache_key(filename, version, passphrase):
+    message = f"{filename}\0{version}\0".encode("utf-8") + passphrase
+
+    return hmac.new(_ssh_key_cache_secret, message, hashlib.sha256).digest()
+
+
+def ssh_key_cache_get(filename, version, passphrase):
+    """
+    Gets a decrypted SSH key.
+
+    Args:
+        filename (str): Path of the encrypted key file
+        version: Version of the key file (e.g. its modification time), so a
+            replaced key file is never served from the cache
+        passphrase (bytes): Fernet key the file was decrypted with
+
+    Returns:
+        bytes: Decrypted key, or None if not cached or expired
+    """
+    key = _ssh_key_cache_key(filename, version, passphrase)
+
+    with _ssh_key_cache_lock:
+        entry = _ssh_key_cache.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+
+    return entry[1]
+
+
+def ssh_key_cache_set(filename, version, passphrase, data):
+    """
+    Stores a decrypted SSH key for SSH_KEY_CACHE_TTL seconds, dropping
+    expired keys.  A TTL of 0 disables the cache.
+
+    Args:
+        filename (str): Path of the encrypted key file
+        version: Version of the key file (e.g. its modification time)
+        passphrase (bytes): Fernet key the file was decrypted with
+        data (bytes): Decrypted key
+
+    Returns:
+        None
+    """
+    ttl = _ssh_key_cache_ttl()
+    now = time.monotonic()
+    key = _ssh_key_cache_key(filename, version, passphrase)
+
+    with _ssh_key_cache_lock:
+        for expired in [k for k, entry in _ssh_key_cache.items() if entry[0] < now]:
+            del _ssh_key_cache[expired]
+        if ttl > 0:
+            _ssh_key_cache[key] = (now + ttl, data)
+
+    return
+
+
+def ssh_key_cache_clear():
+    """
+    Empties the SSH key cache.
+
+    Returns:
+        None
+    """
+    with _ssh_key_cache_lock:
+        _ssh_key_cache.clear()
+
+    return
+
+
+def reachability_cache_get(hostname, port):
+    """
+    Gets the result of the last reachability probe of a firewall.
+
+    Args:
+        hostname (str): Firewall hostname
+        port (str): SSH port
+
+    Returns:
+        tuple: (reachable, checked) with the probe result and the time.time()
+               it was taken, or None if not cached or expired
+    """
+    with _reachability_cache_lock:
+        entry = _reachability_cache.get((hostname, str(port)))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+
+    return entry[1], entry[2]
+
+
+def reachability_cache_set(hostname, port, reachable):
+    """
+    Stores the result of a reachability probe for REACHABILITY_CACHE_TTL
+    seconds, dropping expired results.
+
+    Args:
+        hostname (str): Firewall hostname
+        port (str): SSH port
+        reachable (bool): Probe result
+
+    Returns:
+        None
+    """
+    now = time.monotonic()
+
+    with _reachability_cache_lock:
+        for expired in [
+            k for k, entry in _reachability_cache.items() if entry[0] < now
+        ]:
+            del _reachability_cache[expired]
+        _reachability_cache[(hostname, str(port))] = (
+            now + _reachability_cache_ttl(),
+            reachable,
+            time.time(),
+        )
+
+    return
+
+
+def reachability_cache_clear():
+    """
+    Empties the reachability cache.
+
+    Returns:
+        None
+    """
+    with _reachability_cache_lock:
+        _reachability_cache.clear()
+
+    return
@@ -10,7 +10,7 @@
     - Validating IP versions and configurations
 
     Dependencies:
-    - package.data_file_functions: For reading/writing user data files
+    - package.data_file_functions: For reading and field-level updates of user data files
     - flask: For flash messaging
     - logging: For logging functionality
 """
@@ -19,7 +19,7 @@ import logging
 
 from flask import flash
 
-from package.data_file_functions import read_user_data_file, write_user_data_file
+from package.data_file_functions import mutate_user_data_file, read_user_data_file
 
 
 def add_rule_to_data(session, request):
@@ -52,35 +52,21 @@ def add_rule_to_data(session, request):
         state_rel: Optional, enables related state matching
 
     The function:
-    1. Reads the existing user data file
-    2. Extracts rule details from the form
-    3. Creates necessary data structures if they don't exist
-    4. Processes destination and source address/port configurations
-    5. Adds the rule to the specified chain
-    6. Updates the rule order list
-    7. Saves updated data back to file
-    8. Displays success message
+    1. Extracts rule details from the form
+    2. Processes destination and source address/port configurations
+    3. Reads the existing user data file and updates the rule order list
+    4. Sets the rule and rule order in the user data file, re-applying the
+       change if another session edited the firewall meanwhile
+    5. Displays success message
 
     Returns:
         None
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     chain = request.form["fw_chain"].split(",")
     ip_version = chain[0]
     fw_chain = chain[1]
 
-    # Check and create higher level data structure if it does not exist
-    if ip_version not in user_data:
-        user_data[ip_version] = {}
-        user_data[ip_version]["chains"] = {}
-    if fw_chain not in user_data[ip_version]["chains"]:
-        user_data[ip_version]["chains"][fw_chain] = {}
-    if "rule-order" not in user_data[ip_version]["chains"][fw_chain]:
-        user_data[ip_version]["chains"][fw_chain]["rule-order"] = []
-
     # Assemble rule dict
     rule = request.form["rule"]
     rule_dict = {}
@@ -169,20 +155,32 @@ def add_rule_to_data(session, request):
     if "state_rel" in request.form:
         rule_dict["state_rel"] = True
 
-    # Assign value to data structure
-    user_data[ip_version]["chains"][fw_chain][rule] = rule_dict
+    def build_update(user_data):
+        # Add rule to rule-order in user data
+        rule_order = (
+            user_data.get(ip_version, {})
+            .get("chains", {})
+            .get(fw_chain, {})
+            .get("rule-order", [])
+        )
+        if rule not in rule_order:
+            rule_order.append(rule)
 
-    # Add rule to rule-order in user data
-    if rule not in user_data[ip_version]["chains"][fw_chain]["rule-order"]:
-        user_data[ip_version]["chains"][fw_chain]["rule-order"].append(rule)
+        # Sort rule-order in user data
+        rule_order = sorted(rule_order, key=int)
 
-    # Sort rule-order in user data
-    user_data[ip_version]["chains"][fw_chain]["rule-order"] = sorted(
-        user_data[ip_version]["chains"][fw_chain]["rule-order"], key=int
-    )
+        return {
+            "set_fields": {
+                (ip_version, "chains", fw_chain, rule): rule_dict,
+                (ip_version, "chains", fw_chain, "rule-order"): rule_order,
+            }
+        }
 
-    # Write user_data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
+    # Set rule and rule-order in user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
+        return
 
     flash(f"Rule {rule} added to chain {ip_version}/{fw_chain}.", "success")
 
@@ -205,19 +203,15 @@ def add_chain_to_data(session, request):
         logging: Optional, enables logging if present
 
     The function:
-    1. Reads the existing user data file
-    2. Extracts chain details from the form
-    3. Creates necessary data structure if it doesn't exist
-    4. Adds the new chain with its configuration
-    5. Saves updated data back to file
-    6. Displays success message
+    1. Extracts chain details from the form
+    2. Reads the existing user data file
+    3. Creates the chain with an empty rule order if it doesn't exist
+    4. Sets the chain defaults in the user data file
+    5. Displays success message
 
     Returns:
         None
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     ip_version = request.form["ip_version"]
     fw_chain = request.form["fw_chain"]
@@ -228,26 +222,24 @@ def add_chain_to_data(session, request):
     else:
         default_logging = False
 
-    # Check and create higher level data structure if it does not exist
-    if ip_version not in user_data:
-        user_data[ip_version] = {}
-    if "chains" not in user_data[ip_version]:
-        user_data[ip_version]["chains"] = {}
-    if fw_chain not in user_data[ip_version]["chains"]:
-        user_data[ip_version]["chains"][fw_chain] = {}
-        user_data[ip_version]["chains"][fw_chain]["rule-order"] = []
-    if "default" not in user_data[ip_version]["chains"][fw_chain]:
-        user_data[ip_version]["chains"][fw_chain]["default"] = {}
-    user_data[ip_version]["chains"][fw_chain]["default"]["description"] = description
-    user_data[ip_version]["chains"][fw_chain]["default"][
-        "default_logging"
-    ] = default_logging
-    user_data[ip_version]["chains"][fw_chain]["default"][
-        "default_action"
-    ] = default_action
-
-    # Write user_data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
+    chain_path = (ip_version, "chains", fw_chain)
+
+    def build_update(user_data):
+        # Set chain defaults, creating the chain if it does not exist
+        set_fields = {
+            (*chain_path, "default", "description"): description,
+            (*chain_path, "default", "default_logging"): default_logging,
+            (*chain_path, "default", "default_action"): default_action,
+        }
+        if fw_chain not in user_data.get(ip_version, {}).get("chains", {}):
+            set_fields[(*chain_path, "rule-order")] = []
+        return {"set_fields": set_fields}
+
+    # Update user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
+        return
 
     flash(f"Chain {ip_version}/{fw_chain} added.", "success")
 
@@ -437,11 +429,12 @@ def delete_rule_from_data(session, request):
         None
 
     The function:
-    1. Reads the user's data file
-    2. Extracts ip_version, chain and rule number from the form data
+    1. Extracts ip_version, chain and rule number from the form data
+    2. Reads the user's data file
     3. Deletes the rule from the chain and removes it from the rule order list
     4. Cleans up by removing empty chains and ip versions
-    5. Writes the updated data back to file
+    5. Unsets the rule (or emptied chain) and pulls it from the rule order
+       in the user data file
     6. Flashes success/failure messages to the user
 
     Example:
@@ -450,39 +443,54 @@ def delete_rule_from_data(session, request):
         - If INPUT chain becomes empty, removes the chain
         - If IPv4 has no more chains, removes the IPv4 section
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     rule = request.form["rule"].split(",")
     ip_version = rule[0]
     fw_chain = rule[1]
     rule = rule[2]
-
-    # Delete rule from data
-    try:
-        del user_data[ip_version]["chains"][fw_chain][rule]
-        user_data[ip_version]["chains"][fw_chain]["rule-order"].remove(rule)
+    chain_path = (ip_version, "chains", fw_chain)
+    deleted = []
+
+    def build_update(user_data):
+        # Delete rule from data
+        deleted.clear()
+        try:
+            del user_data[ip_version]["chains"][fw_chain][rule]
+            user_data[ip_version]["chains"][fw_chain]["rule-order"].remove(rule)
+            deleted.append(rule)
+        except Exception:
+            pass
+
+        # Clean-up data — intentionally removes the entire chain (including defaults)
+        # when the last rule is deleted, as empty chains are not desired.
+        unset_fields = [(*chain_path, rule)]
+        pull_fields = {(*chain_path, "rule-order"): rule}
+        try:
+            if not user_data[ip_version]["chains"][fw_chain]["rule-order"]:
+                del user_data[ip_version]["chains"][fw_chain]
+                unset_fields = [chain_path]
+                pull_fields = {}
+            if not user_data[ip_version]:
+                del user_data[ip_version]
+                unset_fields = [(ip_version,)]
+        except Exception as e:
+            logging.info(e)
+
+        return {"unset_fields": unset_fields, "pull_fields": pull_fields}
+
+    # Remove rule from user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
+        return
+
+    if deleted:
         flash(f"Deleted rule {rule} from chain {ip_version}/{fw_chain}.", "warning")
-    except Exception:
+    else:
         flash(
             f"Failed to delete rule {rule} from chain {ip_version}/{fw_chain}.",
             "danger",
         )
-        pass
-
-    # Clean-up data — intentionally removes the entire chain (including defaults)
-    # when the last rule is deleted, as empty chains are not desired.
-    try:
-        if not user_data[ip_version]["chains"][fw_chain]["rule-order"]:
-            del user_data[ip_version]["chains"][fw_chain]
-        if not user_data[ip_version]:
-            del user_data[ip_version]
-    except Exception as e:
-        logging.info(e)
-
-    # Write user's data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
 
     return
 
@@ -521,11 +529,9 @@ def reorder_chain_rule_in_data(session, request):
     - Rule must have 3 components (ip_version, chain, old rule number)
     - New rule number must be different from old rule number
     - New rule number must be a valid integer
-    - New rule number must not already exist in the chain
+    - New rule number must not already exist in the chain (checked against
+      the latest document each time the change is applied)
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     rule = request.form["reorder_rule"].split(",")
 
@@ -537,9 +543,6 @@ def reorder_chain_rule_in_data(session, request):
         old_rule_number = rule[2]
         new_rule_number = request.form["new_rule_number"].strip()
 
-    # Get list of existing rules in chain
-    existing_rule_list = user_data[ip_version]["chains"][fw_chain]["rule-order"]
-
     # Validate new rule number
     if old_rule_number == new_rule_number:
         flash("Old and new rule numbers must be different.", "danger")
@@ -551,30 +554,34 @@ def reorder_chain_rule_in_data(session, request):
         flash("New rule number must be an integer.", "danger")
         return None
 
-    if new_rule_number in existing_rule_list:
-        flash("New rule number must not already exist in the chain.", "danger")
+    chain_path = (ip_version, "chains", fw_chain)
+
+    def build_update(user_data):
+        # Get list of existing rules in chain
+        existing_rule_list = user_data[ip_version]["chains"][fw_chain]["rule-order"]
+
+        if new_rule_number in existing_rule_list:
+            flash("New rule number must not already exist in the chain.", "danger")
+            return None
+
+        # Replace old rule number with new rule number in rule-order
+        rule_order = [r for r in existing_rule_list if r != old_rule_number]
+        rule_order.append(new_rule_number)
+
+        return {
+            "set_fields": {
+                (*chain_path, new_rule_number): user_data[ip_version]["chains"][
+                    fw_chain
+                ][old_rule_number],
+                (*chain_path, "rule-order"): sorted(rule_order, key=int),
+            },
+            "unset_fields": [(*chain_path, old_rule_number)],
+        }
+
+    # Move rule to new rule number in user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
         return None
 
-    # Add new rule to chain in user data
-    user_data[ip_version]["chains"][fw_chain][new_rule_number] = user_data[ip_version][
-        "chains"
-    ][fw_chain][old_rule_number]
-
-    # Add new rule to rule-order in user data
-    user_data[ip_version]["chains"][fw_chain]["rule-order"].append(new_rule_number)
-
-    # Remove Old Rule from user data
-    del user_data[ip_version]["chains"][fw_chain][old_rule_number]
-
-    # Remove Old Rule from rule-order in user data
-    user_data[ip_version]["chains"][fw_chain]["rule-order"].remove(old_rule_number)
-
-    # Sort rule-order in user data
-    user_data[ip_version]["chains"][fw_chain]["rule-order"] = sorted(
-        user_data[ip_version]["chains"][fw_chain]["rule-order"], key=int
-    )
-
-    # Write user's data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
-
     return f"{ip_version}{fw_chain}"
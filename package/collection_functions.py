@@ -0,0 +1,147 @@
+"""
+    Collection Functions
+
+    This module manages collection profiles: named lists of operational
+    commands that are run together over one SSH session (see
+    operational_commands), so gathering e.g. the firewall, statistics,
+    interface and flowtable views costs one connection instead of four.
+
+    Contains functions for:
+    - Listing the built-in and saved collection profiles of a user
+    - Getting the commands of a profile
+    - Saving and deleting a user's profiles from the push page forms
+
+    Profiles are saved per user in the profile store (see
+    write_profile_record), so the same profile can be run on every
+    firewall.  A saved profile with the name of a built-in profile replaces
+    it for that user.
+"""
+
+import logging
+import os
+
+from flask import flash
+
+from package.data_file_functions import (
+    delete_profile_record,
+    read_profile_records,
+    write_profile_record,
+)
+
+DEFAULT_COLLECTION_PROFILES = {
+    "Firewall Overview": [
+        "show firewall",
+        "show firewall statistics",
+        "show interfaces",
+        "show flowtables",
+    ],
+}
+
+
+def _profile_max_commands():
+    try:
+        return max(1, int(os.environ.get("COLLECTION_PROFILE_MAX_COMMANDS")))
+    except Exception:
+        return 20
+
+
+def list_collection_profiles(session):
+    """
+    Lists the collection profiles available to a user.
+
+    Args:
+        session (dict): Session data including username
+
+    Returns:
+        dict: Lists of operational commands keyed by profile name, the
+              built-in profiles first
+    """
+    profiles = {
+        name: list(commands) for name, commands in DEFAULT_COLLECTION_PROFILES.items()
+    }
+    profiles.update(read_profile_records(session["username"]))
+
+    return profiles
+
+
+def get_collection_profile(session, name):
+    """
+    Gets the commands of a collection profile.
+
+    Args:
+        session (dict): Session data including username
+        name (str): Profile name
+
+    Returns:
+        list: Operational commands of the profile, or None if it does not
+              exist
+    """
+    return list_collection_profiles(session).get(name)
+
+
+def save_collection_profile(session, request):
+    """
+    Saves a collection profile from the push page form.
+
+    Args:
+        session (dict): Session data including username
+        request: Flask request with form fields:
+            profile_name: Profile name
+            profile_commands: Operational commands, one per line
+
+    Returns:
+        None
+
+    The function:
+    1. Strips the name and commands, dropping blank lines and a leading
+       "run" that the operational command form does not need
+    2. Rejects an empty name, no commands or more than
+       COLLECTION_PROFILE_MAX_COMMANDS commands (default 20)
+    3. Saves the profile, replacing one of the same name
+    """
+    name = request.form.get("profile_name", "").strip()
+    commands = []
+    for line in request.form.get("profile_commands", "").splitlines():
+        command = line.strip()
+        if command.startswith("run "):
+            command = command[4:].strip()
+        if command:
+            commands.append(command)
+
+    if not name or not commands:
+        flash("A collection profile needs a name and at least one command.", "danger")
+        return
+    if len(commands) > _profile_max_commands():
+        flash(
+            f"A collection profile can have at most {_profile_max_commands()} commands.",
+            "danger",
+        )
+        return
+
+    write_profile_record(session["username"], name, commands)
+    logging.info(f" |--> Saved collection profile {name}: {commands}")
+
+    flash(f"Collection profile {name} saved.", "success")
+
+    return
+
+
+def delete_collection_profile(session, request):
+    """
+    Deletes a saved collection profile from the push page form.
+
+    Args:
+        session (dict): Session data including username
+        request: Flask request with form field profile_name
+
+    Returns:
+        None
+    """
+    name = request.form.get("profile_name", "")
+
+    if delete_profile_record(session["username"], name):
+        flash(f"Collection profile {name} deleted.", "success")
+    else:
+        flash(f"Collection profile {name} is not a saved profile.", "warning")
+
+    return
@@ -0,0 +1,146 @@
+"""
+    Configuration Delta Functions
+
+    This module computes the smallest list of set/delete commands that turns
+    the running configuration of a firewall into the generated configuration,
+    so a push only sends what changed instead of every line of the ruleset.
+
+    Contains functions for:
+    - Parsing and formatting VyOS set/delete commands
+    - Computing the command delta between the running configuration (as
+      returned by 'show configuration commands') and a command file
+
+    A command file is pushed with merge semantics: set commands already in
+    the running configuration are dropped from the delta.  A 'delete <path>'
+    command in the command file (e.g. the 'delete firewall' written for
+    delete_before_set) makes <path> replaced instead: running commands under
+    it that the command file does not set are deleted, deleting the largest
+    subtree that is absent from the command file (e.g. a whole rule) with a
+    single command.
+
+    Commands are compared by their shell tokens, so quoting differences
+    ("accept" vs "'accept'") are not changes.
+"""
+
+import shlex
+
+
+def parse_command(line):
+    """
+    Parses a VyOS configuration command.
+
+    Args:
+        line (str): Command line
+
+    Returns:
+        tuple: (action, tokens) with action "set" or "delete" and the path
+               and value tokens, or None for comments, blank lines, other
+               commands and lines that cannot be tokenized
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+
+    try:
+        tokens = shlex.split(line)
+    except ValueError:
+        return None
+
+    if len(tokens) < 2 or tokens[0] not in ("set", "delete"):
+        return None
+
+    return tokens[0], tuple(tokens[1:])
+
+
+def format_command(action, tokens):
+    """
+    Formats a VyOS configuration command.
+
+    Args:
+        action (str): "set" or "delete"
+        tokens (tuple): Path and value tokens
+
+    Returns:
+        str: Command line, with tokens quoted where the shell requires it
+    """
+    return " ".join([action] + [shlex.quote(token) for token in tokens])
+
+
+def _prefixes(tokens, start=1):
+    return (tokens[:length] for length in range(start, len(tokens) + 1))
+
+
+def config_delta(running_lines, command_lines):
+    """
+    Computes the set/delete commands that turn the running configuration into
+    the configuration of a command file.
+
+    Args:
+        running_lines (iterable): Running configuration as set commands
+        command_lines (iterable): Command file lines (set commands, delete
+            commands and comments)
+
+    Returns:
+        list: Delete commands followed by set commands, in command file order;
+              empty if the running configuration already matches
+
+    Lines of the command file that cannot be parsed are kept in the delta
+    unchanged, so nothing the full command file would push is lost.
+    """
+    desired = []
+    replaced = []
+    verbatim = []
+    for line in command_lines:
+        command = parse_command(line)
+        if command is None:
+            if line.strip() and not line.lstrip().startswith("#"):
+                verbatim.append(line.strip())
+        elif command[0] == "set":
+            desired.append(command[1])
+        else:
+            replaced.append(command[1])
+
+    running = []
+    for line in running_lines:
+        command = parse_command(line)
+        if command is not None and command[0] == "set":
+            running.append(command[1])
+
+    desired_prefixes = set()
+    for tokens in desired:
+        desired_prefixes.update(_prefixes(tokens))
+
+    running_prefixes = set()
+    for tokens in running:
+        running_prefixes.update(_prefixes(tokens))
+
+    # Delete running commands under replaced paths that are not set by the
+    #   command file, at the shortest path under the replaced path that is
+    #   absent from the command file.
+    deletes = []
+    deleted = set()
+    for tokens in running:
+        roots = [len(root) for root in replaced if tokens[: len(root)] == root]
+        if not roots or tokens in desired_prefixes:
+            continue
+
+        for prefix in _prefixes(tokens, start=min(roots)):
+            if prefix in deleted:
+                break
+            if prefix not in desired_prefixes:
+                deleted.add(prefix)
+                deletes.append(format_command("delete", prefix))
+                break
+
+    # Set commands whose node and value are not already running.  Deleted
+    #   paths are never a prefix of a set command, as they are absent from
+    #   the command file.
+    sets = []
+    seen = set()
+    for tokens in desired:
+        if tokens in running_prefixes or tokens in seen:
+            continue
+        seen.add(tokens)
+        sets.append(format_command("set", tokens))
+
+    return deletes + sets + verbatim
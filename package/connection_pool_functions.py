@@ -0,0 +1,248 @@
+"""
+    Connection Pool Functions
+
+    This module keeps NAPALM sessions to firewalls open between requests, so a
+    View Diffs followed by a Commit (or repeated diffs) reuses one SSH session
+    instead of paying the handshake and login on every click.
+
+    Contains functions for:
+    - Building pool keys from connection parameters
+    - Checking a healthy idle session out of the pool
+    - Returning a session to the pool, or closing a session that failed
+    - Closing sessions left idle longer than NAPALM_POOL_IDLE_TIMEOUT
+    - Closing every pooled session
+
+    Sessions are keyed by (hostname, port, username, credential fingerprint),
+    so a session is only reused with the credentials it was opened with.  The
+    fingerprint is an HMAC of the credentials with a key generated for the
+    process; credentials themselves are never kept by the pool.
+
+    At most NAPALM_POOL_MAX_SIZE idle sessions are kept (default 8, 0
+    disables pooling); the least recently used session is closed to make
+    room.  A session is only returned to the pool after a successful
+    operation, with its candidate configuration committed or discarded.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+# Key of the credential fingerprints, unique to this process.
+_fingerprint_key = os.urandom(32)
+
+# Idle sessions, least recently used first.
+#   [(key, driver, last_used)]
+_idle_sessions = []
+_idle_sessions_lock = threading.Lock()
+
+# Background thread closing idle sessions, started with the first pooled
+#   session.
+_reaper = None
+
+
+def _pool_max_size():
+    try:
+        return int(os.environ.get("NAPALM_POOL_MAX_SIZE"))
+    except Exception:
+        return 8
+
+
+def _pool_idle_timeout():
+    try:
+        return float(os.environ.get("NAPALM_POOL_IDLE_TIMEOUT"))
+    except Exception:
+        return 300.0
+
+
+def _close_quietly(driver):
+    try:
+        driver.close()
+    except Exception as e:
+        logging.debug(f" |--> Error closing pooled session: {e}")
+
+    return
+
+
+def napalm_pool_key(connection_string):
+    """
+    Builds the pool key of a NAPALM session.
+
+    Args:
+        connection_string (dict): Connection parameters including hostname,
+            port, username, password and optionally ssh_key_name
+
+    Returns:
+        tuple: (hostname, port, username, credential fingerprint)
+    """
+    credentials = json.dumps(
+        [connection_string["password"], connection_string.get("ssh_key_name", "")]
+    )
+    fingerprint = hmac.new(
+        _fingerprint_key, credentials.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+    return (
+        connection_string["hostname"],
+        str(connection_string["port"]),
+        connection_string["username"],
+        fingerprint,
+    )
+
+
+def napalm_pool_get(key):
+    """
+    Checks an idle session out of the pool.
+
+    Args:
+        key (tuple): Key built by napalm_pool_key()
+
+    The function:
+    1. Takes the most recently used idle session for the key
+    2. Checks the session is still alive, closing it and trying the next
+       one if it is not
+
+    Returns:
+        driver: Open NAPALM driver, or None if the pool holds no healthy
+                session for the key
+    """
+    while True:
+        with _idle_sessions_lock:
+            for index in range(len(_idle_sessions) - 1, -1, -1):
+                if _idle_sessions[index][0] == key:
+                    driver = _idle_sessions.pop(index)[1]
+                    break
+            else:
+                return None
+
+        try:
+            alive = driver.is_alive().get("is_alive")
+        except Exception:
+            alive = False
+
+        if alive:
+            logging.debug(f" |--> Reusing pooled session to {key[0]}:{key[1]}")
+            return driver
+
+        logging.debug(f" |--> Dropping dead pooled session to {key[0]}:{key[1]}")
+        _close_quietly(driver)
+
+
+def napalm_pool_put(key, driver):
+    """
+    Returns an open session to the pool after a successful operation.
+
+    Args:
+        key (tuple): Key built by napalm_pool_key()
+        driver: Open NAPALM driver with no pending candidate configuration
+
+    The least recently used idle sessions are closed to keep at most
+    NAPALM_POOL_MAX_SIZE sessions; with a size of 0 the session is closed.
+
+    Returns:
+        None
+    """
+    max_size = _pool_max_size()
+    evicted = []
+
+    with _idle_sessions_lock:
+        _idle_sessions.append((key, driver, time.monotonic()))
+        while len(_idle_sessions) > max(max_size, 0):
+            evicted.append(_idle_sessions.pop(0)[1])
+
+    for stale in evicted:
+        _close_quietly(stale)
+
+    if driver not in evicted:
+        _start_reaper()
+
+    return
+
+
+def napalm_pool_discard(driver):
+    """
+    Closes a session whose state is unknown after a failed operation,
+    instead of returning it to the pool.
+
+    Args:
+        driver: NAPALM driver
+
+    Returns:
+        None
+    """
+    _close_quietly(driver)
+
+    return
+
+
+def napalm_pool_reap():
+    """
+    Closes the sessions idle for longer than NAPALM_POOL_IDLE_TIMEOUT.
+
+    Returns:
+        int: Number of sessions closed
+    """
+    expired_before = time.monotonic() - _pool_idle_timeout()
+
+    with _idle_sessions_lock:
+        expired = [entry for entry in _idle_sessions if entry[2] < expired_before]
+        _idle_sessions[:] = [
+            entry for entry in _idle_sessions if entry[2] >= expired_before
+        ]
+
+    for _, driver, _ in expired:
+        _close_quietly(driver)
+    if expired:
+        logging.debug(f" |--> Closed {len(expired)} idle pooled sessions")
+
+    return len(expired)
+
+
+def napalm_pool_clear():
+    """
+    Closes every idle session.
+
+    Returns:
+        None
+    """
+    with _idle_sessions_lock:
+        drivers = [driver for _, driver, _ in _idle_sessions]
+        _idle_sessions.clear()
+
+    for driver in drivers:
+        _close_quietly(driver)
+
+    return
+
+
+def napalm_pool_size():
+    """
+    Gets the number of idle sessions in the pool.
+
+    Returns:
+        int: Number of idle sessions
+    """
+    with _idle_sessions_lock:
+        return len(_idle_sessions)
+
+
+def _reap_forever():
+    while True:
+        time.sleep(max(1.0, min(_pool_idle_timeout() / 2, 30.0)))
+        napalm_pool_reap()
+
+
+def _start_reaper():
+    global _reaper
+
+    with _idle_sessions_lock:
+        if _reaper is None:
+            _reaper = threading.Thread(
+                target=_reap_forever, name="napalm-pool-reaper", daemon=True
+            )
+            _reaper.start()
+
+    return
@@ -5,8 +5,9 @@ This module provides utility functions for handling data files in a firewall con
 It includes functions for:
 - Managing user configuration data (add_extra_items, add_hostname)
 - File validation and backup operations (allowed_file, create_backup)
-- Encryption/decryption of sensitive files (decrypt_file)
-- Database operations for user data (delete_user_data_file)
+- Decryption of stored SSH keys into memory (decrypt_key)
+- Database operations for user data (delete_user_data_file, update_user_data_file,
+  mutate_user_data_file)
 
 The module uses MongoDB for data persistence and Fernet for symmetric encryption.
 It handles both individual user data and system-wide backups.
@@ -16,13 +17,11 @@ import glob
 import json
 import logging
 import os
-import random
-import string
 import subprocess  # nosec B404
 import sys
 import uuid
 import zipfile
-from datetime import datetime
+from datetime import datetime, timezone
 
 import boto3
 import bson
@@ -30,9 +29,107 @@ import pymongo
 from cryptography.fernet import Fernet
 from flask import flash
 
+from package.cache_functions import (
+    cache_key,
+    document_cache_get,
+    document_cache_invalidate,
+    document_cache_peek,
+    document_cache_set,
+    invalidate_firewall,
+    request_cache_get,
+    request_cache_set,
+    sidebar_cache_get,
+    sidebar_cache_invalidate,
+    sidebar_cache_set,
+    ssh_key_cache_get,
+    ssh_key_cache_set,
+)
+from package.snapshot_functions import (
+    delete_snapshot,
+    migrate_snapshots,
+    read_snapshot,
+    read_snapshot_series,
+    snapshot_content,
+    tag_snapshot_document,
+    write_snapshot,
+)
+
 # Shared MongoDB client — reused across calls to avoid connection leaks.
 _mongo_client = None
 
+# Fields maintained by write_user_data_file to version each document.  They are
+#   never returned to callers as part of the firewall configuration.
+REVISION_FIELDS = ("rev", "rev_epoch")
+REVISION_PROJECTION = {"_id": 1, "rev": 1, "rev_epoch": 1}
+
+# Indexes kept on every user collection.  Current documents have neither a
+#   "firewall" nor a "snapshot" field, so list_user_files finds them with a
+#   null match on the (firewall, snapshot) index; a partial index cannot
+#   select documents by a missing field.  The partial (firewall, seq) index
+#   only holds snapshots and serves the snapshot store's keyframe and delta
+#   lookups; it is unique so concurrent writers cannot give two snapshots
+#   the same sequence number (see write_snapshot).
+USER_COLLECTION_INDEXES = (
+    ([("firewall", pymongo.ASCENDING), ("snapshot", pymongo.ASCENDING)], {}),
+    (
+        [("firewall", pymongo.ASCENDING), ("seq", pymongo.ASCENDING)],
+        {"partialFilterExpression": {"seq": {"$exists": True}}, "unique": True},
+    ),
+)
+
+# MongoDB error codes of create_index for an index that exists with other
+#   options (IndexOptionsConflict, IndexKeySpecsConflict).
+INDEX_CONFLICT_CODES = (85, 86)
+
+# Collections whose indexes have been ensured by this process.
+_indexed_collections = set()
+
+# Optional MongoDB store of rendered snapshot diffs shared by every process,
+#   enabled by setting DIFF_CACHE_MONGO_DATABASE.  It is kept in its own
+#   database so it is never mistaken for a user collection, and documents
+#   expire DIFF_CACHE_MONGO_TTL seconds after they are written.
+DIFF_CACHE_COLLECTION = "snapshot_diffs"
+
+# Largest rendered diff stored, below the 16 MiB MongoDB document limit.
+DIFF_CACHE_MAX_DOCUMENT = 15 * 1024 * 1024
+
+# Set once the TTL index of the diff store has been ensured by this process.
+_diff_cache_indexed = False
+
+# Records of background device jobs (see job_functions), kept in their own
+#   database (JOB_MONGO_DATABASE, default "<MONGODB_DATABASE>_jobs") so they
+#   are never mistaken for a user collection.  Records expire JOB_MONGO_TTL
+#   seconds after they are created.
+JOB_COLLECTION = "device_jobs"
+
+# Set once the indexes of the job store have been ensured by this process.
+_jobs_indexed = False
+
+# Collection profiles (named lists of operational commands run over one SSH
+#   session, see collection_functions), kept per user in their own database
+#   (PROFILE_MONGO_DATABASE, default "<MONGODB_DATABASE>_profiles") so they
+#   are never mistaken for a user collection.
+PROFILE_COLLECTION = "collection_profiles"
+
+# Set once the indexes of the profile store have been ensured by this process.
+_profiles_indexed = False
+
+# Rule hit counters collected from the firewalls (see rule_stats_functions),
+#   kept in their own database (RULE_STATS_MONGO_DATABASE, default
+#   "<MONGODB_DATABASE>_rule_stats") so they are never mistaken for a user
+#   collection.  The hit buckets hold a columnar time series per firewall
+#   and expire RULE_STATS_MONGO_TTL seconds after they end; the counter
+#   records hold the last counters read from each firewall.
+RULE_HIT_COLLECTION = "rule_hit_buckets"
+RULE_COUNTER_COLLECTION = "rule_hit_counters"
+
+# Set once the indexes of the rule hit store have been ensured by this process.
+_rule_stats_indexed = False
+
+# Number of times mutate_user_data_file re-applies a change after losing a
+#   race with another writer before reporting a conflict.
+MUTATION_RETRIES = 5
+
 
 def _get_mongo_client():
     global _mongo_client
@@ -41,6 +138,228 @@ def _get_mongo_client():
     return _mongo_client
 
 
+def _diff_cache_collection():
+    """
+    Gets the MongoDB diff store, ensuring its TTL index once per process.
+
+    Returns:
+        Collection: The diff store, or None if DIFF_CACHE_MONGO_DATABASE is
+                    not set
+    """
+    global _diff_cache_indexed
+
+    database = os.environ.get("DIFF_CACHE_MONGO_DATABASE")
+    if not database:
+        return None
+
+    collection = _get_mongo_client()[database][DIFF_CACHE_COLLECTION]
+    if not _diff_cache_indexed:
+        try:
+            ttl = int(os.environ.get("DIFF_CACHE_MONGO_TTL"))
+        except Exception:
+            ttl = 7 * 24 * 60 * 60
+        collection.create_index("created", expireAfterSeconds=ttl)
+        _diff_cache_indexed = True
+
+    return collection
+
+
+def _jobs_collection():
+    """
+    Gets the MongoDB job store, ensuring its indexes once per process.
+
+    Returns:
+        Collection: The job store
+    """
+    global _jobs_indexed
+
+    database = (
+        os.environ.get("JOB_MONGO_DATABASE")
+        or f"{os.environ.get('MONGODB_DATABASE')}_jobs"
+    )
+
+    collection = _get_mongo_client()[database][JOB_COLLECTION]
+    if not _jobs_indexed:
+        try:
+            ttl = int(os.environ.get("JOB_MONGO_TTL"))
+        except Exception:
+            ttl = 24 * 60 * 60
+        collection.create_index("created", expireAfterSeconds=ttl)
+        collection.create_index([("username", pymongo.ASCENDING)])
+        _jobs_indexed = True
+
+    return collection
+
+
+def _profiles_collection():
+    """
+    Gets the MongoDB collection profile store, ensuring its indexes once per
+    process.
+
+    Returns:
+        Collection: The profile store
+    """
+    global _profiles_indexed
+
+    database = (
+        os.environ.get("PROFILE_MONGO_DATABASE")
+        or f"{os.environ.get('MONGODB_DATABASE')}_profiles"
+    )
+
+    collection = _get_mongo_client()[database][PROFILE_COLLECTION]
+    if not _profiles_indexed:
+        collection.create_index(
+            [("username", pymongo.ASCENDING), ("name", pymongo.ASCENDING)],
+            unique=True,
+        )
+        _profiles_indexed = True
+
+    return collection
+
+
+def _rule_stats_collections():
+    """
+    Gets the MongoDB rule hit bucket and counter collections, ensuring their
+    indexes once per process.
+
+    Returns:
+        tuple: (buckets, counters) collections
+    """
+    global _rule_stats_indexed
+
+    database = (
+        os.environ.get("RULE_STATS_MONGO_DATABASE")
+        or f"{os.environ.get('MONGODB_DATABASE')}_rule_stats"
+    )
+
+    buckets = _get_mongo_client()[database][RULE_HIT_COLLECTION]
+    counters = _get_mongo_client()[database][RULE_COUNTER_COLLECTION]
+    if not _rule_stats_indexed:
+        try:
+            ttl = int(os.environ.get("RULE_STATS_MONGO_TTL"))
+        except Exception:
+            ttl = 90 * 24 * 60 * 60
+        buckets.create_index(
+            [
+                ("username", pymongo.ASCENDING),
+                ("resolution", pymongo.ASCENDING),
+                ("start", pymongo.ASCENDING),
+                ("firewall", pymongo.ASCENDING),
+            ],
+            unique=True,
+        )
+        buckets.create_index("end_date", expireAfterSeconds=ttl)
+        counters.create_index(
+            [("username", pymongo.ASCENDING), ("firewall", pymongo.ASCENDING)],
+            unique=True,
+        )
+        _rule_stats_indexed = True
+
+    return buckets, counters
+
+
+def _ensure_indexes(collection):
+    """
+    Creates the USER_COLLECTION_INDEXES on a user collection once per
+    process.  create_index is a no-op for an index that already exists.
+    """
+    if collection.name in _indexed_collections:
+        return
+
+    logging.debug(f"Ensuring indexes on {collection.name}.")
+    for keys, options in USER_COLLECTION_INDEXES:
+        try:
+            collection.create_index(keys, **options)
+        except pymongo.errors.DuplicateKeyError as e:
+            logging.error(f"Duplicate snapshot sequence in {collection.name}: {e}")
+        except pymongo.errors.OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+            # Rebuild an index created by an earlier release with other
+            #   options (the (firewall, seq) index was not unique).
+            name = "_".join(f"{key}_{direction}" for key, direction in keys)
+            logging.info(f"Rebuilding index {name} on {collection.name}.")
+            collection.drop_index(name)
+            collection.create_index(keys, **options)
+    _indexed_collections.add(collection.name)
+
+    return
+
+
+def _load_user_data(collection, key, query):
+    """
+    Loads a firewall document together with its revision.
+
+    Checks the stored revision and serves the document from the process
+    cache when it is unchanged, otherwise transfers the full document.  The
+    document and revision always come from the same read, so the revision
+    can be used for a conditional write of changes based on the document.
+
+    Returns:
+        tuple: (document, revision), or (None, None) if not found
+    """
+    logging.debug("Reading revision from Mongo.")
+    revision = document_revision(collection.find_one(query, REVISION_PROJECTION))
+    if revision is not None:
+        user_data = document_cache_get(key, revision)
+        if user_data is not None:
+            return user_data, revision
+
+    logging.debug("Reading data from Mongo.")
+    user_data = collection.find_one(query)
+    if user_data is None:
+        return None, None
+    revision = document_revision(user_data)
+    strip_revision_fields(user_data)
+    if revision is not None and "version" in user_data and "system" in user_data:
+        document_cache_set(key, revision, user_data)
+
+    return user_data, revision
+
+
+def _revision_query(query, revision):
+    """
+    Adds a revision condition to a document query.
+
+    Returns:
+        dict: Query matching the document only while it is at the revision
+    """
+    return {**query, "rev_epoch": revision[0], "rev": revision[1]}
+
+
+def document_revision(doc):
+    """
+    Gets the revision of a MongoDB document.
+
+    Args:
+        doc (dict): Document (or revision projection) read from MongoDB
+
+    Returns:
+        tuple: (rev_epoch, rev), or None if the document has never been
+               written by write_user_data_file
+    """
+    if doc is None or "rev" not in doc:
+        return None
+
+    return (doc.get("rev_epoch"), doc["rev"])
+
+
+def strip_revision_fields(data):
+    """
+    Removes the revision bookkeeping fields from a document in place.
+
+    Args:
+        data (dict): Firewall document
+
+    Returns:
+        dict: The same document without revision fields
+    """
+    for field in REVISION_FIELDS:
+        data.pop(field, None)
+
+    return data
+
+
 def add_extra_items(session, request):
     """
     Adds extra configuration items to a user's firewall configuration file.
@@ -50,17 +369,14 @@ def add_extra_items(session, request):
         request: Request object containing form data with extra_items field
 
     The function:
-    - Reads the existing user data file
     - Processes extra items from the request form, stripping whitespace
     - If items match the default template, shows warning that no items were added
-    - Otherwise saves the new items to the user data file
+    - Otherwise sets the new items in the user data file
     - Displays success/warning message via flash
 
     Returns:
         None
     """
-    # Get user's data
-    user_data = read_user_data_file(f"{session['data_dir']}/{session['firewall_name']}")
     default_extra_items = [
         "# Enter set commands here, one per line.",
         "# set firewall global-options all-ping 'enable'",
@@ -79,9 +395,9 @@ def add_extra_items(session, request):
         flash("There are no extra configuration items to add.", "warning")
         return
     else:
-        user_data["extra-items"] = extra_items
-        write_user_data_file(
-            f"{session['data_dir']}/{session['firewall_name']}", user_data
+        update_user_data_file(
+            f"{session['data_dir']}/{session['firewall_name']}",
+            set_fields={("extra-items",): extra_items},
         )
         flash("Extra items added to configuration.", "success")
         return
@@ -96,22 +412,20 @@ def add_hostname(session, request):
         reqest: Request object containing form data with hostname and port fields
 
     The function:
-    - Reads the existing user data file
     - Updates the system hostname and port with values from the request form
-    - Saves the updated data back to the user's data file
+      as a field-level update of the user's data file
 
     Returns:
         None
     """
-    # Get user's data
-    user_data = read_user_data_file(f"{session['data_dir']}/{session['firewall_name']}")
-
-    # Add hostname and port to user_data
-    user_data["system"]["hostname"] = request.form["hostname"]
-    user_data["system"]["port"] = request.form["port"]
-
-    # Write user_data to file
-    write_user_data_file(f"{session['data_dir']}/{session['firewall_name']}", user_data)
+    # Update hostname and port in user_data
+    update_user_data_file(
+        f"{session['data_dir']}/{session['firewall_name']}",
+        set_fields={
+            ("system", "hostname"): request.form["hostname"],
+            ("system", "port"): request.form["port"],
+        },
+    )
 
 
 def allowed_file(filename):
@@ -131,6 +445,70 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ["json", "key"]
 
 
+def apply_user_data_update(
+    data, set_fields=None, unset_fields=None, push_fields=None, pull_fields=None
+):
+    """
+    Applies a field-level update to a firewall document held in memory.
+
+    Args:
+        data (dict): Firewall document to update in place
+        set_fields (dict, optional): {path: value} to assign
+        unset_fields (list, optional): [path] to remove
+        push_fields (dict, optional): {path: value} to append to a list
+        pull_fields (dict, optional): {path: value} to remove from a list
+
+    Paths are tuples of keys, e.g. ("ipv4", "chains", "WAN_IN", "1010").  The
+    operators behave like their MongoDB counterparts so the result matches the
+    document stored by update_user_data_file:
+    - set and push create missing parent dicts (push creates the list)
+    - unset and pull ignore missing paths
+    - pull with a dict value removes list items whose fields match it
+
+    Returns:
+        dict: The same document with the update applied
+    """
+
+    def parent_of(path, create):
+        node = data
+        for field in path[:-1]:
+            if field not in node:
+                if not create:
+                    return None
+                node[field] = {}
+            node = node[field]
+        return node
+
+    for path, value in (set_fields or {}).items():
+        parent_of(path, True)[path[-1]] = value
+
+    for path in unset_fields or []:
+        parent = parent_of(path, False)
+        if parent is not None:
+            parent.pop(path[-1], None)
+
+    for path, value in (push_fields or {}).items():
+        parent_of(path, True).setdefault(path[-1], []).append(value)
+
+    for path, value in (pull_fields or {}).items():
+        parent = parent_of(path, False)
+        if parent is None or path[-1] not in parent:
+            continue
+        if isinstance(value, dict):
+            parent[path[-1]] = [
+                item
+                for item in parent[path[-1]]
+                if not (
+                    isinstance(item, dict)
+                    and all(item.get(k) == v for k, v in value.items())
+                )
+            ]
+        else:
+            parent[path[-1]] = [item for item in parent[path[-1]] if item != value]
+
+    return data
+
+
 def create_backup(session, user=False):
     """
     Creates a backup of either the full data directory or a specific user's directory.
@@ -199,27 +577,48 @@ def create_backup(session, user=False):
     return
 
 
-def decrypt_file(filename, key):
+def create_job_record(job):
+    """
+    Writes a new background job record to the MongoDB job store.
+
+    Args:
+        job (dict): Job record including its "_id" and "username"; a
+            "created" timestamp used by the TTL index is added
+
+    Returns:
+        None
+    """
+    _jobs_collection().insert_one({**job, "created": datetime.now(timezone.utc)})
+
+    return
+
+
+def decrypt_key(filename, key):
     """
-    Decrypts an encrypted file using Fernet symmetric encryption and saves to a temporary file.
+    Decrypts an encrypted key file using Fernet symmetric encryption into memory.
 
     Args:
         filename (str): Path to the encrypted file to decrypt
         key (bytes): Encryption key to use for decryption
 
     Returns:
-        str: Path to the temporary decrypted file
+        bytes: The decrypted file contents
 
     The function:
-    1. Creates a Fernet instance with the provided key
-    2. Reads and decrypts the encrypted file contents
-    3. Generates a random temporary filename
-    4. Writes the decrypted data to the temporary file
-    5. Returns the path to the temporary decrypted file
+    1. Returns the decrypted key from the SSH key cache when the same file
+       (at the same modification time) was decrypted with the same key
+       within SSH_KEY_CACHE_TTL seconds
+    2. Otherwise reads and decrypts the file with a Fernet instance for the
+       provided key, and caches the result
 
-    Note: The temporary file is created in data/tmp/ directory with a
-    6-character random name using uppercase letters and digits
+    The decrypted key is never written to disk.
     """
+    version = os.stat(filename).st_mtime_ns
+    decrypted = ssh_key_cache_get(filename, version, key)
+    if decrypted is not None:
+        logging.debug(" |--> Using cached decrypted key")
+        return decrypted
+
     # using the key
     fernet = Fernet(key)
 
@@ -229,20 +628,42 @@ def decrypt_file(filename, key):
 
     # decrypting the file
     decrypted = fernet.decrypt(encrypted)
+    ssh_key_cache_set(filename, version, key, decrypted)
 
-    # B311 -- Use of pseudo-random generator is not for security purposes.
-    tmp_file_name = "data/tmp/" + "".join(
-        random.choices(string.ascii_uppercase + string.digits, k=6)  # nosec
-    )
+    return decrypted
+
+
+def delete_profile_record(username, name):
+    """
+    Deletes a collection profile from the MongoDB profile store.
+
+    Args:
+        username (str): User that saved the profile
+        name (str): Profile name
+
+    Returns:
+        bool: True if the profile existed
+    """
+    result = _profiles_collection().delete_one({"username": username, "name": name})
+
+    return result.deleted_count > 0
+
+
+def delete_rule_hit_buckets(bucket_ids):
+    """
+    Deletes rule hit buckets from the MongoDB rule hit store.
+
+    Args:
+        bucket_ids (list): "_id" of each bucket to delete
 
-    # opening the file in write mode and
-    # writing the decrypted data
-    with open(f"{tmp_file_name}", "wb") as dec_file:
-        dec_file.write(decrypted)
-        logging.debug(f" |--> Decrypted key temporarily staged as: {tmp_file_name}")
-        dec_file.close()
+    Returns:
+        None
+    """
+    if bucket_ids:
+        buckets, _ = _rule_stats_collections()
+        buckets.delete_many({"_id": {"$in": list(bucket_ids)}})
 
-    return f"{tmp_file_name}"
+    return
 
 
 def delete_user_data_file(filename):
@@ -261,8 +682,10 @@ def delete_user_data_file(filename):
     3. Builds query based on:
        - For snapshots: Matches firewall and snapshot name
        - For firewalls: Matches firewall _id
-    4. Deletes matching document from the collection
+    4. Deletes matching document from the collection (snapshots through the
+       snapshot store, which re-encodes the following snapshot if needed)
     5. Logs debug information about the deletion
+    6. Invalidates any cached copies of the firewall and the user's sidebar
 
     Returns:
         None
@@ -275,16 +698,35 @@ def delete_user_data_file(filename):
     db = client[os.environ.get("MONGODB_DATABASE")]
     collection = db[collection_name]
 
+    logging.debug("Deleting data from Mongo.")
     if len(filename.split("/")) > 3:
         snapshot_name = filename.split("/")[3]
-        query = {"firewall": firewall, "snapshot": snapshot_name}
+        deleted_count = delete_snapshot(collection, firewall, snapshot_name)
     else:
-        query = {"_id": firewall}
+        deleted_count = collection.delete_one({"_id": firewall}).deleted_count
+    invalidate_firewall(collection_name, firewall)
+    document_cache_invalidate(collection_name, firewall)
+    sidebar_cache_invalidate(collection_name)
+    logging.debug(f"{deleted_count} documents deleted")
 
-    logging.debug("Deleting data from Mongo.")
-    logging.debug(query)
-    result = collection.delete_one(query)
-    logging.debug(f"{result.deleted_count} documents deleted")
+    return
+
+
+def ensure_user_indexes():
+    """
+    Creates the indexes used by the sidebar and snapshot queries on every
+    user collection.  Run at startup; collections created later are indexed
+    the first time list_user_files or list_snapshots reads them.
+
+    Returns:
+        None
+    """
+    logging.info("*** Ensuring MongoDB indexes ***")
+    client = _get_mongo_client()
+    db = client[os.environ.get("MONGODB_DATABASE")]
+
+    for collection_name in db.list_collection_names():
+        _ensure_indexes(db[collection_name])
 
     return
 
@@ -492,25 +934,36 @@ def list_snapshots(session):
     The function:
     1. Creates an empty list to store snapshots
     2. Checks if a firewall is currently selected in the session
-    3. Connects to MongoDB using environment variables for connection details
-    4. Queries the user's collection for documents containing snapshots of the selected firewall
-    5. Sorts results by snapshot timestamp in descending order
-    6. Extracts snapshot details and optional tags into formatted dictionaries
-    7. Returns the list of snapshot dictionaries
+    3. Returns the list from the sidebar cache when it holds one for the user and firewall
+    4. Connects to MongoDB using environment variables for connection details
+    5. Queries the user's collection for documents containing snapshots of the selected firewall,
+       reading only the snapshot name and tag
+    6. Sorts results by snapshot creation order
+    7. Extracts snapshot details and optional tags into formatted dictionaries
+    8. Caches and returns the list of snapshot dictionaries
     """
     snapshot_list = []
 
     if "firewall_name" in session:
         collection_name = f"{session['username']}"
+        cached = sidebar_cache_get(
+            collection_name, session["firewall_name"], "snapshot_list"
+        )
+        if cached is not None:
+            logging.debug("Reading snapshot list from sidebar cache.")
+            return cached
 
         logging.debug("Prepping Mongo query.")
         client = _get_mongo_client()
         db = client[os.environ.get("MONGODB_DATABASE")]
         collection = db[collection_name]
+        _ensure_indexes(collection)
         query = {"firewall": session["firewall_name"], "snapshot": {"$exists": True}}
+        projection = {"_id": 1, "firewall": 1, "snapshot": 1, "tag": 1}
 
         logging.debug("Reading data from Mongo.")
-        for doc in collection.find(query).sort("_id", pymongo.ASCENDING):
+        cursor = collection.find(query, projection).sort("_id", pymongo.ASCENDING)
+        for doc in cursor:
             if "tag" in doc:
                 tag = doc["tag"]
             else:
@@ -518,6 +971,9 @@ def list_snapshots(session):
             snapshot_list.append(
                 {"name": doc["snapshot"], "id": doc["firewall"], "tag": tag}
             )
+        sidebar_cache_set(
+            collection_name, session["firewall_name"], "snapshot_list", snapshot_list
+        )
 
     logging.debug("Snapshot List: " + str(snapshot_list))
 
@@ -570,27 +1026,38 @@ def list_user_files(session):
               excluding snapshots and documents with 'firewall' field
 
     The function:
-    1. Creates an empty list to store filenames
+    1. Returns the list from the sidebar cache when it holds one for the user
     2. Connects to MongoDB using environment variables for connection details
-    3. Queries the user's collection for documents that don't have 'firewall' or 'snapshot' fields
+    3. Queries the user's collection for documents that don't have 'firewall' or 'snapshot' fields,
+       reading only their '_id'
     4. Extracts the '_id' field from each document as the filename
     5. Sorts the list alphabetically
-    6. Returns the sorted list of filenames
+    6. Caches and returns the sorted list of filenames
     """
     file_list = []
     collection_name = f"{session['username']}"
+    firewall = session.get("firewall_name")
+
+    cached = sidebar_cache_get(collection_name, firewall, "file_list")
+    if cached is not None:
+        logging.debug("Reading file list from sidebar cache.")
+        return cached
 
     logging.debug("Prepping Mongo query.")
     client = _get_mongo_client()
     db = client[os.environ.get("MONGODB_DATABASE")]
     collection = db[collection_name]
-    query = {"firewall": {"$exists": False}, "snapshot": {"$exists": False}}
+    _ensure_indexes(collection)
+    # Null matches missing fields and, unlike $exists: False, can use the
+    #   (firewall, snapshot) index.
+    query = {"firewall": None, "snapshot": None}
 
     logging.debug("Reading data from Mongo.")
-    for doc in collection.find(query):
+    for doc in collection.find(query, {"_id": 1}):
         file_list.append(doc["_id"])
 
     file_list.sort()
+    sidebar_cache_set(collection_name, firewall, "file_list", file_list)
     return file_list
 
 
@@ -627,6 +1094,33 @@ def list_user_keys(session):
     return key_list
 
 
+def migrate_user_snapshots():
+    """
+    Moves snapshots stored as full documents to the delta-compressed snapshot
+    store.  Run at startup after upgrade_user_data_files; firewalls already
+    migrated are skipped.
+
+    The function:
+    1. Iterates every user collection
+    2. Rewrites the snapshot series of each firewall that still has full
+       snapshot documents as keyframes and deltas (see
+       snapshot_functions.migrate_snapshots)
+
+    Returns:
+        int: Number of snapshot documents rewritten
+    """
+    logging.info("*** Checking snapshot storage ***")
+    client = _get_mongo_client()
+    db = client[os.environ.get("MONGODB_DATABASE")]
+
+    migrated = 0
+    for collection_name in db.list_collection_names():
+        migrated += migrate_snapshots(db[collection_name])
+    logging.info(f" |--> {migrated} snapshots migrated.")
+
+    return migrated
+
+
 def mongo_dump():
     """
     Creates a backup dump of all collections in the MongoDB database.
@@ -663,6 +1157,68 @@ def mongo_dump():
                 f.write(bson.BSON.encode(doc))
 
 
+def mutate_user_data_file(filename, build_update, retries=MUTATION_RETRIES):
+    """
+    Applies a change that depends on the current firewall document without
+    overwriting concurrent edits by other sessions.
+
+    Args:
+        filename (str): Path in format 'data/<user>/<firewall_name>'
+        build_update (callable): Called with a copy of the current document,
+            returns the keyword arguments for update_user_data_file
+            (set_fields, unset_fields, push_fields, pull_fields), or None
+            to abandon the change
+        retries (int, optional): Attempts after a conflicting write.
+            Defaults to MUTATION_RETRIES.
+
+    The function:
+    1. Reads the document and its revision, saving it first if it needs a
+       schema upgrade
+    2. Builds the user's change from that document
+    3. Writes the change only if the document is still at that revision
+    4. On conflict, re-reads and rebuilds the change so only the user's change
+       is re-applied on top of the other session's edit
+    5. Flashes a conflict message when every attempt loses the race
+
+    No lock is held, so any number of threads and replicas can edit the same
+    firewall; edits to unrelated fields never conflict with each other.
+
+    Returns:
+        bool: True if the change was written, False if it was abandoned or
+              could not be applied
+    """
+    # filename format:  data/<user>/<firewall_name>
+    for attempt in range(retries + 1):
+        user_data, revision = read_user_data_with_revision(filename)
+        if user_data is None:
+            flash("Firewall configuration not found.", "danger")
+            return False
+
+        # Field-level changes assume the current schema, so save the
+        #   upgraded document first and apply the change on top of it.
+        if upgrade_user_data(user_data):
+            write_user_data_file(filename, user_data, expected_revision=revision)
+            continue
+
+        fields = build_update(user_data)
+        if fields is None:
+            return False
+
+        if update_user_data_file(filename, expected_revision=revision, **fields):
+            return True
+        logging.info(
+            f"Concurrent update of {filename} at revision {revision}, "
+            f"retrying ({attempt + 1}/{retries})."
+        )
+
+    flash(
+        "The configuration was changed by another session and your change could "
+        "not be applied. Please review and try again.",
+        "danger",
+    )
+    return False
+
+
 def process_upload(session, request, app):
     """
     Process uploaded files, validate them, and store them in the user's data directory.
@@ -720,6 +1276,7 @@ def process_upload(session, request, app):
                 if "_id" in user_data:
                     del user_data["_id"]
                 filename = filename.replace(".json", "")
+                upgrade_user_data(user_data)
                 write_user_data_file(f"{session['data_dir']}/{filename}", user_data)
                 os.remove(f"data/uploads/{filename}.json")
         except Exception:
@@ -758,14 +1315,135 @@ def process_upload(session, request, app):
     return
 
 
-def read_user_data_file(filename, snapshot="current", diff=False):
+def read_profile_records(username):
+    """
+    Reads the collection profiles saved by a user from the MongoDB profile
+    store.
+
+    Args:
+        username (str): User that saved the profiles
+
+    Returns:
+        dict: Lists of operational commands keyed by profile name, sorted by
+              name
+    """
+    profiles = _profiles_collection().find(
+        {"username": username}, {"_id": 0, "name": 1, "commands": 1}
+    )
+
+    return {
+        profile["name"]: profile["commands"]
+        for profile in sorted(profiles, key=lambda profile: profile["name"])
+    }
+
+
+def read_rule_counters(username, firewall):
+    """
+    Reads the last rule counters recorded for a firewall from the MongoDB
+    rule hit store.
+
+    Args:
+        username (str): User that owns the firewall configuration
+        firewall (str): Firewall configuration name
+
+    Returns:
+        tuple: (sampled, counters) with sampled the epoch second the counters
+               were read and counters {rule: (packets, bytes)}, or None if no
+               counters were recorded
+    """
+    _, counters = _rule_stats_collections()
+    doc = counters.find_one({"username": username, "firewall": firewall})
+    if doc is None:
+        return None
+
+    return doc["sampled"], {
+        rule: (packets, octets)
+        for rule, packets, octets in zip(doc["rules"], doc["packets"], doc["bytes"])
+    }
+
+
+def read_rule_hit_buckets(username, resolution, since=None, until=None, firewall=None):
+    """
+    Reads the rule hit buckets of a user that overlap a time window from the
+    MongoDB rule hit store.
+
+    Args:
+        username (str): User that owns the firewall configurations
+        resolution (str): Bucket resolution, "raw" or "hourly"
+        since (int, optional): Window start as an epoch second
+        until (int, optional): Window end as an epoch second
+        firewall (str, optional): Only read the buckets of this firewall
+
+    Returns:
+        list: Bucket documents sorted by start and firewall
+    """
+    query = {"username": username, "resolution": resolution}
+    if since is not None:
+        query["end"] = {"$gt": since}
+    if until is not None:
+        query["start"] = {"$lt": until}
+    if firewall is not None:
+        query["firewall"] = firewall
+
+    buckets, _ = _rule_stats_collections()
+
+    return list(
+        buckets.find(query).sort(
+            [("start", pymongo.ASCENDING), ("firewall", pymongo.ASCENDING)]
+        )
+    )
+
+
+def read_diff_cache(key):
+    """
+    Reads a rendered snapshot diff from the MongoDB diff store.
+
+    Args:
+        key (str): Hash of the diff view and the content of both snapshots
+
+    The diff store is an optional, shared second level behind the in-process
+    diff cache, so errors are logged and treated as a miss.
+
+    Returns:
+        str: Rendered diff, or None if not stored or the store is disabled
+    """
+    try:
+        collection = _diff_cache_collection()
+        if collection is None:
+            return None
+        doc = collection.find_one({"_id": key}, {"html": 1})
+    except pymongo.errors.PyMongoError as e:
+        logging.warning(f"Diff cache read failed: {e}")
+        return None
+
+    if doc is None:
+        return None
+
+    return doc["html"]
+
+
+def read_job_record(job_id, username):
+    """
+    Reads a background job record from the MongoDB job store.
+
+    Args:
+        job_id (str): Job identifier
+        username (str): User that submitted the job; records of other users
+            are never returned
+
+    Returns:
+        dict: Job record, or None if not found
+    """
+    return _jobs_collection().find_one({"_id": job_id, "username": username})
+
+
+def read_user_data_file(filename, snapshot="current"):
     """
     Read user data from MongoDB for a given firewall configuration.
 
     Args:
         filename (str): Path to the user data file in format 'data/<user>/<firewall_name>'
         snapshot (str, optional): Name of snapshot to read. Defaults to 'current'.
-        diff (bool, optional): Whether this is for a diff operation. Defaults to False.
 
     Returns:
         dict: User data containing firewall configuration, or empty dict if error occurs
@@ -773,52 +1451,157 @@ def read_user_data_file(filename, snapshot="current", diff=False):
     The function:
     1. Extracts collection name and firewall name from filename
     2. Connects to MongoDB using environment variables
-    3. Queries for either current data (_id=firewall) or snapshot data
-    4. Performs schema updates if needed:
-       - Sets version if missing
-       - Adds system config if missing
-    5. For non-current snapshots, overwrites current data unless diff=True
+    3. Queries for either current data (_id=firewall) or snapshot data,
+       reconstructed by the snapshot store (see snapshot_functions)
+    4. Upgrades documents saved with an older schema in memory (see
+       upgrade_user_data); the stored document is not modified
+
+    Reads never write, so every read is cached for the rest of the request and
+    the assemble_* helpers called by one route share a single MongoDB round
+    trip. Across requests, only the document revision is read when the
+    process-wide cache already holds that revision.  Use restore_snapshot to
+    make a snapshot the current configuration.
     """
     # filename format:  data/<user>/<firewall_name>
     try:
         collection_name = filename.split("/")[1]
         firewall = filename.split("/")[2]
 
+        key = cache_key(filename, snapshot)
+        user_data = request_cache_get(key)
+        if user_data is not None:
+            logging.debug("Reading data from request cache.")
+            return user_data
+
         logging.debug("Prepping Mongo query.")
         client = _get_mongo_client()
         db = client[os.environ.get("MONGODB_DATABASE")]
         collection = db[collection_name]
 
         if snapshot == "current":
-            query = {"_id": firewall}
+            user_data, _ = _load_user_data(collection, key, {"_id": firewall})
         else:
-            query = {"firewall": firewall, "snapshot": snapshot}
-
-        logging.debug("Reading data from Mongo.")
-        for data in collection.find(query):
-            user_data = data
-            if "version" not in user_data:
-                user_data["version"] = "0"
-                user_data = update_schema(user_data)
-                write_user_data_file(filename, user_data)
-            if "system" not in user_data:
-                user_data["system"] = {
-                    "hostname": "None",
-                    "port": "None",
-                }
-                write_user_data_file(filename, user_data)
+            logging.debug("Reading snapshot from Mongo.")
+            user_data = read_snapshot(collection, firewall, snapshot)
+        if user_data is None:
+            return None
 
-            # If this was not a read of "current", then we want to immediately
-            #   write over current with the snapshot data.
-            if snapshot != "current" and not diff:
-                delete_user_data_file(filename)
-                write_user_data_file(filename, user_data)
-            return user_data
+        upgrade_user_data(user_data)
+        request_cache_set(key, user_data)
+        return user_data
 
     except Exception:
         return {}
 
 
+def read_user_data_with_revision(filename):
+    """
+    Read the current firewall configuration together with its revision.
+
+    Args:
+        filename (str): Path to the user data file in format 'data/<user>/<firewall_name>'
+
+    Returns:
+        tuple: (user_data, revision), or (None, None) if the firewall does not
+               exist.  The revision is None for documents that have never
+               been written with a revision.
+
+    The document is never served from the request cache so the revision is
+    always the one the document was read at, and can be passed as
+    expected_revision to update_user_data_file or write_user_data_file.
+    """
+    # filename format:  data/<user>/<firewall_name>
+    collection_name = filename.split("/")[1]
+    firewall = filename.split("/")[2]
+
+    logging.debug("Prepping Mongo query.")
+    client = _get_mongo_client()
+    db = client[os.environ.get("MONGODB_DATABASE")]
+    collection = db[collection_name]
+
+    return _load_user_data(collection, cache_key(filename), {"_id": firewall})
+
+
+def read_user_snapshot_series(filename, last=None):
+    """
+    Reads the snapshots of a firewall from MongoDB, oldest first.
+
+    Args:
+        filename (str): Path in format 'data/<user>/<firewall_name>'
+        last (int, optional): Only return this many of the latest snapshots.
+            Defaults to None (every snapshot).
+
+    The series is read and reconstructed in one pass by
+    snapshot_functions.read_snapshot_series, rather than one
+    read_user_data_file call per snapshot.
+
+    Returns:
+        list: Snapshot documents (configuration with _id, firewall, snapshot
+              and tag fields), oldest first
+    """
+    # filename format:  data/<user>/<firewall_name>
+    collection_name = filename.split("/")[1]
+    firewall = filename.split("/")[2]
+
+    logging.debug("Prepping Mongo query.")
+    client = _get_mongo_client()
+    db = client[os.environ.get("MONGODB_DATABASE")]
+    collection = db[collection_name]
+    _ensure_indexes(collection)
+
+    return read_snapshot_series(collection, firewall, last)
+
+
+def restore_snapshot(filename, snapshot):
+    """
+    Makes a snapshot the current configuration of a firewall.
+
+    Args:
+        filename (str): Path in format 'data/<user>/<firewall_name>'
+        snapshot (str): Name of the snapshot to restore
+
+    The function:
+    1. Reconstructs the snapshot configuration without its snapshot fields
+    2. Replaces the current document with it in a single replace_one, so the
+       firewall never disappears while it is being restored
+    3. Gives the restored document a new revision epoch so cached copies and
+       in-flight conditional writes of the replaced document are rejected
+    4. Writes the restored document through to the process-wide cache
+
+    Returns:
+        bool: True if the snapshot was restored, False if it does not exist
+    """
+    # filename format:  data/<user>/<firewall_name>
+    collection_name = filename.split("/")[1]
+    firewall = filename.split("/")[2]
+
+    logging.debug("Prepping Mongo query.")
+    client = _get_mongo_client()
+    db = client[os.environ.get("MONGODB_DATABASE")]
+    collection = db[collection_name]
+
+    logging.debug("Reading snapshot from Mongo.")
+    user_data = read_snapshot(collection, firewall, snapshot)
+    if user_data is None:
+        logging.info(f"Snapshot {snapshot} of {firewall} not found.")
+        return False
+    user_data = snapshot_content(user_data)
+    upgrade_user_data(user_data)
+
+    revision = (uuid.uuid4().hex, 1)
+    logging.debug("Replacing current data in Mongo.")
+    collection.replace_one(
+        {"_id": firewall},
+        {**user_data, "rev_epoch": revision[0], "rev": revision[1]},
+        upsert=True,
+    )
+    invalidate_firewall(collection_name, firewall)
+    sidebar_cache_invalidate(collection_name)
+    document_cache_set(cache_key(filename), revision, {"_id": firewall, **user_data})
+
+    return True
+
+
 def tag_snapshot(session, request):
     """
     Updates the tag for a firewall configuration snapshot.
@@ -832,10 +1615,9 @@ def tag_snapshot(session, request):
 
     The function:
     1. Extracts firewall name, snapshot name and tag from the request form
-    2. Reads the snapshot data for the specified firewall/snapshot
-    3. Updates the tag field in the snapshot data
-    4. Writes the updated data back to storage
-    5. Displays a success message
+    2. Sets the tag field of the snapshot document, leaving its stored
+       configuration untouched
+    3. Displays a success message
 
     Returns:
         None
@@ -843,22 +1625,38 @@ def tag_snapshot(session, request):
     firewall_name = request.form["firewall_name"]
     snapshot_name = request.form["snapshot_name"]
     snapshot_tag = request.form["snapshot_tag"]
-    user_data = read_user_data_file(
-        f"data/{session['username']}/{firewall_name}",
-        snapshot=snapshot_name,
-        diff=True,
-    )
 
-    user_data["tag"] = snapshot_tag
-    write_user_data_file(
-        f"data/{session['username']}/{firewall_name}", user_data, snapshot=snapshot_name
-    )
+    logging.debug("Prepping Mongo query.")
+    client = _get_mongo_client()
+    db = client[os.environ.get("MONGODB_DATABASE")]
+    collection = db[session["username"]]
+
+    logging.debug("Writing snapshot tag to Mongo.")
+    tag_snapshot_document(collection, firewall_name, snapshot_name, snapshot_tag)
+    invalidate_firewall(session["username"], firewall_name)
+    sidebar_cache_invalidate(session["username"], firewall_name)
 
     flash(f"Tag updated for snapshot {snapshot_name}.", "success")
 
     return
 
 
+def update_job_record(job_id, fields):
+    """
+    Updates fields of a background job record in the MongoDB job store.
+
+    Args:
+        job_id (str): Job identifier
+        fields (dict): Fields to set
+
+    Returns:
+        None
+    """
+    _jobs_collection().update_one({"_id": job_id}, {"$set": fields})
+
+    return
+
+
 def update_schema(user_data):
     """
     Updates the schema of a firewall configuration from version 0 to version 1.
@@ -923,6 +1721,188 @@ def update_schema(user_data):
     return user_data
 
 
+def update_user_data_file(
+    filename,
+    set_fields=None,
+    unset_fields=None,
+    push_fields=None,
+    pull_fields=None,
+    expected_revision=None,
+):
+    """
+    Applies a field-level update to the current firewall document in MongoDB.
+
+    Args:
+        filename (str): Path in format 'data/<user>/<firewall_name>' containing user and firewall info
+        set_fields (dict, optional): {path: value} sent as $set
+        unset_fields (list, optional): [path] sent as $unset
+        push_fields (dict, optional): {path: value} sent as $push
+        pull_fields (dict, optional): {path: value} sent as $pull
+        expected_revision (tuple, optional): Only apply the update if the
+            document is still at this revision. Defaults to None (always apply).
+
+    Paths are tuples of keys and are sent as dotted paths, e.g.
+    ("ipv4", "chains", "WAN_IN", "1010") -> "ipv4.chains.WAN_IN.1010", so the
+    size of the write follows the size of the change rather than the ruleset.
+    Paths must not overlap within one update (MongoDB rejects the update).
+
+    The function:
+    1. Falls back to a full read/modify/write when a key cannot be used in a
+       dotted path (contains "." or starts with "$")
+    2. Sends the operators to MongoDB with the "rev" bump in one update,
+       conditioned on expected_revision when given
+    3. Invalidates any request cached copies of the firewall
+    4. Applies the same update to the process-wide cached copy when it holds
+       the previous revision, otherwise drops the cached copy
+
+    Returns:
+        bool: True if the document was updated, False if it does not exist or
+              is no longer at expected_revision
+    """
+    set_fields = set_fields or {}
+    unset_fields = unset_fields or []
+    push_fields = push_fields or {}
+    pull_fields = pull_fields or {}
+
+    paths = [*set_fields, *unset_fields, *push_fields, *pull_fields]
+    if not paths:
+        return True
+
+    # Keys such as "10.0.0.0/8" cannot be expressed as a dotted path.
+    if any(
+        field == "" or "." in field or field.startswith("$")
+        for path in paths
+        for field in path
+    ):
+        logging.debug("Key not usable in dotted path, writing full document.")
+        user_data, revision = read_user_data_with_revision(filename)
+        if user_data is None:
+            return False
+        if expected_revision is not None and revision != expected_revision:
+            return False
+        apply_user_data_update(
+            user_data, set_fields, unset_fields, push_fields, pull_fields
+        )
+        return write_user_data_file(filename, user_data, expected_revision=revision)
+
+    # filename format:  data/<user>/<firewall_name>
+    collection_name = filename.split("/")[1]
+    firewall = filename.split("/")[2]
+
+    logging.debug("Prepping Mongo query.")
+    client = _get_mongo_client()
+    db = client[os.environ.get("MONGODB_DATABASE")]
+    collection = db[collection_name]
+
+    values = {"$inc": {"rev": 1}}
+    if set_fields:
+        values["$set"] = {".".join(path): value for path, value in set_fields.items()}
+    if unset_fields:
+        values["$unset"] = {".".join(path): "" for path in unset_fields}
+    if push_fields:
+        values["$push"] = {".".join(path): value for path, value in push_fields.items()}
+    if pull_fields:
+        values["$pull"] = {".".join(path): value for path, value in pull_fields.items()}
+
+    query = {"_id": firewall}
+    if expected_revision is not None:
+        query = _revision_query(query, expected_revision)
+
+    logging.debug("Updating data in Mongo.")
+    logging.debug(values)
+    result = collection.find_one_and_update(
+        query,
+        values,
+        projection=REVISION_PROJECTION,
+        return_document=pymongo.ReturnDocument.AFTER,
+    )
+    if result is None:
+        logging.info(f"Firewall {firewall} not found at expected revision.")
+        return False
+    invalidate_firewall(collection_name, firewall)
+    logging.debug(f"Document updated to revision {document_revision(result)}")
+
+    # Write-through: replay the update on the cached previous revision.
+    key = cache_key(filename)
+    revision = document_revision(result)
+    cached_revision, cached_data = document_cache_peek(key)
+    if cached_revision == (revision[0], revision[1] - 1):
+        apply_user_data_update(
+            cached_data, set_fields, unset_fields, push_fields, pull_fields
+        )
+        document_cache_set(key, revision, cached_data)
+    else:
+        document_cache_invalidate(collection_name, firewall)
+
+    return True
+
+
+def upgrade_user_data(user_data):
+    """
+    Brings a firewall document saved with an older schema up to date in memory.
+
+    Args:
+        user_data (dict): Firewall document to upgrade in place
+
+    The function:
+    1. Sets version "0" and applies update_schema when version is missing
+    2. Adds a default system config when it is missing
+
+    Returns:
+        bool: True if the document was changed and should be saved
+    """
+    changed = False
+    if "version" not in user_data:
+        user_data["version"] = "0"
+        update_schema(user_data)
+        changed = True
+    if "system" not in user_data:
+        user_data["system"] = {
+            "hostname": "None",
+            "port": "None",
+        }
+        changed = True
+
+    return changed
+
+
+def upgrade_user_data_files():
+    """
+    Saves every firewall document still stored with an older schema in the
+    current schema.  Run at startup, since reads only upgrade in memory.
+
+    The function:
+    1. Finds current and snapshot documents missing "version" or "system"
+       in every user collection
+    2. Upgrades each with upgrade_user_data and writes it back in place
+
+    Returns:
+        None
+    """
+    logging.info("*** Checking firewall document schemas ***")
+    client = _get_mongo_client()
+    db = client[os.environ.get("MONGODB_DATABASE")]
+
+    legacy = {
+        "$or": [{"version": {"$exists": False}}, {"system": {"$exists": False}}],
+        "delta": {"$exists": False},
+    }
+    for collection_name in db.list_collection_names():
+        for user_data in db[collection_name].find(legacy):
+            if "snapshot" in user_data:
+                filename = f"data/{collection_name}/{user_data['firewall']}"
+                snapshot = user_data["snapshot"]
+            else:
+                filename = f"data/{collection_name}/{user_data['_id']}"
+                snapshot = "current"
+            logging.info(f" |--> Upgrading {filename} ({snapshot}).")
+            strip_revision_fields(user_data)
+            upgrade_user_data(user_data)
+            write_user_data_file(filename, user_data, snapshot)
+
+    return
+
+
 def upload_backup_file(backup_file):
     """
     Uploads a backup file to an S3 bucket.
@@ -1021,17 +2001,150 @@ def validate_mongodb_connection(mongodb_uri):
             client.close()
 
 
-def write_user_command_conf_file(session, command_list, delete=False):
+def write_profile_record(username, name, commands):
+    """
+    Writes a collection profile to the MongoDB profile store, replacing a
+    profile of the same name.
+
+    Args:
+        username (str): User saving the profile
+        name (str): Profile name
+        commands (list): Operational commands, in the order they are run
+
+    Returns:
+        None
+    """
+    _profiles_collection().update_one(
+        {"username": username, "name": name},
+        {
+            "$set": {
+                "commands": list(commands),
+                "updated": datetime.now(timezone.utc),
+            }
+        },
+        upsert=True,
+    )
+
+    return
+
+
+def write_rule_counters(username, firewall, sampled, counters):
+    """
+    Writes the rule counters last read from a firewall to the MongoDB rule
+    hit store, replacing the previous ones.
+
+    Args:
+        username (str): User that owns the firewall configuration
+        firewall (str): Firewall configuration name
+        sampled (int): Epoch second the counters were read
+        counters (dict): (packets, bytes) keyed by rule
+
+    Returns:
+        None
+
+    The counters are stored as parallel rule, packet and byte lists, as rule
+    names are not valid MongoDB field names.
+    """
+    _, collection = _rule_stats_collections()
+    collection.replace_one(
+        {"username": username, "firewall": firewall},
+        {
+            "username": username,
+            "firewall": firewall,
+            "sampled": sampled,
+            "rules": list(counters),
+            "packets": [packets for packets, _ in counters.values()],
+            "bytes": [octets for _, octets in counters.values()],
+        },
+        upsert=True,
+    )
+
+    return
+
+
+def write_rule_hit_bucket(bucket):
+    """
+    Writes a rule hit bucket to the MongoDB rule hit store, replacing the
+    bucket of the same user, firewall, resolution and start.
+
+    Args:
+        bucket (dict): Bucket with "username", "firewall", "resolution",
+            "start" and "end" (epoch seconds) and its columns; an "end_date"
+            used by the TTL index is added
+
+    Returns:
+        None
+    """
+    bucket = {key: value for key, value in bucket.items() if key != "_id"}
+    bucket["end_date"] = datetime.fromtimestamp(bucket["end"], timezone.utc)
+
+    buckets, _ = _rule_stats_collections()
+    buckets.replace_one(
+        {
+            "username": bucket["username"],
+            "resolution": bucket["resolution"],
+            "start": bucket["start"],
+            "firewall": bucket["firewall"],
+        },
+        bucket,
+        upsert=True,
+    )
+
+    return
+
+
+def write_diff_cache(key, html):
+    """
+    Writes a rendered snapshot diff to the MongoDB diff store.
+
+    Args:
+        key (str): Hash of the diff view and the content of both snapshots
+        html (str): Rendered diff
+
+    The function:
+    1. Does nothing if the diff store is disabled
+    2. Skips diffs larger than DIFF_CACHE_MAX_DOCUMENT
+    3. Stores the diff with a "created" timestamp used by the TTL index
+    4. Logs and ignores errors, as the diff store is only a cache
+
+    Returns:
+        None
+    """
+    if len(html) > DIFF_CACHE_MAX_DOCUMENT:
+        return
+
+    try:
+        collection = _diff_cache_collection()
+        if collection is None:
+            return
+        collection.replace_one(
+            {"_id": key},
+            {"html": html, "created": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+    except pymongo.errors.PyMongoError as e:
+        logging.warning(f"Diff cache write failed: {e}")
+
+    return
+
+
+def write_user_command_conf_file(session, command_list, delete=False, filename=None):
     """
     Writes firewall commands to a configuration file.
 
     Args:
         session (dict): Session dictionary containing data_dir and firewall_name
-        command_list (list): List of firewall commands to write to file
+        command_list (iterable): Firewall commands to write to file, either a
+            list or a generator such as iter_config(), which is written out
+            as it is consumed
         delete (bool): If True, adds command to delete existing firewall first
+        filename (str, optional): Path of the file to write, e.g. the command
+            file of one device job.  Defaults to the .conf file named after
+            the firewall.
 
     The function:
-    1. Opens a .conf file using the firewall name from the session
+    1. Opens the .conf file named by filename, or by the firewall name from
+       the session
     2. If delete=True:
         - Writes a comment and delete command at the start
         - Writes all commands from command_list
@@ -1042,7 +2155,10 @@ def write_user_command_conf_file(session, command_list, delete=False):
     Returns:
         None
     """
-    with open(f"{session['data_dir']}/{session['firewall_name']}.conf", "w") as f:
+    if filename is None:
+        filename = f"{session['data_dir']}/{session['firewall_name']}.conf"
+
+    with open(filename, "w") as f:
         if delete is True:
             f.write(
                 "#\n# Delete all firewall before setting new values\ndelete firewall\n"
@@ -1055,7 +2171,7 @@ def write_user_command_conf_file(session, command_list, delete=False):
     return
 
 
-def write_user_data_file(filename, data, snapshot="current"):
+def write_user_data_file(filename, data, snapshot="current", expected_revision=None):
     """
     Writes firewall configuration data to MongoDB.
 
@@ -1063,6 +2179,9 @@ def write_user_data_file(filename, data, snapshot="current"):
         filename (str): Path in format 'data/<user>/<firewall_name>' containing user and firewall info
         data (dict): Dictionary containing firewall configuration data to write
         snapshot (str, optional): Name of snapshot to write. Defaults to "current"
+        expected_revision (tuple, optional): Only write if the existing document
+            is still at this revision. Defaults to None (always write, creating
+            the document if needed).
 
     The function:
     1. Extracts collection name (user) and firewall name from filename path
@@ -1071,17 +2190,22 @@ def write_user_data_file(filename, data, snapshot="current"):
         - Removes _id, firewall and snapshot fields from data
         - Uses firewall name as document _id
     4. For named snapshots:
-        - Removes _id field
-        - Adds firewall name and snapshot name to data
-        - Uses firewall and snapshot names to identify document
-    5. Updates or inserts document in MongoDB collection
+        - Writes the snapshot through the snapshot store, which stores it
+          delta-compressed against the previous snapshot (see
+          snapshot_functions.write_snapshot)
+    5. Updates or inserts document in MongoDB collection, bumping its "rev"
+       (a conditional write only updates, and only at expected_revision)
+    6. Invalidates any request cached copies of the firewall and the user's
+       sidebar (a write may create a firewall or snapshot)
+    7. Writes the new revision through to the process-wide cache
 
     Environment variables used:
         MONGODB_URI: MongoDB connection string
         MONGODB_DATABASE: Name of MongoDB database
 
     Returns:
-        None
+        bool: True if the document was written, False if a conditional write
+              found the document missing or at another revision
     """
     # filename format:  data/<user>/<firewall_name>
     collection_name = filename.split("/")[1]
@@ -1102,17 +2226,55 @@ def write_user_data_file(filename, data, snapshot="current"):
             del data["snapshot"]
         query = {"_id": firewall}
     else:
-        if "_id" in data:
-            del data["_id"]
-        # Add snapshot and firewall to the data.
-        data["firewall"] = firewall
-        data["snapshot"] = snapshot
-        query = {"firewall": firewall, "snapshot": snapshot}
-    values = {"$set": data}
+        logging.debug("Writing snapshot to Mongo.")
+        _ensure_indexes(collection)
+        write_snapshot(collection, firewall, snapshot, data)
+        invalidate_firewall(collection_name, firewall)
+        sidebar_cache_invalidate(collection_name, firewall)
+        return True
+    strip_revision_fields(data)
+
+    # Bump the revision atomically with the write.  The epoch is only set
+    #   when the document is created so a re-created firewall never matches
+    #   a revision cached for the document it replaced.
+    epoch = uuid.uuid4().hex
+    values = {
+        "$set": data,
+        "$inc": {"rev": 1},
+        "$setOnInsert": {"rev_epoch": epoch},
+    }
+
+    if expected_revision is not None:
+        query = _revision_query(query, expected_revision)
 
     logging.debug("Writing data to Mongo.")
     logging.debug(query)
-    result = collection.update_one(query, values, upsert=True)
-    logging.debug(f"{result.modified_count} documents updated")
+    result = collection.find_one_and_update(
+        query,
+        values,
+        projection=REVISION_PROJECTION,
+        upsert=expected_revision is None,
+        return_document=pymongo.ReturnDocument.AFTER,
+    )
+    if result is None:
+        logging.info(f"Firewall {firewall} not found at expected revision.")
+        return False
+    logging.debug(f"Document written at revision {document_revision(result)}")
+    invalidate_firewall(collection_name, firewall)
+    sidebar_cache_invalidate(collection_name)
+
+    # Write-through: $set replaces top level keys, so the stored document is
+    #   the previously cached revision overlaid with data.  When the previous
+    #   revision is unknown the cached copy is dropped instead.
+    key = cache_key(filename, snapshot)
+    revision = document_revision(result)
+    cached_revision, cached_data = document_cache_peek(key)
+    if result["rev"] == 1 and result.get("rev_epoch") == epoch:
+        document_cache_set(key, revision, {"_id": result["_id"], **data})
+    elif cached_revision == (revision[0], revision[1] - 1):
+        cached_data.update(data)
+        document_cache_set(key, revision, cached_data)
+    else:
+        document_cache_invalidate(collection_name, firewall)
 
-    return
+    return True
@@ -1,11 +1,75 @@
 """
 Diff related functions for comparing configuration snapshots and generating HTML diff views.
 Contains functions for processing configuration lists and creating styled HTML diff output.
+
+Three views are available:
+- Structural (default): walks groups, filters, chains and rules of both
+  snapshots by key and renders only the added, removed and changed items
+  and fields.  Runs in time linear in the size of the snapshots.
+- Unified: regenerates the configuration of both snapshots, diffs the
+  lines with the patience algorithm and renders only the changed regions
+  (hunks) with a few lines of context, a page of hunks at a time.
+- Text: regenerates the configuration of both snapshots and renders a
+  side-by-side difflib.HtmlDiff of the full text.
+
+A timeline summarises every step of a series of consecutive snapshots, with
+each snapshot read and generated once; large series are split across a
+process pool.
+
+Rendered diffs are cached by a hash of the view and the content of both
+snapshots, in process (cache_functions) and optionally in MongoDB
+(data_file_functions), so reviewing the same pair again is served without
+regenerating or re-diffing either snapshot.
 """
 
+import bisect
 import difflib
+import hashlib
+import html
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from package.cache_functions import diff_cache_get, diff_cache_set
+from package.data_file_functions import (
+    read_diff_cache,
+    read_user_data_file,
+    read_user_snapshot_series,
+    write_diff_cache,
+)
+from package.generate_config import generate_config, iter_config, iter_config_lines
+from package.snapshot_functions import (
+    SNAPSHOT_ID_FIELDS,
+    SNAPSHOT_STORE_FIELDS,
+    snapshot_content,
+)
+
+# Document keys that are bookkeeping rather than firewall configuration
+DIFF_IGNORED_KEYS = set(SNAPSHOT_ID_FIELDS) | set(SNAPSHOT_STORE_FIELDS) | {"version"}
 
-from package.generate_config import generate_config
+# Diff views accepted by process_diff, the first being the default
+DIFF_VIEWS = ("structural", "unified", "text")
+
+# Number of changed items listed in each step of a snapshot timeline
+TIMELINE_ITEMS = 10
+
+# Process pool for large timelines, created on first use.
+_timeline_pool = None
+_timeline_pool_lock = threading.Lock()
+
+# Display names of the top level sections of a firewall document
+DIFF_SECTION_LABELS = {
+    "extra-items": "Extra Items",
+    "flowtables": "Flowtables",
+    "interfaces": "Interfaces",
+    "ipv4": "IPv4",
+    "ipv6": "IPv6",
+    "system": "System",
+}
 
 
 def fix_list(config_lines):
@@ -31,21 +95,319 @@ def fix_list(config_lines):
     return new_list
 
 
-def process_diff(session, request):
+def _record_change(changes, path, old, new):
     """
-    Generates an HTML diff view comparing two configuration snapshots.
+    Appends the change between two versions of a flat item (rule, group,
+    chain/filter settings...) to the list of changes.
+
+    Args:
+        changes: List of changes to append to
+        path: List of labels locating the item, e.g. ["IPv4", "Chain WAN_IN", "Rule 10"]
+        old: Item in the first snapshot, or None if it does not exist there
+        new: Item in the second snapshot, or None if it does not exist there
+
+    Returns:
+        None
+    """
+    if old is None and new is None:
+        return
+
+    if old is None:
+        action = "added"
+        fields = [(field, None, value) for field, value in new.items()]
+    elif new is None:
+        action = "removed"
+        fields = [(field, value, None) for field, value in old.items()]
+    else:
+        action = "changed"
+        fields = [
+            (field, value, new.get(field))
+            for field, value in old.items()
+            if field not in new or new[field] != value
+        ]
+        fields.extend(
+            (field, None, value) for field, value in new.items() if field not in old
+        )
+        if not fields:
+            return
+
+    changes.append({"action": action, "path": path, "fields": fields})
+
+    return
+
+
+def _diff_keyed(changes, path, old_items, new_items, label, diff_item):
+    """
+    Matches the items of two dictionaries by key and diffs each pair.
+
+    Args:
+        changes: List of changes to append to
+        path: List of labels locating the dictionary
+        old_items: Items in the first snapshot
+        new_items: Items in the second snapshot
+        label: Label prefix of each item, e.g. "Chain"
+        diff_item: Function(changes, path, old, new) diffing one pair of items
+
+    Returns:
+        None
+    """
+    for name, old in old_items.items():
+        diff_item(changes, path + [f"{label} {name}"], old, new_items.get(name))
+    for name, new in new_items.items():
+        if name not in old_items:
+            diff_item(changes, path + [f"{label} {name}"], None, new)
+
+    return
+
+
+def _diff_chain(changes, path, old, new):
+    """
+    Diffs a chain: its default settings and rule order, then each rule.
+
+    Returns:
+        None
+    """
+
+    def settings(chain):
+        if chain is None:
+            return None
+        return {**chain.get("default", {}), "rule-order": chain.get("rule-order", [])}
+
+    def rules(chain):
+        if chain is None:
+            return {}
+        return {
+            name: rule
+            for name, rule in chain.items()
+            if name not in ("default", "rule-order")
+        }
+
+    _record_change(changes, path, settings(old), settings(new))
+    _diff_keyed(changes, path, rules(old), rules(new), "Rule", _record_change)
+
+    return
+
+
+def _diff_filter(changes, path, old, new):
+    """
+    Diffs a filter: its settings and rule order, then each rule.
+
+    Returns:
+        None
+    """
+
+    def settings(filter_data):
+        if filter_data is None:
+            return None
+        return {name: value for name, value in filter_data.items() if name != "rules"}
+
+    def rules(filter_data):
+        if filter_data is None:
+            return {}
+        return filter_data.get("rules", {})
+
+    _record_change(changes, path, settings(old), settings(new))
+    _diff_keyed(changes, path, rules(old), rules(new), "Rule", _record_change)
+
+    return
+
+
+def _diff_ip_version(changes, path, old, new):
+    """
+    Diffs the groups, filters and chains of one IP version.
+
+    Returns:
+        None
+    """
+    old = old or {}
+    new = new or {}
+
+    for section, label, diff_item in (
+        ("groups", "Group", _record_change),
+        ("filters", "Filter", _diff_filter),
+        ("chains", "Chain", _diff_chain),
+    ):
+        _diff_keyed(
+            changes,
+            path,
+            old.get(section, {}),
+            new.get(section, {}),
+            label,
+            diff_item,
+        )
+
+    for key in dict.fromkeys([*old, *new]):
+        if key not in ("groups", "filters", "chains"):
+            _diff_value(changes, path + [key], old.get(key), new.get(key))
+
+    return
+
+
+def _diff_value(changes, path, old, new):
+    """
+    Diffs a section without a known structure.
+
+    - Lists of named items (flowtables, interfaces) are matched by name
+    - Other lists (extra items) are compared as multisets of values
+    - Dictionaries are compared field by field
+
+    Returns:
+        None
+    """
+    if isinstance(old, list) or isinstance(new, list):
+        old = old or []
+        new = new or []
+        if all(isinstance(item, dict) and "name" in item for item in old + new):
+            _diff_keyed(
+                changes,
+                path[:-1],
+                {item["name"]: item for item in old},
+                {item["name"]: item for item in new},
+                path[-1],
+                _record_change,
+            )
+            return
+
+        old_counts = Counter(map(repr, old))
+        new_counts = Counter(map(repr, new))
+        for item in old:
+            if old_counts[repr(item)] > new_counts[repr(item)]:
+                old_counts[repr(item)] -= 1
+                _record_change(changes, path, {"value": item}, None)
+        for item in new:
+            if new_counts[repr(item)] > old_counts[repr(item)]:
+                new_counts[repr(item)] -= 1
+                _record_change(changes, path, None, {"value": item})
+        return
+
+    if isinstance(old, dict) or isinstance(new, dict):
+        _record_change(changes, path, old, new)
+        return
+
+    if old != new:
+        _record_change(
+            changes,
+            path[:-1],
+            None if old is None else {path[-1]: old},
+            None if new is None else {path[-1]: new},
+        )
+
+    return
+
+
+def structural_diff(old_data, new_data):
+    """
+    Compares two firewall documents item by item.
+
+    Args:
+        old_data: Firewall document of the first snapshot
+        new_data: Firewall document of the second snapshot
+
+    The function:
+    1. Matches groups, filters, chains and rules of both documents by key
+    2. Reports items only present in one document as added or removed
+    3. Reports the fields that differ for items present in both
+    4. Ignores bookkeeping keys (_id, snapshot, revision...)
+
+    Every item is looked up by key, so the time taken is linear in the size
+    of the documents.
+
+    Returns:
+        list: Changes, each a dict with:
+            - action: "added", "removed" or "changed"
+            - path: List of labels locating the item
+            - fields: List of (field, old value, new value)
+    """
+    old_data = old_data or {}
+    new_data = new_data or {}
+    changes = []
+
+    for key in dict.fromkeys([*old_data, *new_data]):
+        if key in DIFF_IGNORED_KEYS:
+            continue
+        label = DIFF_SECTION_LABELS.get(key, key)
+        if key in ("ipv4", "ipv6"):
+            _diff_ip_version(changes, [label], old_data.get(key), new_data.get(key))
+        else:
+            _diff_value(changes, [label], old_data.get(key), new_data.get(key))
+
+    return changes
+
+
+def _format_value(value):
+    """
+    Formats a field value for display.
+
+    Returns:
+        str: HTML escaped value, lists joined with commas
+    """
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        value = ", ".join(str(item) for item in value)
+
+    return html.escape(str(value))
+
+
+def render_structural_diff(changes, snapshot_1, snapshot_2):
+    """
+    Renders the changes found by structural_diff as an HTML table.
+
+    Args:
+        changes: List of changes returned by structural_diff
+        snapshot_1: Name of the first snapshot
+        snapshot_2: Name of the second snapshot
+
+    Returns:
+        html: String containing a summary and a table with one row per
+              changed field
+    """
+    css_class = {"added": "diff_add", "removed": "diff_sub", "changed": "diff_chg"}
+    counts = Counter(change["action"] for change in changes)
+
+    parts = [
+        '<p class="diff-summary">'
+        f'{counts["added"]} added, {counts["removed"]} removed, '
+        f'{counts["changed"]} changed</p>'
+    ]
+
+    if not changes:
+        parts.append('<p class="diff-summary">No differences.</p>')
+        return "".join(parts)
+
+    parts.append(
+        '<table class="structural-diff">'
+        "<thead><tr><th>Change</th><th>Item</th><th>Field</th>"
+        f"<th>Snapshot: {html.escape(snapshot_1)}</th>"
+        f"<th>Snapshot: {html.escape(snapshot_2)}</th></tr></thead><tbody>"
+    )
+    for change in changes:
+        item = html.escape(" / ".join(change["path"]))
+        row_class = css_class[change["action"]]
+        for field, old, new in change["fields"]:
+            parts.append(
+                f'<tr class="{row_class}"><td>{change["action"]}</td>'
+                f"<td>{item}</td><td>{html.escape(str(field))}</td>"
+                f"<td>{_format_value(old)}</td><td>{_format_value(new)}</td></tr>"
+            )
+    parts.append("</tbody></table>")
+
+    return "".join(parts)
+
+
+def process_text_diff(session, snapshot_1, snapshot_2):
+    """
+    Generates a side-by-side HTML diff of the configuration text of two
+    snapshots.
 
     Args:
         session: The current session object
-        request: The HTTP request containing snapshot IDs
+        snapshot_1: Name of the first snapshot
+        snapshot_2: Name of the second snapshot
 
     Returns:
         html: String containing styled HTML diff output
     """
-    # Get snapshot IDs from the request
-    snapshot_1 = request.form["snapshot_1"]
-    snapshot_2 = request.form["snapshot_2"]
-
     # Generate and process config lists for both snapshots
     snapshot_1_list = fix_list(
         generate_config(session, snapshot=snapshot_1, diff=True)[1]
@@ -65,3 +427,532 @@ def process_diff(session, request):
     )
 
     return html
+
+
+def _diff_context_lines():
+    try:
+        return int(os.environ.get("DIFF_CONTEXT_LINES"))
+    except Exception:
+        return 3
+
+
+def _diff_hunks_per_page():
+    try:
+        return max(1, int(os.environ.get("DIFF_HUNKS_PER_PAGE")))
+    except Exception:
+        return 50
+
+
+def _timeline_pool_min():
+    try:
+        return int(os.environ.get("TIMELINE_PROCESS_POOL_MIN"))
+    except Exception:
+        return 20
+
+
+def _timeline_workers():
+    try:
+        return int(os.environ.get("TIMELINE_WORKERS"))
+    except Exception:
+        return min(4, os.cpu_count() or 1)
+
+
+def _unique_lines(lines, lo, hi):
+    """
+    Finds the lines occurring exactly once in lines[lo:hi].
+
+    Returns:
+        dict: line -> index, in index order
+    """
+    index = {}
+    for i in range(lo, hi):
+        index[lines[i]] = -1 if lines[i] in index else i
+
+    return {line: i for line, i in index.items() if i >= 0}
+
+
+def _longest_increasing(pairs):
+    """
+    Finds the longest subsequence of (i, j) pairs, sorted by i, whose j are
+    increasing (patience sorting).
+
+    Returns:
+        list: The (i, j) pairs of the subsequence
+    """
+    tails = []
+    tail_js = []
+    previous = [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        position = bisect.bisect_left(tail_js, j)
+        if position:
+            previous[k] = tails[position - 1]
+        if position == len(tails):
+            tails.append(k)
+            tail_js.append(j)
+        else:
+            tails[position] = k
+            tail_js[position] = j
+
+    result = []
+    k = tails[-1] if tails else None
+    while k is not None:
+        result.append(pairs[k])
+        k = previous[k]
+
+    return result[::-1]
+
+
+def _patience_blocks(a, b, alo, ahi, blo, bhi, blocks):
+    """
+    Appends the matching blocks of a[alo:ahi] and b[blo:bhi] found by the
+    patience algorithm to blocks.
+
+    The function:
+    1. Matches the common prefix and suffix
+    2. Anchors on the longest increasing run of lines that are unique in
+       both ranges and recurses between anchors
+    3. Falls back to difflib.SequenceMatcher for ranges without unique lines
+
+    Returns:
+        None
+    """
+    start_a, start_b = alo, blo
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        alo += 1
+        blo += 1
+    if alo > start_a:
+        blocks.append((start_a, start_b, alo - start_a))
+
+    suffix = 0
+    while (
+        alo < ahi - suffix
+        and blo < bhi - suffix
+        and a[ahi - 1 - suffix] == b[bhi - 1 - suffix]
+    ):
+        suffix += 1
+    ahi -= suffix
+    bhi -= suffix
+
+    if alo < ahi and blo < bhi:
+        unique_b = _unique_lines(b, blo, bhi)
+        anchors = _longest_increasing(
+            [
+                (i, unique_b[line])
+                for line, i in _unique_lines(a, alo, ahi).items()
+                if line in unique_b
+            ]
+        )
+        if anchors:
+            for i, j in anchors:
+                _patience_blocks(a, b, alo, i, blo, j, blocks)
+                blocks.append((i, j, 1))
+                alo, blo = i + 1, j + 1
+            _patience_blocks(a, b, alo, ahi, blo, bhi, blocks)
+        else:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi])
+            blocks.extend(
+                (alo + i, blo + j, n) for i, j, n in matcher.get_matching_blocks() if n
+            )
+
+    if suffix:
+        blocks.append((ahi, bhi, suffix))
+
+    return
+
+
+class PatienceSequenceMatcher(difflib.SequenceMatcher):
+    """
+    SequenceMatcher matching lines with the patience algorithm, which aligns
+    on lines unique to both sides (rule and group definitions) instead of
+    frequent ones (comments, blank lines), giving hunks that follow the
+    configuration structure.
+    """
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is not None:
+            return self.matching_blocks
+
+        blocks = []
+        _patience_blocks(self.a, self.b, 0, len(self.a), 0, len(self.b), blocks)
+
+        # Merge adjacent blocks as SequenceMatcher does
+        merged = []
+        for i, j, n in blocks:
+            if merged and merged[-1][0] + merged[-1][2] == i:
+                if merged[-1][1] + merged[-1][2] == j:
+                    merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + n)
+                    continue
+            merged.append((i, j, n))
+        merged.append((len(self.a), len(self.b), 0))
+
+        self.matching_blocks = [difflib.Match._make(block) for block in merged]
+
+        return self.matching_blocks
+
+
+def unified_hunks(old_lines, new_lines, context=3):
+    """
+    Diffs two lists of lines and groups the changes into unified diff hunks.
+
+    Args:
+        old_lines: Lines of the first snapshot
+        new_lines: Lines of the second snapshot
+        context: Number of unchanged lines kept around each change
+
+    Returns:
+        list: Hunks, each a dict with:
+            - old_start, old_count: Range of the hunk in old_lines (1-based)
+            - new_start, new_count: Range of the hunk in new_lines (1-based)
+            - lines: List of [tag, line], tag being " ", "-" or "+"
+    """
+    matcher = PatienceSequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    hunks = []
+
+    for group in matcher.get_grouped_opcodes(context):
+        first, last = group[0], group[-1]
+        lines = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                lines.extend([" ", line] for line in old_lines[i1:i2])
+                continue
+            lines.extend(["-", line] for line in old_lines[i1:i2])
+            lines.extend(["+", line] for line in new_lines[j1:j2])
+        hunks.append(
+            {
+                "old_start": first[1] + 1,
+                "old_count": last[2] - first[1],
+                "new_start": first[3] + 1,
+                "new_count": last[4] - first[3],
+                "lines": lines,
+            }
+        )
+
+    return hunks
+
+
+def _config_lines(session, snapshot):
+    """
+    Generates the configuration of a snapshot as a list of single lines.
+
+    Returns:
+        list: Configuration lines, entries holding newlines split up
+    """
+    return "\n".join(iter_config(session, snapshot=snapshot, diff=True)).split("\n")
+
+
+def render_unified_diff(hunks, snapshot_1, snapshot_2, page=1):
+    """
+    Renders one page of unified diff hunks as HTML.
+
+    Args:
+        hunks: List of hunks returned by unified_hunks
+        snapshot_1: Name of the first snapshot
+        snapshot_2: Name of the second snapshot
+        page: Page of hunks to render (1-based), clamped to the valid range
+
+    The function:
+    1. Renders a summary of the lines added and removed by all hunks
+    2. Renders the DIFF_HUNKS_PER_PAGE hunks of the requested page
+    3. Renders buttons posting back for the previous and next pages
+
+    Returns:
+        html: String containing the summary, hunk table and page navigation
+    """
+    per_page = _diff_hunks_per_page()
+    pages = max(1, -(-len(hunks) // per_page))
+    page = min(max(1, page), pages)
+    added = sum(1 for hunk in hunks for tag, _ in hunk["lines"] if tag == "+")
+    removed = sum(1 for hunk in hunks for tag, _ in hunk["lines"] if tag == "-")
+
+    parts = [
+        f'<p class="diff-summary">{len(hunks)} changed regions, '
+        f"{added} lines added, {removed} lines removed</p>"
+    ]
+
+    if not hunks:
+        parts.append('<p class="diff-summary">No differences.</p>')
+        return "".join(parts)
+
+    css_class = {" ": "diff_ctx", "-": "diff_sub", "+": "diff_add"}
+    parts.append(
+        '<table class="unified-diff">'
+        f"<thead><tr><th>--- Snapshot: {html.escape(snapshot_1)}<br>"
+        f"+++ Snapshot: {html.escape(snapshot_2)}</th></tr></thead><tbody>"
+    )
+    for hunk in hunks[(page - 1) * per_page : page * per_page]:
+        parts.append(
+            '<tr class="diff_header"><td>'
+            f'@@ -{hunk["old_start"]},{hunk["old_count"]} '
+            f'+{hunk["new_start"]},{hunk["new_count"]} @@</td></tr>'
+        )
+        for tag, line in hunk["lines"]:
+            parts.append(
+                f'<tr class="{css_class[tag]}"><td>{tag} {html.escape(line)}</td></tr>'
+            )
+    parts.append("</tbody></table>")
+
+    if pages > 1:
+        parts.append(
+            '<form action="/snapshot_diff_display" method="post" class="diff-pages">'
+            f'<input type="hidden" name="snapshot_1" value="{html.escape(snapshot_1)}">'
+            f'<input type="hidden" name="snapshot_2" value="{html.escape(snapshot_2)}">'
+            '<input type="hidden" name="view" value="unified">'
+        )
+        if page > 1:
+            parts.append(
+                '<button type="submit" name="page" value="'
+                f'{page - 1}" class="btn btn-secondary">Previous</button>'
+            )
+        parts.append(f'<span class="diff-summary">Page {page} of {pages}</span>')
+        if page < pages:
+            parts.append(
+                '<button type="submit" name="page" value="'
+                f'{page + 1}" class="btn btn-secondary">Next</button>'
+            )
+        parts.append("</form>")
+
+    return "".join(parts)
+
+
+def content_hash(data):
+    """
+    Hashes the configuration content of a firewall document.
+
+    Args:
+        data: Firewall document, or None
+
+    Returns:
+        str: SHA-256 hex digest of the document without identifying or store
+             fields, independent of key order
+    """
+    content = json.dumps(snapshot_content(data or {}), sort_keys=True, default=str)
+
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def diff_cache_key(view, snapshot_1, data_1, snapshot_2, data_2):
+    """
+    Builds the cache key of a rendered diff.
+
+    The snapshot names are part of the key as they appear in the rendered
+    headings; the content hashes make the key change whenever either side
+    changes, so a cached diff never has to be invalidated.
+
+    Returns:
+        str: SHA-256 hex digest identifying the rendered diff
+    """
+    key = json.dumps(
+        [view, snapshot_1, content_hash(data_1), snapshot_2, content_hash(data_2)]
+    )
+
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def process_diff(session, request):
+    """
+    Generates an HTML diff view comparing two configuration snapshots.
+
+    Args:
+        session: The current session object
+        request: The HTTP request containing snapshot IDs, optionally view
+                 (one of DIFF_VIEWS, defaults to "structural") and, for the
+                 unified view, page
+
+    The function:
+    1. Reads both snapshots and builds the cache key from their content
+    2. Returns the diff from the in-process cache, then the MongoDB diff
+       store, if present
+    3. Otherwise renders the diff in the requested view and caches it
+
+    The unified view caches its hunks (as JSON) rather than a rendered page,
+    so every page of one comparison is served from a single cache entry.
+
+    Returns:
+        html: String containing styled HTML diff output
+    """
+    # Get snapshot IDs from the request
+    snapshot_1 = request.form["snapshot_1"]
+    snapshot_2 = request.form["snapshot_2"]
+    view = request.form.get("view")
+    if view not in DIFF_VIEWS:
+        view = DIFF_VIEWS[0]
+
+    filename = f'{session["data_dir"]}/{session["firewall_name"]}'
+    data_1 = read_user_data_file(filename, snapshot=snapshot_1)
+    data_2 = read_user_data_file(filename, snapshot=snapshot_2)
+    if view == "unified":
+        context = _diff_context_lines()
+        key = diff_cache_key(f"unified:{context}", "", data_1, "", data_2)
+    else:
+        key = diff_cache_key(view, snapshot_1, data_1, snapshot_2, data_2)
+
+    cached = diff_cache_get(key)
+    if cached is None:
+        cached = read_diff_cache(key)
+        if cached is not None:
+            logging.debug(f"Diff {snapshot_1} -> {snapshot_2} served from diff store.")
+            diff_cache_set(key, cached)
+    else:
+        logging.debug(f"Diff {snapshot_1} -> {snapshot_2} served from cache.")
+
+    if cached is None:
+        if view == "text":
+            cached = process_text_diff(session, snapshot_1, snapshot_2)
+        elif view == "unified":
+            hunks = unified_hunks(
+                _config_lines(session, snapshot_1),
+                _config_lines(session, snapshot_2),
+                context,
+            )
+            cached = json.dumps(hunks)
+        else:
+            changes = structural_diff(data_1, data_2)
+            cached = render_structural_diff(changes, snapshot_1, snapshot_2)
+
+        diff_cache_set(key, cached)
+        write_diff_cache(key, cached)
+
+    if view == "unified":
+        try:
+            page = int(request.form.get("page", 1))
+        except ValueError:
+            page = 1
+        return render_unified_diff(json.loads(cached), snapshot_1, snapshot_2, page)
+
+    return cached
+
+
+def _timeline_step(old, new, old_lines, new_lines):
+    """
+    Summarises the change between two consecutive snapshots.
+
+    Args:
+        old: Earlier snapshot document
+        new: Later snapshot document
+        old_lines: Configuration lines of the earlier snapshot
+        new_lines: Configuration lines of the later snapshot
+
+    Returns:
+        dict: from/to snapshot names, tag of the later snapshot, counts of
+              added/removed/changed items and of added/removed lines, and the
+              first TIMELINE_ITEMS changed items
+    """
+    changes = structural_diff(old, new)
+    counts = Counter(change["action"] for change in changes)
+
+    lines_added = 0
+    lines_removed = 0
+    matcher = PatienceSequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            lines_removed += i2 - i1
+            lines_added += j2 - j1
+
+    return {
+        "from": old["snapshot"],
+        "to": new["snapshot"],
+        "tag": new.get("tag", ""),
+        "added": counts["added"],
+        "removed": counts["removed"],
+        "changed": counts["changed"],
+        "lines_added": lines_added,
+        "lines_removed": lines_removed,
+        "items": [
+            f'{change["action"]}: {" / ".join(change["path"])}'
+            for change in changes[:TIMELINE_ITEMS]
+        ],
+    }
+
+
+def _timeline_segment(series):
+    """
+    Summarises each step of a run of consecutive snapshots, generating the
+    configuration of every snapshot once.  Runs in the timeline process pool
+    for large series.
+
+    Args:
+        series: Snapshot documents, oldest first
+
+    Returns:
+        list: One summary (see _timeline_step) per consecutive pair
+    """
+    steps = []
+    previous = None
+    previous_lines = None
+    for snapshot in series:
+        lines = "\n".join(iter_config_lines(snapshot_content(snapshot))).split("\n")
+        if previous is not None:
+            steps.append(_timeline_step(previous, snapshot, previous_lines, lines))
+        previous, previous_lines = snapshot, lines
+
+    return steps
+
+
+def _get_timeline_pool():
+    """
+    Gets the process pool used for large timelines, creating it on first use.
+
+    Workers are spawned rather than forked, as the web server is threaded.
+
+    Returns:
+        ProcessPoolExecutor: Pool of TIMELINE_WORKERS processes
+    """
+    global _timeline_pool
+
+    with _timeline_pool_lock:
+        if _timeline_pool is None:
+            _timeline_pool = ProcessPoolExecutor(
+                max_workers=_timeline_workers(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    return _timeline_pool
+
+
+def snapshot_timeline(session, last=50):
+    """
+    Summarises how a firewall changed across its latest snapshots.
+
+    Args:
+        session: The current session object
+        last: Number of latest snapshots to include, defaults to 50
+
+    The function:
+    1. Reads and reconstructs the snapshot series in one pass
+    2. Generates the configuration of each snapshot once and diffs each
+       consecutive pair, structurally and line by line
+    3. For series of TIMELINE_PROCESS_POOL_MIN snapshots or more, splits the
+       series into one run per TIMELINE_WORKERS process.  Runs overlap by one
+       snapshot, whose configuration is generated once in each run.
+
+    Returns:
+        list: One summary per step, oldest first, each a dict with:
+            - from, to: Snapshot names
+            - tag: Tag of the later snapshot
+            - added, removed, changed: Number of items (groups, filters,
+              chains, rules...) added, removed or changed
+            - lines_added, lines_removed: Number of configuration lines
+              added and removed
+            - items: The first TIMELINE_ITEMS changed items
+    """
+    series = read_user_snapshot_series(
+        f'{session["data_dir"]}/{session["firewall_name"]}', last
+    )
+    if len(series) < 2:
+        return []
+
+    workers = _timeline_workers()
+    if workers < 2 or len(series) < _timeline_pool_min():
+        return _timeline_segment(series)
+
+    logging.debug(f"Splitting timeline of {len(series)} snapshots across processes.")
+    size = -(-(len(series) - 1) // workers)
+    segments = [
+        series[start : start + size + 1] for start in range(0, len(series) - 1, size)
+    ]
+
+    return [
+        step
+        for steps in _get_timeline_pool().map(_timeline_segment, segments)
+        for step in steps
+    ]
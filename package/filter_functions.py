@@ -9,14 +9,16 @@
     - Deleting filter rules
     - Reordering filter rules
 
-    The functions interact with user data files that store firewall configurations.
+    The functions interact with user data files that store firewall configurations,
+    writing only the fields they change and re-applying the change when another
+    session edited the firewall at the same time.
 """
 
 import logging
 
 from flask import flash
 
-from package.data_file_functions import read_user_data_file, write_user_data_file
+from package.data_file_functions import mutate_user_data_file, read_user_data_file
 
 
 def add_filter_rule_to_data(session, request):
@@ -30,13 +32,9 @@ def add_filter_rule_to_data(session, request):
     The function:
     - Extracts rule details from the request form
     - Creates a rule dictionary with the configuration
-    - Adds the rule to the user's data structure
     - Updates the rule ordering
-    - Writes changes back to the data file
+    - Sets the rule and rule ordering in the data file
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     rule = request.form["rule"]
     rule_dict = {}
@@ -60,26 +58,29 @@ def add_filter_rule_to_data(session, request):
     if request.form["action"] == "offload":
         rule_dict["fw_chain"] = request.form["offload_target"]
 
-    # Check and create higher level data structure if it does not exist
-    if "rules" not in user_data[ip_version]["filters"][filter]:
-        user_data[ip_version]["filters"][filter]["rules"] = {}
+    filter_path = (ip_version, "filters", filter)
 
-    # Add rule to data structure
-    user_data[ip_version]["filters"][filter]["rules"][rule] = rule_dict
+    def build_update(user_data):
+        # Add rule to rule-order in user data
+        rule_order = user_data[ip_version]["filters"][filter]["rule-order"]
+        if rule not in rule_order:
+            rule_order.append(rule)
 
-    # Add rule to rule-order in user data
-    if rule not in user_data[ip_version]["filters"][filter]["rule-order"]:
-        user_data[ip_version]["filters"][filter]["rule-order"].append(rule)
+        # Sort rule-order in user data
+        rule_order = sorted(rule_order, key=int)
 
-    # Sort rule-order in user data
-    user_data[ip_version]["filters"][filter]["rule-order"] = sorted(
-        user_data[ip_version]["filters"][filter]["rule-order"], key=int
-    )
+        return {
+            "set_fields": {
+                (*filter_path, "rules", rule): rule_dict,
+                (*filter_path, "rule-order"): rule_order,
+            }
+        }
 
-    # logging.info(json.dumps(user_data, indent=4))
-
-    # Write user_data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
+    # Set rule and rule-order in user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
+        return
 
     flash(f"Rule {rule} added to filter {ip_version}/{filter}.", "success")
 
@@ -96,13 +97,9 @@ def add_filter_to_data(session, request):
 
     The function:
     - Extracts filter details from the request form
-    - Creates necessary data structures if they don't exist
-    - Adds the filter configuration
-    - Writes changes back to the data file
+    - Creates the filter with an empty rule order if it doesn't exist
+    - Sets the filter configuration in the data file
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     logging.info(request.form)
     # Set local vars from posted form data
     ip_version = request.form["ip_version"]
@@ -114,22 +111,24 @@ def add_filter_to_data(session, request):
     else:
         log = False
 
-    # Check and create higher level data structure if it does not exist
-    if ip_version not in user_data:
-        user_data[ip_version] = {}
-    if "filters" not in user_data[ip_version]:
-        user_data[ip_version]["filters"] = {}
-    if type not in user_data[ip_version]["filters"]:
-        user_data[ip_version]["filters"][type] = {}
-        user_data[ip_version]["filters"][type]["rule-order"] = []
-
-    # Add filter to data structure
-    user_data[ip_version]["filters"][type]["description"] = description
-    user_data[ip_version]["filters"][type]["default-action"] = default_action
-    user_data[ip_version]["filters"][type]["log"] = log
-
-    # Write user_data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
+    filter_path = (ip_version, "filters", type)
+
+    def build_update(user_data):
+        # Set filter configuration, creating the filter if it does not exist
+        set_fields = {
+            (*filter_path, "description"): description,
+            (*filter_path, "default-action"): default_action,
+            (*filter_path, "log"): log,
+        }
+        if type not in user_data.get(ip_version, {}).get("filters", {}):
+            set_fields[(*filter_path, "rule-order")] = []
+        return {"set_fields": set_fields}
+
+    # Update user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
+        return
 
     flash(f"Filter {ip_version}/{type} added.", "success")
 
@@ -258,43 +257,59 @@ def delete_filter_rule_from_data(session, request):
     The function:
     - Removes the rule from the data structure
     - Cleans up empty data structures
-    - Writes changes back to the data file
+    - Unsets the rule (or emptied structure) in the data file
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     rule = request.form["rule"].split(",")
     ip_version = rule[0]
     filter = rule[1]
     rule = rule[2]
+    filter_path = (ip_version, "filters", filter)
+    deleted = []
 
-    # Delete rule from data
-    try:
-        del user_data[ip_version]["filters"][filter]["rules"][rule]
-        user_data[ip_version]["filters"][filter]["rule-order"].remove(rule)
+    def build_update(user_data):
+        # Delete rule from data
+        deleted.clear()
+        try:
+            del user_data[ip_version]["filters"][filter]["rules"][rule]
+            user_data[ip_version]["filters"][filter]["rule-order"].remove(rule)
+            deleted.append(rule)
+        except Exception:
+            pass
+
+        # Clean-up data — intentionally removes the entire filter (including defaults)
+        # when the last rule is deleted, as empty filters are not desired.
+        unset_fields = [(*filter_path, "rules", rule)]
+        pull_fields = {(*filter_path, "rule-order"): rule}
+        try:
+            if not user_data[ip_version]["filters"][filter]["rule-order"]:
+                del user_data[ip_version]["filters"][filter]
+                unset_fields = [filter_path]
+                pull_fields = {}
+            if not user_data[ip_version]["filters"]:
+                del user_data[ip_version]["filters"]
+                unset_fields = [(ip_version, "filters")]
+            if not user_data[ip_version]:
+                del user_data[ip_version]
+                unset_fields = [(ip_version,)]
+        except Exception as e:
+            logging.info(e)
+
+        return {"unset_fields": unset_fields, "pull_fields": pull_fields}
+
+    # Remove rule from user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
+        return
+
+    if deleted:
         flash(f"Deleted rule {rule} from filter {ip_version}/{filter}.", "warning")
-    except Exception:
+    else:
         flash(
             f"Failed to delete rule {rule} from filter {ip_version}/{filter}.",
             "danger",
         )
-        pass
-
-    # Clean-up data — intentionally removes the entire filter (including defaults)
-    # when the last rule is deleted, as empty filters are not desired.
-    try:
-        if not user_data[ip_version]["filters"][filter]["rule-order"]:
-            del user_data[ip_version]["filters"][filter]
-        if not user_data[ip_version]["filters"]:
-            del user_data[ip_version]["filters"]
-        if not user_data[ip_version]:
-            del user_data[ip_version]
-    except Exception as e:
-        logging.info(e)
-
-    # Write user's data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
 
     return
 
@@ -309,12 +324,8 @@ def reorder_filter_rule_in_data(session, request):
 
     The function:
     - Validates the new rule number
-    - Updates the rule ordering
-    - Writes changes back to the data file
+    - Moves the rule and updates the rule ordering in the data file
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     rule = request.form["reorder_rule"].split(",")
 
@@ -326,9 +337,6 @@ def reorder_filter_rule_in_data(session, request):
         old_rule_number = rule[2]
         new_rule_number = request.form["new_rule_number"].strip()
 
-    # Get list of existing rules in chain
-    existing_rule_list = user_data[ip_version]["filters"][filter]["rule-order"]
-
     # Validate new rule number
     if old_rule_number == new_rule_number:
         flash("Old and new rule numbers must be different.", "danger")
@@ -340,30 +348,34 @@ def reorder_filter_rule_in_data(session, request):
         flash("New rule number must be an integer.", "danger")
         return None
 
-    if new_rule_number in existing_rule_list:
-        flash("New rule number must not already exist in the filter.", "danger")
+    filter_path = (ip_version, "filters", filter)
+
+    def build_update(user_data):
+        # Get list of existing rules in filter
+        existing_rule_list = user_data[ip_version]["filters"][filter]["rule-order"]
+
+        if new_rule_number in existing_rule_list:
+            flash("New rule number must not already exist in the filter.", "danger")
+            return None
+
+        # Replace old rule number with new rule number in rule-order
+        rule_order = [r for r in existing_rule_list if r != old_rule_number]
+        rule_order.append(new_rule_number)
+
+        return {
+            "set_fields": {
+                (*filter_path, "rules", new_rule_number): user_data[ip_version][
+                    "filters"
+                ][filter]["rules"][old_rule_number],
+                (*filter_path, "rule-order"): sorted(rule_order, key=int),
+            },
+            "unset_fields": [(*filter_path, "rules", old_rule_number)],
+        }
+
+    # Move rule to new rule number in user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
         return None
 
-    # Add new rule to chain in user data
-    user_data[ip_version]["filters"][filter]["rules"][new_rule_number] = user_data[
-        ip_version
-    ]["filters"][filter]["rules"][old_rule_number]
-
-    # Add new rule to rule-order in user data
-    user_data[ip_version]["filters"][filter]["rule-order"].append(new_rule_number)
-
-    # Remove Old Rule from user data
-    del user_data[ip_version]["filters"][filter]["rules"][old_rule_number]
-
-    # Remove Old Rule from rule-order in user data
-    user_data[ip_version]["filters"][filter]["rule-order"].remove(old_rule_number)
-
-    # Sort rule-order in user data
-    user_data[ip_version]["filters"][filter]["rule-order"] = sorted(
-        user_data[ip_version]["filters"][filter]["rule-order"], key=int
-    )
-
-    # Write user's data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
-
     return f"{ip_version}{filter}"
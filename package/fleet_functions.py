@@ -0,0 +1,198 @@
+"""
+    Fleet Functions
+
+    This module pushes configurations to several firewalls at once, for fleets
+    of VyOS devices with near-identical rulesets.
+
+    Contains functions for:
+    - Listing the firewall configurations that have a hostname configured
+    - Viewing diffs or committing the selected configurations concurrently,
+      yielding each device's result as soon as it finishes
+
+    Devices are handled by a bounded thread pool of FLEET_PUSH_WORKERS threads
+    (default 8), so a fleet push takes about as long as its slowest device
+    instead of the sum of every device's connection and commit time.  The
+    same credentials are used for every device.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from package.data_file_functions import (
+    get_system_name,
+    list_user_files,
+    write_user_command_conf_file,
+)
+from package.generate_config import iter_config
+from package.napalm_ssh_functions import (
+    NapalmAssemblyError,
+    authentication_failure_message,
+    push_config,
+)
+from package.telemetry_functions import telemetry_commit, telemetry_diff
+
+FLEET_ACTIONS = ("View Diffs", "Commit")
+
+
+def _fleet_workers():
+    try:
+        return max(1, int(os.environ.get("FLEET_PUSH_WORKERS")))
+    except Exception:
+        return 8
+
+
+def _hostname_configured(hostname):
+    return hostname not in (None, "", "None")
+
+
+def list_fleet_targets(session):
+    """
+    Lists the user's firewall configurations with their hostname and port.
+
+    Args:
+        session (dict): Session data including username and data directory path
+
+    Returns:
+        list: [{"firewall", "hostname", "port", "configured"}] sorted by
+              firewall name; configured is False when no hostname is set
+    """
+    targets = []
+
+    for firewall in list_user_files(session):
+        hostname, port = get_system_name({**session, "firewall_name": firewall})
+        targets.append(
+            {
+                "firewall": firewall,
+                "hostname": hostname,
+                "port": port,
+                "configured": _hostname_configured(hostname),
+            }
+        )
+
+    return targets
+
+
+def _fleet_push_device(connection_string, device_session, commit, delta):
+    """
+    Views diffs or commits on one device of a fleet push.
+
+    Args:
+        connection_string (dict): Connection parameters of the device
+        device_session (dict): Session data of the device's firewall
+        commit (bool): Commit the differences instead of discarding them
+        delta (bool): Push only the changed commands
+
+    Returns:
+        dict: Device result (see fleet_push)
+    """
+    started = time.monotonic()
+    result = {
+        "firewall": device_session["firewall_name"],
+        "hostname": device_session["hostname"],
+        "port": device_session["port"],
+    }
+
+    try:
+        result["message"] = push_config(
+            connection_string, device_session, commit, delta
+        )
+        result["status"] = "ok"
+
+    except NapalmAssemblyError as e:
+        logging.info(f" |--X Fleet push to {result['firewall']}: {e}")
+        result["message"] = authentication_failure_message(e)
+        result["status"] = "error"
+
+    except Exception as e:
+        logging.info(f" |--X Fleet push to {result['firewall']}: {e}")
+        result["message"] = str(e)
+        result["status"] = "error"
+
+    result["seconds"] = round(time.monotonic() - started, 3)
+
+    return result
+
+
+def fleet_push(
+    connection_string, session, firewalls, action, delete=False, delta=False
+):
+    """
+    Views diffs or commits the configurations of several firewalls
+    concurrently.
+
+    Args:
+        connection_string (dict): Credentials used for every device (username,
+            password and optionally ssh_key_name)
+        session (dict): Session data including username and data directory path
+        firewalls (list): Names of the firewall configurations to push
+        action (str): "View Diffs" or "Commit"
+        delete (bool): Include 'delete firewall' before the set commands
+        delta (bool): Push only the commands that differ from each device's
+            running configuration (see push_config)
+
+    Yields:
+        dict: One result per firewall as soon as it is available:
+              {"firewall", "hostname", "port", "status", "message", "seconds"}
+              with status "ok" or "error"
+
+    The function:
+    1. Writes the command file of each firewall and submits the device to a
+       thread pool of at most FLEET_PUSH_WORKERS threads; firewalls without
+       a hostname are reported as errors without connecting
+    2. Yields the device results in completion order
+
+    Devices not yet started are cancelled if the caller stops iterating
+    (e.g. the client disconnects).
+    """
+    commit = action == "Commit"
+    if commit:
+        telemetry_commit()
+    else:
+        telemetry_diff()
+
+    logging.info(f" |--> Fleet {action.lower()} on {len(firewalls)} firewalls")
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(_fleet_workers(), max(len(firewalls), 1)),
+        thread_name_prefix="fleet-push",
+    )
+    futures = []
+    try:
+        for firewall in firewalls:
+            device_session = {**session, "firewall_name": firewall}
+            hostname, port = get_system_name(device_session)
+
+            if not _hostname_configured(hostname):
+                yield {
+                    "firewall": firewall,
+                    "hostname": hostname,
+                    "port": port,
+                    "status": "error",
+                    "message": "Need to set firewall hostname and SSH port.",
+                    "seconds": 0.0,
+                }
+                continue
+
+            device_session["hostname"] = hostname
+            device_session["port"] = port
+            write_user_command_conf_file(
+                device_session, iter_config(device_session), delete=delete
+            )
+
+            futures.append(
+                executor.submit(
+                    _fleet_push_device,
+                    {**connection_string, "hostname": hostname, "port": port},
+                    device_session,
+                    commit,
+                    delta,
+                )
+            )
+
+        for future in as_completed(futures):
+            yield future.result()
+
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -26,7 +26,11 @@ import logging
 
 from flask import flash
 
-from package.data_file_functions import read_user_data_file, write_user_data_file
+from package.data_file_functions import (
+    mutate_user_data_file,
+    read_user_data_file,
+    update_user_data_file,
+)
 
 
 def add_flowtable_to_data(session, request):
@@ -46,13 +50,10 @@ def add_flowtable_to_data(session, request):
         None
 
     Side effects:
-        - Creates flowtables list in user data if it doesn't exist
-        - Adds new flowtable entry to user's data file
+        - Pushes new flowtable entry to user's data file (creating the list
+          if it doesn't exist), or replaces an existing entry of the same name
         - Displays success message via Flask flash
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     logging.info(request.form.items())
     flowtable_name = ""
     flowtable_desc = ""
@@ -66,29 +67,33 @@ def add_flowtable_to_data(session, request):
         if "interface_" in key:
             interface_list.append(value)
 
-    # Create higher level data structure if it does not exist
-    if "flowtables" not in user_data:
-        user_data["flowtables"] = []
-
-    # Capture list of flowtables and remove from user_data
-    flowtable_list = user_data["flowtables"]
-    del user_data["flowtables"]
-    user_data["flowtables"] = []
-
-    for flowtable in flowtable_list:
-        if flowtable["name"] != flowtable_name:
-            user_data["flowtables"].append(flowtable)
-
     # Assign values into data structure
     new_flowtable = {}
     new_flowtable["name"] = flowtable_name
     new_flowtable["description"] = flowtable_desc
     new_flowtable["interfaces"] = interface_list
 
-    user_data["flowtables"].append(new_flowtable)
+    def build_update(user_data):
+        # Capture list of flowtables
+        flowtable_list = user_data.get("flowtables", [])
+
+        # Push a new flowtable, or replace the list when the flowtable already
+        #   exists ($pull and $push on one path cannot share an update)
+        if any(flowtable["name"] == flowtable_name for flowtable in flowtable_list):
+            new_flowtable_list = [
+                flowtable
+                for flowtable in flowtable_list
+                if flowtable["name"] != flowtable_name
+            ]
+            new_flowtable_list.append(new_flowtable)
+            return {"set_fields": {("flowtables",): new_flowtable_list}}
+        return {"push_fields": {("flowtables",): new_flowtable}}
 
-    # Write user_data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
+    # Write flowtable to user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
+        return
 
     flash(f"Flowtable {flowtable_name} added.", "success")
 
@@ -110,31 +115,20 @@ def delete_flowtable_from_data(session, request):
         None
 
     Side effects:
-        - Removes specified flowtable from user's data file
+        - Pulls specified flowtable from user's data file
         - Displays success message via Flask flash
-        - Logs debug messages about flowtable list changes
+        - Logs debug message about the removed flowtable
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     flowtable_name = request.form["flowtable"]
 
-    flowtable_list = user_data["flowtables"]
-    logging.debug(f"Flowtable list: {flowtable_list}")
-
-    new_flowtable_list = []
-
-    for flowtable in flowtable_list:
-        if flowtable["name"] != flowtable_name:
-            new_flowtable_list.append(flowtable)
-
-    logging.debug(f"New Flowtable list: {new_flowtable_list}")
-
-    user_data["flowtables"] = new_flowtable_list
+    logging.debug(f"Removing flowtable: {flowtable_name}")
 
-    # Write user_data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
+    # Pull flowtable from user data file
+    update_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}',
+        pull_fields={("flowtables",): {"name": flowtable_name}},
+    )
 
     flash(f"Flowtable {flowtable_name} deleted.", "success")
 
@@ -6,6 +6,11 @@
     Key functions:
     - download_json_data: Retrieves and formats user data as JSON
     - generate_config: Generates firewall configuration from user data
+    - iter_config: Generates the same configuration one line at a time
+    - iter_config_lines: Generates the configuration of a document already
+      read, one line at a time
+    - iter_config_text: Generates the configuration text in chunks for
+      streamed downloads
 
     The configuration generation handles:
     - Extra configuration items
@@ -14,13 +19,371 @@
     - Groups (address, domain, interface, MAC, network, port)
     - Filters with rules and actions
     - Rule descriptions, logging, and actions (jump, offload)
+
+    Each section (extra items, flow tables, every group, filter and chain) is
+    generated separately and its lines are cached by a hash of the section's
+    content, so after an edit only the changed sections are regenerated.
 """
 
+import hashlib
 import json
 
+from package.cache_functions import section_cache_get, section_cache_set
 from package.data_file_functions import read_user_data_file
 
 
+def _generate_section(section_function, *args):
+    """
+    Generates the configuration lines of one section, reusing the lines
+    generated earlier for identical content.
+
+    Args:
+        section_function: Function generating the section's lines
+        *args: Arguments of section_function (IP version, name and data of
+               the section)
+
+    Returns:
+        tuple: Configuration lines of the section
+
+    The cache key is a hash of the section function and all of its
+    arguments, so editing one rule only regenerates the chain or filter it
+    belongs to and every other section is served from the cache.
+    """
+    content = json.dumps(
+        [section_function.__name__, *args], sort_keys=True, default=str
+    )
+    key = hashlib.sha256(content.encode()).hexdigest()
+
+    lines = section_cache_get(key)
+    if lines is None:
+        lines = tuple(section_function(*args))
+        section_cache_set(key, lines)
+
+    return lines
+
+
+def _extra_items_section(extra_items):
+    lines = ["#\n#\n# Extra Configuration Items\n#\n#"]
+    for item in extra_items:
+        lines.append(f"{item}")
+    lines.append("")
+
+    return lines
+
+
+def _flowtables_section(flowtables):
+    lines = ["#\n#\n# FLOW TABLES\n#\n#\n"]
+    for flowtable in flowtables:
+        lines.append(f"# Flowtable: {flowtable["name"]}")
+        for interface in flowtable["interfaces"]:
+            lines.append(
+                f"set firewall flowtable {flowtable["name"]} interface '{interface}'"
+            )
+        lines.append(
+            f"set firewall flowtable {flowtable["name"]} description '{flowtable["description"]}'"
+        )
+        lines.append(f"set firewall flowtable {flowtable["name"]} offload software")
+        lines.append("")
+
+    return lines
+
+
+def _group_section(ip_version, group_name, group):
+    lines = []
+
+    # Get Values
+    group_desc = group["group_desc"]
+    group_type = group["group_type"]
+    group_value = group["group_value"]
+
+    if group_type == "address-group":
+        value_type = "address"
+    elif group_type == "domain-group":
+        value_type = "address"
+    elif group_type == "interface-group":
+        value_type = "interface"
+    elif group_type == "mac-group":
+        value_type = "mac-address"
+    elif group_type == "network-group":
+        value_type = "network"
+    elif group_type == "port-group":
+        value_type = "port"
+    else:
+        value_type = "address"
+
+    lines.append(f"\n# Group: {group_name}")
+
+    # Write Config Statements
+    if ip_version == "ipv4":
+        if group_desc != "":
+            lines.append(
+                f"set firewall group {group_type} {group_name} description '{group_desc}'"
+            )
+        for value in group_value:
+            if value != "":
+                lines.append(
+                    f"set firewall group {group_type} {group_name} {value_type} '{value}'"
+                )
+
+    if ip_version == "ipv6":
+        if group_desc != "":
+            lines.append(
+                f"set firewall group {ip_version}-{group_type} {group_name} description '{group_desc}'"
+            )
+        for value in group_value:
+            if value != "":
+                lines.append(
+                    f"set firewall group {ip_version}-{group_type} {group_name} {value_type} '{value}'"
+                )
+
+    return lines
+
+
+def _filter_section(ip_version, filter_name, filter_data):
+    lines = []
+
+    # Get Values
+    filter_desc = filter_data["description"]
+    filter_action = filter_data["default-action"]
+    filter_log = filter_data["log"]
+
+    # Write Config Statements
+    lines.append(f"#\n# Filter: {filter_name}\n#")
+    lines.append(
+        f"set firewall {ip_version} {filter_name} filter description '{filter_desc}'"
+    )
+    lines.append(
+        f"set firewall {ip_version} {filter_name} filter default-action {filter_action}"
+    )
+    if filter_log:
+        lines.append(
+            f"set firewall {ip_version} {filter_name} filter enable-default-log"
+        )
+    lines.append("\n")
+
+    for rule in filter_data["rule-order"]:
+        # Get Values
+        rule_data = filter_data["rules"][rule]
+        description = rule_data["description"]
+        log = "log" in rule_data
+        rule_disable = "rule_disable" in rule_data
+        action = rule_data["action"]
+        if action == "jump":
+            interface = rule_data["interface"]
+            direction = rule_data["direction"]
+            jump_target = rule_data["fw_chain"]
+        if action == "offload":
+            offload_target = rule_data["fw_chain"]
+
+        # Write Config Statements
+        lines.append(f"# Rule {rule}")
+
+        # Description
+        if description != "":
+            lines.append(
+                f"set firewall {ip_version} {filter_name} filter rule {rule} description '{description}'"
+            )
+
+        # Action
+        lines.append(
+            f"set firewall {ip_version} {filter_name} filter rule {rule} action '{action}'"
+        )
+        if action == "offload":
+            lines.append(
+                f"set firewall {ip_version} {filter_name} filter rule {rule} offload-target '{offload_target}'"
+            )
+
+        # Interface / Directions
+        if action == "jump":
+            if direction == "inbound":
+                lines.append(
+                    f"set firewall {ip_version} {filter_name} filter rule {rule} inbound-interface name '{interface}'"
+                )
+            if direction == "outbound":
+                lines.append(
+                    f"set firewall {ip_version} {filter_name} filter rule {rule} outbound-interface name '{interface}'"
+                )
+            lines.append(
+                f"set firewall {ip_version} {filter_name} filter rule {rule} jump-target '{jump_target}'"
+            )
+
+        # Disable
+        if rule_disable:
+            lines.append(
+                f"set firewall {ip_version} {filter_name} filter rule {rule} disable"
+            )
+
+        # Log
+        if log:
+            lines.append(
+                f"set firewall {ip_version} {filter_name} filter rule {rule} log"
+            )
+        lines.append("\n")
+
+    return lines
+
+
+def _chain_section(ip_version, fw_chain, chain):
+    lines = []
+
+    lines.append(f"#\n# Chain: {fw_chain}\n#")
+
+    if "default" in chain:
+        description = chain["default"]["description"]
+        if "default_logging" in chain["default"]:
+            default_logging = chain["default"]["default_logging"]
+        else:
+            default_logging = False
+        default_action = chain["default"]["default_action"]
+        lines.append(
+            f"set firewall {ip_version} name {fw_chain} description '{description}'"
+        )
+        lines.append(
+            f"set firewall {ip_version} name {fw_chain} default-action '{default_action}'"
+        )
+        if default_logging:
+            lines.append(f"set firewall {ip_version} name {fw_chain} default-log")
+        lines.append("\n")
+
+    for rule in chain["rule-order"]:
+        # Get Values
+        rule_data = chain[rule]
+        description = rule_data["description"]
+        rule_disable = "rule_disable" in rule_data
+        rule_logging = "logging" in rule_data
+        action = rule_data["action"]
+        dest_address = rule_data["dest_address"]
+        dest_address_type = rule_data["dest_address_type"]
+        dest_port = rule_data["dest_port"]
+        dest_port_type = rule_data["dest_port_type"]
+        source_address = rule_data["source_address"]
+        source_address_type = rule_data["source_address_type"]
+        source_port = rule_data["source_port"]
+        source_port_type = rule_data["source_port_type"]
+        protocol = rule_data["protocol"]
+        state_est = "state_est" in rule_data
+        state_inv = "state_inv" in rule_data
+        state_new = "state_new" in rule_data
+        state_rel = "state_rel" in rule_data
+
+        # Write Config Statements
+        lines.append(f"# Rule {rule}")
+
+        # Disable
+        if rule_disable:
+            lines.append(
+                f"set firewall {ip_version} name {fw_chain} rule {rule} disable"
+            )
+
+        # Description
+        if description != "":
+            lines.append(
+                f"set firewall {ip_version} name {fw_chain} rule {rule} description '{description}'"
+            )
+
+        # Action
+        lines.append(
+            f"set firewall {ip_version} name {fw_chain} rule {rule} action '{action}'"
+        )
+
+        # Destination
+        if dest_address != "":
+            if dest_address_type == "address":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination address '{dest_address}'"
+                )
+            elif dest_address_type == "address_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group address-group '{dest_address}'"
+                )
+            elif dest_address_type == "domain_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group domain-group '{dest_address}'"
+                )
+            elif dest_address_type == "mac_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group mac-group '{dest_address}'"
+                )
+            elif dest_address_type == "network_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group network-group '{dest_address}'"
+                )
+        if dest_port != "":
+            if dest_port_type == "port":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination port '{dest_port}'"
+                )
+            elif dest_port_type == "port_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group port-group '{dest_port}'"
+                )
+
+        # Source
+        if source_address != "":
+            if source_address_type == "address":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} source address '{source_address}'"
+                )
+            elif source_address_type == "address_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group address-group '{source_address}'"
+                )
+            elif source_address_type == "domain_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group domain-group '{source_address}'"
+                )
+            elif source_address_type == "mac_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group mac-group '{source_address}'"
+                )
+            elif source_address_type == "network_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group network-group '{source_address}'"
+                )
+        if source_port != "":
+            if source_port_type == "port":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} source port '{source_port}'"
+                )
+            elif source_port_type == "port_group":
+                lines.append(
+                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group port-group '{source_port}'"
+                )
+
+        # Protocol
+        if protocol != "":
+            if ip_version == "ipv6" and protocol == "icmp":
+                protocol = "ipv6-icmp"
+            lines.append(
+                f"set firewall {ip_version} name {fw_chain} rule {rule} protocol '{protocol}'"
+            )
+
+        # Logging
+        if rule_logging:
+            lines.append(f"set firewall {ip_version} name {fw_chain} rule {rule} log")
+
+        # States
+        if state_est:
+            lines.append(
+                f"set firewall {ip_version} name {fw_chain} rule {rule} state 'established'"
+            )
+        if state_inv:
+            lines.append(
+                f"set firewall {ip_version} name {fw_chain} rule {rule} state 'invalid'"
+            )
+        if state_new:
+            lines.append(
+                f"set firewall {ip_version} name {fw_chain} rule {rule} state 'new'"
+            )
+        if state_rel:
+            lines.append(
+                f"set firewall {ip_version} name {fw_chain} rule {rule} state 'related'"
+            )
+        lines.append("")
+
+    return lines
+
+
 def download_json_data(session):
     """
     Retrieves user data and converts it to formatted JSON
@@ -47,7 +410,30 @@ def generate_config(session, snapshot="current", diff=False):
         diff: Whether to generate diff configuration, defaults to "False"
 
     Returns:
-        list: Configuration commands
+        tuple: (HTML message of the configuration, list of configuration
+               commands)
+    """
+    config = list(iter_config(session, snapshot, diff))
+
+    # Convert list of lines to single string
+    message = "".join(line.replace("\n", "<br>") + "<br>" for line in config)
+
+    # Return message of config commands
+    return message, config
+
+
+def iter_config(session, snapshot="current", diff=False):
+    """
+    Generates firewall configuration from user data one line at a time, so
+    callers writing the configuration out never hold all of it in memory
+
+    Args:
+        session: Dictionary containing data_dir and firewall_name
+        snapshot: Snapshot name to use, defaults to "current"
+        diff: Whether to generate diff configuration, defaults to "False"
+
+    Yields:
+        str: Configuration commands, as listed by generate_config
     """
 
     if not diff:
@@ -60,45 +446,36 @@ def generate_config(session, snapshot="current", diff=False):
         user_data = read_user_data_file(
             f'{session["data_dir"]}/{session["firewall_name"]}',
             snapshot=snapshot,
-            diff=diff,
         )
 
-    # Create firewall configuration
-    config = []
+    yield from iter_config_lines(user_data)
+
 
+def iter_config_lines(user_data):
+    """
+    Generates firewall configuration from a firewall document one line at a
+    time, for callers that already hold the document (e.g. a snapshot series)
+
+    Args:
+        user_data: Firewall document, as returned by read_user_data_file
+
+    Yields:
+        str: Configuration commands, as listed by generate_config
+    """
     if (
         "ipv4" not in user_data
         and "ipv6" not in user_data
         and "extra-items" not in user_data
     ):
-        config.append(
-            "Empty rule set.  Start by adding a Chain using the button on the right."
-        )
+        yield "Empty rule set.  Start by adding a Chain using the button on the right."
 
     # Add Extra Items
     if "extra-items" in user_data:
-        config.append("#\n#\n# Extra Configuration Items\n#\n#")
-        for item in user_data["extra-items"]:
-            config.append(f"{item}")
-        config.append("")
+        yield from _generate_section(_extra_items_section, user_data["extra-items"])
 
     # Work through each IP Version, Chain and Rule adding to config
     if "flowtables" in user_data:
-        config.append("#\n#\n# FLOW TABLES\n#\n#\n")
-
-        for flowtable in user_data["flowtables"]:
-            config.append(f"# Flowtable: {flowtable["name"]}")
-            for interface in flowtable["interfaces"]:
-                config.append(
-                    f"set firewall flowtable {flowtable["name"]} interface '{interface}'"
-                )
-            config.append(
-                f"set firewall flowtable {flowtable["name"]} description '{flowtable["description"]}'"
-            )
-            config.append(
-                f"set firewall flowtable {flowtable["name"]} offload software"
-            )
-            config.append("")
+        yield from _generate_section(_flowtables_section, user_data["flowtables"])
 
     for ip_version in user_data:
         if (
@@ -112,335 +489,62 @@ def generate_config(session, snapshot="current", diff=False):
             and ip_version != "version"
         ):
             if ip_version == "ipv4":
-                config.append("#\n#\n# IPv4\n#\n#\n")
+                yield "#\n#\n# IPv4\n#\n#\n"
             if ip_version == "ipv6":
-                config.append("#\n#\n# IPv6\n#\n#\n")
+                yield "#\n#\n# IPv6\n#\n#\n"
 
             if "groups" in user_data[ip_version]:
-                config.append("#\n# Groups\n#")
+                yield "#\n# Groups\n#"
                 for group_name in user_data[ip_version]["groups"]:
-                    # Get Values
-                    group_desc = user_data[ip_version]["groups"][group_name][
-                        "group_desc"
-                    ]
-                    group_type = user_data[ip_version]["groups"][group_name][
-                        "group_type"
-                    ]
-                    group_value = user_data[ip_version]["groups"][group_name][
-                        "group_value"
-                    ]
-
-                    if group_type == "address-group":
-                        value_type = "address"
-                    elif group_type == "domain-group":
-                        value_type = "address"
-                    elif group_type == "interface-group":
-                        value_type = "interface"
-                    elif group_type == "mac-group":
-                        value_type = "mac-address"
-                    elif group_type == "network-group":
-                        value_type = "network"
-                    elif group_type == "port-group":
-                        value_type = "port"
-                    else:
-                        value_type = "address"
-
-                    config.append(f"\n# Group: {group_name}")
-
-                    # Write Config Statements
-                    if ip_version == "ipv4":
-                        if group_desc != "":
-                            config.append(
-                                f"set firewall group {group_type} {group_name} description '{group_desc}'"
-                            )
-                        for value in group_value:
-                            if value != "":
-                                config.append(
-                                    f"set firewall group {group_type} {group_name} {value_type} '{value}'"
-                                )
-
-                    if ip_version == "ipv6":
-                        if group_desc != "":
-                            config.append(
-                                f"set firewall group {ip_version}-{group_type} {group_name} description '{group_desc}'"
-                            )
-                        for value in group_value:
-                            if value != "":
-                                config.append(
-                                    f"set firewall group {ip_version}-{group_type} {group_name} {value_type} '{value}'"
-                                )
-
-                config.append("")
+                    yield from _generate_section(
+                        _group_section,
+                        ip_version,
+                        group_name,
+                        user_data[ip_version]["groups"][group_name],
+                    )
+                yield ""
 
             if "filters" in user_data[ip_version]:
                 for filter_name in user_data[ip_version]["filters"]:
-                    # Get Values
-                    filter_desc = user_data[ip_version]["filters"][filter_name][
-                        "description"
-                    ]
-                    filter_action = user_data[ip_version]["filters"][filter_name][
-                        "default-action"
-                    ]
-                    filter_log = user_data[ip_version]["filters"][filter_name]["log"]
-
-                    # Write Config Statements
-                    config.append(f"#\n# Filter: {filter_name}\n#")
-                    config.append(
-                        f"set firewall {ip_version} {filter_name} filter description '{filter_desc}'"
+                    yield from _generate_section(
+                        _filter_section,
+                        ip_version,
+                        filter_name,
+                        user_data[ip_version]["filters"][filter_name],
                     )
-                    config.append(
-                        f"set firewall {ip_version} {filter_name} filter default-action {filter_action}"
-                    )
-                    if filter_log:
-                        config.append(
-                            f"set firewall {ip_version} {filter_name} filter enable-default-log"
-                        )
-                    config.append("\n")
-
-                    for rule in user_data[ip_version]["filters"][filter_name][
-                        "rule-order"
-                    ]:
-                        # Get Values
-                        rule_data = user_data[ip_version]["filters"][filter_name][
-                            "rules"
-                        ][rule]
-                        description = rule_data["description"]
-                        log = "log" in rule_data
-                        rule_disable = "rule_disable" in rule_data
-                        action = rule_data["action"]
-                        if action == "jump":
-                            interface = rule_data["interface"]
-                            direction = rule_data["direction"]
-                            jump_target = rule_data["fw_chain"]
-                        if action == "offload":
-                            offload_target = rule_data["fw_chain"]
-
-                        # Write Config Statements
-                        config.append(f"# Rule {rule}")
-
-                        # Description
-                        if description != "":
-                            config.append(
-                                f"set firewall {ip_version} {filter_name} filter rule {rule} description '{description}'"
-                            )
-
-                        # Action
-                        config.append(
-                            f"set firewall {ip_version} {filter_name} filter rule {rule} action '{action}'"
-                        )
-                        if action == "offload":
-                            config.append(
-                                f"set firewall {ip_version} {filter_name} filter rule {rule} offload-target '{offload_target}'"
-                            )
-
-                        # Interface / Directions
-                        if action == "jump":
-                            if direction == "inbound":
-                                config.append(
-                                    f"set firewall {ip_version} {filter_name} filter rule {rule} inbound-interface name '{interface}'"
-                                )
-                            if direction == "outbound":
-                                config.append(
-                                    f"set firewall {ip_version} {filter_name} filter rule {rule} outbound-interface name '{interface}'"
-                                )
-                            config.append(
-                                f"set firewall {ip_version} {filter_name} filter rule {rule} jump-target '{jump_target}'"
-                            )
-
-                        # Disable
-                        if rule_disable:
-                            config.append(
-                                f"set firewall {ip_version} {filter_name} filter rule {rule} disable"
-                            )
-
-                        # Log
-                        if log:
-                            config.append(
-                                f"set firewall {ip_version} {filter_name} filter rule {rule} log"
-                            )
-                        config.append("\n")
 
             if "chains" in user_data[ip_version]:
                 for fw_chain in user_data[ip_version]["chains"]:
-                    config.append(f"#\n# Chain: {fw_chain}\n#")
-
-                    if "default" in user_data[ip_version]["chains"][fw_chain]:
-                        description = user_data[ip_version]["chains"][fw_chain][
-                            "default"
-                        ]["description"]
-                        if (
-                            "default_logging"
-                            in user_data[ip_version]["chains"][fw_chain]["default"]
-                        ):
-                            default_logging = user_data[ip_version]["chains"][fw_chain][
-                                "default"
-                            ]["default_logging"]
-                        else:
-                            default_logging = False
-                        default_action = user_data[ip_version]["chains"][fw_chain][
-                            "default"
-                        ]["default_action"]
-                        config.append(
-                            f"set firewall {ip_version} name {fw_chain} description '{description}'"
-                        )
-                        config.append(
-                            f"set firewall {ip_version} name {fw_chain} default-action '{default_action}'"
-                        )
-                        if default_logging:
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} default-log"
-                            )
-                        config.append("\n")
-
-                    for rule in user_data[ip_version]["chains"][fw_chain]["rule-order"]:
-                        # Get Values
-                        rule_data = user_data[ip_version]["chains"][fw_chain][rule]
-                        description = rule_data["description"]
-                        rule_disable = "rule_disable" in rule_data
-                        rule_logging = "logging" in rule_data
-                        action = rule_data["action"]
-                        dest_address = rule_data["dest_address"]
-                        dest_address_type = rule_data["dest_address_type"]
-                        dest_port = rule_data["dest_port"]
-                        dest_port_type = rule_data["dest_port_type"]
-                        source_address = rule_data["source_address"]
-                        source_address_type = rule_data["source_address_type"]
-                        source_port = rule_data["source_port"]
-                        source_port_type = rule_data["source_port_type"]
-                        protocol = rule_data["protocol"]
-                        state_est = "state_est" in rule_data
-                        state_inv = "state_inv" in rule_data
-                        state_new = "state_new" in rule_data
-                        state_rel = "state_rel" in rule_data
-
-                        # Write Config Statements
-                        config.append(f"# Rule {rule}")
-
-                        # Disable
-                        if rule_disable:
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} rule {rule} disable"
-                            )
-
-                        # Description
-                        if description != "":
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} rule {rule} description '{description}'"
-                            )
-
-                        # Action
-                        config.append(
-                            f"set firewall {ip_version} name {fw_chain} rule {rule} action '{action}'"
-                        )
-
-                        # Destination
-                        if dest_address != "":
-                            if dest_address_type == "address":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination address '{dest_address}'"
-                                )
-                            elif dest_address_type == "address_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group address-group '{dest_address}'"
-                                )
-                            elif dest_address_type == "domain_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group domain-group '{dest_address}'"
-                                )
-                            elif dest_address_type == "mac_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group mac-group '{dest_address}'"
-                                )
-                            elif dest_address_type == "network_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group network-group '{dest_address}'"
-                                )
-                        if dest_port != "":
-                            if dest_port_type == "port":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination port '{dest_port}'"
-                                )
-                            elif dest_port_type == "port_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} destination group port-group '{dest_port}'"
-                                )
-
-                        # Source
-                        if source_address != "":
-                            if source_address_type == "address":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} source address '{source_address}'"
-                                )
-                            elif source_address_type == "address_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group address-group '{source_address}'"
-                                )
-                            elif source_address_type == "domain_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group domain-group '{source_address}'"
-                                )
-                            elif source_address_type == "mac_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group mac-group '{source_address}'"
-                                )
-                            elif source_address_type == "network_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group network-group '{source_address}'"
-                                )
-                        if source_port != "":
-                            if source_port_type == "port":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} source port '{source_port}'"
-                                )
-                            elif source_port_type == "port_group":
-                                config.append(
-                                    f"set firewall {ip_version} name {fw_chain} rule {rule} source group port-group '{source_port}'"
-                                )
-
-                        # Protocol
-                        if protocol != "":
-                            if ip_version == "ipv6" and protocol == "icmp":
-                                protocol = "ipv6-icmp"
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} rule {rule} protocol '{protocol}'"
-                            )
-
-                        # Logging
-                        if rule_logging:
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} rule {rule} log"
-                            )
-
-                        # States
-                        if state_est:
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} rule {rule} state 'established'"
-                            )
-                        if state_inv:
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} rule {rule} state 'invalid'"
-                            )
-                        if state_new:
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} rule {rule} state 'new'"
-                            )
-                        if state_rel:
-                            config.append(
-                                f"set firewall {ip_version} name {fw_chain} rule {rule} state 'related'"
-                            )
-                        config.append("")
-
-    # If this is a Diff, just return the config
-    if diff:
-        message = ""
-        for line in config:
-            message = message + line.replace("\n", "<br>") + "<br>"
-        return message, config
+                    yield from _generate_section(
+                        _chain_section,
+                        ip_version,
+                        fw_chain,
+                        user_data[ip_version]["chains"][fw_chain],
+                    )
 
-    # Convert list of lines to single string
-    message = ""
-    for line in config:
-        message = message + line.replace("\n", "<br>") + "<br>"
 
-    # Return message of config commands
-    return message, config
+def iter_config_text(session, chunk_size=64 * 1024):
+    """
+    Generates the current configuration as a text file in chunks, one command
+    per line, for streaming responses
+
+    Args:
+        session: Dictionary containing data_dir and firewall_name
+        chunk_size: Approximate size of each chunk in characters, defaults
+                    to 64 KiB
+
+    Yields:
+        str: Chunks of the configuration text
+    """
+    chunk = []
+    size = 0
+    for line in iter_config(session):
+        chunk.append(f"{line}\n")
+        size += len(line) + 1
+        if size >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+
+    if chunk:
+        yield "".join(chunk)
@@ -9,7 +9,11 @@ import logging
 
 from flask import flash
 
-from package.data_file_functions import read_user_data_file, write_user_data_file
+from package.data_file_functions import (
+    mutate_user_data_file,
+    read_user_data_file,
+    update_user_data_file,
+)
 
 
 def add_group_to_data(session, request):
@@ -21,15 +25,9 @@ def add_group_to_data(session, request):
         request: Flask request object containing form data for the new group
 
     The function:
-    - Reads existing user data
     - Extracts group details from form (type, IP version, description, name, values)
-    - Creates necessary data structures if they don't exist
-    - Adds the new group data
-    - Writes updated data back to file
+    - Sets the group data in the user data file, creating it if it doesn't exist
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     group_type = request.form["group_type"]
     if group_type == "address-group" or group_type == "network-group":
@@ -46,23 +44,16 @@ def add_group_to_data(session, request):
     for value in group_value.split(","):
         group_value_list.append(value.strip())
 
-    # Check and create higher level data structure if it does not exist
-    if ip_version not in user_data:
-        user_data[ip_version] = {}
-    if "groups" not in user_data[ip_version]:
-        user_data[ip_version]["groups"] = {}
-    if group_name not in user_data[ip_version]["groups"]:
-        user_data[ip_version]["groups"][group_name] = {}
-
-    # Assign values into data structure
-    user_data[ip_version]["groups"][group_name]["group_desc"] = group_desc
-    user_data[ip_version]["groups"][group_name]["group_type"] = group_type
-    user_data[ip_version]["groups"][group_name]["group_value"] = group_value_list
-
-    # logging.info(json.dumps(user_data, indent=4))
-
-    # Write user_data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
+    # Set group values in user data file, creating the group if it does not exist
+    group_path = (ip_version, "groups", group_name)
+    update_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}',
+        set_fields={
+            (*group_path, "group_desc"): group_desc,
+            (*group_path, "group_type"): group_type,
+            (*group_path, "group_value"): group_value_list,
+        },
+    )
 
     flash(f"Group {group_name} added.", "success")
 
@@ -153,34 +144,46 @@ def delete_group_from_data(session, request):
     - Extracts group details from form
     - Removes the group from the data structure
     - Cleans up empty data structures
-    - Writes updated data back to file
+    - Unsets the group (or emptied structure) in the user data file
     """
-    # Get user's data
-    user_data = read_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}')
-
     # Set local vars from posted form data
     group = request.form["group"].split(",")
     ip_version = group[0]
     group_name = group[1]
-
-    # Delete group from data
-    try:
-        del user_data[ip_version]["groups"][group_name]
+    deleted = []
+
+    def build_update(user_data):
+        # Delete group from data
+        deleted.clear()
+        try:
+            del user_data[ip_version]["groups"][group_name]
+            deleted.append(group_name)
+        except Exception:
+            pass
+
+        # Clean-up data
+        unset_fields = [(ip_version, "groups", group_name)]
+        try:
+            if not user_data[ip_version]["groups"]:
+                del user_data[ip_version]["groups"]
+                unset_fields = [(ip_version, "groups")]
+            if not user_data[ip_version]:
+                del user_data[ip_version]
+                unset_fields = [(ip_version,)]
+        except Exception as e:
+            logging.info(e)
+
+        return {"unset_fields": unset_fields}
+
+    # Remove group from user data file
+    if not mutate_user_data_file(
+        f'{session["data_dir"]}/{session["firewall_name"]}', build_update
+    ):
+        return
+
+    if deleted:
         flash(f"Deleted group {group_name} from {ip_version}.", "warning")
-    except Exception:
+    else:
         flash(f"Failed to delete group {group_name} from {ip_version}.", "danger")
-        pass
-
-    # Clean-up data
-    try:
-        if not user_data[ip_version]["groups"]:
-            del user_data[ip_version]["groups"]
-        if not user_data[ip_version]:
-            del user_data[ip_version]
-    except Exception as e:
-        logging.info(e)
-
-    # Write user's data to file
-    write_user_data_file(f'{session["data_dir"]}/{session["firewall_name"]}', user_data)
 
     return
@@ -2,14 +2,19 @@
 Interface Support Functions
 
 This module provides functions for managing network interface data in a firewall configuration system.
-It handles adding, deleting and listing interface configurations using a JSON-based data store.
+It handles adding, deleting and listing interface configurations using a JSON-based data store,
+pushing and pulling individual interfaces rather than rewriting the whole document.
 """
 
 import logging
 
 from flask import flash
 
-from package.data_file_functions import read_user_data_file, write_user_data_file
+from package.data_file_functions import (
+    mutate_user_data_file,
+    read_user_data_file,
+    update_user_data_file,
+)
 
 
 def add_interface_to_data(session, request):
@@ -23,36 +28,36 @@ def add_interface_to_data(session, request):
     Returns:
         None. Updates data file and displays success message.
     """
-    # Get user's data
-    user_data = read_user_data_file(f"{session['data_dir']}/{session['firewall_name']}")
-
     # Set local vars from posted form data
     interface_name = request.form["interface_name"].replace(" ", "")
     interface_desc = request.form["interface_desc"]
 
-    # Capture list of interfaces and remove from user_data
-    if "interfaces" in user_data:
-        interface_list = user_data["interfaces"]
-        del user_data["interfaces"]
-    else:
-        interface_list = []
-
-    # Create higher level data structure if it does not exist
-    if "interfaces" not in user_data:
-        user_data["interfaces"] = []
-
-    for interface in interface_list:
-        if interface["name"] != interface_name:
-            user_data["interfaces"].append(interface)
-
     # Assign values into data structure
     new_interface = {}
     new_interface["name"] = interface_name
     new_interface["description"] = interface_desc
-    user_data["interfaces"].append(new_interface)
 
-    # Write user_data to file
-    write_user_data_file(f"{session['data_dir']}/{session['firewall_name']}", user_data)
+    def build_update(user_data):
+        # Capture list of interfaces
+        interface_list = user_data.get("interfaces", [])
+
+        # Push a new interface, or replace the list when the interface already
+        #   exists ($pull and $push on one path cannot share an update)
+        if any(interface["name"] == interface_name for interface in interface_list):
+            new_interface_list = [
+                interface
+                for interface in interface_list
+                if interface["name"] != interface_name
+            ]
+            new_interface_list.append(new_interface)
+            return {"set_fields": {("interfaces",): new_interface_list}}
+        return {"push_fields": {("interfaces",): new_interface}}
+
+    # Write interface to user data file
+    if not mutate_user_data_file(
+        f"{session['data_dir']}/{session['firewall_name']}", build_update
+    ):
+        return
 
     flash(f"Interface {interface_name} added.", "success")
 
@@ -70,27 +75,16 @@ def delete_interface_from_data(session, request):
     Returns:
         None. Updates data file and displays success message.
     """
-    # Get user's data
-    user_data = read_user_data_file(f"{session['data_dir']}/{session['firewall_name']}")
-
     # Set local vars from posted form data
     interface_name = request.form["interface"]
 
-    interface_list = user_data["interfaces"]
-    logging.debug(f"Interface list: {interface_list}")
-
-    new_interface_list = []
-
-    for interface in interface_list:
-        if interface["name"] != interface_name:
-            new_interface_list.append(interface)
-
-    logging.debug(f"New Interface list: {new_interface_list}")
-
-    user_data["interfaces"] = new_interface_list
+    logging.debug(f"Removing interface: {interface_name}")
 
-    # Write user_data to file
-    write_user_data_file(f"{session['data_dir']}/{session['firewall_name']}", user_data)
+    # Pull interface from user data file
+    update_user_data_file(
+        f"{session['data_dir']}/{session['firewall_name']}",
+        pull_fields={("interfaces",): {"name": interface_name}},
+    )
 
     flash(f"Interface {interface_name} deleted.", "success")
 
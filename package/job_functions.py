@@ -0,0 +1,231 @@
+"""
+    Job Functions
+
+    This module runs device operations in the background, so an HTTP thread
+    is freed as soon as the operation is submitted instead of being held for
+    the whole SSH session (up to the 120 second channel timeout on slow
+    devices).
+
+    Contains functions for:
+    - Submitting a View Diffs, Commit, Run Operational Command or Run
+      Collection Profile action as a background job
+    - Reading the state and result of a job, for the UI to poll
+
+    Jobs run on an in-process thread pool of DEVICE_JOB_WORKERS threads
+    (default 4).  Their state is kept in a MongoDB job record (see
+    create_job_record), so any request can poll it:
+
+        queued -> running -> done | error
+
+    Credentials are passed to the worker thread only and are never written
+    to the job record.  The commands of a View Diffs or Commit job are written
+    to a command file of the job when it is submitted, so later edits or
+    submits for the same firewall cannot change what the job pushes; the file
+    is deleted when the job finishes.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from package.data_file_functions import (
+    create_job_record,
+    read_job_record,
+    update_job_record,
+    write_user_command_conf_file,
+)
+from package.napalm_ssh_functions import (
+    command_file,
+    delta_command_file,
+    device_action,
+)
+
+DEVICE_ACTIONS = (
+    "View Diffs",
+    "Commit",
+    "Run Operational Command",
+    "Run Collection Profile",
+)
+
+# Device actions that push the firewall's commands.
+PUSH_ACTIONS = ("View Diffs", "Commit")
+
+# Thread pool running device jobs, created with the first job.
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+
+def _job_workers():
+    try:
+        return max(1, int(os.environ.get("DEVICE_JOB_WORKERS")))
+    except Exception:
+        return 4
+
+
+def _get_job_executor():
+    global _job_executor
+
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(
+                max_workers=_job_workers(), thread_name_prefix="device-job"
+            )
+
+    return _job_executor
+
+
+def _run_job(job_id, action, connection_string, session, op_command, delta, filename):
+    """
+    Runs a device job on a worker thread and records its result.
+
+    Args:
+        job_id (str): Job identifier
+        action (str): Device action (see DEVICE_ACTIONS)
+        connection_string (dict): Connection parameters
+        session (dict): Session data of the firewall
+        op_command (str or list): Operational command, the commands of a
+            collection profile, or None
+        delta (bool): Push only the changed commands
+        filename (str): Command file of the job, or None
+
+    Returns:
+        None
+    """
+    update_job_record(
+        job_id, {"status": "running", "started": datetime.now(timezone.utc)}
+    )
+
+    try:
+        message, error = device_action(
+            action, connection_string, session, op_command, delta, filename
+        )
+    except Exception as e:
+        logging.exception(f" |--X Device job {job_id} failed")
+        message, error = str(e), "Error running job.  Inspect output."
+    finally:
+        if filename is not None:
+            for path in (filename, delta_command_file(filename)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    update_job_record(
+        job_id,
+        {
+            "status": "done" if error is None else "error",
+            "message": message,
+            "error": error,
+            "finished": datetime.now(timezone.utc),
+        },
+    )
+
+    return
+
+
+def submit_device_job(
+    action,
+    connection_string,
+    session,
+    op_command=None,
+    delta=False,
+    command_list=None,
+    delete=False,
+):
+    """
+    Submits a device action to run in the background.
+
+    Args:
+        action (str): "View Diffs", "Commit", "Run Operational Command" or
+            "Run Collection Profile"
+        connection_string (dict): Connection parameters
+        session (dict): Session data including username, firewall_name and
+            data directory path
+        op_command (str or list, optional): Operational command to run, or
+            the commands of a collection profile
+        delta (bool, optional): Push only the commands that differ from the
+            running configuration (see push_config)
+        command_list (iterable, optional): Firewall commands to push for a
+            View Diffs or Commit job, e.g. iter_config(session); written to
+            the job's own command file before the job is queued
+        delete (bool, optional): Include 'delete firewall' before the set
+            commands
+
+    Returns:
+        str: Job identifier to poll with get_device_job
+
+    Raises:
+        ValueError: If the action is not a device action
+    """
+    if action not in DEVICE_ACTIONS:
+        raise ValueError(f"Unknown device action: {action}")
+
+    job_id = uuid.uuid4().hex
+
+    filename = None
+    if action in PUSH_ACTIONS and command_list is not None:
+        filename = command_file(session, job_id)
+        write_user_command_conf_file(session, command_list, delete, filename)
+
+    create_job_record(
+        {
+            "_id": job_id,
+            "username": session["username"],
+            "firewall": session["firewall_name"],
+            "action": action,
+            "status": "queued",
+            "message": None,
+            "error": None,
+            "started": None,
+            "finished": None,
+        }
+    )
+    logging.info(f" |--> Queued device job {job_id}: {action}")
+
+    _get_job_executor().submit(
+        _run_job,
+        job_id,
+        action,
+        dict(connection_string),
+        dict(session),
+        op_command,
+        delta,
+        filename,
+    )
+
+    return job_id
+
+
+def get_device_job(job_id, username):
+    """
+    Gets the state and result of a device job.
+
+    Args:
+        job_id (str): Job identifier
+        username (str): User that submitted the job
+
+    Returns:
+        dict: {"id", "firewall", "action", "status", "message", "error",
+               "created", "started", "finished"} with ISO 8601 timestamps,
+               or None if the job does not exist for the user
+    """
+    job = read_job_record(job_id, username)
+    if job is None:
+        return None
+
+    result = {"id": job["_id"]}
+    for field in (
+        "firewall",
+        "action",
+        "status",
+        "message",
+        "error",
+        "created",
+        "started",
+        "finished",
+    ):
+        value = job.get(field)
+        result[field] = value.isoformat() if isinstance(value, datetime) else value
+
+    return result
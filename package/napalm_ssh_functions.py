@@ -4,23 +4,70 @@ Napalm & Paramiko Functions to connect with VyOS Firewall
 This module provides functions for connecting to and managing VyOS firewalls using both
 the NAPALM and Paramiko libraries. It handles SSH key and password authentication,
 configuration management, and connection testing.
+
+NAPALM sessions used for diffs and commits are kept open between requests in
+the connection pool (see connection_pool_functions).
 """
 
+import codecs
+import io
 import logging
 import os
 import socket
+import time
 
 import paramiko
 from flask import flash
 from napalm import get_network_driver
 
-from package.data_file_functions import decrypt_file
+from package.config_delta_functions import config_delta, parse_command
+from package.connection_pool_functions import (
+    napalm_pool_discard,
+    napalm_pool_get,
+    napalm_pool_key,
+    napalm_pool_put,
+)
+from package.data_file_functions import decrypt_key
+from package.reachability_functions import check_reachability
 from package.telemetry_functions import (
     telemetry_commit,
     telemetry_diff,
     telemetry_rule_usage,
 )
 
+# Running firewall configuration as set commands, compared by delta pushes.
+RUNNING_CONFIG_COMMAND = "show configuration commands | match firewall"
+
+
+def load_private_key(connection_string, session):
+    """
+    Decrypts a stored SSH private key into a Paramiko key object, without
+    writing the decrypted key to disk.
+
+    Args:
+        connection_string (dict): Connection parameters including password
+            (the key passphrase) and ssh_key_name
+        session (dict): Session data including data directory path
+
+    Returns:
+        paramiko.PKey: The private key
+
+    Raises:
+        paramiko.SSHException: If the key is not an Ed25519, ECDSA or RSA
+            private key
+    """
+    key = connection_string["password"].encode("utf-8")
+    key_name = f"{session['data_dir']}/{connection_string['ssh_key_name']}"
+    key_text = decrypt_key(key_name, key).decode("utf-8")
+
+    for key_class in (paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey):
+        try:
+            return key_class.from_private_key(io.StringIO(key_text))
+        except paramiko.SSHException:
+            continue
+
+    raise paramiko.SSHException("Unsupported private key type")
+
 
 def assemble_napalm_driver_string(connection_string, session):
     """
@@ -31,40 +78,75 @@ def assemble_napalm_driver_string(connection_string, session):
         session (dict): Session data including data directory path
 
     Returns:
-        tuple: (NAPALM driver instance, temporary key file path if using SSH key auth)
+        NAPALM driver instance
+
+    The VyOS driver only forwards a fixed set of optional arguments to
+    Netmiko, which does not include an in-memory key, so the key is handed to
+    Netmiko through the driver's netmiko_optional_args.
     """
     driver = get_network_driver("vyos")
     optional_args = {"port": connection_string["port"], "conn_timeout": 120}
 
     if "ssh_key_name" in connection_string:
-        key = connection_string["password"].encode("utf-8")
-        key_name = f"{session['data_dir']}/{connection_string['ssh_key_name']}"
-        tmp_key_name = decrypt_file(key_name, key)
-        optional_args["key_file"] = tmp_key_name
-
-        return (
-            # B106 -- Not a hardcoded password.
-            driver(
-                hostname=connection_string["hostname"],
-                username=connection_string["username"],
-                password="",
-                optional_args=optional_args,
-            ),  # nosec
-            tmp_key_name,
-        )
+        pkey = load_private_key(connection_string, session)
+
+        # B106 -- Not a hardcoded password.
+        device = driver(
+            hostname=connection_string["hostname"],
+            username=connection_string["username"],
+            password="",
+            optional_args=optional_args,
+        )  # nosec
+
+        device.netmiko_optional_args["pkey"] = pkey
+        return device
 
     else:
-        return (
-            driver(
-                hostname=connection_string["hostname"],
-                username=connection_string["username"],
-                password=connection_string["password"],
-                optional_args=optional_args,
-            ),
-            None,
+        return driver(
+            hostname=connection_string["hostname"],
+            username=connection_string["username"],
+            password=connection_string["password"],
+            optional_args=optional_args,
         )
 
 
+class NapalmAssemblyError(Exception):
+    """Raised by checkout_napalm_driver when the driver cannot be assembled."""
+
+
+def checkout_napalm_driver(connection_string, session):
+    """
+    Gets an open NAPALM session to a VyOS device, reusing a pooled session
+    opened with the same connection parameters when one is available.
+
+    Args:
+        connection_string (dict): Connection parameters including hostname, port, credentials
+        session (dict): Session data including data directory path
+
+    Returns:
+        tuple: (pool key, open NAPALM driver)
+
+    Raises:
+        NapalmAssemblyError: If the driver cannot be assembled (e.g. the SSH
+            key cannot be decrypted)
+        Exception: If the connection cannot be opened
+    """
+    key = napalm_pool_key(connection_string)
+    driver = napalm_pool_get(key)
+    if driver is not None:
+        return key, driver
+
+    try:
+        driver = assemble_napalm_driver_string(connection_string, session)
+    except Exception as e:
+        raise NapalmAssemblyError(e) from e
+
+    logging.debug(" |--> Opening connection")
+    driver.open()
+
+    return key, driver
+
+
 def assemble_paramiko_driver_string(connection_string, session):
     """
     Creates a Paramiko SSH client instance for connecting to a VyOS device.
@@ -74,7 +156,7 @@ def assemble_paramiko_driver_string(connection_string, session):
         session (dict): Session data including data directory path
 
     Returns:
-        tuple: (Paramiko SSH client instance, temporary key file path if using SSH key auth)
+        paramiko.SSHClient: Connected SSH client
     """
     # B507 -- Purposely allowing trust of the unknown host key
     ssh = paramiko.SSHClient()
@@ -89,182 +171,343 @@ def assemble_paramiko_driver_string(connection_string, session):
 
     if "ssh_key_name" in connection_string:
         logging.info("key")
-        key = connection_string["password"].encode("utf-8")
-        key_name = f"{session['data_dir']}/{connection_string['ssh_key_name']}"
-        tmp_key_name = decrypt_file(key_name, key)
-        ssh.connect(hostname, port=port, username=username, key_filename=tmp_key_name)
+        pkey = load_private_key(connection_string, session)
+        ssh.connect(hostname, port=port, username=username, pkey=pkey)
     else:
         logging.info("no_key")
-        tmp_key_name = None
         ssh.connect(hostname, port=port, username=username, password=password)
 
-    return ssh, tmp_key_name
+    return ssh
 
 
-def commit_to_firewall(connection_string, session):
+def command_file(session, name=None):
     """
-    Commits configuration changes to the VyOS firewall.
+    Gets the path of a firewall command file.
+
+    Args:
+        session (dict): Session data including data directory path and
+            firewall name
+        name (str, optional): Suffix naming a file of one push (e.g. a job
+            identifier), so concurrent pushes of a firewall do not share a
+            file.  Defaults to the firewall's shared command file.
+
+    Returns:
+        str: Path of the command file
+    """
+    if name is None:
+        return f"{session['data_dir']}/{session['firewall_name']}.conf"
+
+    return f"{session['data_dir']}/{session['firewall_name']}.{name}.conf"
+
+
+def delta_command_file(filename):
+    """
+    Gets the path of the delta command file written for a command file.
+    """
+    return f"{filename.removesuffix('.conf')}.delta.conf"
+
+
+def _delta_candidate(vyos_router, filename):
+    """
+    Writes the commands of a firewall command file that differ from the
+    running configuration to a delta command file.
+
+    Args:
+        vyos_router: Open NAPALM driver
+        filename (str): Path of the firewall command file
+
+    Returns:
+        str: Path of the delta command file, the path of the full
+             configuration file if the running configuration has no set
+             commands, or None if the running configuration already matches
+
+    The running configuration is read as set commands with
+    RUNNING_CONFIG_COMMAND; the driver's get_config returns the curly-brace
+    format of 'show', which config_delta cannot compare.
+    """
+    running = vyos_router.device.send_command(RUNNING_CONFIG_COMMAND).splitlines()
+
+    # Without running set commands nothing can be compared or deleted, so push
+    #   the full file, including its 'delete firewall' when there is one.
+    if not any(parse_command(line) for line in running):
+        logging.info(" |--> No running set commands read, pushing full configuration")
+        return filename
+
+    with open(filename) as f:
+        commands = config_delta(running, f)
+    if not commands:
+        return None
+
+    filename = delta_command_file(filename)
+    with open(filename, "w") as f:
+        for command in commands:
+            f.write(f"{command}\n")
+    logging.debug(f" |--> Pushing {len(commands)} changed commands")
+
+    return filename
+
+
+def push_config(connection_string, session, commit=False, delta=False, filename=None):
+    """
+    Compares the firewall configuration file with the running configuration
+    of a VyOS device and optionally commits the differences.
 
     Args:
         connection_string (dict): Connection parameters
         session (dict): Session data including firewall configuration file path
+        commit (bool): Commit the differences instead of discarding them
+        delta (bool): Load only the set/delete commands that differ from the
+            running configuration (see config_delta_functions) instead of
+            merging every line of the configuration file
+        filename (str, optional): Command file to push.  Defaults to the
+            firewall's shared command file (see command_file)
 
     Returns:
-        str: Result message indicating success or failure
-    """
-    logging.debug(" |------------------------------------------")
-    telemetry_commit()
+        str: Configuration differences, followed by the commit result when
+             committing, or a message that there is nothing to commit
 
-    try:
-        driver, tmpfile = assemble_napalm_driver_string(connection_string, session)
-    except Exception as e:
-        tmpfile = None
-        logging.info(f" |--X Error assembling NAPALM driver: {e}")
-        flash(f"Error: {e}", "danger")
-        return f"Authentication failure!\n{e}\n\nIf using SSH key, suggest uploading again and saving your encryption key."
+    Raises:
+        NapalmAssemblyError: If the driver cannot be assembled
+        Exception: If the device cannot be reached or rejects the configuration
 
+    The session is returned to the connection pool after a successful
+    operation and closed after a failure.  Does not flash messages, so it can
+    be run outside of a request (see fleet_functions).
+    """
     logging.debug(f" |--> Connecting to: {session['hostname']}:{session['port']}")
     logging.debug(" |--> Configuring driver")
 
-    vyos_router = driver
+    vyos_router = None
+    try:
+        key, vyos_router = checkout_napalm_driver(connection_string, session)
 
-    logging.debug(" |--> Opening connection")
+        if filename is None:
+            filename = command_file(session)
+        if delta:
+            logging.debug(" |--> Computing configuration delta")
+            filename = _delta_candidate(vyos_router, filename)
+            if filename is None:
+                napalm_pool_put(key, vyos_router)
+                logging.debug(" |--> Connection returned to pool.")
+                return "No configuration changes to commit."
 
-    try:
-        vyos_router.open()
-        vyos_router.load_merge_candidate(
-            filename=f"{session['data_dir']}/{session['firewall_name']}.conf"
-        )
+        vyos_router.load_merge_candidate(filename=filename)
 
         logging.debug(" |--> Comparing configuration")
         diffs = vyos_router.compare_config()
 
-        if bool(diffs) is True:
+        if bool(diffs) is True and commit:
             logging.debug(" |--> Committing configuration")
-            commit = vyos_router.commit_config()
+            result = vyos_router.commit_config()
 
-            logging.debug(" |--> Connection closed.\n |")
-            vyos_router.close()
+            logging.debug(" |--> Connection returned to pool.\n |")
+            napalm_pool_put(key, vyos_router)
 
-            if commit is None:
+            if result is None:
                 return str(diffs + "Commit successful.")
             else:
-                return str(diffs + commit)
+                return str(diffs + result)
 
+        vyos_router.discard_config()
+        napalm_pool_put(key, vyos_router)
+        logging.debug(" |--> Connection returned to pool.")
+
+        if bool(diffs) is True:
+            return diffs
         else:
             logging.debug(" |--> No configuration changes to commit")
-            vyos_router.discard_config()
-
-            logging.debug(" |--> Connection closed.")
-            vyos_router.close()
             return "No configuration changes to commit."
 
+    except NapalmAssemblyError:
+        raise
+
+    except Exception:
+        if vyos_router is not None:
+            napalm_pool_discard(vyos_router)
+        raise
+
+
+def authentication_failure_message(error):
+    """
+    Builds the result message of a device action whose NAPALM driver could
+    not be assembled.
+
+    Args:
+        error (Exception): Error raised by checkout_napalm_driver
+
+    Returns:
+        str: Result message
+    """
+    return (
+        f"Authentication failure!\n{error}\n\n"
+        "If using SSH key, suggest uploading again and saving your encryption key."
+    )
+
+
+def device_action(
+    action, connection_string, session, op_command=None, delta=False, filename=None
+):
+    """
+    Runs a device action without flashing messages, so it can be run outside
+    of a request (see job_functions).
+
+    Args:
+        action (str): "View Diffs", "Commit", "Run Operational Command" or
+            "Run Collection Profile"
+        connection_string (dict): Connection parameters
+        session (dict): Session data including firewall configuration file path
+        op_command (str or list, optional): Operational command to run, or
+            the list of commands of a collection profile
+        delta (bool, optional): Push only the changed commands (see push_config)
+        filename (str, optional): Command file to push (see push_config)
+
+    Returns:
+        tuple: (result message, error message to flash as 'danger' or None)
+    """
+    logging.debug(" |------------------------------------------")
+
+    if action in ("Run Operational Command", "Run Collection Profile"):
+        telemetry_rule_usage()
+        try:
+            if action == "Run Collection Profile":
+                results = operational_commands(connection_string, session, op_command)
+                return format_command_batch(results), None
+            return operational_command(connection_string, session, op_command), None
+
+        except Exception as e:
+            logging.info(f" |--X Error: {e}")
+            return (
+                str(e),
+                "Error connecting to host.  Inspect output and correct errors.",
+            )
+
+        finally:
+            logging.debug(" |------------------------------------------")
+
+    commit = action == "Commit"
+    if commit:
+        telemetry_commit()
+    else:
+        telemetry_diff()
+
+    try:
+        return push_config(connection_string, session, commit, delta, filename), None
+
+    except NapalmAssemblyError as e:
+        logging.info(f" |--X Error assembling NAPALM driver: {e}")
+        return authentication_failure_message(e), f"Error: {e}"
+
     except Exception as e:
         logging.info(f" |--X Error: {e}")
-        flash("Error in diff.  Inspect output and correct errors.", "danger")
-        return str(e)
+        return str(e), "Error in diff.  Inspect output and correct errors."
 
     finally:
-        # Delete key
-        if tmpfile is not None:
-            os.remove(tmpfile)
-            logging.debug(f" |--> Deleted temporary key: {tmpfile}")
-            logging.debug(" |-----------------------------------------")
+        logging.debug(" |------------------------------------------")
 
 
-def get_diffs_from_firewall(connection_string, session):
+def commit_to_firewall(connection_string, session, delta=False):
+    """
+    Commits configuration changes to the VyOS firewall.
+
+    Args:
+        connection_string (dict): Connection parameters
+        session (dict): Session data including firewall configuration file path
+        delta (bool, optional): Push only the changed commands (see push_config)
+
+    Returns:
+        str: Result message indicating success or failure
+    """
+    message, error = device_action("Commit", connection_string, session, delta=delta)
+    if error is not None:
+        flash(error, "danger")
+
+    return message
+
+
+def get_diffs_from_firewall(connection_string, session, delta=False):
     """
     Gets configuration differences between local and remote firewall configurations.
 
     Args:
         connection_string (dict): Connection parameters
         session (dict): Session data including firewall configuration file path
+        delta (bool, optional): Push only the changed commands (see push_config)
 
     Returns:
         str: Configuration differences or status message
     """
-    logging.debug(" |------------------------------------------")
-    telemetry_diff()
+    message, error = device_action(
+        "View Diffs", connection_string, session, delta=delta
+    )
+    if error is not None:
+        flash(error, "danger")
 
-    try:
-        driver, tmpfile = assemble_napalm_driver_string(connection_string, session)
-    except Exception as e:
-        tmpfile = None
-        logging.info(f" |--X Error assembling NAPALM driver: {e}")
-        flash(f"Error: {e}", "danger")
-        return f"Authentication failure!\n{e}\n\nIf using SSH key, suggest uploading again and saving your encryption key."
+    return message
 
-    logging.debug(f" |--> Connecting to: {session['hostname']}:{session['port']}")
-    logging.debug(" |--> Configuring driver")
 
-    vyos_router = driver
+def _op_stream_max_bytes():
+    try:
+        return int(os.environ.get("OP_STREAM_MAX_BYTES"))
+    except Exception:
+        return 4 * 1024 * 1024
 
-    logging.debug(" |--> Opening connection")
 
+def _op_stream_max_seconds():
     try:
-        vyos_router.open()
-        vyos_router.load_merge_candidate(
-            filename=f"{session['data_dir']}/{session['firewall_name']}.conf"
-        )
+        return float(os.environ.get("OP_STREAM_MAX_SECONDS"))
+    except Exception:
+        return 300.0
 
-        logging.debug(" |--> Comparing configuration")
-        diffs = vyos_router.compare_config()
 
-        vyos_router.discard_config()
-        vyos_router.close()
-        logging.debug(" |--> Connection closed.")
+def _start_operational_command(ssh, op_command):
+    """
+    Starts an operational command on a connected Paramiko SSH client.
 
-        if bool(diffs) is True:
-            return diffs
-        else:
-            return "No configuration changes to commit."
+    Args:
+        ssh (paramiko.SSHClient): Connected SSH client
+        op_command (str): Operational command to run
 
-    except Exception as e:
-        logging.info(f" |--X Error: {e}")
-        flash("Error in diff.  Inspect output and correct errors.", "danger")
-        return str(e)
+    Returns:
+        tuple: (stdin, stdout, stderr) of the command
+    """
+    logging.info(f"Op Command: '{op_command}'")
+    commands = [
+        "source /opt/vyatta/etc/functions/script-template",
+        f"run {op_command}",
+        "exit",
+    ]
 
-    finally:
-        # Delete key
-        if tmpfile is not None:
-            os.remove(tmpfile)
-            logging.debug(f" |--> Deleted temporary key: {tmpfile}")
-            logging.debug(" |------------------------------------------")
+    command_string = "\n".join(commands) + "\n"
+
+    # B601 -- no shell injection
+    stdin, stdout, stderr = ssh.exec_command(f"vbash -s {command_string}")  # nosec
+    stdin.write(command_string)
+    stdin.flush()
+    stdin.channel.shutdown_write()
+
+    return stdin, stdout, stderr
 
 
 # Uses Paramiko rather than Napalm
-def run_operational_command(connection_string, session, op_command):
+def operational_command(connection_string, session, op_command):
     """
-    Shows current firewall usage statistics using Paramiko SSH client.
+    Runs an operational command using Paramiko SSH client.
 
     Args:
         connection_string (dict): Connection parameters
         session (dict): Session data
+        op_command (str): Operational command to run
 
     Returns:
-        str: Firewall usage output or error message
+        str: Command output
+
+    Raises:
+        Exception: If the device cannot be reached or the command cannot be run
     """
-    logging.debug(" |------------------------------------------")
-    telemetry_rule_usage()
+    ssh = assemble_paramiko_driver_string(connection_string, session)
 
-    tmpfile = None
     try:
-        ssh, tmpfile = assemble_paramiko_driver_string(connection_string, session)
-
-        logging.info(f"Op Command: '{op_command}'")
-        commands = [
-            "source /opt/vyatta/etc/functions/script-template",
-            f"run {op_command}",
-            "exit",
-        ]
-
-        command_string = "\n".join(commands) + "\n"
-
-        # B601 -- no shell injection
-        stdin, stdout, stderr = ssh.exec_command(f"vbash -s {command_string}")  # nosec
-        stdin.write(command_string)
-        stdin.flush()
-        stdin.channel.shutdown_write()
+        stdin, stdout, stderr = _start_operational_command(ssh, op_command)
 
         # Read the output
         output = stdout.read().decode()
@@ -272,48 +515,246 @@ def run_operational_command(connection_string, session, op_command):
 
         logging.debug(output)
 
+    finally:
         ssh.close()
 
-        return output
+    return output
+
+
+def operational_commands(connection_string, session, op_commands):
+    """
+    Runs several operational commands over one Paramiko SSH session, so
+    gathering them costs a single connection and authentication.
+
+    Args:
+        connection_string (dict): Connection parameters
+        session (dict): Session data
+        op_commands (list): Operational commands to run, in order
+
+    Returns:
+        list: One dict per command, {"command", "output", "error",
+              "seconds"}, with error None unless the command could not be run
+
+    Raises:
+        Exception: If the device cannot be reached
+    """
+    ssh = assemble_paramiko_driver_string(connection_string, session)
+
+    results = []
+    try:
+        for op_command in op_commands:
+            started = time.monotonic()
+            output, error = "", None
+            try:
+                stdin, stdout, stderr = _start_operational_command(ssh, op_command)
+                output = stdout.read().decode(errors="replace")
+            except Exception as e:
+                logging.info(f" |--X Error running '{op_command}': {e}")
+                error = str(e)
+            results.append(
+                {
+                    "command": op_command,
+                    "output": output,
+                    "error": error,
+                    "seconds": round(time.monotonic() - started, 3),
+                }
+            )
+
+    finally:
+        ssh.close()
+
+    logging.debug(
+        f" |--> Ran {len(results)} commands in "
+        f"{sum(result['seconds'] for result in results):.2f}s"
+    )
+
+    return results
+
+
+def format_command_batch(results):
+    """
+    Formats the results of operational_commands as one text report.
+
+    Args:
+        results (list): Results returned by operational_commands
+
+    Returns:
+        str: Each command's output under a header with its run time
+    """
+    sections = []
+    for result in results:
+        header = f"### {result['command']} ({result['seconds']:.2f}s)"
+        body = result["output"] if result["error"] is None else result["error"]
+        sections.append(f"{header}\n{body.rstrip()}\n")
+
+    return "\n".join(sections)
+
+
+def stream_operational_command(
+    connection_string,
+    session,
+    op_command,
+    max_bytes=None,
+    max_seconds=None,
+    chunk_size=32 * 1024,
+):
+    """
+    Runs an operational command using Paramiko SSH client, yielding the
+    output as it arrives.
+
+    Args:
+        connection_string (dict): Connection parameters
+        session (dict): Session data
+        op_command (str): Operational command to run
+        max_bytes (int, optional): Stop after this many bytes of output.
+            Defaults to OP_STREAM_MAX_BYTES (4 MiB)
+        max_seconds (float, optional): Stop after this many seconds.
+            Defaults to OP_STREAM_MAX_SECONDS (300)
+        chunk_size (int, optional): Largest chunk read from the channel
+
+    Yields:
+        tuple: (event, data) where event is:
+               - "output": data is the next chunk of output
+               - "truncated": data says which cap stopped the command
+               - "error": data is the error message
+               - "done": the command finished
+
+    The function:
+    1. Connects and starts the command as run_operational_command does
+    2. Yields each chunk read from the channel, decoded as UTF-8 (a
+       character split across chunks is kept for the next chunk)
+    3. Stops at the end of the output, or when the byte or time cap is
+       reached, for commands such as 'monitor log' that never finish
+
+    The connection is closed when the command stops or the caller stops
+    iterating (e.g. the client disconnects), so at most one chunk is held in
+    memory.
+    """
+    if max_bytes is None:
+        max_bytes = _op_stream_max_bytes()
+    if max_seconds is None:
+        max_seconds = _op_stream_max_seconds()
+
+    logging.debug(" |------------------------------------------")
+    telemetry_rule_usage()
+
+    ssh = None
+    try:
+        ssh = assemble_paramiko_driver_string(connection_string, session)
+        stdin, stdout, stderr = _start_operational_command(ssh, op_command)
+        channel = stdout.channel
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        deadline = time.monotonic() + max_seconds
+        received = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield "truncated", f"Output stopped after {max_seconds:g} seconds."
+                break
+
+            # Wake up at least every second to check the time cap.
+            channel.settimeout(min(remaining, 1.0))
+            try:
+                data = channel.recv(chunk_size)
+            except socket.timeout:
+                continue
+
+            if not data:
+                text = decoder.decode(b"", final=True)
+                if text:
+                    yield "output", text
+                yield "done", ""
+                break
+
+            if received + len(data) > max_bytes:
+                text = decoder.decode(data[: max_bytes - received], final=True)
+                if text:
+                    yield "output", text
+                yield "truncated", f"Output stopped after {max_bytes} bytes."
+                break
+
+            received += len(data)
+            text = decoder.decode(data)
+            if text:
+                yield "output", text
 
     except Exception as e:
         logging.info(f" |--X Error: {e}")
-        flash("Error connecting to host.  Inspect output and correct errors.", "danger")
-        return str(e)
+        yield "error", str(e)
 
     finally:
-        # Delete key
-        if tmpfile is not None:
-            os.remove(tmpfile)
-            logging.debug(f" |--> Deleted temporary key: {tmpfile}")
-            logging.debug(" |------------------------------------------")
+        if ssh is not None:
+            ssh.close()
+        logging.debug(" |------------------------------------------")
+
+
+def sse_event(event, data):
+    """
+    Formats an event of a text/event-stream (Server-Sent Events) response.
+
+    Args:
+        event (str): Event name
+        data (str): Event data; each line is sent as its own data field, as
+            carriage returns would otherwise end the field
+
+    Returns:
+        str: The event, terminated by a blank line
+    """
+    data = data.replace("\r\n", "\n").replace("\r", "\n")
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+
+    return f"event: {event}\n{lines}\n"
+
+
+def run_operational_command(connection_string, session, op_command):
+    """
+    Shows current firewall usage statistics using Paramiko SSH client.
+
+    Args:
+        connection_string (dict): Connection parameters
+        session (dict): Session data
+
+    Returns:
+        str: Firewall usage output or error message
+    """
+    message, error = device_action(
+        "Run Operational Command", connection_string, session, op_command
+    )
+    if error is not None:
+        flash(error, "danger")
+
+    return message
 
 
 def test_connection(session):
     """
-    Tests TCP connection to the firewall.
+    Tests TCP connection to the firewall, from the result of the last
+    background probe (see reachability_functions).
 
     Args:
         session (dict): Session data including hostname and port
 
     Returns:
-        bool: True if connection successful, False otherwise
+        bool: True if connection successful, False if not, or None if the
+              firewall has not been probed yet
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        s.settimeout(20)
-        s.connect((session["hostname"], int(session["port"])))
-        s.shutdown(2)
+    reachable = check_reachability(session["hostname"], session["port"])
+    if reachable is None:
+        flash(
+            f"Checking connection to {session['hostname']} on port {session['port']}...",
+            "warning",
+        )
+    elif reachable:
         flash(
             f"Connection to {session['hostname']} on port {session['port']} validated!",
             "success",
         )
-        return True
-    except Exception:
+    else:
         flash(
             f"Cannot connect to {session['hostname']} on port {session['port']}!",
             "danger",
         )
-        return False
-    finally:
-        s.close()
+
+    return reachable
@@ -0,0 +1,249 @@
+"""
+    Reachability Functions
+
+    This module keeps the TCP reachability of firewalls current in the
+    background, so pages showing whether a firewall can be reached render
+    from a cached result instead of holding a request thread while a
+    connection to an unreachable host times out.
+
+    Contains functions for:
+    - Probing whether the SSH port of a firewall accepts TCP connections
+    - Probing many firewalls concurrently
+    - Checking a firewall's reachability from the cache, registering it with
+      the monitor
+    - Running the monitor that re-probes every registered firewall on a
+      schedule
+
+    A firewall is registered with the monitor whenever its reachability is
+    checked, and dropped once it has not been checked for
+    REACHABILITY_WATCH_TTL seconds (default 3600).  The monitor re-probes the
+    registered firewalls every REACHABILITY_INTERVAL seconds (default 30) on
+    a pool of REACHABILITY_WORKERS threads (default 16), each probe timing out
+    after REACHABILITY_PROBE_TIMEOUT seconds (default 5).  Results are kept
+    in the reachability cache (see cache_functions) for
+    REACHABILITY_CACHE_TTL seconds.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from package.cache_functions import reachability_cache_get, reachability_cache_set
+
+# Firewalls re-probed by the monitor.
+#   (hostname, port) -> time.monotonic() of the last check
+_watched = {}
+# Firewalls with a probe queued or running, so each is probed once at a time.
+_pending = set()
+_watch_lock = threading.Lock()
+
+# Thread pool running probes, created with the first probe.
+_probe_executor = None
+_probe_executor_lock = threading.Lock()
+
+_monitor_thread = None
+_monitor_stop = threading.Event()
+_monitor_lock = threading.Lock()
+
+
+def _monitor_interval():
+    try:
+        return max(1.0, float(os.environ.get("REACHABILITY_INTERVAL")))
+    except Exception:
+        return 30.0
+
+
+def _probe_timeout():
+    try:
+        return float(os.environ.get("REACHABILITY_PROBE_TIMEOUT"))
+    except Exception:
+        return 5.0
+
+
+def _probe_workers():
+    try:
+        return max(1, int(os.environ.get("REACHABILITY_WORKERS")))
+    except Exception:
+        return 16
+
+
+def _watch_ttl():
+    try:
+        return float(os.environ.get("REACHABILITY_WATCH_TTL"))
+    except Exception:
+        return 3600.0
+
+
+def _get_probe_executor():
+    global _probe_executor
+
+    with _probe_executor_lock:
+        if _probe_executor is None:
+            _probe_executor = ThreadPoolExecutor(
+                max_workers=_probe_workers(), thread_name_prefix="reachability"
+            )
+
+    return _probe_executor
+
+
+def probe_host(hostname, port, timeout=None):
+    """
+    Tests whether a TCP connection to a firewall can be opened.
+
+    Args:
+        hostname (str): Firewall hostname
+        port (str): SSH port
+        timeout (float, optional): Connection timeout in seconds.  Defaults
+            to REACHABILITY_PROBE_TIMEOUT (5)
+
+    Returns:
+        bool: True if the connection was opened, False otherwise
+    """
+    if timeout is None:
+        timeout = _probe_timeout()
+
+    try:
+        with socket.create_connection((hostname, int(port)), timeout=timeout):
+            return True
+    except Exception as e:
+        logging.debug(f" |--> {hostname}:{port} unreachable: {e}")
+        return False
+
+
+def _probe(target):
+    try:
+        reachable = probe_host(*target)
+        reachability_cache_set(*target, reachable)
+    finally:
+        with _watch_lock:
+            _pending.discard(target)
+
+    return reachable
+
+
+def _submit_probe(target):
+    with _watch_lock:
+        if target in _pending:
+            return None
+        _pending.add(target)
+
+    return _get_probe_executor().submit(_probe, target)
+
+
+def probe_hosts(targets):
+    """
+    Probes firewalls concurrently and caches the results.
+
+    Args:
+        targets (iterable): (hostname, port) tuples
+
+    Returns:
+        None
+
+    A firewall whose previous probe is still running is not probed again.
+    """
+    futures = []
+    for hostname, port in targets:
+        future = _submit_probe((hostname, str(port)))
+        if future is not None:
+            futures.append(future)
+    wait(futures)
+
+    return
+
+
+def check_reachability(hostname, port):
+    """
+    Gets the cached reachability of a firewall without waiting for a probe.
+
+    Args:
+        hostname (str): Firewall hostname
+        port (str): SSH port
+
+    Returns:
+        bool: True if reachable, False if not, or None if the firewall has
+              not been probed yet
+
+    The function:
+    1. Registers the firewall with the monitor, starting the monitor if it
+       is not running
+    2. Returns the cached probe result when there is one
+    3. Otherwise queues a probe, so the result is cached shortly
+    """
+    target = (hostname, str(port))
+    with _watch_lock:
+        _watched[target] = time.monotonic()
+    start_reachability_monitor()
+
+    cached = reachability_cache_get(*target)
+    if cached is not None:
+        return cached[0]
+
+    _submit_probe(target)
+
+    return None
+
+
+def _monitor_loop():
+    while not _monitor_stop.is_set():
+        expires = time.monotonic() - _watch_ttl()
+        with _watch_lock:
+            for target in [t for t, seen in _watched.items() if seen < expires]:
+                del _watched[target]
+            targets = list(_watched)
+
+        if targets:
+            started = time.monotonic()
+            probe_hosts(targets)
+            logging.debug(
+                f" |--> Probed {len(targets)} firewalls in "
+                f"{time.monotonic() - started:.2f}s"
+            )
+
+        _monitor_stop.wait(_monitor_interval())
+
+
+def start_reachability_monitor():
+    """
+    Starts the background thread re-probing the registered firewalls, if it
+    is not running.
+
+    Returns:
+        None
+    """
+    global _monitor_thread
+
+    with _monitor_lock:
+        if _monitor_thread is None or not _monitor_thread.is_alive():
+            _monitor_stop.clear()
+            _monitor_thread = threading.Thread(
+                target=_monitor_loop, name="reachability-monitor", daemon=True
+            )
+            _monitor_thread.start()
+            logging.info(" |--> Started reachability monitor")
+
+    return
+
+
+def stop_reachability_monitor():
+    """
+    Stops the reachability monitor and forgets the registered firewalls.
+
+    Returns:
+        None
+    """
+    global _monitor_thread
+
+    with _monitor_lock:
+        _monitor_stop.set()
+        if _monitor_thread is not None:
+            _monitor_thread.join()
+            _monitor_thread = None
+
+    with _watch_lock:
+        _watched.clear()
+
+    return
@@ -0,0 +1,666 @@
+"""
+    Rule Statistics Functions
+
+    This module collects the per-rule packet and byte counters of the
+    firewalls into a time series, so rules can be ranked by hits and rules
+    that are never hit can be found across the fleet without connecting to
+    every firewall.
+
+    Contains functions for:
+    - Parsing the output of 'show firewall statistics' into rule counters
+    - Recording the hits since the previous read of a firewall's counters
+    - Collecting the counters of every configured firewall concurrently
+    - Downsampling old samples to hourly totals
+    - Ranking rules by hits and listing rules that were never hit in a window
+    - Running the collector that collects on a schedule
+
+    The counters of a firewall are cumulative and reset when its
+    configuration is committed, so each read is recorded as the increase
+    since the previous read (the first read of a firewall only sets the
+    baseline).  Increases are stored in buckets (see write_rule_hit_bucket):
+    one document per firewall and RULE_STATS_BUCKET_SECONDS (default 3600)
+    holding a column of hits per rule, aligned with the sample times:
+
+        {"firewall": "fw1", "resolution": "raw", "start": 1700000000,
+         "end": 1700003600, "times": [0, 300, ...],
+         "rules": ["ipv4 name WAN_IN rule 10", ...],
+         "packets": [[12, 0, ...], ...], "bytes": [[1500, 0, ...], ...]}
+
+    Raw buckets older than RULE_STATS_RAW_RETENTION seconds (default two
+    days) are merged into "hourly" buckets of one day each.
+
+    The collector reads the firewalls of every user that started it every
+    RULE_STATS_INTERVAL seconds (default 300) on a pool of RULE_STATS_WORKERS
+    threads (default 8).  Credentials are kept in memory only, so collection
+    stops when the application restarts.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from package.data_file_functions import (
+    delete_rule_hit_buckets,
+    read_rule_counters,
+    read_rule_hit_buckets,
+    write_rule_counters,
+    write_rule_hit_bucket,
+)
+from package.fleet_functions import list_fleet_targets
+from package.napalm_ssh_functions import operational_command
+
+STATISTICS_COMMAND = "show firewall statistics"
+
+DAY_SECONDS = 24 * 60 * 60
+HOUR_SECONDS = 60 * 60
+
+# Ruleset heading of 'show firewall statistics', e.g.
+#   ipv4 Firewall "name WAN_IN"
+#   ipv6 Firewall "forward filter"
+_RULESET = re.compile(r'^(ipv4|ipv6|bridge) Firewall "([^"]+)"')
+
+# Users collecting rule counters.
+#   username -> {"connection_string", "session", "next_run"}
+_collectors = {}
+# Time and device results of each user's last collection.
+#   username -> {"time": epoch second, "results": [...]}
+_last_collection = {}
+_collector_lock = threading.Lock()
+
+_collector_thread = None
+_collector_stop = threading.Event()
+_collector_wake = threading.Event()
+_collector_thread_lock = threading.Lock()
+
+
+def _collector_interval():
+    try:
+        return max(1.0, float(os.environ.get("RULE_STATS_INTERVAL")))
+    except Exception:
+        return 300.0
+
+
+def _collector_workers():
+    try:
+        return max(1, int(os.environ.get("RULE_STATS_WORKERS")))
+    except Exception:
+        return 8
+
+
+def _bucket_seconds():
+    try:
+        return max(60, int(os.environ.get("RULE_STATS_BUCKET_SECONDS")))
+    except Exception:
+        return HOUR_SECONDS
+
+
+def _raw_retention():
+    try:
+        return int(os.environ.get("RULE_STATS_RAW_RETENTION"))
+    except Exception:
+        return 2 * DAY_SECONDS
+
+
+def parse_firewall_statistics(output):
+    """
+    Parses the output of 'show firewall statistics' into rule counters.
+
+    Args:
+        output (str): Command output
+
+    Returns:
+        dict: (packets, bytes) keyed by rule, named by its configuration
+              path, e.g. "ipv4 name WAN_IN rule 10" or
+              "ipv4 forward filter default-action"
+
+    Rows without counters (shown as N/A) are skipped.
+    """
+    counters = {}
+    ruleset = None
+
+    for line in output.splitlines():
+        match = _RULESET.match(line.strip())
+        if match:
+            ruleset = f"{match.group(1)} {match.group(2)}"
+            continue
+
+        fields = line.split()
+        if ruleset is None or len(fields) < 3:
+            continue
+        if not (fields[1].isdigit() and fields[2].isdigit()):
+            continue
+
+        if fields[0].isdigit():
+            rule = f"{ruleset} rule {fields[0]}"
+        elif fields[0] == "default":
+            rule = f"{ruleset} default-action"
+        else:
+            continue
+
+        counters[rule] = (int(fields[1]), int(fields[2]))
+
+    return counters
+
+
+def _increases(previous, counters):
+    """
+    Computes the hits of each rule since the previous counters.
+
+    A rule that is new, or whose counters went down because the
+    configuration was committed, is counted from zero.
+    """
+    increases = {}
+
+    for rule, (packets, octets) in counters.items():
+        last = previous.get(rule)
+        if last is None or packets < last[0] or octets < last[1]:
+            increases[rule] = (packets, octets)
+        else:
+            increases[rule] = (packets - last[0], octets - last[1])
+
+    return increases
+
+
+def _new_bucket(username, firewall, resolution, start, span):
+    return {
+        "username": username,
+        "firewall": firewall,
+        "resolution": resolution,
+        "start": start,
+        "end": start + span,
+        "times": [],
+        "rules": [],
+        "packets": [],
+        "bytes": [],
+    }
+
+
+def _add_point(bucket, offset, increases):
+    """
+    Adds hits to the point of a bucket at an offset from its start, adding
+    the point and any new rule columns (zero-filled) as needed.
+    """
+    times = bucket["times"]
+    columns = {rule: index for index, rule in enumerate(bucket["rules"])}
+
+    for rule in increases:
+        if rule not in columns:
+            columns[rule] = len(bucket["rules"])
+            bucket["rules"].append(rule)
+            bucket["packets"].append([0] * len(times))
+            bucket["bytes"].append([0] * len(times))
+
+    point = bisect_left(times, offset)
+    if point == len(times) or times[point] != offset:
+        insort(times, offset)
+        for column in bucket["packets"] + bucket["bytes"]:
+            column.insert(point, 0)
+
+    for rule, (packets, octets) in increases.items():
+        bucket["packets"][columns[rule]][point] += packets
+        bucket["bytes"][columns[rule]][point] += octets
+
+    return
+
+
+def record_rule_counters(username, firewall, counters, sampled=None):
+    """
+    Records the hits of a firewall's rules since its counters were last read.
+
+    Args:
+        username (str): User that owns the firewall configuration
+        firewall (str): Firewall configuration name
+        counters (dict): (packets, bytes) keyed by rule, as returned by
+            parse_firewall_statistics
+        sampled (int, optional): Epoch second the counters were read.
+            Defaults to now
+
+    Returns:
+        dict: (packets, bytes) hits keyed by rule, or None if these are the
+              first counters read from the firewall
+
+    The function:
+    1. Reads the previous counters of the firewall; without them the
+       counters are only saved as the baseline
+    2. Adds the increases as a point of the raw bucket holding the sample
+       time, creating the bucket if needed
+    3. Saves the counters for the next read
+    """
+    if sampled is None:
+        sampled = int(time.time())
+
+    previous = read_rule_counters(username, firewall)
+    increases = None
+
+    if previous is not None:
+        increases = _increases(previous[1], counters)
+
+        span = _bucket_seconds()
+        start = sampled - sampled % span
+        bucket = next(
+            (
+                bucket
+                for bucket in read_rule_hit_buckets(
+                    username, "raw", since=start, until=start + 1, firewall=firewall
+                )
+                if bucket["start"] == start
+            ),
+            None,
+        ) or _new_bucket(username, firewall, "raw", start, span)
+
+        _add_point(bucket, sampled - start, increases)
+        write_rule_hit_bucket(bucket)
+
+    write_rule_counters(username, firewall, sampled, counters)
+
+    return increases
+
+
+def _collect_device(connection_string, username, device_session):
+    """
+    Reads and records the rule counters of one firewall.
+
+    Args:
+        connection_string (dict): Connection parameters of the device
+        username (str): User that owns the firewall configuration
+        device_session (dict): Session data of the device's firewall
+
+    Returns:
+        dict: Device result, {"firewall", "status", "message", "rules",
+              "seconds"} with status "ok" or "error"
+    """
+    started = time.monotonic()
+    result = {"firewall": device_session["firewall_name"], "rules": 0}
+
+    try:
+        output = operational_command(
+            connection_string, device_session, STATISTICS_COMMAND
+        )
+        counters = parse_firewall_statistics(output)
+        if not counters:
+            raise ValueError("No rule counters found in the output.")
+
+        record_rule_counters(
+            username, device_session["firewall_name"], counters, int(time.time())
+        )
+        result["rules"] = len(counters)
+        result["message"] = f"Read counters of {len(counters)} rules."
+        result["status"] = "ok"
+
+    except Exception as e:
+        logging.info(f" |--X Rule counters of {result['firewall']}: {e}")
+        result["message"] = str(e)
+        result["status"] = "error"
+
+    result["seconds"] = round(time.monotonic() - started, 3)
+
+    return result
+
+
+def collect_rule_hits(connection_string, session):
+    """
+    Reads and records the rule counters of every configured firewall of a
+    user concurrently.
+
+    Args:
+        connection_string (dict): Credentials used for every device (username,
+            password and optionally ssh_key_name)
+        session (dict): Session data including username and data directory path
+
+    Returns:
+        list: One device result per firewall with a hostname, sorted by
+              firewall name (see _collect_device)
+
+    The function:
+    1. Lists the firewalls with a hostname configured
+    2. Reads each one's counters on a thread pool of at most
+       RULE_STATS_WORKERS threads
+    3. Downsamples the user's raw buckets past the raw retention
+    """
+    targets = [target for target in list_fleet_targets(session) if target["configured"]]
+    username = session["username"]
+
+    with ThreadPoolExecutor(
+        max_workers=min(_collector_workers(), max(len(targets), 1)),
+        thread_name_prefix="rule-stats",
+    ) as executor:
+        results = list(
+            executor.map(
+                lambda target: _collect_device(
+                    {
+                        **connection_string,
+                        "hostname": target["hostname"],
+                        "port": target["port"],
+                    },
+                    username,
+                    {
+                        **session,
+                        "firewall_name": target["firewall"],
+                        "hostname": target["hostname"],
+                        "port": target["port"],
+                    },
+                ),
+                targets,
+            )
+        )
+
+    downsample_rule_hits(username)
+
+    logging.info(
+        f" |--> Collected rule counters of {len(results)} firewalls for {username}"
+    )
+
+    return results
+
+
+def downsample_rule_hits(username, before=None):
+    """
+    Merges a user's raw buckets into hourly buckets.
+
+    Args:
+        username (str): User that owns the firewall configurations
+        before (int, optional): Merge the raw buckets ending at or before this
+            epoch second.  Defaults to now less RULE_STATS_RAW_RETENTION
+
+    Returns:
+        int: Number of raw buckets merged
+
+    Each raw point is added to the point of its hour in the hourly bucket of
+    its day, so a rule's hourly point holds its hits over the hour.  The raw
+    buckets are deleted once the hourly buckets are written.
+    """
+    if before is None:
+        before = int(time.time()) - _raw_retention()
+
+    raw_buckets = [
+        bucket
+        for bucket in read_rule_hit_buckets(username, "raw", until=before)
+        if bucket["end"] <= before
+    ]
+    hourly = {}
+
+    for raw in raw_buckets:
+        for index, offset in enumerate(raw["times"]):
+            sampled = raw["start"] + offset
+            day = sampled - sampled % DAY_SECONDS
+            key = (raw["firewall"], day)
+            if key not in hourly:
+                hourly[key] = next(
+                    iter(
+                        read_rule_hit_buckets(
+                            username,
+                            "hourly",
+                            since=day,
+                            until=day + 1,
+                            firewall=raw["firewall"],
+                        )
+                    ),
+                    None,
+                ) or _new_bucket(username, raw["firewall"], "hourly", day, DAY_SECONDS)
+
+            _add_point(
+                hourly[key],
+                sampled - day - sampled % HOUR_SECONDS,
+                {
+                    rule: (raw["packets"][column][index], raw["bytes"][column][index])
+                    for column, rule in enumerate(raw["rules"])
+                },
+            )
+
+    for bucket in hourly.values():
+        write_rule_hit_bucket(bucket)
+    delete_rule_hit_buckets([bucket["_id"] for bucket in raw_buckets])
+
+    if raw_buckets:
+        logging.debug(
+            f" |--> Downsampled {len(raw_buckets)} rule hit buckets of {username}"
+        )
+
+    return len(raw_buckets)
+
+
+def rule_hit_totals(username, since, until=None, firewalls=None):
+    """
+    Totals the hits of each rule of a user's firewalls over a time window.
+
+    Args:
+        username (str): User that owns the firewall configurations
+        since (int): Window start as an epoch second
+        until (int, optional): Window end as an epoch second.  Defaults to no
+            end
+        firewalls (list, optional): Only total these firewalls
+
+    Returns:
+        dict: [packets, bytes] keyed by (firewall, rule), for every rule with
+              a point in the window
+    """
+    totals = {}
+
+    for resolution in ("hourly", "raw"):
+        for bucket in read_rule_hit_buckets(username, resolution, since, until):
+            if firewalls is not None and bucket["firewall"] not in firewalls:
+                continue
+
+            # Points are sorted by time, so the window is a slice of each column.
+            first = bisect_left(bucket["times"], since - bucket["start"])
+            last = len(bucket["times"])
+            if until is not None:
+                last = bisect_left(bucket["times"], until - bucket["start"])
+            if first >= last:
+                continue
+
+            for column, rule in enumerate(bucket["rules"]):
+                total = totals.setdefault((bucket["firewall"], rule), [0, 0])
+                total[0] += sum(bucket["packets"][column][first:last])
+                total[1] += sum(bucket["bytes"][column][first:last])
+
+    return totals
+
+
+def rank_rules_by_hits(username, since, until=None, firewalls=None, limit=None):
+    """
+    Ranks the rules of a user's firewalls by their hits over a time window.
+
+    Args:
+        username (str): User that owns the firewall configurations
+        since (int): Window start as an epoch second
+        until (int, optional): Window end as an epoch second
+        firewalls (list, optional): Only rank the rules of these firewalls
+        limit (int, optional): Number of rules to return
+
+    Returns:
+        list: [{"firewall", "rule", "packets", "bytes"}] with the most
+              packets first
+    """
+    ranked = sorted(
+        (
+            {"firewall": firewall, "rule": rule, "packets": packets, "bytes": octets}
+            for (firewall, rule), (packets, octets) in rule_hit_totals(
+                username, since, until, firewalls
+            ).items()
+        ),
+        key=lambda row: (-row["packets"], -row["bytes"], row["firewall"], row["rule"]),
+    )
+
+    return ranked[:limit] if limit is not None else ranked
+
+
+def never_hit_rules(username, since, until=None, firewalls=None):
+    """
+    Lists the rules of a user's firewalls that had no hits over a time window.
+
+    Args:
+        username (str): User that owns the firewall configurations
+        since (int): Window start as an epoch second
+        until (int, optional): Window end as an epoch second
+        firewalls (list, optional): Only list the rules of these firewalls
+
+    Returns:
+        list: [{"rule", "firewalls", "fleet_wide"}] sorted by rule, with
+              firewalls the firewalls the rule had no packets on and
+              fleet_wide True if it had no packets on any firewall
+
+    Only rules that are still in the last counters read from a firewall are
+    listed, so deleted rules are not reported.
+    """
+    current = {}
+    unused = defaultdict(list)
+    hit = set()
+
+    for (firewall, rule), (packets, _) in sorted(
+        rule_hit_totals(username, since, until, firewalls).items()
+    ):
+        if packets:
+            hit.add(rule)
+            continue
+
+        if firewall not in current:
+            counters = read_rule_counters(username, firewall)
+            current[firewall] = counters[1] if counters is not None else {}
+        if rule in current[firewall]:
+            unused[rule].append(firewall)
+
+    return [
+        {"rule": rule, "firewalls": unused[rule], "fleet_wide": rule not in hit}
+        for rule in sorted(unused)
+    ]
+
+
+def _collector_loop():
+    while not _collector_stop.is_set():
+        _collector_wake.clear()
+
+        now = time.monotonic()
+        with _collector_lock:
+            due = [
+                (username, collector["connection_string"], collector["session"])
+                for username, collector in _collectors.items()
+                if collector["next_run"] <= now
+            ]
+
+        for username, connection_string, session in due:
+            if _collector_stop.is_set():
+                break
+            try:
+                results = collect_rule_hits(connection_string, session)
+            except Exception as e:
+                logging.exception(f" |--X Rule counter collection for {username}")
+                results = [{"firewall": None, "status": "error", "message": str(e)}]
+
+            with _collector_lock:
+                if username in _collectors:
+                    _collectors[username]["next_run"] = (
+                        time.monotonic() + _collector_interval()
+                    )
+                _last_collection[username] = {
+                    "time": int(time.time()),
+                    "results": results,
+                }
+
+        with _collector_lock:
+            next_run = min(
+                (collector["next_run"] for collector in _collectors.values()),
+                default=None,
+            )
+
+        _collector_wake.wait(
+            None if next_run is None else max(0.0, next_run - time.monotonic())
+        )
+
+
+def start_rule_hit_collector(connection_string, session):
+    """
+    Starts collecting the rule counters of a user's firewalls, starting the
+    collector if it is not running.
+
+    Args:
+        connection_string (dict): Credentials used for every device
+        session (dict): Session data including username and data directory path
+
+    Returns:
+        None
+
+    The first collection runs immediately.  Starting again replaces the
+    user's credentials.
+    """
+    global _collector_thread
+
+    with _collector_lock:
+        _collectors[session["username"]] = {
+            "connection_string": dict(connection_string),
+            "session": dict(session),
+            "next_run": time.monotonic(),
+        }
+
+    with _collector_thread_lock:
+        if _collector_thread is None or not _collector_thread.is_alive():
+            _collector_stop.clear()
+            _collector_thread = threading.Thread(
+                target=_collector_loop, name="rule-stats-collector", daemon=True
+            )
+            _collector_thread.start()
+            logging.info(" |--> Started rule counter collector")
+
+    _collector_wake.set()
+
+    return
+
+
+def stop_rule_hit_collector(username=None):
+    """
+    Stops collecting the rule counters of a user's firewalls.
+
+    Args:
+        username (str, optional): User to stop collecting for.  Defaults to
+            stopping the collector for every user
+
+    Returns:
+        None
+    """
+    global _collector_thread
+
+    if username is not None:
+        with _collector_lock:
+            _collectors.pop(username, None)
+        return
+
+    with _collector_thread_lock:
+        _collector_stop.set()
+        _collector_wake.set()
+        if _collector_thread is not None:
+            _collector_thread.join()
+            _collector_thread = None
+
+    with _collector_lock:
+        _collectors.clear()
+        _last_collection.clear()
+
+    return
+
+
+def rule_hit_collector_status(username):
+    """
+    Gets the collection status of a user.
+
+    Args:
+        username (str): User to get the status of
+
+    Returns:
+        dict: {"collecting", "time", "results"} with collecting True while
+              the user's firewalls are collected, and the epoch second and
+              device results of the last collection (None and [] before the
+              first one)
+    """
+    with _collector_lock:
+        last = _last_collection.get(username, {})
+
+        return {
+            "collecting": username in _collectors,
+            "time": last.get("time"),
+            "results": list(last.get("results", [])),
+        }
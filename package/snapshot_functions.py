@@ -0,0 +1,572 @@
+"""
+    Snapshot Store Functions
+
+    This module stores firewall snapshots delta-compressed.  Snapshot documents
+    stay in the user's collection next to the current configuration and keep
+    their "firewall", "snapshot" and optional "tag" fields, so they are listed
+    and addressed exactly as before.  Their configuration is stored as either:
+
+    - a keyframe: the full configuration at the top level of the document
+      (the same layout as snapshots written before delta compression), with
+      "keyframe": True
+    - a delta: a JSON Patch (RFC 6902) list of operations under "delta" that
+      turns the previous snapshot of the firewall into this one
+
+    Snapshots of a firewall are ordered by "seq".  A keyframe is written every
+    SNAPSHOT_KEYFRAME_INTERVAL snapshots, and whenever the delta would not be
+    meaningfully smaller than the configuration, so a snapshot is rebuilt from
+    at most one keyframe and a short run of deltas.  Materialized keyframes
+    are kept in a small LRU (see cache_functions.keyframe_cache_get).
+
+    Contains functions for:
+    - Computing and applying JSON Patch deltas between configurations
+    - Reading (reconstructing) a snapshot
+    - Reading (reconstructing) a series of consecutive snapshots in one pass
+    - Writing, tagging and deleting snapshots while keeping later deltas valid
+    - Migrating snapshots stored as full documents to the delta store
+
+    The functions take the MongoDB collection to work on; data_file_functions
+    owns the client and the per-request and process-wide caches.
+"""
+
+import logging
+import os
+
+import bson
+import pymongo
+
+from package.cache_functions import (
+    keyframe_cache_get,
+    keyframe_cache_invalidate,
+    keyframe_cache_set,
+)
+
+# Fields identifying a snapshot document.  They are returned with a snapshot
+#   but are not part of the configuration stored in keyframes and deltas.
+SNAPSHOT_ID_FIELDS = ("_id", "firewall", "snapshot", "tag")
+
+# Fields maintained by the snapshot store, never returned to callers.
+SNAPSHOT_STORE_FIELDS = ("seq", "depth", "keyframe", "delta", "rev", "rev_epoch")
+
+# Number of times write_snapshot re-reads the latest snapshot after a
+#   concurrent writer took the next sequence number.
+SNAPSHOT_WRITE_RETRIES = 5
+
+
+def _keyframe_interval():
+    try:
+        return max(1, int(os.environ.get("SNAPSHOT_KEYFRAME_INTERVAL")))
+    except Exception:
+        return 10
+
+
+def _escape_pointer(key):
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape_pointer(token):
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _same_value(old, new):
+    # bool is an int in Python, but not in BSON.
+    return type(old) is type(new) and old == new
+
+
+def make_patch(old, new, path=""):
+    """
+    Computes the JSON Patch that turns one configuration into another.
+
+    Args:
+        old (dict): Previous configuration
+        new (dict): New configuration
+        path (str, optional): JSON Pointer of old/new within the document.
+            Defaults to "" (the document root).
+
+    Returns:
+        list: JSON Patch operations ("add", "remove" and "replace")
+
+    The function:
+    1. Removes keys that are no longer present
+    2. Recurses into dictionaries present in both, as long as applying the
+       patch keeps the key order of the new configuration (generate_config
+       emits keys in document order); otherwise the dictionary is replaced
+    3. Replaces every other changed value, including lists, as a whole
+    4. Adds new keys in the order they appear in the new configuration
+    """
+    if path == "" and not _keeps_key_order(old, new):
+        return [{"op": "replace", "path": "", "value": new}]
+
+    patch = []
+
+    for key in old:
+        if key not in new:
+            patch.append({"op": "remove", "path": f"{path}/{_escape_pointer(key)}"})
+
+    for key, value in new.items():
+        pointer = f"{path}/{_escape_pointer(key)}"
+        if key not in old:
+            patch.append({"op": "add", "path": pointer, "value": value})
+        elif (
+            isinstance(value, dict)
+            and isinstance(old[key], dict)
+            and _keeps_key_order(old[key], value)
+        ):
+            patch.extend(make_patch(old[key], value, pointer))
+        elif not _same_value(old[key], value):
+            patch.append({"op": "replace", "path": pointer, "value": value})
+
+    return patch
+
+
+def _keeps_key_order(old, new):
+    """
+    Checks whether patching old key by key produces new with its key order:
+    the kept keys must be in the same order, and added keys after them.
+    """
+    kept_old = [key for key in old if key in new]
+    kept_new = [key for key in new if key in old]
+    if kept_old != kept_new:
+        return False
+
+    keys = list(new)
+    return all(key not in old for key in keys[len(kept_new) :])
+
+
+def apply_patch(data, patch):
+    """
+    Applies a JSON Patch produced by make_patch in place.
+
+    Args:
+        data (dict): Configuration to patch
+        patch (list): JSON Patch operations
+
+    Returns:
+        dict: The patched configuration
+
+    Raises:
+        KeyError: If the patch does not apply to the configuration
+    """
+    for operation in patch:
+        if operation["path"] == "":
+            data.clear()
+            data.update(operation["value"])
+            continue
+        tokens = [_unescape_pointer(t) for t in operation["path"].split("/")[1:]]
+        parent = data
+        for token in tokens[:-1]:
+            parent = parent[token]
+
+        if operation["op"] == "remove":
+            del parent[tokens[-1]]
+        elif operation["op"] == "replace":
+            if tokens[-1] not in parent:
+                raise KeyError(operation["path"])
+            parent[tokens[-1]] = operation["value"]
+        else:
+            parent[tokens[-1]] = operation["value"]
+
+    return data
+
+
+def snapshot_content(data):
+    """
+    Gets the configuration part of a snapshot.
+
+    Args:
+        data (dict): Snapshot or firewall document
+
+    Returns:
+        dict: Copy of the document without identifying or store fields
+    """
+    return {
+        key: value
+        for key, value in data.items()
+        if key not in SNAPSHOT_ID_FIELDS and key not in SNAPSHOT_STORE_FIELDS
+    }
+
+
+def _encode(content, previous, depth):
+    """
+    Chooses how to store a snapshot.
+
+    Args:
+        content (dict): Snapshot configuration
+        previous (dict): Configuration of the previous snapshot, or None
+        depth (int): Number of deltas since the last keyframe, including
+            the delta that would be stored for this snapshot
+
+    Returns:
+        dict: Store fields and configuration for the snapshot document
+    """
+    if previous is not None and depth < _keyframe_interval():
+        delta = make_patch(previous, content)
+        if len(bson.encode({"delta": delta})) * 2 < len(bson.encode(content)):
+            return {"depth": depth, "delta": delta}
+
+    return {"depth": 0, "keyframe": True, **content}
+
+
+def _snapshot_document(doc, encoded):
+    """
+    Builds a snapshot document from an existing document's identifying
+    fields and the output of _encode.
+    """
+    new_doc = {"firewall": doc["firewall"], "snapshot": doc["snapshot"]}
+    if "tag" in doc:
+        new_doc["tag"] = doc["tag"]
+    new_doc["seq"] = doc["seq"]
+    new_doc.update(encoded)
+
+    return new_doc
+
+
+def _materialize(collection, doc):
+    """
+    Reconstructs the configuration of a snapshot document.
+
+    Args:
+        collection: MongoDB collection holding the snapshot
+        doc (dict): Snapshot document (at least _id, firewall, seq and
+            either the keyframe configuration or delta)
+
+    Returns:
+        dict: Snapshot configuration
+
+    The function:
+    1. Returns the configuration of keyframes and legacy full documents
+    2. For deltas, finds the nearest keyframe before the snapshot and takes
+       it from the keyframe cache, reading it from MongoDB on a miss
+    3. Reads the deltas after the keyframe in one query and applies them
+    """
+    if "delta" not in doc:
+        return snapshot_content(doc)
+
+    firewall = doc["firewall"]
+    keyframe = collection.find_one(
+        {"firewall": firewall, "keyframe": True, "seq": {"$lt": doc["seq"]}},
+        {"_id": 1, "seq": 1},
+        sort=[("seq", pymongo.DESCENDING)],
+    )
+    if keyframe is None:
+        raise KeyError(f"No keyframe for snapshot {doc['snapshot']} of {firewall}")
+
+    key = (collection.name, str(keyframe["_id"]))
+    content = keyframe_cache_get(key)
+    if content is None:
+        logging.debug("Reading snapshot keyframe from Mongo.")
+        content = snapshot_content(collection.find_one({"_id": keyframe["_id"]}))
+        keyframe_cache_set(key, content)
+
+    logging.debug("Reading snapshot deltas from Mongo.")
+    deltas = collection.find(
+        {"firewall": firewall, "seq": {"$gt": keyframe["seq"], "$lt": doc["seq"]}},
+        {"_id": 0, "delta": 1},
+    ).sort("seq", pymongo.ASCENDING)
+    for delta in deltas:
+        apply_patch(content, delta["delta"])
+
+    return apply_patch(content, doc["delta"])
+
+
+def _neighbour(collection, firewall, seq, later):
+    """
+    Gets the snapshot stored just before or after a sequence number.
+    """
+    if later:
+        query, direction = {"$gt": seq}, pymongo.ASCENDING
+    else:
+        query, direction = {"$lt": seq}, pymongo.DESCENDING
+
+    return collection.find_one(
+        {"firewall": firewall, "seq": query}, sort=[("seq", direction)]
+    )
+
+
+def _rebase(collection, doc, previous):
+    """
+    Re-encodes a delta snapshot against a new previous snapshot.
+
+    Args:
+        collection: MongoDB collection holding the snapshot
+        doc (dict): Snapshot document to re-encode, with its configuration
+            reconstructed under "content"
+        previous (dict): New previous snapshot document, or None
+
+    Returns:
+        None
+    """
+    if previous is None:
+        encoded = _encode(doc["content"], None, 0)
+    else:
+        encoded = _encode(
+            doc["content"],
+            _materialize(collection, previous),
+            previous.get("depth", 0) + 1,
+        )
+    collection.replace_one({"_id": doc["_id"]}, _snapshot_document(doc, encoded))
+    keyframe_cache_invalidate((collection.name, str(doc["_id"])))
+
+    return
+
+
+def read_snapshot(collection, firewall, snapshot):
+    """
+    Reads a snapshot of a firewall.
+
+    Args:
+        collection: MongoDB collection of the user
+        firewall (str): Firewall name
+        snapshot (str): Snapshot name
+
+    Returns:
+        dict: Snapshot configuration with its _id, firewall, snapshot and
+              tag fields, or None if the snapshot does not exist
+    """
+    doc = collection.find_one({"firewall": firewall, "snapshot": snapshot})
+    if doc is None:
+        return None
+
+    user_data = {key: doc[key] for key in SNAPSHOT_ID_FIELDS if key in doc}
+    user_data.update(_materialize(collection, doc))
+
+    return user_data
+
+
+def read_snapshot_series(collection, firewall, last=None):
+    """
+    Reads the snapshots of a firewall in order, reconstructing each once.
+
+    Args:
+        collection: MongoDB collection of the user
+        firewall (str): Firewall name
+        last (int, optional): Only return this many of the latest snapshots.
+            Defaults to None (every snapshot).
+
+    Returns:
+        list: Snapshots, oldest first, each with its configuration and its
+              _id, firewall, snapshot and tag fields
+
+    The function:
+    1. Reads the snapshot documents newest first in one query, stopping as
+       soon as it holds the requested snapshots and the keyframe the oldest
+       of them is rebuilt from
+    2. Replays the documents oldest first, applying each delta to the
+       configuration of the snapshot before it, so no snapshot is rebuilt
+       from its keyframe separately
+    """
+    cursor = collection.find(
+        {"firewall": firewall, "snapshot": {"$exists": True}}
+    ).sort([("seq", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+
+    logging.debug("Reading snapshot series from Mongo.")
+    docs = []
+    for doc in cursor:
+        docs.append(doc)
+        if last is not None and len(docs) >= last and "delta" not in doc:
+            break
+    cursor.close()
+
+    series = []
+    content = None
+    for doc in reversed(docs):
+        if "delta" in doc:
+            if content is None:
+                raise KeyError(
+                    f"No keyframe for snapshot {doc['snapshot']} of {firewall}"
+                )
+            content = apply_patch(content, doc["delta"])
+        else:
+            content = snapshot_content(doc)
+
+        snapshot = {key: doc[key] for key in SNAPSHOT_ID_FIELDS if key in doc}
+        # The configuration is patched in place by the next delta
+        snapshot.update(bson.decode(bson.encode(content)))
+        series.append(snapshot)
+
+    if last is not None:
+        return series[-last:] if last > 0 else []
+
+    return series
+
+
+def write_snapshot(collection, firewall, snapshot, data):
+    """
+    Writes a snapshot of a firewall.
+
+    Args:
+        collection: MongoDB collection of the user
+        firewall (str): Firewall name
+        snapshot (str): Snapshot name
+        data (dict): Configuration to store, optionally with a "tag"
+
+    Returns:
+        None
+
+    The function:
+    1. Appends a new snapshot after the latest one, stored as a delta
+       against it or as a keyframe
+    2. Replaces the configuration of an existing snapshot in place,
+       re-encoding the following snapshot when it is a delta against it
+    3. Rewrites legacy full snapshot documents in place as full documents;
+       migrate_snapshots moves them to the delta store
+    """
+    content = snapshot_content(data)
+    existing = collection.find_one(
+        {"firewall": firewall, "snapshot": snapshot},
+        {"_id": 1, "firewall": 1, "snapshot": 1, "tag": 1, "seq": 1},
+    )
+    doc = existing or {"firewall": firewall, "snapshot": snapshot}
+    if "tag" in data:
+        doc["tag"] = data["tag"]
+
+    if existing is None:
+        # The unique (firewall, seq) index rejects a sequence number taken by
+        #   a concurrent writer; re-read the latest snapshot and encode
+        #   against it again.
+        for attempt in range(SNAPSHOT_WRITE_RETRIES):
+            latest = collection.find_one(
+                {"firewall": firewall, "seq": {"$exists": True}},
+                sort=[("seq", pymongo.DESCENDING)],
+            )
+            if latest is None:
+                doc["seq"] = 1
+                encoded = _encode(content, None, 0)
+            else:
+                doc["seq"] = latest["seq"] + 1
+                encoded = _encode(
+                    content,
+                    _materialize(collection, latest),
+                    latest.get("depth", 0) + 1,
+                )
+            logging.debug("Writing snapshot to Mongo.")
+            try:
+                collection.insert_one(_snapshot_document(doc, encoded))
+                return
+            except pymongo.errors.DuplicateKeyError:
+                if attempt == SNAPSHOT_WRITE_RETRIES - 1:
+                    raise
+                logging.debug(f"Snapshot sequence {doc['seq']} taken, retrying.")
+
+    if "seq" not in existing:
+        logging.debug("Writing legacy snapshot to Mongo.")
+        collection.replace_one({"_id": doc.pop("_id")}, {**doc, **content})
+        return
+
+    # Replacing a snapshot in the middle of the series: the next snapshot
+    #   is re-encoded against the new configuration.
+    following = _neighbour(collection, firewall, doc["seq"], later=True)
+    if following is not None and "delta" in following:
+        following["content"] = _materialize(collection, following)
+
+    doc["content"] = content
+    _rebase(collection, doc, _neighbour(collection, firewall, doc["seq"], later=False))
+
+    if following is not None and "delta" in following:
+        _rebase(collection, following, collection.find_one({"_id": doc["_id"]}))
+
+    return
+
+
+def tag_snapshot_document(collection, firewall, snapshot, tag):
+    """
+    Sets the tag of a snapshot without rewriting its configuration.
+
+    Returns:
+        bool: True if the snapshot exists
+    """
+    result = collection.update_one(
+        {"firewall": firewall, "snapshot": snapshot}, {"$set": {"tag": tag}}
+    )
+
+    return result.matched_count > 0
+
+
+def delete_snapshot(collection, firewall, snapshot):
+    """
+    Deletes a snapshot of a firewall.
+
+    Args:
+        collection: MongoDB collection of the user
+        firewall (str): Firewall name
+        snapshot (str): Snapshot name
+
+    Returns:
+        int: Number of documents deleted
+
+    The next snapshot is re-encoded first when it is a delta against the
+    deleted one, either as a delta against the snapshot before or as a
+    keyframe.
+    """
+    doc = collection.find_one(
+        {"firewall": firewall, "snapshot": snapshot},
+        {"_id": 1, "seq": 1, "keyframe": 1},
+    )
+    if doc is None:
+        return 0
+
+    if "seq" in doc:
+        following = _neighbour(collection, firewall, doc["seq"], later=True)
+        if following is not None and "delta" in following:
+            following["content"] = _materialize(collection, following)
+            _rebase(
+                collection,
+                following,
+                _neighbour(collection, firewall, doc["seq"], later=False),
+            )
+
+    keyframe_cache_invalidate((collection.name, str(doc["_id"])))
+
+    return collection.delete_one({"_id": doc["_id"]}).deleted_count
+
+
+def migrate_snapshots(collection):
+    """
+    Moves the snapshots of a collection to the delta store.
+
+    Args:
+        collection: MongoDB collection of the user
+
+    Returns:
+        int: Number of snapshot documents rewritten
+
+    The function:
+    1. Finds firewalls with snapshots stored as full documents (no "seq")
+    2. Reconstructs every snapshot of such a firewall in creation order
+    3. Rewrites the series with consecutive sequence numbers above the
+       highest one already stored, as keyframes and deltas
+
+    Numbering above the highest stored sequence number keeps every number
+    unique while the series is rewritten, even when snapshots already in the
+    delta store are mixed with legacy ones (e.g. written by an older
+    replica).  Firewalls whose snapshots are all in the delta store are left
+    alone, so the migration can be run on every start.
+    """
+    migrated = 0
+    firewalls = collection.distinct(
+        "firewall", {"snapshot": {"$exists": True}, "seq": {"$exists": False}}
+    )
+    for firewall in firewalls:
+        logging.info(f" |--> Migrating snapshots of {collection.name}/{firewall}.")
+        docs = list(
+            collection.find({"firewall": firewall, "snapshot": {"$exists": True}}).sort(
+                "_id", pymongo.ASCENDING
+            )
+        )
+        for doc in docs:
+            doc["content"] = _materialize(collection, doc)
+        last_seq = max((doc["seq"] for doc in docs if "seq" in doc), default=0)
+
+        previous, depth = None, 0
+        for seq, doc in enumerate(docs, start=last_seq + 1):
+            doc["seq"] = seq
+            encoded = _encode(doc["content"], previous, depth + 1)
+            depth = encoded["depth"]
+            previous = doc["content"]
+            collection.replace_one(
+                {"_id": doc["_id"]}, _snapshot_document(doc, encoded)
+            )
+            keyframe_cache_invalidate((collection.name, str(doc["_id"])))
+            migrated += 1
+
+    return migrated
@@ -54,7 +54,10 @@ def example_user_data():
 
 @pytest.fixture
 def mock_read_write(monkeypatch):
-    """Factory fixture that patches read_user_data_file/write_user_data_file for a module.
+    """Factory fixture that patches read_user_data_file, write_user_data_file,
+    update_user_data_file and mutate_user_data_file for a module.  Field-level
+    updates are applied to the captured data so written_data always holds the
+    resulting document; the raw update arguments are kept in capture.updates.
 
     Usage:
         capture = mock_read_write("package.chain_functions", initial_data)
@@ -68,6 +71,7 @@ def mock_read_write(monkeypatch):
             self.written_data = None
             self.written_filename = None
             self.written_snapshot = None
+            self.updates = []
 
         def read(self, *args, **kwargs):
             return copy.deepcopy(self.data)
@@ -78,10 +82,29 @@ def mock_read_write(monkeypatch):
             self.written_snapshot = snapshot
             self.data = copy.deepcopy(data)
 
+        def update(self, filename, **fields):
+            from package.data_file_functions import apply_user_data_update
+
+            self.updates.append(copy.deepcopy(fields))
+            data = apply_user_data_update(copy.deepcopy(self.data), **fields)
+            self.write(filename, data)
+            return True
+
+        def mutate(self, filename, build_update, retries=None):
+            fields = build_update(copy.deepcopy(self.data))
+            if fields is None:
+                return False
+            return self.update(filename, **fields)
+
     def _factory(module_path, initial_data):
         capture = Capture(initial_data)
-        monkeypatch.setattr(f"{module_path}.read_user_data_file", capture.read)
-        monkeypatch.setattr(f"{module_path}.write_user_data_file", capture.write)
+        for name, replacement in [
+            ("read_user_data_file", capture.read),
+            ("write_user_data_file", capture.write),
+            ("update_user_data_file", capture.update),
+            ("mutate_user_data_file", capture.mutate),
+        ]:
+            monkeypatch.setattr(f"{module_path}.{name}", replacement, raising=False)
         return capture
 
     return _factory
@@ -202,3 +225,23 @@ def auth_client(flask_app):
         sess["ssh_pass"] = ""  # nosec
         sess["ssh_keyname"] = ""
     return test_client
+
+
+@pytest.fixture
+def fake_napalm():
+    """Patches the NAPALM VyOS driver with tests/fake_napalm.FakeVyOSDriver
+    and empties the connection pool around the test."""
+    from unittest.mock import patch
+
+    from package.connection_pool_functions import napalm_pool_clear
+    from tests.fake_napalm import FakeVyOSDriver
+
+    FakeVyOSDriver.reset()
+    napalm_pool_clear()
+    with patch(
+        "package.napalm_ssh_functions.get_network_driver",
+        return_value=FakeVyOSDriver,
+    ):
+        yield FakeVyOSDriver
+    napalm_pool_clear()
+    FakeVyOSDriver.reset()
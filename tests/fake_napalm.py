@@ -0,0 +1,140 @@
+"""
+Local fake of the NAPALM VyOS driver for tests.
+
+FakeVyOSDriver records what each device is asked to do and answers from
+per-hostname behaviour set in FakeVyOSDriver.devices:
+
+    FakeVyOSDriver.devices["10.0.0.1"] = {
+        "diff": "+set firewall ...",   # compare_config() result
+        "commit": None,                # commit_config() result
+        "running": "set firewall ...", # running configuration commands
+        "delay": 0.2,                  # seconds open() blocks
+        "error": Exception("refused"), # raised by open()
+    }
+
+Like the real driver, get_config() returns the running configuration in
+the curly-brace format of 'show'; the set commands are only served by
+device.send_command("show configuration commands ...").
+
+Use the fake_napalm fixture from conftest.py, which patches
+get_network_driver and resets the recorded state.
+"""
+
+import shlex
+import threading
+import time
+
+
+def _hierarchical(commands):
+    """Renders set commands in the curly-brace format of 'show'."""
+    tree = {}
+    for line in commands.splitlines():
+        tokens = shlex.split(line)
+        if tokens[:1] != ["set"]:
+            continue
+        node = tree
+        for token in tokens[1:]:
+            node = node.setdefault(token, {})
+
+    def render(node, depth):
+        lines = []
+        for token, children in node.items():
+            indent = "    " * depth
+            if not children:
+                lines.append(f"{indent}{token}")
+            elif all(not grandchild for grandchild in children.values()):
+                lines += [f"{indent}{token} {value}" for value in children]
+            else:
+                lines += [f"{indent}{token} {{", *render(children, depth + 1)]
+                lines.append(f"{indent}}}")
+        return lines
+
+    return "\n".join(render(tree, 0)) + "\n"
+
+
+class FakeNetmikoConnection:
+    def __init__(self, driver):
+        self.driver = driver
+        self.commands = []
+
+    def send_command(self, command):
+        self.commands.append(command)
+        if command.startswith("show configuration commands"):
+            return self.driver._behaviour().get("running", "")
+        return ""
+
+
+class FakeVyOSDriver:
+    devices = {}
+    opened = []
+    committed = []
+    candidates = {}
+    active = 0
+    max_active = 0
+    _lock = threading.Lock()
+
+    def __init__(self, hostname, username, password, optional_args=None):
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.optional_args = optional_args or {}
+        self.netmiko_optional_args = {"port": self.optional_args.get("port")}
+        self.candidate = None
+        self.device = FakeNetmikoConnection(self)
+
+    @classmethod
+    def reset(cls):
+        cls.devices = {}
+        cls.opened = []
+        cls.committed = []
+        cls.candidates = {}
+        cls.active = 0
+        cls.max_active = 0
+
+    def _behaviour(self):
+        return self.devices.get(self.hostname, {})
+
+    def open(self):
+        cls = type(self)
+        with cls._lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            time.sleep(self._behaviour().get("delay", 0))
+            if "error" in self._behaviour():
+                raise self._behaviour()["error"]
+            with cls._lock:
+                cls.opened.append(self.hostname)
+        finally:
+            with cls._lock:
+                cls.active -= 1
+
+    def close(self):
+        pass
+
+    def is_alive(self):
+        return {"is_alive": True}
+
+    def get_config(self, retrieve="all"):
+        return {
+            "running": _hierarchical(self._behaviour().get("running", "")),
+            "candidate": "",
+            "startup": "",
+        }
+
+    def load_merge_candidate(self, filename=None, config=None):
+        with open(filename) as f:
+            self.candidate = f.read()
+        type(self).candidates[self.hostname] = self.candidate
+
+    def compare_config(self):
+        return self._behaviour().get("diff", "")
+
+    def commit_config(self):
+        with type(self)._lock:
+            type(self).committed.append(self.hostname)
+        self.candidate = None
+        return self._behaviour().get("commit")
+
+    def discard_config(self):
+        self.candidate = None
@@ -4,12 +4,34 @@ Tests Flask routes using the real app with mocked package-level functions.
 Templates render for real to catch variable mismatches.
 """
 
+import json
 import os
+import time
 from unittest.mock import Mock, patch
 
 import pytest
 
 
+@pytest.fixture(autouse=True)
+def no_reachability_probes():
+    """Routes that select a firewall register it with the reachability
+    monitor; keep the tests from probing the network."""
+    with patch("app.check_reachability", return_value=None):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def builtin_collection_profiles():
+    """The push page lists the user's collection profiles; serve the
+    built-in ones without the profile store."""
+    from package.collection_functions import DEFAULT_COLLECTION_PROFILES
+
+    with patch(
+        "app.list_collection_profiles", return_value=DEFAULT_COLLECTION_PROFILES
+    ):
+        yield
+
+
 # ---------------------------------------------------------------------------
 # Login-required guard
 # ---------------------------------------------------------------------------
@@ -633,6 +655,14 @@ class TestConfigRoutes:
             resp = auth_client.get("/display_config")
             assert resp.status_code == 200
 
+    def test_display_config_lists_snapshots_once(self, auth_client):
+        with patch(
+            "app.generate_config",
+            return_value=("config output", ["line1"]),
+        ), patch("app.list_snapshots", return_value=[]) as mock_list:
+            auth_client.get("/display_config")
+            assert mock_list.call_count == 1
+
     def test_display_config_no_firewall(self, flask_app):
         test_client = flask_app.test_client()
         with test_client.session_transaction() as sess:
@@ -648,11 +678,12 @@ class TestConfigRoutes:
 
     def test_download_config(self, auth_client):
         with patch(
-            "app.generate_config",
-            return_value=("line1<br>line2", ["line1", "line2"]),
+            "app.iter_config_text",
+            return_value=iter(["line1\n", "line2\n"]),
         ):
             resp = auth_client.get("/download_config")
             assert resp.status_code == 200
+            assert resp.mimetype == "text/plain"
             assert b"line1\nline2" in resp.data
 
     def test_download_json(self, auth_client):
@@ -663,6 +694,11 @@ class TestConfigRoutes:
             resp = auth_client.get("/download_json")
             assert resp.status_code == 200
 
+    def test_cache_stats(self, auth_client):
+        resp = auth_client.get("/cache_stats")
+        assert resp.status_code == 200
+        assert set(resp.get_json()) >= {"hits", "misses", "entries", "bytes"}
+
     def test_create_config_valid(self, auth_client):
         with patch("app.write_user_data_file") as mock_write:
             resp = auth_client.post(
@@ -703,6 +739,19 @@ class TestConfigRoutes:
             assert resp.status_code == 302
             mock_write.assert_called_once()
 
+    def test_select_firewall_config_snapshot_restore(self, auth_client):
+        with patch("app.restore_snapshot", return_value=True) as mock_restore, patch(
+            "app.get_system_name", return_value=("192.168.1.1", "22")
+        ):
+            resp = auth_client.post(
+                "/select_firewall_config",
+                data={"file": "my_fw/01-01-2025 10:00:00"},
+            )
+            assert resp.status_code == 302
+            mock_restore.assert_called_once_with(
+                "data/testuser/my_fw", "01-01-2025 10:00:00"
+            )
+
     def test_select_firewall_config_snapshot_delete(self, auth_client):
         with patch("app.read_user_data_file"), patch(
             "app.delete_user_data_file"
@@ -790,6 +839,17 @@ class TestConfigRoutes:
             resp = auth_client.get("/configuration_push")
             assert resp.status_code == 200
 
+    def test_configuration_push_get_not_probed_yet(self, auth_client):
+        with patch(
+            "app.generate_config",
+            return_value=("config", ["line"]),
+        ), patch("app.test_connection", return_value=None), patch(
+            "app.list_user_keys", return_value=[]
+        ):
+            resp = auth_client.get("/configuration_push")
+            assert resp.status_code == 200
+            assert b"status-indicator checking" in resp.data
+
     def test_configuration_push_get_hostname_none(self, flask_app):
         test_client = flask_app.test_client()
         with test_client.session_transaction() as sess:
@@ -816,10 +876,10 @@ class TestConfigRoutes:
         with patch(
             "app.generate_config",
             return_value=("config", ["line"]),
-        ), patch("app.write_user_command_conf_file"), patch(
-            "app.commit_to_firewall",
-            return_value="Commit successful",
-        ) as mock_commit, patch(
+        ), patch("app.iter_config", return_value=iter([])), patch(
+            "app.submit_device_job",
+            return_value="job1",
+        ) as mock_submit, patch(
             "app.list_user_keys", return_value=[]
         ):
             resp = auth_client.post(
@@ -831,16 +891,19 @@ class TestConfigRoutes:
                 },
             )
             assert resp.status_code == 200
-            mock_commit.assert_called_once()
+            assert b'data-job-id="job1"' in resp.data
+            args = mock_submit.call_args.args
+            assert args[0] == "Commit"
+            assert args[1]["password"] == "vyos"  # nosec
 
     def test_configuration_push_post_view_diffs(self, auth_client):
         with patch(
             "app.generate_config",
             return_value=("config", ["line"]),
-        ), patch("app.write_user_command_conf_file"), patch(
-            "app.get_diffs_from_firewall",
-            return_value="diff output",
-        ) as mock_diffs, patch(
+        ), patch("app.iter_config", return_value=iter([])) as mock_iter, patch(
+            "app.submit_device_job",
+            return_value="job1",
+        ) as mock_submit, patch(
             "app.list_user_keys", return_value=[]
         ):
             resp = auth_client.post(
@@ -849,10 +912,135 @@ class TestConfigRoutes:
                     "username": "vyos",
                     "password": "vyos",
                     "action": "View Diffs",
+                    "delta_push": "true",
+                    "delete_before_set": "true",
                 },
             )
             assert resp.status_code == 200
-            mock_diffs.assert_called_once()
+            assert mock_submit.call_args.args[0] == "View Diffs"
+            kwargs = mock_submit.call_args.kwargs
+            assert kwargs["delta"] is True
+            assert kwargs["delete"] is True
+            assert kwargs["command_list"] is mock_iter.return_value
+
+    def test_configuration_push_post_op_command(self, auth_client):
+        with patch(
+            "app.submit_device_job",
+            return_value="job1",
+        ) as mock_submit, patch(
+            "app.list_user_keys", return_value=[]
+        ):
+            resp = auth_client.post(
+                "/configuration_push",
+                data={
+                    "username": "vyos",
+                    "password": "vyos",
+                    "action": "Run Operational Command",
+                    "op_command": "show firewall",
+                },
+            )
+            assert resp.status_code == 200
+            args = mock_submit.call_args.args
+            assert args[0] == "Run Operational Command"
+            assert args[3] == "show firewall"
+
+    def test_configuration_push_post_collection_profile(self, auth_client):
+        with patch("app.iter_config", return_value=iter([])), patch(
+            "app.get_collection_profile",
+            return_value=["show firewall", "show interfaces"],
+        ) as mock_profile, patch(
+            "app.submit_device_job",
+            return_value="job1",
+        ) as mock_submit, patch(
+            "app.list_user_keys", return_value=[]
+        ):
+            resp = auth_client.post(
+                "/configuration_push",
+                data={
+                    "username": "vyos",
+                    "password": "vyos",
+                    "action": "Run Collection Profile",
+                    "profile_name": "Firewall Overview",
+                },
+            )
+            assert resp.status_code == 200
+            assert b'data-job-id="job1"' in resp.data
+            assert mock_profile.call_args.args[1] == "Firewall Overview"
+            args = mock_submit.call_args.args
+            assert args[0] == "Run Collection Profile"
+            assert args[3] == ["show firewall", "show interfaces"]
+
+    def test_configuration_push_post_unknown_profile(self, auth_client):
+        with patch("app.iter_config", return_value=iter([])), patch(
+            "app.get_collection_profile", return_value=None
+        ), patch(
+            "app.submit_device_job"
+        ) as mock_submit:
+            resp = auth_client.post(
+                "/configuration_push",
+                data={
+                    "username": "vyos",
+                    "password": "vyos",
+                    "action": "Run Collection Profile",
+                    "profile_name": "Missing",
+                },
+            )
+            assert resp.status_code == 302
+            assert "/configuration_push" in resp.headers["Location"]
+            mock_submit.assert_not_called()
+
+    def test_collection_profile_save(self, auth_client):
+        with patch("app.save_collection_profile") as mock_save:
+            resp = auth_client.post(
+                "/collection_profile_save",
+                data={"profile_name": "Routes", "profile_commands": "show ip route"},
+            )
+            assert resp.status_code == 302
+            assert "/configuration_push" in resp.headers["Location"]
+            mock_save.assert_called_once()
+
+    def test_collection_profile_delete(self, auth_client):
+        with patch("app.delete_collection_profile") as mock_delete:
+            resp = auth_client.post(
+                "/collection_profile_delete", data={"profile_name": "Routes"}
+            )
+            assert resp.status_code == 302
+            assert "/configuration_push" in resp.headers["Location"]
+            mock_delete.assert_called_once()
+
+    def test_device_job(self, auth_client):
+        job = {"id": "job1", "status": "done", "message": "ok"}
+        with patch("app.get_device_job", return_value=job) as mock_get:
+            resp = auth_client.get("/device_job/job1")
+            assert resp.status_code == 200
+            assert resp.get_json() == job
+            mock_get.assert_called_once_with("job1", "testuser")
+
+    def test_device_job_not_found(self, auth_client):
+        with patch("app.get_device_job", return_value=None):
+            resp = auth_client.get("/device_job/job1")
+            assert resp.status_code == 404
+
+    def test_configuration_push_post_streams_conf_file(self, auth_client):
+        with patch("app.iter_config", return_value=iter(["line"])), patch(
+            "app.submit_device_job",
+            return_value="job1",
+        ) as mock_submit, patch(
+            "app.list_user_keys", return_value=[]
+        ):
+            resp = auth_client.post(
+                "/configuration_push",
+                data={
+                    "username": "vyos",
+                    "password": "vyos",
+                    "action": "Commit",
+                    "delete_before_set": "on",
+                },
+            )
+            assert resp.status_code == 200
+            kwargs = mock_submit.call_args.kwargs
+            assert list(kwargs["command_list"]) == ["line"]
+            assert kwargs["delete"] is True
 
     def test_snapshot_diff_choose(self, auth_client):
         with patch(
@@ -871,6 +1059,32 @@ class TestConfigRoutes:
                 data={"snapshot_1": "snap1", "snapshot_2": "snap2"},
             )
             assert resp.status_code == 200
+            assert b'name="view" value="text"' in resp.data
+
+    def test_snapshot_diff_display_text_view(self, auth_client):
+        with patch(
+            "app.process_diff", return_value="<div>diff</div>"
+        ):
+            resp = auth_client.post(
+                "/snapshot_diff_display",
+                data={"snapshot_1": "snap1", "snapshot_2": "snap2", "view": "text"},
+            )
+            assert resp.status_code == 200
+            assert b'name="view" value="structural"' in resp.data
+
+    def test_snapshot_timeline(self, auth_client):
+        steps = [{"from": "snap1", "to": "snap2", "added": 1}]
+        with patch("app.snapshot_timeline", return_value=steps) as mock_timeline:
+            resp = auth_client.get("/snapshot_timeline?last=1000")
+            assert resp.status_code == 200
+            assert resp.get_json() == {"firewall": "test_firewall", "steps": steps}
+            assert mock_timeline.call_args.kwargs == {"last": 500}
+
+    def test_snapshot_timeline_no_firewall(self, auth_client):
+        with auth_client.session_transaction() as sess:
+            sess.pop("firewall_name")
+        resp = auth_client.get("/snapshot_timeline")
+        assert resp.status_code == 400
 
     def test_snapshot_diff_display_same_snapshots(self, auth_client):
         resp = auth_client.post(
@@ -881,6 +1095,310 @@ class TestConfigRoutes:
         assert "/snapshot_diff_choose" in resp.headers["Location"]
 
 
+    def test_operational_command_stream_post(self, auth_client):
+        events = iter([("output", "rule 10\n"), ("done", "")])
+        with patch(
+            "app.stream_operational_command", return_value=events
+        ) as mock_stream:
+            resp = auth_client.post(
+                "/operational_command_stream",
+                data={
+                    "username": "vyos",
+                    "password": "vyos",
+                    "op_command": "show firewall",
+                },
+            )
+            assert resp.status_code == 200
+            assert resp.mimetype == "text/event-stream"
+            assert resp.get_data(as_text=True) == (
+                "event: output\ndata: rule 10\ndata: \n\nevent: done\ndata: \n\n"
+            )
+            args = mock_stream.call_args.args
+            assert args[0]["username"] == "vyos"
+            assert args[2] == "show firewall"
+
+    def test_operational_command_stream_post_ssh_key(self, auth_client):
+        with patch(
+            "app.stream_operational_command", return_value=iter([])
+        ) as mock_stream:
+            resp = auth_client.post(
+                "/operational_command_stream",
+                data={
+                    "username": "vyos",
+                    "password": "passphrase",
+                    "ssh_key_name": "fw_key.key",
+                    "op_command": "monitor log",
+                },
+            )
+            assert resp.status_code == 200
+            assert mock_stream.call_args.args[0]["ssh_key_name"] == "fw_key.key"
+
+    def test_operational_command_stream_rejects_get(self, auth_client):
+        with auth_client.session_transaction() as sess:
+            sess["ssh_user"] = "vyos"
+            sess["ssh_pass"] = "vyos"  # nosec
+        with patch("app.stream_operational_command") as mock_stream:
+            resp = auth_client.get(
+                "/operational_command_stream?op_command=show+firewall"
+            )
+            assert resp.status_code == 405
+            mock_stream.assert_not_called()
+
+    def test_operational_command_stream_requires_credentials(self, auth_client):
+        # Credentials cached in the session are not used
+        with auth_client.session_transaction() as sess:
+            sess["ssh_user"] = "vyos"
+            sess["ssh_pass"] = "vyos"  # nosec
+        with patch("app.stream_operational_command") as mock_stream:
+            resp = auth_client.post(
+                "/operational_command_stream",
+                data={"op_command": "show firewall"},
+            )
+            assert resp.status_code == 400
+            mock_stream.assert_not_called()
+
+    def test_firewall_reachability(self, auth_client):
+        with patch("app.check_reachability", return_value=True) as mock_check:
+            resp = auth_client.get("/firewall_reachability")
+            assert resp.status_code == 200
+            assert resp.get_json() == {
+                "hostname": "192.168.1.1",
+                "port": "22",
+                "reachable": True,
+            }
+            mock_check.assert_called_once_with("192.168.1.1", "22")
+
+    def test_firewall_reachability_no_hostname(self, auth_client):
+        with auth_client.session_transaction() as sess:
+            sess["hostname"] = "None"
+        with patch("app.check_reachability") as mock_check:
+            resp = auth_client.get("/firewall_reachability")
+            assert resp.get_json()["reachable"] is None
+            mock_check.assert_not_called()
+
+    def test_fleet_push_get(self, auth_client):
+        targets = [
+            {
+                "firewall": "fw_a",
+                "hostname": "10.0.0.1",
+                "port": "22",
+                "configured": True,
+            }
+        ]
+        with patch("app.list_fleet_targets", return_value=targets), patch(
+            "app.list_user_keys", return_value=[]
+        ):
+            resp = auth_client.get("/fleet_push")
+            assert resp.status_code == 200
+            assert b"10.0.0.1:22" in resp.data
+
+    def test_fleet_push_post_streams_results(self, auth_client):
+        results = [
+            {"firewall": "fw_b", "status": "ok", "message": "diff"},
+            {"firewall": "fw_a", "status": "error", "message": "refused"},
+        ]
+        with patch("app.fleet_push", return_value=iter(results)) as mock_push:
+            resp = auth_client.post(
+                "/fleet_push",
+                data={
+                    "username": "vyos",
+                    "password": "vyos",
+                    "firewalls": ["fw_a", "fw_b"],
+                    "action": "Commit",
+                },
+            )
+            assert resp.status_code == 200
+            assert resp.mimetype == "application/x-ndjson"
+            lines = resp.get_data(as_text=True).splitlines()
+            assert [json.loads(line) for line in lines] == results
+            args = mock_push.call_args.args
+            assert args[0] == {"username": "vyos", "password": "vyos"}
+            assert args[2:] == (["fw_a", "fw_b"], "Commit")
+
+    def test_fleet_push_post_requires_firewalls(self, auth_client):
+        with patch("app.fleet_push") as mock_push:
+            resp = auth_client.post(
+                "/fleet_push",
+                data={"username": "vyos", "password": "vyos", "action": "Commit"},
+            )
+            assert resp.status_code == 302
+            assert "/fleet_push" in resp.headers["Location"]
+            mock_push.assert_not_called()
+
+    def test_rule_hits_get(self, auth_client):
+        ranked = [
+            {
+                "firewall": "fw_a",
+                "rule": "ipv4 name WAN_IN rule 10",
+                "packets": 1234567,
+                "bytes": 89,
+            }
+        ]
+        unused = [
+            {
+                "rule": "ipv4 name WAN_IN rule 20",
+                "firewalls": ["fw_a", "fw_b"],
+                "fleet_wide": True,
+            }
+        ]
+        status = {"collecting": True, "time": 1700000000, "results": []}
+        with patch(
+            "app.rank_rules_by_hits", return_value=ranked
+        ) as mock_rank, patch(
+            "app.never_hit_rules", return_value=unused
+        ), patch(
+            "app.rule_hit_collector_status", return_value=status
+        ), patch(
+            "app.list_user_keys", return_value=[]
+        ):
+            resp = auth_client.get("/rule_hits?hours=168")
+            assert resp.status_code == 200
+            assert b"1,234,567" in resp.data
+            assert b"All firewalls: fw_a, fw_b" in resp.data
+            assert b"Collecting." in resp.data
+            username, since = mock_rank.call_args.args
+            assert username == "testuser"
+            assert abs(time.time() - 168 * 3600 - since) < 60
+
+    def test_rule_hits_post_start(self, auth_client):
+        with patch("app.start_rule_hit_collector") as mock_start:
+            resp = auth_client.post(
+                "/rule_hits",
+                data={
+                    "username": "vyos",
+                    "password": "vyos",
+                    "action": "Start Collecting",
+                },
+            )
+            assert resp.status_code == 302
+            assert "/rule_hits" in resp.headers["Location"]
+            connection_string, device_session = mock_start.call_args.args
+            assert connection_string == {"username": "vyos", "password": "vyos"}
+            assert device_session["username"] == "testuser"
+
+    def test_rule_hits_post_stop(self, auth_client):
+        with patch("app.stop_rule_hit_collector") as mock_stop:
+            resp = auth_client.post(
+                "/rule_hits", data={"action": "Stop Collecting"}
+            )
+            assert resp.status_code == 302
+            mock_stop.assert_called_once_with("testuser")
+
+    def test_configuration_import_get(self, auth_client):
+        with patch("app.list_user_keys", return_value=["fw_key"]):
+            resp = auth_client.get("/configuration_import")
+            assert resp.status_code == 200
+            assert b"Fetch from Router" in resp.data
+            assert b"fw_key.key" in resp.data
+
+    def test_configuration_import_paste(self, auth_client):
+        with patch("app.import_firewall_config") as mock_import, patch(
+            "app.get_system_name", return_value=("None", "None")
+        ), patch("app.fetch_firewall_commands") as mock_fetch:
+            resp = auth_client.post(
+                "/configuration_import",
+                data={
+                    "config_name": "imported",
+                    "action": "Import Commands",
+                    "config_commands": "set firewall a\nset firewall b",
+                },
+            )
+            assert resp.status_code == 302
+            assert "/display_config" in resp.headers["Location"]
+            args = mock_import.call_args.args
+            assert args[1:] == (
+                "imported",
+                ["set firewall a", "set firewall b"],
+                None,
+                None,
+                False,
+            )
+            mock_fetch.assert_not_called()
+        with auth_client.session_transaction() as sess:
+            assert sess["firewall_name"] == "imported"
+
+    def test_configuration_import_fetch(self, auth_client):
+        with patch("app.import_firewall_config") as mock_import, patch(
+            "app.get_system_name", return_value=("10.0.0.1", "2222")
+        ), patch(
+            "app.fetch_firewall_commands", return_value=["set firewall a"]
+        ) as mock_fetch:
+            resp = auth_client.post(
+                "/configuration_import",
+                data={
+                    "config_name": "imported",
+                    "action": "Fetch from Router",
+                    "hostname": "10.0.0.1",
+                    "port": "2222",
+                    "username": "vyos",
+                    "password": "vyos",
+                    "ssh_key_name": "",
+                },
+            )
+            assert resp.status_code == 302
+            assert mock_fetch.call_args.args[0] == {
+                "hostname": "10.0.0.1",
+                "username": "vyos",
+                "password": "vyos",
+                "port": "2222",
+            }
+            args = mock_import.call_args.args
+            assert args[1:] == (
+                "imported",
+                ["set firewall a"],
+                "10.0.0.1",
+                "2222",
+                False,
+            )
+        with auth_client.session_transaction() as sess:
+            assert sess["hostname"] == "10.0.0.1"
+
+    def test_configuration_import_fetch_error(self, auth_client):
+        with patch("app.import_firewall_config") as mock_import, patch(
+            "app.fetch_firewall_commands", side_effect=Exception("refused")
+        ):
+            resp = auth_client.post(
+                "/configuration_import",
+                data={
+                    "config_name": "imported",
+                    "action": "Fetch from Router",
+                    "hostname": "10.0.0.1",
+                    "port": "22",
+                    "username": "vyos",
+                    "password": "vyos",
+                },
+            )
+            assert resp.status_code == 302
+            assert "/configuration_import" in resp.headers["Location"]
+            mock_import.assert_not_called()
+
+    def test_configuration_import_existing_name(self, auth_client):
+        with patch(
+            "app.import_firewall_config", return_value=False
+        ) as mock_import, patch("app.get_system_name") as mock_system:
+            resp = auth_client.post(
+                "/configuration_import",
+                data={
+                    "config_name": "test_firewall",
+                    "action": "Import Commands",
+                    "config_commands": "set firewall a",
+                    "overwrite": "true",
+                },
+            )
+            assert resp.status_code == 302
+            assert "/configuration_import" in resp.headers["Location"]
+            assert mock_import.call_args.args[-1] is True
+            mock_system.assert_not_called()
+
+    def test_configuration_import_requires_name(self, auth_client):
+        with patch("app.import_firewall_config") as mock_import:
+            resp = auth_client.post(
+                "/configuration_import",
+                data={"config_name": " ", "config_commands": "set firewall a"},
+            )
+            assert resp.status_code == 302
+            mock_import.assert_not_called()
+
 # ---------------------------------------------------------------------------
 # Admin routes
 # ---------------------------------------------------------------------------
@@ -0,0 +1,109 @@
+"""
+Tests for benchmarks/run_benchmarks.py
+
+Covers: make_user_data, make_legacy_user_data, run_benchmarks,
+        compare_to_baseline and the command line entry point.
+"""
+
+import json
+
+import pytest
+
+import package.data_file_functions as data_file_functions
+from benchmarks.run_benchmarks import (
+    _count_rules,
+    compare_to_baseline,
+    main,
+    make_legacy_user_data,
+    make_user_data,
+    run_benchmarks,
+)
+from package.data_file_functions import update_schema
+
+
+@pytest.fixture(autouse=True)
+def restore_mongo_client(monkeypatch):
+    """The benchmarks install their own mongomock client; put the original
+    back afterwards."""
+    monkeypatch.setattr(
+        "package.data_file_functions._mongo_client", data_file_functions._mongo_client
+    )
+    monkeypatch.setenv("MONGODB_DATABASE", "test_db")
+
+
+class TestMakeUserData:
+    @pytest.mark.parametrize("rules", [10, 1000])
+    def test_rule_count(self, rules):
+        assert _count_rules(make_user_data(rules)) == rules
+
+    def test_example_schema(self):
+        user_data = make_user_data(100)
+        chain = user_data["ipv4"]["chains"]["CHAIN_0"]
+        assert chain["default"]["default_action"] == "drop"
+        assert chain[chain["rule-order"][0]]["dest_address_type"]
+        assert set(user_data["ipv4"]["filters"]) == {"input", "forward", "output"}
+
+    def test_legacy_converts_to_current(self):
+        assert update_schema(make_legacy_user_data(100)) == make_user_data(100)
+
+
+class TestRunBenchmarks:
+    def test_all_cases_reported(self):
+        report = run_benchmarks(sizes=[10], repeat=1)
+
+        names = {result["name"] for result in report["results"]}
+        assert "generate_config (cold)" in names
+        assert "process_diff" in names
+        assert "update_schema" in names
+        assert "parse_firewall_commands" in names
+        assert "assemble_list_of_groups" in names
+        for result in report["results"]:
+            assert result["size"] == 10
+            assert result["median"] >= 0
+
+    def test_case_filter(self):
+        report = run_benchmarks(sizes=[10], repeat=1, cases=["update_schema"])
+        assert [result["name"] for result in report["results"]] == ["update_schema"]
+
+
+class TestCompareToBaseline:
+    def report(self, median):
+        return {"results": [{"name": "case", "size": 10, "median": median}]}
+
+    def test_regression(self):
+        regressions = compare_to_baseline(self.report(3.0), self.report(1.0), 1.5)
+        assert regressions[0]["ratio"] == 3.0
+
+    def test_within_limit(self):
+        assert compare_to_baseline(self.report(1.2), self.report(1.0), 1.5) == []
+
+    def test_missing_from_baseline(self):
+        assert compare_to_baseline(self.report(3.0), {"results": []}) == []
+
+
+def test_main_writes_report_and_gates_on_baseline(tmp_path):
+    output = tmp_path / "results.json"
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(
+        json.dumps(
+            {"results": [{"name": "update_schema", "size": 10, "median": 1e-12}]}
+        )
+    )
+
+    status = main(
+        [
+            "--sizes",
+            "10",
+            "--repeat",
+            "1",
+            "--case",
+            "update_schema",
+            "--output",
+            str(output),
+            "--baseline",
+            str(baseline),
+        ]
+    )
+
+    assert status == 1
+    assert json.loads(output.read_text())["results"][0]["name"] == "update_schema"
@@ -0,0 +1,238 @@
+"""
+Tests for package/cache_functions.py
+
+Covers: cache_key, request cache get/set/invalidate, process-wide document
+        cache get/set/invalidate, LRU eviction and stats, the sidebar
+        cache, the snapshot diff cache, the SSH key cache and the
+        reachability cache.
+"""
+
+import pytest
+
+from package.cache_functions import (
+    cache_key,
+    diff_cache_clear,
+    diff_cache_get,
+    diff_cache_set,
+    document_cache_clear,
+    document_cache_get,
+    document_cache_invalidate,
+    document_cache_peek,
+    document_cache_set,
+    document_cache_stats,
+    get_request_cache,
+    invalidate_firewall,
+    reachability_cache_clear,
+    reachability_cache_get,
+    reachability_cache_set,
+    request_cache_get,
+    request_cache_set,
+    sidebar_cache_clear,
+    sidebar_cache_get,
+    sidebar_cache_invalidate,
+    sidebar_cache_set,
+    ssh_key_cache_clear,
+    ssh_key_cache_get,
+    ssh_key_cache_set,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_document_cache():
+    document_cache_clear()
+    sidebar_cache_clear()
+    diff_cache_clear()
+    ssh_key_cache_clear()
+    reachability_cache_clear()
+    yield
+    document_cache_clear()
+    sidebar_cache_clear()
+    diff_cache_clear()
+    ssh_key_cache_clear()
+    reachability_cache_clear()
+
+
+class TestCacheKey:
+    def test_current(self):
+        assert cache_key("data/testuser/fw1") == ("testuser", "fw1", "current")
+
+    def test_snapshot(self):
+        assert cache_key("data/testuser/fw1", "snap1") == ("testuser", "fw1", "snap1")
+
+
+class TestRequestCache:
+    def test_no_cache_outside_request(self):
+        assert get_request_cache() is None
+        request_cache_set(("u", "fw", "current"), {"a": 1})
+        assert request_cache_get(("u", "fw", "current")) is None
+
+    def test_set_and_get_returns_copy(self, app):
+        with app.test_request_context():
+            key = ("u", "fw", "current")
+            request_cache_set(key, {"ipv4": {"chains": {}}})
+            first = request_cache_get(key)
+            first["ipv4"]["chains"]["NEW"] = {}
+            assert request_cache_get(key) == {"ipv4": {"chains": {}}}
+
+    def test_invalidate_firewall(self, app):
+        with app.test_request_context():
+            request_cache_set(("u", "fw", "current"), {"a": 1})
+            request_cache_set(("u", "fw", "snap1"), {"a": 2})
+            request_cache_set(("u", "other", "current"), {"a": 3})
+            invalidate_firewall("u", "fw")
+            assert request_cache_get(("u", "fw", "current")) is None
+            assert request_cache_get(("u", "fw", "snap1")) is None
+            assert request_cache_get(("u", "other", "current")) == {"a": 3}
+
+
+class TestDocumentCache:
+    def test_hit_at_matching_revision(self):
+        key = ("u", "fw", "current")
+        document_cache_set(key, ("e", 1), {"version": "1"})
+        assert document_cache_get(key, ("e", 1)) == {"version": "1"}
+        assert document_cache_stats()["hits"] == 1
+
+    def test_miss_at_other_revision(self):
+        key = ("u", "fw", "current")
+        document_cache_set(key, ("e", 1), {"version": "1"})
+        assert document_cache_get(key, ("e", 2)) is None
+        assert document_cache_get(key, ("other", 1)) is None
+        assert document_cache_stats()["misses"] == 2
+
+    def test_peek_does_not_count(self):
+        key = ("u", "fw", "current")
+        document_cache_set(key, ("e", 3), {"version": "1"})
+        assert document_cache_peek(key) == (("e", 3), {"version": "1"})
+        assert document_cache_peek(("u", "x", "current")) == (None, None)
+        stats = document_cache_stats()
+        assert stats["hits"] == 0 and stats["misses"] == 0
+
+    def test_invalidate_firewall(self):
+        document_cache_set(("u", "fw", "current"), ("e", 1), {"a": 1})
+        document_cache_set(("u", "fw", "snap1"), ("e", 1), {"a": 2})
+        document_cache_set(("u", "other", "current"), ("e", 1), {"a": 3})
+        document_cache_invalidate("u", "fw")
+        stats = document_cache_stats()
+        assert stats["entries"] == 1
+        assert document_cache_get(("u", "other", "current"), ("e", 1)) == {"a": 3}
+
+    def test_evicts_least_recently_used_by_bytes(self, monkeypatch):
+        monkeypatch.setenv("DOCUMENT_CACHE_MAX_BYTES", "200")
+        payload = {"data": "x" * 60}
+        document_cache_set(("u", "fw1", "current"), ("e", 1), payload)
+        document_cache_set(("u", "fw2", "current"), ("e", 1), payload)
+        # Touch fw1 so fw2 is the least recently used entry.
+        document_cache_get(("u", "fw1", "current"), ("e", 1))
+        document_cache_set(("u", "fw3", "current"), ("e", 1), payload)
+        stats = document_cache_stats()
+        assert stats["evictions"] == 1
+        assert stats["bytes"] <= 200
+        assert document_cache_get(("u", "fw2", "current"), ("e", 1)) is None
+        assert document_cache_get(("u", "fw1", "current"), ("e", 1)) == payload
+
+    def test_document_larger_than_cache_is_not_stored(self, monkeypatch):
+        monkeypatch.setenv("DOCUMENT_CACHE_MAX_BYTES", "50")
+        document_cache_set(("u", "fw", "current"), ("e", 1), {"data": "x" * 100})
+        assert document_cache_stats()["entries"] == 0
+
+
+class TestSidebarCache:
+    def test_get_set(self):
+        assert sidebar_cache_get("u", "fw", "file_list") is None
+        sidebar_cache_set("u", "fw", "file_list", ["fw"])
+        assert sidebar_cache_get("u", "fw", "file_list") == ["fw"]
+        assert sidebar_cache_get("u", "fw", "snapshot_list") is None
+        assert sidebar_cache_get("u", "other", "file_list") is None
+
+    def test_returns_copies(self):
+        sidebar_cache_set("u", "fw", "snapshot_list", [{"name": "s1"}])
+        sidebar_cache_get("u", "fw", "snapshot_list")[0]["name"] = "changed"
+        assert sidebar_cache_get("u", "fw", "snapshot_list") == [{"name": "s1"}]
+
+    def test_expires(self, monkeypatch):
+        monkeypatch.setenv("SIDEBAR_CACHE_TTL", "-1")
+        sidebar_cache_set("u", "fw", "file_list", ["fw"])
+        assert sidebar_cache_get("u", "fw", "file_list") is None
+
+    def test_invalidate_firewall(self):
+        sidebar_cache_set("u", "fw1", "file_list", ["fw1"])
+        sidebar_cache_set("u", "fw2", "file_list", ["fw1"])
+        sidebar_cache_invalidate("u", "fw1")
+        assert sidebar_cache_get("u", "fw1", "file_list") is None
+        assert sidebar_cache_get("u", "fw2", "file_list") == ["fw1"]
+
+    def test_invalidate_user(self):
+        sidebar_cache_set("u", "fw1", "file_list", ["fw1"])
+        sidebar_cache_set("u", None, "file_list", ["fw1"])
+        sidebar_cache_set("v", "fw1", "file_list", ["fw1"])
+        sidebar_cache_invalidate("u")
+        assert sidebar_cache_get("u", "fw1", "file_list") is None
+        assert sidebar_cache_get("u", None, "file_list") is None
+        assert sidebar_cache_get("v", "fw1", "file_list") == ["fw1"]
+
+
+class TestDiffCache:
+    def test_get_set(self):
+        assert diff_cache_get("k") is None
+        diff_cache_set("k", "<p>diff</p>")
+        assert diff_cache_get("k") == "<p>diff</p>"
+
+    def test_evicts_least_recently_used(self, monkeypatch):
+        monkeypatch.setenv("DIFF_CACHE_MAX_BYTES", "10")
+        diff_cache_set("a", "aaaa")
+        diff_cache_set("b", "bbbb")
+        diff_cache_get("a")
+        diff_cache_set("c", "cccc")
+        assert diff_cache_get("a") == "aaaa"
+        assert diff_cache_get("b") is None
+        assert diff_cache_get("c") == "cccc"
+
+    def test_oversized_not_cached(self, monkeypatch):
+        monkeypatch.setenv("DIFF_CACHE_MAX_BYTES", "3")
+        diff_cache_set("a", "aaaa")
+        assert diff_cache_get("a") is None
+
+    def test_replace(self, monkeypatch):
+        monkeypatch.setenv("DIFF_CACHE_MAX_BYTES", "8")
+        diff_cache_set("a", "aaaa")
+        diff_cache_set("a", "AAAA")
+        diff_cache_set("b", "bbbb")
+        assert diff_cache_get("a") == "AAAA"
+        assert diff_cache_get("b") == "bbbb"
+
+
+class TestSshKeyCache:
+    def test_get_set(self):
+        assert ssh_key_cache_get("k.pem", 1, b"pass") is None
+        ssh_key_cache_set("k.pem", 1, b"pass", b"key")
+        assert ssh_key_cache_get("k.pem", 1, b"pass") == b"key"
+
+    def test_requires_same_passphrase_and_version(self):
+        ssh_key_cache_set("k.pem", 1, b"pass", b"key")
+        assert ssh_key_cache_get("k.pem", 1, b"other") is None
+        assert ssh_key_cache_get("k.pem", 2, b"pass") is None
+
+    def test_expires(self, monkeypatch):
+        monkeypatch.setenv("SSH_KEY_CACHE_TTL", "-1")
+        ssh_key_cache_set("k.pem", 1, b"pass", b"key")
+        assert ssh_key_cache_get("k.pem", 1, b"pass") is None
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setenv("SSH_KEY_CACHE_TTL", "0")
+        ssh_key_cache_set("k.pem", 1, b"pass", b"key")
+        assert ssh_key_cache_get("k.pem", 1, b"pass") is None
+
+
+class TestReachabilityCache:
+    def test_get_set(self):
+        assert reachability_cache_get("10.0.0.1", "22") is None
+        reachability_cache_set("10.0.0.1", 22, True)
+        reachable, checked = reachability_cache_get("10.0.0.1", "22")
+        assert reachable is True
+        assert checked > 0
+        assert reachability_cache_get("10.0.0.1", "2222") is None
+
+    def test_expires(self, monkeypatch):
+        monkeypatch.setenv("REACHABILITY_CACHE_TTL", "-1")
+        reachability_cache_set("10.0.0.1", "22", False)
+        assert reachability_cache_get("10.0.0.1", "22") is None
@@ -465,6 +465,20 @@ class TestDeleteRuleFromData:
         assert "10" not in chain["rule-order"]
         assert "20" in chain["rule-order"]
 
+    def test_delete_sends_only_the_rule(self, app, mock_session, mock_read_write):
+        data = _data_with_two_rules()
+        capture = mock_read_write("package.chain_functions", data)
+        req = make_request({"rule": "ipv4,OUTSIDE-IN,10"})
+        with app.test_request_context():
+            delete_rule_from_data(mock_session, req)
+
+        assert capture.updates == [
+            {
+                "unset_fields": [("ipv4", "chains", "OUTSIDE-IN", "10")],
+                "pull_fields": {("ipv4", "chains", "OUTSIDE-IN", "rule-order"): "10"},
+            }
+        ]
+
     def test_delete_last_rule_removes_chain(self, app, mock_session, mock_read_write):
         data = _data_with_chain()  # Only rule 10
         capture = mock_read_write("package.chain_functions", data)
@@ -0,0 +1,128 @@
+"""
+Tests for package/collection_functions.py
+
+Covers: list_collection_profiles, get_collection_profile,
+        save_collection_profile, delete_collection_profile.
+"""
+
+from unittest.mock import patch
+
+import pytest
+from flask import get_flashed_messages
+
+from package.collection_functions import (
+    DEFAULT_COLLECTION_PROFILES,
+    delete_collection_profile,
+    get_collection_profile,
+    list_collection_profiles,
+    save_collection_profile,
+)
+from tests.conftest import make_request
+
+
+@pytest.fixture
+def saved_profiles():
+    """Patch the profile store with an in-memory dict of saved profiles."""
+    profiles = {}
+
+    def read(username):
+        return dict(sorted(profiles.get(username, {}).items()))
+
+    def write(username, name, commands):
+        profiles.setdefault(username, {})[name] = list(commands)
+
+    def delete(username, name):
+        return profiles.get(username, {}).pop(name, None) is not None
+
+    with patch(
+        "package.collection_functions.read_profile_records", side_effect=read
+    ), patch(
+        "package.collection_functions.write_profile_record", side_effect=write
+    ), patch(
+        "package.collection_functions.delete_profile_record", side_effect=delete
+    ):
+        yield profiles
+
+
+class TestListCollectionProfiles:
+    def test_defaults_then_saved(self, mock_session, saved_profiles):
+        saved_profiles["testuser"] = {"Routes": ["show ip route"]}
+        profiles = list_collection_profiles(mock_session)
+        assert list(profiles) == list(DEFAULT_COLLECTION_PROFILES) + ["Routes"]
+
+    def test_saved_replaces_default(self, mock_session, saved_profiles):
+        saved_profiles["testuser"] = {"Firewall Overview": ["show firewall"]}
+        assert get_collection_profile(mock_session, "Firewall Overview") == [
+            "show firewall"
+        ]
+
+    def test_defaults_not_shared(self, mock_session, saved_profiles):
+        get_collection_profile(mock_session, "Firewall Overview").append("reboot")
+        assert "reboot" not in DEFAULT_COLLECTION_PROFILES["Firewall Overview"]
+
+    def test_missing(self, mock_session, saved_profiles):
+        assert get_collection_profile(mock_session, "Missing") is None
+
+
+class TestSaveCollectionProfile:
+    def test_saves_commands(self, app, mock_session, saved_profiles):
+        request = make_request(
+            {
+                "profile_name": " Routes ",
+                "profile_commands": "run show ip route\n\n  show arp  \n",
+            }
+        )
+        with app.test_request_context():
+            save_collection_profile(mock_session, request)
+            assert get_flashed_messages(with_categories=True) == [
+                ("success", "Collection profile Routes saved.")
+            ]
+        assert saved_profiles["testuser"] == {"Routes": ["show ip route", "show arp"]}
+
+    @pytest.mark.parametrize(
+        "form",
+        [
+            {"profile_name": "", "profile_commands": "show arp"},
+            {"profile_name": "Empty", "profile_commands": "\n  \n"},
+        ],
+    )
+    def test_rejects_empty(self, app, mock_session, saved_profiles, form):
+        with app.test_request_context():
+            save_collection_profile(mock_session, make_request(form))
+            assert get_flashed_messages(category_filter=["danger"])
+        assert saved_profiles == {}
+
+    def test_rejects_too_many_commands(
+        self, app, mock_session, saved_profiles, monkeypatch
+    ):
+        monkeypatch.setenv("COLLECTION_PROFILE_MAX_COMMANDS", "2")
+        request = make_request(
+            {"profile_name": "Big", "profile_commands": "show a\nshow b\nshow c"}
+        )
+        with app.test_request_context():
+            save_collection_profile(mock_session, request)
+            assert get_flashed_messages(category_filter=["danger"]) == [
+                "A collection profile can have at most 2 commands."
+            ]
+        assert saved_profiles == {}
+
+
+class TestDeleteCollectionProfile:
+    def test_deletes_saved(self, app, mock_session, saved_profiles):
+        saved_profiles["testuser"] = {"Routes": ["show ip route"]}
+        with app.test_request_context():
+            delete_collection_profile(
+                mock_session, make_request({"profile_name": "Routes"})
+            )
+            assert get_flashed_messages(category_filter=["success"])
+        assert saved_profiles["testuser"] == {}
+
+    def test_builtin_not_deleted(self, app, mock_session, saved_profiles):
+        with app.test_request_context():
+            delete_collection_profile(
+                mock_session, make_request({"profile_name": "Firewall Overview"})
+            )
+            assert get_flashed_messages(category_filter=["warning"]) == [
+                "Collection profile Firewall Overview is not a saved profile."
+            ]
+        assert get_collection_profile(mock_session, "Firewall Overview")
@@ -0,0 +1,97 @@
+"""
+Tests for package/config_delta_functions.py
+
+Covers: parse_command, format_command, config_delta.
+"""
+
+from package.config_delta_functions import config_delta, format_command, parse_command
+
+RUNNING = [
+    "set firewall group address-group G address '1.1.1.1'",
+    "set firewall group address-group G address '2.2.2.2'",
+    "set firewall ipv4 name X default-action 'drop'",
+    "set firewall ipv4 name X rule 10 action 'accept'",
+    "set firewall ipv4 name X rule 20 action 'drop'",
+    "set firewall ipv4 name X rule 20 description 'Old rule'",
+    "set firewall ipv4 name Y default-action 'drop'",
+    "set interfaces ethernet eth0 address 'dhcp'",
+]
+
+
+class TestParseCommand:
+    def test_set(self):
+        assert parse_command("set firewall ipv4 name X description 'WAN in'") == (
+            "set",
+            ("firewall", "ipv4", "name", "X", "description", "WAN in"),
+        )
+
+    def test_ignored_lines(self):
+        assert parse_command("") is None
+        assert parse_command("# Rule 10") is None
+        assert parse_command("commit") is None
+        assert parse_command("set firewall description 'unbalanced") is None
+
+
+class TestFormatCommand:
+    def test_quotes_when_needed(self):
+        assert (
+            format_command("set", ("firewall", "description", "WAN in"))
+            == "set firewall description 'WAN in'"
+        )
+
+
+class TestConfigDelta:
+    def test_unchanged(self):
+        assert config_delta(RUNNING, ["#", "# Rule 10", ""] + RUNNING) == []
+
+    def test_quoting_is_not_a_change(self):
+        assert (
+            config_delta(RUNNING, ["set firewall ipv4 name X default-action drop"])
+            == []
+        )
+
+    def test_merge_only_sets_changes(self):
+        commands = [
+            "set firewall ipv4 name X rule 10 action 'drop'",
+            "set firewall ipv4 name X rule 20 action 'drop'",
+            "set firewall ipv4 name Z default-action 'accept'",
+        ]
+        assert config_delta(RUNNING, commands) == [
+            "set firewall ipv4 name X rule 10 action drop",
+            "set firewall ipv4 name Z default-action accept",
+        ]
+
+    def test_replace_deletes_stale_subtrees(self):
+        commands = [
+            "delete firewall",
+            "set firewall group address-group G address '2.2.2.2'",
+            "set firewall group address-group G address '3.3.3.3'",
+            "set firewall ipv4 name X default-action 'drop'",
+            "set firewall ipv4 name X rule 10 action 'drop'",
+        ]
+        assert config_delta(RUNNING, commands) == [
+            "delete firewall group address-group G address 1.1.1.1",
+            "delete firewall ipv4 name X rule 10 action accept",
+            "delete firewall ipv4 name X rule 20",
+            "delete firewall ipv4 name Y",
+            "set firewall group address-group G address 3.3.3.3",
+            "set firewall ipv4 name X rule 10 action drop",
+        ]
+
+    def test_replace_everything(self):
+        assert config_delta(RUNNING, ["delete firewall"]) == ["delete firewall"]
+
+    def test_replace_is_scoped_to_deleted_path(self):
+        commands = [
+            "delete firewall ipv4 name X",
+            "set firewall ipv4 name X rule 10 action 'accept'",
+        ]
+        assert config_delta(RUNNING, commands) == [
+            "delete firewall ipv4 name X default-action",
+            "delete firewall ipv4 name X rule 20",
+        ]
+
+    def test_unparsed_lines_are_kept(self):
+        assert config_delta(RUNNING, ["set firewall description 'unbalanced"]) == [
+            "set firewall description 'unbalanced"
+        ]
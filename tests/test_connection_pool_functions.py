@@ -0,0 +1,124 @@
+"""
+Tests for package/connection_pool_functions.py
+
+Covers: napalm_pool_key, napalm_pool_get/put health checks, max size
+        eviction, idle timeout reaping, discard and clear.
+"""
+
+from unittest.mock import Mock
+
+import pytest
+
+from package.connection_pool_functions import (
+    napalm_pool_clear,
+    napalm_pool_discard,
+    napalm_pool_get,
+    napalm_pool_key,
+    napalm_pool_put,
+    napalm_pool_reap,
+    napalm_pool_size,
+)
+
+KEY = ("192.168.1.1", "22", "vyos", "fingerprint")
+
+
+@pytest.fixture(autouse=True)
+def clear_pool():
+    napalm_pool_clear()
+    yield
+    napalm_pool_clear()
+
+
+def alive_driver(alive=True):
+    driver = Mock()
+    driver.is_alive.return_value = {"is_alive": alive}
+    return driver
+
+
+class TestPoolKey:
+    def test_key_fields(self):
+        key = napalm_pool_key(
+            {"hostname": "fw", "port": 22, "username": "vyos", "password": "p"}
+        )
+        assert key[:3] == ("fw", "22", "vyos")
+        assert "p" != key[3] and len(key[3]) == 64
+
+    def test_ssh_key_name_changes_fingerprint(self):
+        base = {"hostname": "fw", "port": "22", "username": "vyos", "password": "p"}
+        assert napalm_pool_key(base) != napalm_pool_key({**base, "ssh_key_name": "k"})
+
+
+class TestPoolGetPut:
+    def test_empty(self):
+        assert napalm_pool_get(KEY) is None
+
+    def test_put_then_get(self):
+        driver = alive_driver()
+        napalm_pool_put(KEY, driver)
+        assert napalm_pool_size() == 1
+        assert napalm_pool_get(KEY) is driver
+        assert napalm_pool_size() == 0
+        assert napalm_pool_get(KEY) is None
+
+    def test_other_key_not_returned(self):
+        napalm_pool_put(KEY, alive_driver())
+        assert napalm_pool_get(("other",) + KEY[1:]) is None
+        assert napalm_pool_size() == 1
+
+    def test_dead_session_closed(self):
+        dead = alive_driver(False)
+        healthy = alive_driver()
+        napalm_pool_put(KEY, healthy)
+        napalm_pool_put(KEY, dead)
+        assert napalm_pool_get(KEY) is healthy
+        dead.close.assert_called_once()
+
+    def test_health_check_error_closes(self):
+        broken = Mock()
+        broken.is_alive.side_effect = OSError("Socket closed")
+        napalm_pool_put(KEY, broken)
+        assert napalm_pool_get(KEY) is None
+        broken.close.assert_called_once()
+
+    def test_max_size_evicts_least_recently_used(self, monkeypatch):
+        monkeypatch.setenv("NAPALM_POOL_MAX_SIZE", "2")
+        drivers = [alive_driver() for _ in range(3)]
+        for n, driver in enumerate(drivers):
+            napalm_pool_put(KEY[:3] + (str(n),), driver)
+        assert napalm_pool_size() == 2
+        drivers[0].close.assert_called_once()
+        drivers[2].close.assert_not_called()
+
+    def test_size_zero_disables_pooling(self, monkeypatch):
+        monkeypatch.setenv("NAPALM_POOL_MAX_SIZE", "0")
+        driver = alive_driver()
+        napalm_pool_put(KEY, driver)
+        assert napalm_pool_size() == 0
+        driver.close.assert_called_once()
+
+
+class TestPoolMaintenance:
+    def test_reap_idle(self, monkeypatch):
+        driver = alive_driver()
+        napalm_pool_put(KEY, driver)
+        assert napalm_pool_reap() == 0
+
+        monkeypatch.setenv("NAPALM_POOL_IDLE_TIMEOUT", "-1")
+        assert napalm_pool_reap() == 1
+        driver.close.assert_called_once()
+        assert napalm_pool_size() == 0
+
+    def test_discard_closes_quietly(self):
+        driver = Mock()
+        driver.close.side_effect = OSError("Already closed")
+        napalm_pool_discard(driver)
+        driver.close.assert_called_once()
+
+    def test_clear(self):
+        drivers = [alive_driver(), alive_driver()]
+        for driver in drivers:
+            napalm_pool_put(KEY, driver)
+        napalm_pool_clear()
+        assert napalm_pool_size() == 0
+        for driver in drivers:
+            driver.close.assert_called_once()
@@ -1,37 +1,76 @@
 """
 Tests for package/data_file_functions.py
 
-Covers: allowed_file, update_schema, get_extra_items, get_system_name,
+Covers: allowed_file, ensure_user_indexes, apply_user_data_update, update_schema, upgrade_user_data,
+        upgrade_user_data_files, migrate_user_snapshots, restore_snapshot, get_extra_items, get_system_name,
         list_user_keys, list_full_backups, list_user_files, list_snapshots,
-        read_user_data_file, write_user_data_file, delete_user_data_file,
+        read_user_data_file, read_user_data_with_revision, write_user_data_file,
+        update_user_data_file, mutate_user_data_file, delete_user_data_file,
         add_extra_items, add_hostname, write_user_command_conf_file,
-        tag_snapshot, validate_mongodb_connection, upload_backup_file.
+        tag_snapshot, validate_mongodb_connection, upload_backup_file,
+        read_diff_cache, write_diff_cache, read_user_snapshot_series,
+        decrypt_key, create_job_record, read_job_record, update_job_record,
+        delete_profile_record, read_profile_records, write_profile_record,
+        read_rule_counters, write_rule_counters, read_rule_hit_buckets,
+        write_rule_hit_bucket, delete_rule_hit_buckets.
 """
 
 import copy
 import os
 import sys
+import time
 from unittest.mock import MagicMock, patch
 
 import mongomock
 import pytest
 
+from package.cache_functions import (
+    document_cache_clear,
+    document_cache_stats,
+    sidebar_cache_clear,
+    ssh_key_cache_clear,
+)
 from package.data_file_functions import (
+    _ensure_indexes,
     add_extra_items,
     add_hostname,
     allowed_file,
+    create_job_record,
+    decrypt_key,
+    delete_profile_record,
+    delete_rule_hit_buckets,
+    apply_user_data_update,
     delete_user_data_file,
+    ensure_user_indexes,
     get_extra_items,
     get_system_name,
     list_full_backups,
     list_snapshots,
     list_user_files,
     list_user_keys,
+    migrate_user_snapshots,
+    mutate_user_data_file,
+    read_diff_cache,
+    read_job_record,
+    read_profile_records,
+    read_rule_counters,
+    read_rule_hit_buckets,
     read_user_data_file,
+    read_user_data_with_revision,
+    read_user_snapshot_series,
+    restore_snapshot,
     tag_snapshot,
     update_schema,
+    update_job_record,
+    update_user_data_file,
+    upgrade_user_data,
+    upgrade_user_data_files,
     upload_backup_file,
     validate_mongodb_connection,
+    write_diff_cache,
+    write_profile_record,
+    write_rule_counters,
+    write_rule_hit_bucket,
     write_user_command_conf_file,
     write_user_data_file,
 )
@@ -49,6 +88,12 @@ def mock_mongo(monkeypatch):
     client = mongomock.MongoClient()
     monkeypatch.setattr("package.data_file_functions._mongo_client", client)
     monkeypatch.setattr("package.data_file_functions._get_mongo_client", lambda: client)
+    monkeypatch.setattr("package.data_file_functions._indexed_collections", set())
+    monkeypatch.setattr("package.data_file_functions._diff_cache_indexed", False)
+    monkeypatch.setattr("package.data_file_functions._jobs_indexed", False)
+    monkeypatch.setattr("package.data_file_functions._profiles_indexed", False)
+    monkeypatch.setattr("package.data_file_functions._rule_stats_indexed", False)
+    sidebar_cache_clear()
     monkeypatch.setenv("MONGODB_DATABASE", "test_db")
     monkeypatch.setenv("MONGODB_URI", "mongodb://localhost:27017")
     return client
@@ -320,6 +365,58 @@ class TestListUserKeys:
         assert result == ["alpha", "middle", "zebra"]
 
 
+# ===========================================================================
+# decrypt_key
+# ===========================================================================
+
+
+class TestDecryptKey:
+    @pytest.fixture(autouse=True)
+    def clear_key_cache(self):
+        ssh_key_cache_clear()
+        yield
+        ssh_key_cache_clear()
+
+    @pytest.fixture
+    def key_file(self, tmp_path):
+        from cryptography.fernet import Fernet
+
+        passphrase = Fernet.generate_key()
+        path = tmp_path / "server1.key"
+        path.write_bytes(Fernet(passphrase).encrypt(b"private key"))
+        return str(path), passphrase
+
+    def test_decrypts_without_writing(self, key_file, tmp_path):
+        path, passphrase = key_file
+        assert decrypt_key(path, passphrase) == b"private key"
+        assert os.listdir(tmp_path) == ["server1.key"]
+
+    def test_cached(self, key_file):
+        path, passphrase = key_file
+        decrypt_key(path, passphrase)
+        with patch("package.data_file_functions.Fernet") as mock_fernet:
+            assert decrypt_key(path, passphrase) == b"private key"
+        mock_fernet.assert_not_called()
+
+    def test_wrong_passphrase_not_served_from_cache(self, key_file):
+        from cryptography.fernet import Fernet, InvalidToken
+
+        path, passphrase = key_file
+        decrypt_key(path, passphrase)
+        with pytest.raises(InvalidToken):
+            decrypt_key(path, Fernet.generate_key())
+
+    def test_replaced_key_file_decrypted_again(self, key_file):
+        from cryptography.fernet import Fernet
+
+        path, passphrase = key_file
+        decrypt_key(path, passphrase)
+        with open(path, "wb") as f:
+            f.write(Fernet(passphrase).encrypt(b"new key"))
+        os.utime(path, ns=(0, 0))
+        assert decrypt_key(path, passphrase) == b"new key"
+
+
 # ===========================================================================
 # list_full_backups
 # ===========================================================================
@@ -394,6 +491,74 @@ class TestListUserFiles:
         result = list_user_files(session)
         assert result == ["alpha", "mike", "zulu"]
 
+    def test_cache_invalidated_by_new_firewall(self, mock_mongo, sample_user_data):
+        session = {"username": "testuser", "firewall_name": "fw_alpha"}
+        write_user_data_file("data/testuser/fw_alpha", copy.deepcopy(sample_user_data))
+        assert list_user_files(session) == ["fw_alpha"]
+
+        write_user_data_file("data/testuser/fw_beta", copy.deepcopy(sample_user_data))
+        assert list_user_files(session) == ["fw_alpha", "fw_beta"]
+
+        delete_user_data_file("data/testuser/fw_alpha")
+        assert list_user_files(session) == ["fw_beta"]
+
+    def test_ensures_indexes(self, mock_mongo):
+        list_user_files({"username": "testuser"})
+        indexes = mock_mongo["test_db"]["testuser"].index_information()
+        assert "firewall_1_snapshot_1" in indexes
+
+
+# ===========================================================================
+# ensure_user_indexes
+# ===========================================================================
+
+
+class TestEnsureUserIndexes:
+    def test_indexes_every_collection(self, mock_mongo):
+        db = mock_mongo["test_db"]
+        db["alice"].insert_one({"_id": "fw1"})
+        db["bob"].insert_one({"_id": "fw2"})
+
+        ensure_user_indexes()
+
+        for name in ["alice", "bob"]:
+            indexes = db[name].index_information()
+            assert indexes["firewall_1_snapshot_1"]["key"] == [
+                ("firewall", 1),
+                ("snapshot", 1),
+            ]
+            assert indexes["firewall_1_seq_1"]["partialFilterExpression"] == {
+                "seq": {"$exists": True}
+            }
+            assert indexes["firewall_1_seq_1"]["unique"] is True
+
+    def test_is_idempotent(self, mock_mongo, monkeypatch):
+        db = mock_mongo["test_db"]
+        db["alice"].insert_one({"_id": "fw1"})
+        ensure_user_indexes()
+        monkeypatch.setattr("package.data_file_functions._indexed_collections", set())
+
+        ensure_user_indexes()
+
+        assert len(db["alice"].index_information()) == 3
+
+
+    def test_rebuilds_non_unique_seq_index(self, mock_mongo):
+        import pymongo
+
+        collection = MagicMock()
+        collection.name = "alice"
+        collection.create_index.side_effect = [
+            None,
+            pymongo.errors.OperationFailure("IndexOptionsConflict", code=85),
+            None,
+        ]
+
+        _ensure_indexes(collection)
+
+        collection.drop_index.assert_called_once_with("firewall_1_seq_1")
+        assert collection.create_index.call_args.kwargs["unique"] is True
+
 
 # ===========================================================================
 # list_snapshots (MongoDB)
@@ -446,6 +611,67 @@ class TestListSnapshots:
         result = list_snapshots(session)
         assert result == []
 
+    def test_cached_until_snapshot_created(self, mock_mongo, sample_user_data):
+        session = {"username": "testuser", "firewall_name": "test_firewall"}
+        coll = mock_mongo["test_db"]["testuser"]
+        assert list_snapshots(session) == []
+
+        # Changes made behind the data functions' back are not seen...
+        coll.insert_one({"firewall": "test_firewall", "snapshot": "hidden"})
+        assert list_snapshots(session) == []
+
+        # ...but writing a snapshot invalidates the cached list.
+        write_user_data_file(
+            "data/testuser/test_firewall", copy.deepcopy(sample_user_data), "snap1"
+        )
+        names = [snapshot["name"] for snapshot in list_snapshots(session)]
+        assert names == ["hidden", "snap1"]
+
+    def test_cache_invalidated_by_delete(self, mock_mongo, sample_user_data):
+        session = {"username": "testuser", "firewall_name": "test_firewall"}
+        write_user_data_file(
+            "data/testuser/test_firewall", copy.deepcopy(sample_user_data), "snap1"
+        )
+        assert len(list_snapshots(session)) == 1
+
+        delete_user_data_file("data/testuser/test_firewall/snap1")
+
+        assert list_snapshots(session) == []
+
+    def test_cache_invalidated_by_tag(self, app, mock_mongo, sample_user_data):
+        session = {"username": "testuser", "firewall_name": "test_firewall"}
+        write_user_data_file(
+            "data/testuser/test_firewall", copy.deepcopy(sample_user_data), "snap1"
+        )
+        assert list_snapshots(session)[0]["tag"] == ""
+        request = make_request(
+            {
+                "firewall_name": "test_firewall",
+                "snapshot_name": "snap1",
+                "snapshot_tag": "gold",
+            }
+        )
+        with app.test_request_context():
+            tag_snapshot(session, request)
+
+        assert list_snapshots(session)[0]["tag"] == "gold"
+
+    def test_reads_only_listing_fields(self, monkeypatch):
+        sidebar_cache_clear()
+        client = MagicMock()
+        collection = client["test_db"]["testuser"]
+        collection.find.return_value.sort.return_value = [
+            {"_id": 1, "firewall": "test_firewall", "snapshot": "s1"}
+        ]
+        monkeypatch.setattr("package.data_file_functions._get_mongo_client", lambda: client)
+        monkeypatch.setenv("MONGODB_DATABASE", "test_db")
+
+        result = list_snapshots({"username": "testuser", "firewall_name": "test_firewall"})
+
+        assert result == [{"name": "s1", "id": "test_firewall", "tag": ""}]
+        projection = collection.find.call_args[0][1]
+        assert set(projection) == {"_id", "firewall", "snapshot", "tag"}
+
     def test_excludes_other_firewall_snapshots(self, mock_mongo):
         db = mock_mongo["test_db"]
         coll = db["testuser"]
@@ -504,6 +730,14 @@ class TestReadUserDataFile:
         assert "chains" in result["ipv4"]
         assert "tables" not in result["ipv4"]
 
+    def test_upgrade_is_not_written_back(self, mock_mongo):
+        db = mock_mongo["test_db"]
+        db["testuser"].insert_one({"_id": "test_firewall", "ipv4": {"tables": {}}})
+        result = read_user_data_file("data/testuser/test_firewall")
+        assert result["version"] == "1"
+        doc = db["testuser"].find_one({"_id": "test_firewall"})
+        assert doc == {"_id": "test_firewall", "ipv4": {"tables": {}}}
+
     def test_read_snapshot(self, mock_mongo, sample_user_data):
         db = mock_mongo["test_db"]
         coll = db["testuser"]
@@ -519,7 +753,7 @@ class TestReadUserDataFile:
         )
         assert result["version"] == "1"
 
-    def test_read_snapshot_with_diff_true_does_not_overwrite(self, mock_mongo, sample_user_data):
+    def test_read_snapshot_does_not_overwrite_current(self, mock_mongo, sample_user_data):
         db = mock_mongo["test_db"]
         coll = db["testuser"]
         coll.insert_one({"_id": "test_firewall", **sample_user_data})
@@ -529,7 +763,7 @@ class TestReadUserDataFile:
         snap_data["extra-items"] = ["snapshot item"]
         coll.insert_one(snap_data)
         result = read_user_data_file(
-            "data/testuser/test_firewall", snapshot="snap1", diff=True
+            "data/testuser/test_firewall", snapshot="snap1"
         )
         assert "extra-items" in result
         # Original current doc should still exist unchanged
@@ -538,6 +772,135 @@ class TestReadUserDataFile:
         assert "extra-items" not in current
 
 
+# ===========================================================================
+# read_user_data_file request cache
+# ===========================================================================
+
+
+class TestReadUserDataFileRequestCache:
+    def test_second_read_served_from_cache(self, app, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.insert_one({"_id": "test_firewall", **sample_user_data})
+        with app.test_request_context():
+            read_user_data_file("data/testuser/test_firewall")
+            coll.update_one({"_id": "test_firewall"}, {"$set": {"version": "9"}})
+            result = read_user_data_file("data/testuser/test_firewall")
+        assert result["version"] == "1"
+
+    def test_reads_return_independent_copies(self, app, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.insert_one({"_id": "test_firewall", **sample_user_data})
+        with app.test_request_context():
+            first = read_user_data_file("data/testuser/test_firewall")
+            first["ipv4"]["chains"]["WAN_LOCAL"]["number"] = "10"
+            second = read_user_data_file("data/testuser/test_firewall")
+        assert "number" not in second["ipv4"]["chains"]["WAN_LOCAL"]
+
+    def test_write_invalidates_cache(self, app, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.insert_one({"_id": "test_firewall", **sample_user_data})
+        with app.test_request_context():
+            user_data = read_user_data_file("data/testuser/test_firewall")
+            user_data["extra-items"] = ["set firewall global-options all-ping 'enable'"]
+            write_user_data_file("data/testuser/test_firewall", user_data)
+            result = read_user_data_file("data/testuser/test_firewall")
+        assert "extra-items" in result
+
+    def test_delete_invalidates_cache(self, app, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.insert_one({"_id": "test_firewall", **sample_user_data})
+        with app.test_request_context():
+            read_user_data_file("data/testuser/test_firewall")
+            delete_user_data_file("data/testuser/test_firewall")
+            result = read_user_data_file("data/testuser/test_firewall")
+        assert result is None
+
+    def test_cache_is_per_request(self, app, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.insert_one({"_id": "test_firewall", **sample_user_data})
+        with app.test_request_context():
+            read_user_data_file("data/testuser/test_firewall")
+        coll.update_one({"_id": "test_firewall"}, {"$set": {"version": "9"}})
+        with app.test_request_context():
+            result = read_user_data_file("data/testuser/test_firewall")
+        assert result["version"] == "9"
+
+
+# ===========================================================================
+# read_user_data_file / write_user_data_file process-wide cache
+# ===========================================================================
+
+
+class TestDocumentRevisionCache:
+    @pytest.fixture(autouse=True)
+    def clear_document_cache(self):
+        document_cache_clear()
+        yield
+        document_cache_clear()
+
+    def test_write_bumps_revision(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        doc = coll.find_one({"_id": "test_firewall"})
+        assert doc["rev"] == 2
+        assert doc["rev_epoch"]
+
+    def test_read_after_write_is_cache_hit(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        # Change the stored document without bumping rev: a cache hit still
+        #   returns the written copy.
+        coll.update_one({"_id": "test_firewall"}, {"$set": {"version": "9"}})
+        result = read_user_data_file("data/testuser/test_firewall")
+        assert result["version"] == "1"
+        assert "rev" not in result and "rev_epoch" not in result
+        assert document_cache_stats()["hits"] == 1
+
+    def test_revision_change_is_cache_miss(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        coll.update_one(
+            {"_id": "test_firewall"}, {"$set": {"version": "9"}, "$inc": {"rev": 1}}
+        )
+        result = read_user_data_file("data/testuser/test_firewall")
+        assert result["version"] == "9"
+        assert document_cache_stats()["misses"] == 1
+
+    def test_write_through_keeps_untouched_top_level_keys(self, mock_mongo, sample_user_data):
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        write_user_data_file("data/testuser/test_firewall", {"extra-items": ["x"]})
+        result = read_user_data_file("data/testuser/test_firewall")
+        stored = mock_mongo["test_db"]["testuser"].find_one({"_id": "test_firewall"})
+        assert document_cache_stats()["hits"] == 1
+        assert result["extra-items"] == ["x"]
+        assert result["ipv4"] == stored["ipv4"]
+
+    def test_recreated_firewall_is_not_served_stale(self, mock_mongo, sample_user_data):
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        read_user_data_file("data/testuser/test_firewall")
+        # Another process deletes and re-creates the firewall with rev 1.
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.delete_one({"_id": "test_firewall"})
+        coll.insert_one(
+            {"_id": "test_firewall", "version": "1", "system": {}, "rev": 1, "rev_epoch": "new"}
+        )
+        result = read_user_data_file("data/testuser/test_firewall")
+        assert "ipv4" not in result
+
+    def test_legacy_document_without_revision_not_cached(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.insert_one({"_id": "test_firewall", **sample_user_data})
+        read_user_data_file("data/testuser/test_firewall")
+        assert document_cache_stats()["entries"] == 0
+
+    def test_delete_invalidates(self, mock_mongo, sample_user_data):
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        delete_user_data_file("data/testuser/test_firewall")
+        assert document_cache_stats()["entries"] == 0
+        assert read_user_data_file("data/testuser/test_firewall") is None
+
+
 # ===========================================================================
 # write_user_data_file (MongoDB)
 # ===========================================================================
@@ -586,6 +949,27 @@ class TestWriteUserDataFile:
         assert doc["firewall"] == "test_firewall"
         assert doc["snapshot"] == "snap_2024"
 
+    def test_write_snapshot_series_is_delta_compressed(self, mock_mongo, sample_user_data):
+        for n in range(3):
+            sample_user_data["extra-items"] = [f"set item {n}"]
+            write_user_data_file(
+                "data/testuser/test_firewall",
+                copy.deepcopy(sample_user_data),
+                snapshot=f"snap{n}",
+            )
+        coll = mock_mongo["test_db"]["testuser"]
+        assert coll.find_one({"snapshot": "snap0"})["keyframe"] is True
+        assert "ipv4" not in coll.find_one({"snapshot": "snap2"})
+
+        result = read_user_data_file("data/testuser/test_firewall", snapshot="snap1")
+        assert result["extra-items"] == ["set item 1"]
+        assert result["ipv4"] == sample_user_data["ipv4"]
+        for field in ["seq", "depth", "delta", "keyframe"]:
+            assert field not in result
+        session = {"username": "testuser", "firewall_name": "test_firewall"}
+        names = [snapshot["name"] for snapshot in list_snapshots(session)]
+        assert names == ["snap0", "snap1", "snap2"]
+
     def test_write_current_removes_firewall_and_snapshot_fields(self, mock_mongo):
         data = {
             "version": "1",
@@ -599,6 +983,222 @@ class TestWriteUserDataFile:
         assert "snapshot" not in doc
 
 
+# ===========================================================================
+# apply_user_data_update / update_user_data_file
+# ===========================================================================
+
+
+class TestApplyUserDataUpdate:
+    def test_set_creates_parents(self):
+        data = {}
+        apply_user_data_update(data, set_fields={("ipv4", "chains", "WAN", "10"): {"a": 1}})
+        assert data == {"ipv4": {"chains": {"WAN": {"10": {"a": 1}}}}}
+
+    def test_unset_ignores_missing(self):
+        data = {"ipv4": {"chains": {"WAN": {"10": {}}}}}
+        apply_user_data_update(
+            data, unset_fields=[("ipv4", "chains", "WAN", "10"), ("ipv6", "chains")]
+        )
+        assert data == {"ipv4": {"chains": {"WAN": {}}}}
+
+    def test_push_creates_list(self):
+        data = {}
+        apply_user_data_update(data, push_fields={("interfaces",): {"name": "eth0"}})
+        assert data == {"interfaces": [{"name": "eth0"}]}
+
+    def test_pull_value_and_matching_dict(self):
+        data = {
+            "order": ["10", "20"],
+            "interfaces": [{"name": "eth0", "description": "x"}, {"name": "eth1"}],
+        }
+        apply_user_data_update(
+            data,
+            pull_fields={("order",): "10", ("interfaces",): {"name": "eth0"}},
+        )
+        assert data == {"order": ["20"], "interfaces": [{"name": "eth1"}]}
+
+
+class TestUpdateUserDataFile:
+    @pytest.fixture(autouse=True)
+    def clear_document_cache(self):
+        document_cache_clear()
+        yield
+        document_cache_clear()
+
+    def test_sends_dotted_paths(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        update_user_data_file(
+            "data/testuser/test_firewall",
+            set_fields={
+                ("ipv4", "chains", "WAN_LOCAL", "10"): {"action": "accept"},
+                ("ipv4", "chains", "WAN_LOCAL", "rule-order"): ["10"],
+            },
+        )
+        doc = coll.find_one({"_id": "test_firewall"})
+        assert doc["ipv4"]["chains"]["WAN_LOCAL"]["10"] == {"action": "accept"}
+        assert doc["ipv4"]["chains"]["WAN_LOCAL"]["default"] == {"default_action": "drop"}
+        assert doc["rev"] == 2
+
+    def test_update_operators_match_in_memory_apply(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        data = copy.deepcopy(sample_user_data)
+        data["interfaces"] = [{"name": "eth0"}, {"name": "eth1"}]
+        data["ipv4"]["chains"]["WAN_LOCAL"]["rule-order"] = ["10", "20"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(data))
+        fields = {
+            "unset_fields": [("ipv4", "groups")],
+            "push_fields": {("flowtables",): {"name": "FT"}},
+            "pull_fields": {
+                ("interfaces",): {"name": "eth0"},
+                ("ipv4", "chains", "WAN_LOCAL", "rule-order"): "10",
+            },
+        }
+        update_user_data_file("data/testuser/test_firewall", **fields)
+        doc = coll.find_one({"_id": "test_firewall"}, {"rev": 0, "rev_epoch": 0})
+        assert doc == {"_id": "test_firewall", **apply_user_data_update(data, **fields)}
+
+    def test_write_through_keeps_cache_valid(self, mock_mongo, sample_user_data):
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        update_user_data_file(
+            "data/testuser/test_firewall", set_fields={("system", "port"): "2222"}
+        )
+        result = read_user_data_file("data/testuser/test_firewall")
+        assert result["system"]["port"] == "2222"
+        assert document_cache_stats()["hits"] == 1
+
+    def test_dotted_key_falls_back_to_full_write(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        update_user_data_file(
+            "data/testuser/test_firewall",
+            set_fields={("ipv4", "groups", "net.10"): {"group_type": "network-group"}},
+        )
+        doc = coll.find_one({"_id": "test_firewall"})
+        assert doc["ipv4"]["groups"]["net.10"] == {"group_type": "network-group"}
+
+    def test_missing_firewall_is_not_created(self, mock_mongo):
+        update_user_data_file(
+            "data/testuser/missing_fw", set_fields={("system", "port"): "22"}
+        )
+        assert mock_mongo["test_db"]["testuser"].find_one({"_id": "missing_fw"}) is None
+
+    def test_no_fields_no_write(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        update_user_data_file("data/testuser/test_firewall")
+        assert coll.find_one({"_id": "test_firewall"})["rev"] == 1
+
+
+# ===========================================================================
+# Optimistic concurrency (expected_revision / mutate_user_data_file)
+# ===========================================================================
+
+
+class TestOptimisticConcurrency:
+    FILENAME = "data/testuser/test_firewall"
+
+    @pytest.fixture(autouse=True)
+    def clear_document_cache(self):
+        document_cache_clear()
+        yield
+        document_cache_clear()
+
+    @staticmethod
+    def _concurrent_edit(coll, port):
+        coll.update_one(
+            {"_id": "test_firewall"},
+            {"$set": {"system.port": port}, "$inc": {"rev": 1}},
+        )
+
+    def test_read_with_revision(self, mock_mongo, sample_user_data):
+        write_user_data_file(self.FILENAME, copy.deepcopy(sample_user_data))
+        user_data, revision = read_user_data_with_revision(self.FILENAME)
+        assert user_data["version"] == "1"
+        assert revision[1] == 1
+
+    def test_read_with_revision_missing(self, mock_mongo):
+        assert read_user_data_with_revision(self.FILENAME) == (None, None)
+
+    def test_update_at_stale_revision_rejected(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file(self.FILENAME, copy.deepcopy(sample_user_data))
+        _, revision = read_user_data_with_revision(self.FILENAME)
+        self._concurrent_edit(coll, "2222")
+        assert not update_user_data_file(
+            self.FILENAME,
+            set_fields={("system", "hostname"): "10.0.0.1"},
+            expected_revision=revision,
+        )
+        assert coll.find_one({"_id": "test_firewall"})["system"]["hostname"] == "192.168.1.1"
+
+    def test_update_at_current_revision_applied(self, mock_mongo, sample_user_data):
+        write_user_data_file(self.FILENAME, copy.deepcopy(sample_user_data))
+        _, revision = read_user_data_with_revision(self.FILENAME)
+        assert update_user_data_file(
+            self.FILENAME,
+            set_fields={("system", "hostname"): "10.0.0.1"},
+            expected_revision=revision,
+        )
+
+    def test_write_at_stale_revision_rejected(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file(self.FILENAME, copy.deepcopy(sample_user_data))
+        user_data, revision = read_user_data_with_revision(self.FILENAME)
+        self._concurrent_edit(coll, "2222")
+        user_data["system"]["hostname"] = "10.0.0.1"
+        assert not write_user_data_file(self.FILENAME, user_data, expected_revision=revision)
+        assert coll.find_one({"_id": "test_firewall"})["system"]["port"] == "2222"
+
+    def test_mutate_reapplies_change_after_conflict(self, app, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file(self.FILENAME, copy.deepcopy(sample_user_data))
+        seen = []
+
+        def build_update(user_data):
+            seen.append(user_data["system"]["port"])
+            if len(seen) == 1:
+                # Another session saves between our read and our write.
+                self._concurrent_edit(coll, "2222")
+            order = user_data["ipv4"]["chains"]["WAN_LOCAL"]["rule-order"] + ["10"]
+            return {
+                "set_fields": {("ipv4", "chains", "WAN_LOCAL", "rule-order"): order}
+            }
+
+        with app.test_request_context():
+            assert mutate_user_data_file(self.FILENAME, build_update)
+
+        doc = coll.find_one({"_id": "test_firewall"})
+        assert seen == ["22", "2222"]
+        assert doc["system"]["port"] == "2222"
+        assert doc["ipv4"]["chains"]["WAN_LOCAL"]["rule-order"] == ["10"]
+
+    def test_mutate_reports_conflict_when_retries_exhausted(
+        self, app, mock_mongo, sample_user_data
+    ):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file(self.FILENAME, copy.deepcopy(sample_user_data))
+
+        def build_update(user_data):
+            self._concurrent_edit(coll, "2222")
+            return {"set_fields": {("system", "hostname"): "10.0.0.1"}}
+
+        with app.test_request_context():
+            from flask import get_flashed_messages
+
+            assert not mutate_user_data_file(self.FILENAME, build_update, retries=2)
+            messages = get_flashed_messages(with_categories=True)
+        assert any(cat == "danger" and "another session" in msg for cat, msg in messages)
+        assert coll.find_one({"_id": "test_firewall"})["system"]["hostname"] == "192.168.1.1"
+
+    def test_mutate_abandoned_by_builder(self, app, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file(self.FILENAME, copy.deepcopy(sample_user_data))
+        with app.test_request_context():
+            assert not mutate_user_data_file(self.FILENAME, lambda user_data: None)
+        assert coll.find_one({"_id": "test_firewall"})["rev"] == 1
+
+
 # ===========================================================================
 # delete_user_data_file (MongoDB)
 # ===========================================================================
@@ -623,6 +1223,20 @@ class TestDeleteUserDataFile:
         )
         assert doc is None
 
+    def test_delete_snapshot_keeps_later_snapshots(self, mock_mongo, sample_user_data):
+        for n in range(3):
+            sample_user_data["extra-items"] = [f"set item {n}"]
+            write_user_data_file(
+                "data/testuser/test_firewall",
+                copy.deepcopy(sample_user_data),
+                snapshot=f"snap{n}",
+            )
+
+        delete_user_data_file("data/testuser/test_firewall/snap1")
+
+        result = read_user_data_file("data/testuser/test_firewall", snapshot="snap2")
+        assert result["extra-items"] == ["set item 2"]
+
     def test_delete_nonexistent_no_error(self, mock_mongo):
         # Should not raise an exception
         delete_user_data_file("data/testuser/nonexistent_fw")
@@ -761,6 +1375,385 @@ class TestWriteUserCommandConfFile:
         content = conf_path.read_text()
         assert "delete firewall" in content
 
+    def test_write_from_generator(self, tmp_path):
+        session = {
+            "data_dir": str(tmp_path),
+            "firewall_name": "test_fw",
+        }
+        commands = (f"set firewall name RULE_{i}" for i in range(3))
+        write_user_command_conf_file(session, commands)
+        conf_path = tmp_path / "test_fw.conf"
+        content = conf_path.read_text()
+        assert content == "".join(f"set firewall name RULE_{i}\n" for i in range(3))
+
+
+# ===========================================================================
+# read_user_snapshot_series
+# ===========================================================================
+
+
+class TestReadUserSnapshotSeries:
+    def test_reads_series(self, mock_mongo, sample_user_data):
+        filename = "data/testuser/test_firewall"
+        write_user_data_file(filename, copy.deepcopy(sample_user_data))
+        for n in range(3):
+            data = copy.deepcopy(sample_user_data)
+            data["extra-items"] = [f"item {n}"]
+            write_user_data_file(filename, data, snapshot=f"snap{n}")
+
+        series = read_user_snapshot_series(filename, last=2)
+
+        assert [snapshot["snapshot"] for snapshot in series] == ["snap1", "snap2"]
+        assert series[1]["extra-items"] == ["item 2"]
+        assert series[1]["firewall"] == "test_firewall"
+
+
+# ===========================================================================
+# read_diff_cache / write_diff_cache
+# ===========================================================================
+
+
+class TestDiffCacheStore:
+    def test_disabled_by_default(self, mock_mongo, monkeypatch):
+        monkeypatch.delenv("DIFF_CACHE_MONGO_DATABASE", raising=False)
+        write_diff_cache("k", "<p>diff</p>")
+        assert read_diff_cache("k") is None
+        assert mock_mongo.list_database_names() == []
+
+    def test_round_trip(self, mock_mongo, monkeypatch):
+        monkeypatch.setenv("DIFF_CACHE_MONGO_DATABASE", "diff_db")
+        assert read_diff_cache("k") is None
+        write_diff_cache("k", "<p>diff</p>")
+        write_diff_cache("k", "<p>diff 2</p>")
+        assert read_diff_cache("k") == "<p>diff 2</p>"
+        doc = mock_mongo["diff_db"]["snapshot_diffs"].find_one({"_id": "k"})
+        assert "created" in doc
+        # Never stored alongside the user collections
+        assert mock_mongo["test_db"].list_collection_names() == []
+
+    def test_ttl_index(self, mock_mongo, monkeypatch):
+        monkeypatch.setenv("DIFF_CACHE_MONGO_DATABASE", "diff_db")
+        monkeypatch.setenv("DIFF_CACHE_MONGO_TTL", "60")
+        write_diff_cache("k", "<p>diff</p>")
+        indexes = mock_mongo["diff_db"]["snapshot_diffs"].index_information()
+        assert indexes["created_1"]["expireAfterSeconds"] == 60
+
+    def test_oversized_not_stored(self, mock_mongo, monkeypatch):
+        monkeypatch.setenv("DIFF_CACHE_MONGO_DATABASE", "diff_db")
+        monkeypatch.setattr("package.data_file_functions.DIFF_CACHE_MAX_DOCUMENT", 4)
+        write_diff_cache("k", "<p>diff</p>")
+        assert read_diff_cache("k") is None
+
+    def test_errors_are_a_miss(self, monkeypatch):
+        import pymongo
+
+        client = MagicMock()
+        collection = client.__getitem__.return_value.__getitem__.return_value
+        collection.find_one.side_effect = pymongo.errors.ServerSelectionTimeoutError()
+        collection.replace_one.side_effect = pymongo.errors.ServerSelectionTimeoutError()
+        monkeypatch.setattr("package.data_file_functions._get_mongo_client", lambda: client)
+        monkeypatch.setattr("package.data_file_functions._diff_cache_indexed", True)
+        monkeypatch.setenv("DIFF_CACHE_MONGO_DATABASE", "diff_db")
+        write_diff_cache("k", "<p>diff</p>")
+        assert read_diff_cache("k") is None
+
+
+# ===========================================================================
+# create_job_record, read_job_record, update_job_record
+# ===========================================================================
+
+
+class TestJobStore:
+    def test_round_trip(self, mock_mongo, monkeypatch):
+        monkeypatch.delenv("JOB_MONGO_DATABASE", raising=False)
+        create_job_record({"_id": "j1", "username": "testuser", "status": "queued"})
+        update_job_record("j1", {"status": "done", "message": "ok"})
+        job = read_job_record("j1", "testuser")
+        assert job["status"] == "done"
+        assert job["message"] == "ok"
+        assert "created" in job
+        # Never stored alongside the user collections
+        assert mock_mongo["test_db"].list_collection_names() == []
+        assert mock_mongo["test_db_jobs"]["device_jobs"].count_documents({}) == 1
+
+    def test_other_user_not_found(self, mock_mongo):
+        create_job_record({"_id": "j1", "username": "testuser", "status": "queued"})
+        assert read_job_record("j1", "otheruser") is None
+
+    def test_ttl_index(self, mock_mongo, monkeypatch):
+        monkeypatch.setenv("JOB_MONGO_DATABASE", "job_db")
+        monkeypatch.setenv("JOB_MONGO_TTL", "60")
+        create_job_record({"_id": "j1", "username": "testuser"})
+        indexes = mock_mongo["job_db"]["device_jobs"].index_information()
+        assert indexes["created_1"]["expireAfterSeconds"] == 60
+
+
+# ===========================================================================
+# delete_profile_record, read_profile_records, write_profile_record
+# ===========================================================================
+
+
+class TestProfileStore:
+    def test_round_trip(self, mock_mongo, monkeypatch):
+        monkeypatch.delenv("PROFILE_MONGO_DATABASE", raising=False)
+        write_profile_record("testuser", "Routes", ["show ip route"])
+        write_profile_record("testuser", "Interfaces", ["show interfaces"])
+        assert read_profile_records("testuser") == {
+            "Interfaces": ["show interfaces"],
+            "Routes": ["show ip route"],
+        }
+        # Never stored alongside the user collections
+        assert mock_mongo["test_db"].list_collection_names() == []
+        profiles = mock_mongo["test_db_profiles"]["collection_profiles"]
+        assert profiles.count_documents({}) == 2
+
+    def test_overwrite(self, mock_mongo):
+        write_profile_record("testuser", "Routes", ["show ip route"])
+        write_profile_record("testuser", "Routes", ["show ip route", "show arp"])
+        assert read_profile_records("testuser") == {
+            "Routes": ["show ip route", "show arp"]
+        }
+
+    def test_per_user(self, mock_mongo):
+        write_profile_record("testuser", "Routes", ["show ip route"])
+        assert read_profile_records("otheruser") == {}
+        assert not delete_profile_record("otheruser", "Routes")
+
+    def test_delete(self, mock_mongo, monkeypatch):
+        monkeypatch.setenv("PROFILE_MONGO_DATABASE", "profile_db")
+        write_profile_record("testuser", "Routes", ["show ip route"])
+        assert delete_profile_record("testuser", "Routes")
+        assert not delete_profile_record("testuser", "Routes")
+        assert read_profile_records("testuser") == {}
+        assert mock_mongo["profile_db"]["collection_profiles"].count_documents({}) == 0
+
+
+# ===========================================================================
+# Rule hit store: counters and buckets
+# ===========================================================================
+
+
+class TestRuleHitStore:
+    def _bucket(self, firewall, start):
+        return {
+            "username": "testuser",
+            "firewall": firewall,
+            "resolution": "raw",
+            "start": start,
+            "end": start + 3600,
+            "times": [300],
+            "rules": ["ipv4 name WAN_IN rule 10"],
+            "packets": [[1]],
+            "bytes": [[60]],
+        }
+
+    def test_counters_round_trip(self, mock_mongo):
+        assert read_rule_counters("testuser", "fw1") is None
+        write_rule_counters("testuser", "fw1", 100, {"ipv4 name A rule 1": (5, 300)})
+        write_rule_counters("testuser", "fw1", 200, {"ipv4 name A rule 1": (7, 420)})
+        assert read_rule_counters("testuser", "fw1") == (
+            200,
+            {"ipv4 name A rule 1": (7, 420)},
+        )
+        assert read_rule_counters("otheruser", "fw1") is None
+        # Never stored alongside the user collections
+        assert mock_mongo["test_db"].list_collection_names() == []
+
+    def test_buckets_by_window(self, mock_mongo, monkeypatch):
+        monkeypatch.setenv("RULE_STATS_MONGO_DATABASE", "stats_db")
+        start = int(time.time()) // 3600 * 3600
+        write_rule_hit_bucket(self._bucket("fw1", start))
+        write_rule_hit_bucket(self._bucket("fw2", start))
+        write_rule_hit_bucket(self._bucket("fw1", start + 3600))
+        # Replaces the bucket of the same firewall and start
+        write_rule_hit_bucket(self._bucket("fw1", start))
+
+        buckets = read_rule_hit_buckets("testuser", "raw", since=start + 3599)
+        assert [(b["firewall"], b["start"]) for b in buckets] == [
+            ("fw1", start),
+            ("fw2", start),
+            ("fw1", start + 3600),
+        ]
+        assert len(read_rule_hit_buckets("testuser", "raw", until=start + 1)) == 2
+        assert len(read_rule_hit_buckets("testuser", "raw", firewall="fw2")) == 1
+        assert read_rule_hit_buckets("testuser", "hourly") == []
+
+        delete_rule_hit_buckets([b["_id"] for b in buckets[:2]])
+        assert mock_mongo["stats_db"]["rule_hit_buckets"].count_documents({}) == 1
+
+    def test_ttl_index(self, mock_mongo, monkeypatch):
+        monkeypatch.setenv("RULE_STATS_MONGO_TTL", "60")
+        write_rule_counters("testuser", "fw1", 100, {})
+        indexes = mock_mongo["test_db_rule_stats"]["rule_hit_buckets"].index_information()
+        assert indexes["end_date_1"]["expireAfterSeconds"] == 60
+
+
+# ===========================================================================
+# restore_snapshot
+# ===========================================================================
+
+
+class TestRestoreSnapshot:
+    @pytest.fixture(autouse=True)
+    def clear_document_cache(self):
+        document_cache_clear()
+        yield
+        document_cache_clear()
+
+    def _insert_snapshot(self, coll, sample_user_data):
+        snap_data = copy.deepcopy(sample_user_data)
+        snap_data["firewall"] = "test_firewall"
+        snap_data["snapshot"] = "snap1"
+        snap_data["tag"] = "known-good"
+        snap_data["extra-items"] = ["snapshot item"]
+        coll.insert_one(snap_data)
+
+    def test_replaces_current(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        coll.update_one({"_id": "test_firewall"}, {"$set": {"interfaces": [{"name": "eth0"}]}})
+        self._insert_snapshot(coll, sample_user_data)
+
+        assert restore_snapshot("data/testuser/test_firewall", "snap1")
+
+        current = coll.find_one({"_id": "test_firewall"})
+        assert current["extra-items"] == ["snapshot item"]
+        assert "interfaces" not in current
+        for field in ["firewall", "snapshot", "tag"]:
+            assert field not in current
+        # The snapshot itself is kept.
+        assert coll.count_documents({"firewall": "test_firewall", "snapshot": "snap1"}) == 1
+
+    def test_restored_document_served_fresh(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        read_user_data_file("data/testuser/test_firewall")
+        self._insert_snapshot(coll, sample_user_data)
+
+        restore_snapshot("data/testuser/test_firewall", "snap1")
+
+        result = read_user_data_file("data/testuser/test_firewall")
+        assert result["extra-items"] == ["snapshot item"]
+
+    def test_rejects_writes_based_on_replaced_document(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        _, revision = read_user_data_with_revision("data/testuser/test_firewall")
+        self._insert_snapshot(coll, sample_user_data)
+
+        restore_snapshot("data/testuser/test_firewall", "snap1")
+
+        assert not update_user_data_file(
+            "data/testuser/test_firewall",
+            set_fields={("system", "port"): "2222"},
+            expected_revision=revision,
+        )
+
+    def test_restores_delta_snapshot(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        for n in range(3):
+            sample_user_data["extra-items"] = [f"set item {n}"]
+            write_user_data_file(
+                "data/testuser/test_firewall",
+                copy.deepcopy(sample_user_data),
+                snapshot=f"snap{n}",
+            )
+
+        assert restore_snapshot("data/testuser/test_firewall", "snap2")
+
+        current = coll.find_one({"_id": "test_firewall"})
+        assert current["extra-items"] == ["set item 2"]
+        for field in ["seq", "depth", "delta", "keyframe", "firewall", "snapshot"]:
+            assert field not in current
+
+    def test_missing_snapshot(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        write_user_data_file("data/testuser/test_firewall", copy.deepcopy(sample_user_data))
+        assert not restore_snapshot("data/testuser/test_firewall", "nope")
+        assert coll.find_one({"_id": "test_firewall"})["version"] == "1"
+
+
+# ===========================================================================
+# upgrade_user_data / upgrade_user_data_files
+# ===========================================================================
+
+
+class TestUpgradeUserData:
+    def test_current_document_unchanged(self, sample_user_data):
+        assert not upgrade_user_data(sample_user_data)
+
+    def test_adds_version_and_system(self):
+        user_data = {"ipv4": {"tables": {"A": {}}}}
+        assert upgrade_user_data(user_data)
+        assert user_data == {
+            "ipv4": {"chains": {"A": {}}},
+            "version": "1",
+            "system": {"hostname": "None", "port": "None"},
+        }
+
+    def test_upgrade_user_data_files(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.insert_one({"_id": "fw1", "ipv4": {"tables": {}}})
+        coll.insert_one({"firewall": "fw1", "snapshot": "snap1", "version": "1"})
+        coll.insert_one({"_id": "fw2", **sample_user_data})
+
+        upgrade_user_data_files()
+
+        current = coll.find_one({"_id": "fw1"})
+        assert current["version"] == "1"
+        assert current["ipv4"] == {"chains": {}}
+        snapshot = coll.find_one({"firewall": "fw1", "snapshot": "snap1"})
+        assert snapshot["system"] == {"hostname": "None", "port": "None"}
+        assert "rev" not in coll.find_one({"_id": "fw2"})
+
+    def test_upgrade_skips_delta_snapshots(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        for n in range(2):
+            sample_user_data["extra-items"] = [f"set item {n}"]
+            write_user_data_file(
+                "data/testuser/test_firewall",
+                copy.deepcopy(sample_user_data),
+                snapshot=f"snap{n}",
+            )
+        before = coll.find_one({"snapshot": "snap1"})
+
+        upgrade_user_data_files()
+
+        assert coll.find_one({"snapshot": "snap1"}) == before
+
+    def test_migrate_user_snapshots(self, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        for n in range(3):
+            coll.insert_one(
+                {
+                    "firewall": "test_firewall",
+                    "snapshot": f"snap{n}",
+                    **sample_user_data,
+                    "extra-items": [f"set item {n}"],
+                }
+            )
+
+        assert migrate_user_snapshots() == 3
+        assert migrate_user_snapshots() == 0
+
+        assert "delta" in coll.find_one({"snapshot": "snap2"})
+        result = read_user_data_file("data/testuser/test_firewall", snapshot="snap2")
+        assert result["extra-items"] == ["set item 2"]
+
+    def test_mutate_saves_upgrade_before_change(self, app, mock_mongo):
+        coll = mock_mongo["test_db"]["testuser"]
+        coll.insert_one({"_id": "test_firewall", "ipv4": {"tables": {"A": {"rule-order": []}}}})
+
+        def build_update(user_data):
+            return {"set_fields": {("ipv4", "chains", "B", "rule-order"): []}}
+
+        with app.test_request_context():
+            assert mutate_user_data_file("data/testuser/test_firewall", build_update)
+
+        doc = coll.find_one({"_id": "test_firewall"})
+        assert set(doc["ipv4"]["chains"]) == {"A", "B"}
+        assert "tables" not in doc["ipv4"]
+
 
 # ===========================================================================
 # tag_snapshot
@@ -789,6 +1782,29 @@ class TestTagSnapshot:
         doc = coll.find_one({"firewall": "test_firewall", "snapshot": "snap_2024"})
         assert doc["tag"] == "pre-upgrade"
 
+    def test_tag_snapshot_keeps_delta(self, app, mock_mongo, sample_user_data):
+        coll = mock_mongo["test_db"]["testuser"]
+        for n in range(2):
+            sample_user_data["extra-items"] = [f"set item {n}"]
+            write_user_data_file(
+                "data/testuser/test_firewall",
+                copy.deepcopy(sample_user_data),
+                snapshot=f"snap{n}",
+            )
+        request = make_request(
+            {
+                "firewall_name": "test_firewall",
+                "snapshot_name": "snap1",
+                "snapshot_tag": "pre-upgrade",
+            }
+        )
+        with app.test_request_context():
+            tag_snapshot({"username": "testuser"}, request)
+
+        doc = coll.find_one({"firewall": "test_firewall", "snapshot": "snap1"})
+        assert doc["tag"] == "pre-upgrade"
+        assert "delta" in doc
+
     def test_tag_snapshot_flashes_success(self, app, mock_mongo, sample_user_data):
         db = mock_mongo["test_db"]
         coll = db["testuser"]
@@ -1,6 +1,43 @@
+import copy
 from unittest.mock import Mock, patch
 
-from package.diff_functions import fix_list, process_diff
+import pytest
+
+import package.diff_functions as diff_functions_module
+from package.cache_functions import diff_cache_clear
+from package.diff_functions import (
+    PatienceSequenceMatcher,
+    content_hash,
+    fix_list,
+    process_diff,
+    render_structural_diff,
+    render_unified_diff,
+    snapshot_timeline,
+    structural_diff,
+    unified_hunks,
+)
+from package.generate_config import iter_config_lines
+
+
+@pytest.fixture(autouse=True)
+def clear_diff_cache():
+    diff_cache_clear()
+    yield
+    diff_cache_clear()
+
+
+@pytest.fixture
+def patch_snapshots():
+    """Patches read_user_data_file in package.diff_functions to return the
+    document of each snapshot from a dict keyed by snapshot name."""
+
+    def _factory(snapshots):
+        return patch(
+            "package.diff_functions.read_user_data_file",
+            side_effect=lambda filename, snapshot: copy.deepcopy(snapshots[snapshot]),
+        )
+
+    return _factory
 
 
 def test_fix_list():
@@ -25,12 +62,14 @@ def test_fix_list():
     assert fix_list(["\n\n"]) == [" ", " ", " "]
 
 
-def test_process_diff(app, mock_session):
+def test_process_diff(app, mock_session, patch_snapshots):
     with app.test_request_context():
         mock_request = Mock()
-        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap2"}
+        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap2", "view": "text"}
 
-        with patch("package.diff_functions.generate_config") as mock_generate:
+        with patch_snapshots({"snap1": {}, "snap2": {}}), patch(
+            "package.diff_functions.generate_config"
+        ) as mock_generate:
             mock_generate.side_effect = [
                 ("", ["# Config A\nset firewall rule 1"]),
                 ("", ["# Config B\nset firewall rule 2"]),
@@ -46,13 +85,15 @@ def test_process_diff(app, mock_session):
             assert "Snapshot: snap2" in result
 
 
-def test_process_diff_identical_snapshots(app, mock_session):
+def test_process_diff_identical_snapshots(app, mock_session, patch_snapshots):
     with app.test_request_context():
         mock_request = Mock()
-        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap1"}
+        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap1", "view": "text"}
 
         config_lines = ["# Same config\nset firewall rule 1"]
-        with patch("package.diff_functions.generate_config") as mock_generate:
+        with patch_snapshots({"snap1": {}}), patch(
+            "package.diff_functions.generate_config"
+        ) as mock_generate:
             mock_generate.return_value = ("", config_lines)
 
             result = process_diff(mock_session, mock_request)
@@ -61,14 +102,420 @@ def test_process_diff_identical_snapshots(app, mock_session):
             assert "Snapshot: snap1" in result
 
 
-def test_process_diff_empty_configs(app, mock_session):
+def test_process_diff_empty_configs(app, mock_session, patch_snapshots):
     with app.test_request_context():
         mock_request = Mock()
-        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap2"}
+        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap2", "view": "text"}
 
-        with patch("package.diff_functions.generate_config") as mock_generate:
+        with patch_snapshots({"snap1": {}, "snap2": {}}), patch(
+            "package.diff_functions.generate_config"
+        ) as mock_generate:
             mock_generate.return_value = ("", [])
 
             result = process_diff(mock_session, mock_request)
 
             assert isinstance(result, str)
+
+
+def test_structural_diff_identical(example_user_data):
+    assert structural_diff(example_user_data, copy.deepcopy(example_user_data)) == []
+
+
+def test_structural_diff_ignores_bookkeeping(example_user_data):
+    old = copy.deepcopy(example_user_data)
+    new = copy.deepcopy(example_user_data)
+    old.update({"_id": "a", "snapshot": "snap1", "rev": 1, "version": "0"})
+    new.update({"_id": "b", "snapshot": "snap2", "seq": 4, "tag": "Tag"})
+
+    assert structural_diff(old, new) == []
+
+
+def test_structural_diff_rule_changes(example_user_data):
+    old = example_user_data
+    new = copy.deepcopy(old)
+    chain = new["ipv4"]["chains"]["WAN_LOCAL"]
+    chain["10"]["description"] = "Edited"
+    chain["99"] = {"description": "New", "action": "drop"}
+    chain["rule-order"].append("99")
+    del new["ipv4"]["chains"]["WAN_IN"]["20"]
+
+    changes = structural_diff(old, new)
+    by_path = {tuple(change["path"]): change for change in changes}
+
+    edited = by_path[("IPv4", "Chain WAN_LOCAL", "Rule 10")]
+    assert edited["action"] == "changed"
+    assert edited["fields"] == [("description", "Allow established/related.", "Edited")]
+
+    added = by_path[("IPv4", "Chain WAN_LOCAL", "Rule 99")]
+    assert added["action"] == "added"
+    assert ("action", None, "drop") in added["fields"]
+
+    removed = by_path[("IPv4", "Chain WAN_IN", "Rule 20")]
+    assert removed["action"] == "removed"
+    assert ("action", "drop", None) in removed["fields"]
+
+    order = by_path[("IPv4", "Chain WAN_LOCAL")]
+    assert order["fields"] == [("rule-order", ["10", "20"], ["10", "20", "99"])]
+
+    assert len(changes) == 4
+
+
+def test_structural_diff_groups_filters_and_sections(example_user_data):
+    old = example_user_data
+    new = copy.deepcopy(old)
+    new["ipv6"]["groups"]["Web_Ports"]["group_value"] = ["443"]
+    new["ipv4"]["filters"]["input"]["default-action"] = "drop"
+    new["ipv4"]["filters"]["input"]["rules"]["10"]["description"] = "Edited"
+    new["extra-items"] = ["set system host-name fw"]
+    new["flowtables"] = [{"name": "FT", "interfaces": ["eth0"], "description": ""}]
+
+    changes = structural_diff(old, new)
+    by_path = {tuple(change["path"]): change for change in changes}
+
+    assert by_path[("IPv6", "Group Web_Ports")]["fields"] == [
+        ("group_value", ["80", "443"], ["443"])
+    ]
+    assert by_path[("IPv4", "Filter input")]["fields"] == [
+        ("default-action", "accept", "drop")
+    ]
+    assert by_path[("IPv4", "Filter input", "Rule 10")]["action"] == "changed"
+    assert by_path[("Extra Items",)]["fields"] == [
+        ("value", None, "set system host-name fw")
+    ]
+    assert by_path[("Flowtables FT",)]["action"] == "added"
+
+
+def test_structural_diff_extra_items_removed_and_added():
+    changes = structural_diff(
+        {"extra-items": ["a", "b", "b"]}, {"extra-items": ["b", "c"]}
+    )
+
+    assert [(change["action"], change["fields"]) for change in changes] == [
+        ("removed", [("value", "a", None)]),
+        ("removed", [("value", "b", None)]),
+        ("added", [("value", None, "c")]),
+    ]
+
+
+def test_structural_diff_whole_chain_added(example_user_data):
+    new = copy.deepcopy(example_user_data)
+    del example_user_data["ipv6"]["chains"]["WAN_IN"]
+
+    changes = structural_diff(example_user_data, new)
+
+    assert {change["action"] for change in changes} == {"added"}
+    assert changes[0]["path"] == ["IPv6", "Chain WAN_IN"]
+    assert len(changes) == 1 + len(new["ipv6"]["chains"]["WAN_IN"]["rule-order"])
+
+
+def test_render_structural_diff_escapes_and_summarises():
+    changes = [
+        {
+            "action": "changed",
+            "path": ["IPv4", "Chain <X>", "Rule 10"],
+            "fields": [("description", "old", "<b>new</b>")],
+        }
+    ]
+
+    html = render_structural_diff(changes, "snap1", "current")
+
+    assert "0 added, 0 removed, 1 changed" in html
+    assert "Snapshot: snap1" in html
+    assert "Chain &lt;X&gt;" in html
+    assert "&lt;b&gt;new&lt;/b&gt;" in html
+    assert 'class="diff_chg"' in html
+
+
+def test_render_structural_diff_no_changes():
+    assert "No differences." in render_structural_diff([], "snap1", "snap2")
+
+
+def test_process_diff_structural(app, mock_session, example_user_data):
+    with app.test_request_context():
+        mock_request = Mock()
+        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "current"}
+        new = copy.deepcopy(example_user_data)
+        new["ipv4"]["chains"]["WAN_IN"]["10"]["action"] = "drop"
+
+        with patch(
+            "package.diff_functions.read_user_data_file",
+            side_effect=[example_user_data, new],
+        ) as mock_read, patch("package.diff_functions.generate_config") as mock_generate:
+            result = process_diff(mock_session, mock_request)
+
+        mock_generate.assert_not_called()
+        mock_read.assert_any_call(
+            f'{mock_session["data_dir"]}/{mock_session["firewall_name"]}',
+            snapshot="snap1",
+        )
+        assert "Chain WAN_IN / Rule 10" in result
+        assert '<table class="structural-diff"' in result
+
+
+def test_content_hash_ignores_key_order_and_bookkeeping(example_user_data):
+    reordered = dict(reversed(list(copy.deepcopy(example_user_data).items())))
+    reordered.update({"_id": "x", "snapshot": "snap1", "seq": 3, "rev": 7})
+
+    assert content_hash(reordered) == content_hash(example_user_data)
+
+    example_user_data["ipv4"]["chains"]["WAN_IN"]["10"]["action"] = "drop"
+    assert content_hash(reordered) != content_hash(example_user_data)
+
+
+def test_process_diff_cached(app, mock_session, patch_snapshots, example_user_data):
+    """A repeated review of the same pair is served without re-diffing."""
+    new = copy.deepcopy(example_user_data)
+    new["ipv4"]["chains"]["WAN_IN"]["10"]["action"] = "drop"
+    snapshots = {"snap1": example_user_data, "current": new}
+    mock_request = Mock()
+    mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "current"}
+
+    with app.test_request_context(), patch_snapshots(snapshots), patch(
+        "package.diff_functions.structural_diff", wraps=structural_diff
+    ) as mock_diff:
+        first = process_diff(mock_session, mock_request)
+        second = process_diff(mock_session, mock_request)
+
+        assert second == first
+        assert mock_diff.call_count == 1
+
+        # Editing either side changes the key, so the diff is recomputed
+        snapshots["current"]["ipv4"]["chains"]["WAN_IN"]["10"]["action"] = "reject"
+        third = process_diff(mock_session, mock_request)
+
+        assert mock_diff.call_count == 2
+        assert "reject" in third
+
+
+def test_process_diff_cache_per_view(app, mock_session, patch_snapshots):
+    """The text and structural views of one pair are cached separately."""
+    mock_request = Mock()
+
+    with app.test_request_context(), patch_snapshots(
+        {"snap1": {}, "snap2": {"extra-items": ["set system host-name fw"]}}
+    ), patch(
+        "package.diff_functions.generate_config",
+        return_value=("", ["set system host-name fw"]),
+    ) as mock_generate:
+        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap2"}
+        structural = process_diff(mock_session, mock_request)
+        mock_request.form = {**mock_request.form, "view": "text"}
+        text = process_diff(mock_session, mock_request)
+        process_diff(mock_session, mock_request)
+
+        assert structural != text
+        assert mock_generate.call_count == 2
+
+
+def test_process_diff_served_from_diff_store(app, mock_session, patch_snapshots):
+    """A diff stored by another process is used and kept in process."""
+    mock_request = Mock()
+    mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap2"}
+
+    with app.test_request_context(), patch_snapshots(
+        {"snap1": {}, "snap2": {}}
+    ), patch(
+        "package.diff_functions.read_diff_cache", return_value="<p>stored</p>"
+    ) as mock_read, patch(
+        "package.diff_functions.write_diff_cache"
+    ) as mock_write:
+        assert process_diff(mock_session, mock_request) == "<p>stored</p>"
+        assert process_diff(mock_session, mock_request) == "<p>stored</p>"
+
+        assert mock_read.call_count == 1
+        mock_write.assert_not_called()
+
+
+def test_patience_matcher_reproduces_new_lines():
+    old = ["#", "set a", "#", "set b", "set c", "#", "set d"]
+    new = ["#", "set a", "set x", "#", "set c", "#", "set d", "#"]
+
+    rebuilt = []
+    matcher = PatienceSequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            assert old[i1:i2] == new[j1:j2]
+        rebuilt.extend(new[j1:j2])
+
+    assert rebuilt == new
+
+
+def test_patience_matcher_anchors_on_unique_lines():
+    """Moved blocks are matched on their unique lines, not on blank lines."""
+    old = ["a", "", "b", "", "c"]
+    new = ["c", "", "a", "", "b"]
+
+    matcher = PatienceSequenceMatcher(None, old, new, autojunk=False)
+    equal = [
+        old[i1:i2] for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag == "equal"
+    ]
+
+    assert ["a", "", "b"] in equal
+
+
+def test_unified_hunks_only_changed_regions():
+    old = [f"set firewall rule {i}" for i in range(1000)]
+    new = list(old)
+    new[10] = "set firewall rule 10 changed"
+    new.insert(800, "set firewall rule new")
+
+    hunks = unified_hunks(old, new, context=2)
+
+    assert len(hunks) == 2
+    assert hunks[0]["old_start"] == 9
+    assert hunks[0]["old_count"] == 5
+    assert hunks[0]["lines"] == [
+        [" ", "set firewall rule 8"],
+        [" ", "set firewall rule 9"],
+        ["-", "set firewall rule 10"],
+        ["+", "set firewall rule 10 changed"],
+        [" ", "set firewall rule 11"],
+        [" ", "set firewall rule 12"],
+    ]
+    assert hunks[1]["new_count"] == hunks[1]["old_count"] + 1
+    assert sum(len(hunk["lines"]) for hunk in hunks) < 20
+
+
+def test_unified_hunks_identical():
+    assert unified_hunks(["a", "b"], ["a", "b"]) == []
+    assert unified_hunks([], []) == []
+
+
+def test_render_unified_diff_pages(monkeypatch):
+    monkeypatch.setenv("DIFF_HUNKS_PER_PAGE", "2")
+    hunks = [
+        {
+            "old_start": i,
+            "old_count": 1,
+            "new_start": i,
+            "new_count": 1,
+            "lines": [["-", f"old {i}"], ["+", f"<new {i}>"]],
+        }
+        for i in range(5)
+    ]
+
+    first = render_unified_diff(hunks, "snap1", "current", page=1)
+    last = render_unified_diff(hunks, "snap1", "current", page=99)
+
+    assert "5 changed regions, 5 lines added, 5 lines removed" in first
+    assert "old 1" in first and "old 2" not in first
+    assert "Page 1 of 3" in first
+    assert 'name="page" value="2"' in first and "Previous" not in first
+    assert "old 4" in last and "old 3" not in last
+    assert "Page 3 of 3" in last and "Next" not in last
+    assert "&lt;new 4&gt;" in last
+
+
+def test_process_diff_unified_paginates_from_one_diff(
+    app, mock_session, patch_snapshots, monkeypatch
+):
+    monkeypatch.setenv("DIFF_HUNKS_PER_PAGE", "1")
+    monkeypatch.setenv("DIFF_CONTEXT_LINES", "0")
+    configs = {
+        "snap1": ["set a", "set b", "#", "set c"],
+        "snap2": ["set A", "set b", "#", "set C"],
+    }
+    mock_request = Mock()
+
+    with app.test_request_context(), patch_snapshots(
+        {"snap1": {"extra-items": ["1"]}, "snap2": {"extra-items": ["2"]}}
+    ), patch(
+        "package.diff_functions.iter_config",
+        side_effect=lambda session, snapshot, diff: iter(configs[snapshot]),
+    ) as mock_iter:
+        mock_request.form = {"snapshot_1": "snap1", "snapshot_2": "snap2", "view": "unified"}
+        first = process_diff(mock_session, mock_request)
+        mock_request.form = {**mock_request.form, "page": "2"}
+        second = process_diff(mock_session, mock_request)
+
+    assert mock_iter.call_count == 2
+    assert "set a" in first and "set c" not in first
+    assert "set C" in second and "set A" not in second
+    assert "Page 2 of 2" in second
+
+
+@pytest.fixture
+def snapshot_series(example_user_data):
+    """Five snapshots, each changing the one before it."""
+    series = []
+    data = copy.deepcopy(example_user_data)
+    for n in range(5):
+        data = copy.deepcopy(data)
+        data["ipv4"]["chains"]["WAN_IN"]["10"]["description"] = f"Step {n}"
+        if n == 3:
+            data["ipv4"]["groups"]["NEW"] = {
+                "group_desc": "New",
+                "group_type": "address-group",
+                "group_value": ["10.0.0.1"],
+            }
+        series.append(
+            {"_id": n, "firewall": "test_firewall", "snapshot": f"snap{n}", **data}
+        )
+    series[4]["tag"] = "release"
+    return series
+
+
+def test_snapshot_timeline(mock_session, snapshot_series, monkeypatch):
+    monkeypatch.setenv("TIMELINE_WORKERS", "1")
+    with patch(
+        "package.diff_functions.read_user_snapshot_series",
+        return_value=snapshot_series,
+    ) as mock_series, patch(
+        "package.diff_functions.iter_config_lines", wraps=iter_config_lines
+    ) as mock_generate:
+        steps = snapshot_timeline(mock_session, last=5)
+
+    mock_series.assert_called_once_with("data/testuser/test_firewall", 5)
+    # Each snapshot is generated once
+    assert mock_generate.call_count == 5
+    assert [(step["from"], step["to"]) for step in steps] == [
+        ("snap0", "snap1"),
+        ("snap1", "snap2"),
+        ("snap2", "snap3"),
+        ("snap3", "snap4"),
+    ]
+    assert steps[0] == {
+        "from": "snap0",
+        "to": "snap1",
+        "tag": "",
+        "added": 0,
+        "removed": 0,
+        "changed": 1,
+        "lines_added": 1,
+        "lines_removed": 1,
+        "items": ["changed: IPv4 / Chain WAN_IN / Rule 10"],
+    }
+    assert steps[2]["added"] == 1
+    assert "added: IPv4 / Group NEW" in steps[2]["items"]
+    assert steps[3]["tag"] == "release"
+
+
+def test_snapshot_timeline_too_short(mock_session, snapshot_series):
+    with patch(
+        "package.diff_functions.read_user_snapshot_series",
+        return_value=snapshot_series[:1],
+    ):
+        assert snapshot_timeline(mock_session) == []
+
+
+def test_snapshot_timeline_process_pool(mock_session, snapshot_series, monkeypatch):
+    """Large series are split across processes with the same result."""
+    monkeypatch.setenv("TIMELINE_WORKERS", "1")
+    with patch(
+        "package.diff_functions.read_user_snapshot_series",
+        return_value=snapshot_series,
+    ):
+        serial = snapshot_timeline(mock_session)
+
+        monkeypatch.setenv("TIMELINE_WORKERS", "2")
+        monkeypatch.setenv("TIMELINE_PROCESS_POOL_MIN", "3")
+        monkeypatch.setattr("package.diff_functions._timeline_pool", None)
+        try:
+            pooled = snapshot_timeline(mock_session)
+            pool = diff_functions_module._timeline_pool
+        finally:
+            if diff_functions_module._timeline_pool is not None:
+                diff_functions_module._timeline_pool.shutdown()
+
+    assert pool is not None
+    assert pooled == serial
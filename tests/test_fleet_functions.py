@@ -0,0 +1,133 @@
+"""
+Tests for package/fleet_functions.py
+
+Covers: list_fleet_targets, fleet_push (against tests/fake_napalm.FakeVyOSDriver).
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+from package.fleet_functions import fleet_push, list_fleet_targets
+
+FIREWALLS = {
+    "fw_a": ("10.0.0.1", "22"),
+    "fw_b": ("10.0.0.2", "2222"),
+    "fw_c": ("10.0.0.3", "22"),
+    "fw_none": ("None", "22"),
+}
+
+
+@pytest.fixture
+def fleet(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "package.fleet_functions.get_system_name",
+        lambda session: FIREWALLS[session["firewall_name"]],
+    )
+    monkeypatch.setattr(
+        "package.fleet_functions.list_user_files", lambda session: sorted(FIREWALLS)
+    )
+    monkeypatch.setattr(
+        "package.fleet_functions.iter_config",
+        lambda session: iter([f"set system host-name {session['firewall_name']}"]),
+    )
+    with patch("package.fleet_functions.telemetry_commit"), patch(
+        "package.fleet_functions.telemetry_diff"
+    ):
+        yield {"data_dir": str(tmp_path), "username": "testuser"}
+
+
+@pytest.fixture
+def credentials():
+    return {"username": "vyos", "password": "vyos"}
+
+
+class TestListFleetTargets:
+    def test_lists_hostnames(self, fleet):
+        targets = list_fleet_targets(fleet)
+        assert [t["firewall"] for t in targets] == ["fw_a", "fw_b", "fw_c", "fw_none"]
+        assert targets[1] == {
+            "firewall": "fw_b",
+            "hostname": "10.0.0.2",
+            "port": "2222",
+            "configured": True,
+        }
+        assert targets[3]["configured"] is False
+
+
+class TestFleetPush:
+    def test_view_diffs(self, fleet, credentials, fake_napalm):
+        fake_napalm.devices["10.0.0.1"] = {"diff": "+set firewall a"}
+
+        results = {
+            r["firewall"]: r
+            for r in fleet_push(credentials, fleet, ["fw_a", "fw_b"], "View Diffs")
+        }
+
+        assert results["fw_a"]["status"] == "ok"
+        assert results["fw_a"]["message"] == "+set firewall a"
+        assert results["fw_b"]["message"] == "No configuration changes to commit."
+        assert results["fw_b"]["port"] == "2222"
+        assert fake_napalm.committed == []
+
+    def test_commit_writes_each_config(self, fleet, credentials, fake_napalm):
+        for hostname, _ in FIREWALLS.values():
+            fake_napalm.devices[hostname] = {"diff": "+set x\n"}
+
+        results = list(
+            fleet_push(credentials, fleet, ["fw_a", "fw_c"], "Commit", delete=True)
+        )
+
+        assert sorted(fake_napalm.committed) == ["10.0.0.1", "10.0.0.3"]
+        assert {r["message"] for r in results} == {"+set x\nCommit successful."}
+        with open(f"{fleet['data_dir']}/fw_c.conf") as f:
+            conf = f.read()
+        assert "delete firewall" in conf
+        assert "set system host-name fw_c" in conf
+
+    def test_runs_concurrently(self, fleet, credentials, fake_napalm, monkeypatch):
+        monkeypatch.setenv("FLEET_PUSH_WORKERS", "2")
+        for hostname, _ in FIREWALLS.values():
+            fake_napalm.devices[hostname] = {"delay": 0.2}
+
+        list(fleet_push(credentials, fleet, ["fw_a", "fw_b", "fw_c"], "View Diffs"))
+
+        assert fake_napalm.max_active == 2
+
+    def test_results_stream_in_completion_order(self, fleet, credentials, fake_napalm):
+        fake_napalm.devices["10.0.0.1"] = {"delay": 0.5}
+
+        results = fleet_push(credentials, fleet, ["fw_a", "fw_b"], "View Diffs")
+
+        assert next(results)["firewall"] == "fw_b"
+        assert next(results)["firewall"] == "fw_a"
+
+    def test_device_errors_are_isolated(self, fleet, credentials, fake_napalm):
+        fake_napalm.devices["10.0.0.2"] = {"error": ConnectionError("refused")}
+
+        results = {
+            r["firewall"]: r
+            for r in fleet_push(
+                credentials, fleet, ["fw_a", "fw_b", "fw_none"], "Commit"
+            )
+        }
+
+        assert results["fw_a"]["status"] == "ok"
+        assert results["fw_b"] == {
+            "firewall": "fw_b",
+            "hostname": "10.0.0.2",
+            "port": "2222",
+            "status": "error",
+            "message": "refused",
+            "seconds": results["fw_b"]["seconds"],
+        }
+        assert results["fw_none"]["status"] == "error"
+        assert fake_napalm.opened == ["10.0.0.1"]
+
+    def test_authentication_failure(self, fleet, fake_napalm):
+        credentials = {"username": "vyos", "password": "x", "ssh_key_name": "k.key"}
+
+        results = list(fleet_push(credentials, fleet, ["fw_a"], "View Diffs"))
+
+        assert results[0]["status"] == "error"
+        assert results[0]["message"].startswith("Authentication failure!")
@@ -4,7 +4,8 @@ Tests for package/generate_config.py
 Covers download_json_data, generate_config with empty data, extra items,
 flowtables, IPv4/IPv6 groups, filters (jump/offload/disable/log),
 chains (addresses, ports, protocol, states, logging, disable),
-IPv6 icmp conversion, diff mode, and full example data.
+IPv6 icmp conversion, diff mode, full example data, section caching and the
+streaming iter_config/iter_config_text generators.
 """
 
 import copy
@@ -12,7 +13,15 @@ import json
 
 import pytest
 
-from package.generate_config import download_json_data, generate_config
+import package.generate_config as generate_config_module
+from package.cache_functions import section_cache_clear
+from package.generate_config import (
+    download_json_data,
+    generate_config,
+    iter_config,
+    iter_config_lines,
+    iter_config_text,
+)
 
 
 # ---------------------------------------------------------------------------
@@ -756,3 +765,118 @@ def test_generate_config_full_example(mock_session, patch_read, example_user_dat
     assert "set firewall ipv6 input filter description 'Input Filter'" in config
     assert "set firewall ipv6 input filter rule 10 action 'jump'" in config
     assert "set firewall ipv6 input filter rule 10 jump-target 'WAN_LOCAL'" in config
+
+
+# ===========================================================================
+# generate_config -- section cache
+# ===========================================================================
+@pytest.fixture
+def count_chain_sections(monkeypatch):
+    """Clears the section cache and counts chains actually generated."""
+    section_cache_clear()
+    generated = []
+    chain_section = generate_config_module._chain_section
+
+    def _counting(ip_version, fw_chain, chain):
+        generated.append((ip_version, fw_chain))
+        return chain_section(ip_version, fw_chain, chain)
+
+    _counting.__name__ = chain_section.__name__
+    monkeypatch.setattr(generate_config_module, "_chain_section", _counting)
+    yield generated
+    section_cache_clear()
+
+
+def test_generate_config_cached_output_identical(
+    mock_session, patch_read, example_user_data, count_chain_sections
+):
+    """Output served from the section cache matches the generated output."""
+    patch_read(example_user_data)
+
+    first = generate_config(mock_session)
+    generated = len(count_chain_sections)
+    second = generate_config(mock_session)
+
+    assert second == first
+    assert generated > 0
+    assert len(count_chain_sections) == generated
+
+
+def test_generate_config_regenerates_only_edited_chain(
+    mock_session, patch_read, example_user_data, count_chain_sections
+):
+    """Editing one rule regenerates only the chain holding it."""
+    patch_read(example_user_data)
+    generate_config(mock_session)
+    count_chain_sections.clear()
+
+    example_user_data["ipv4"]["chains"]["WAN_LOCAL"]["10"]["description"] = "Edited"
+    patch_read(example_user_data)
+    message, config = generate_config(mock_session)
+
+    assert count_chain_sections == [("ipv4", "WAN_LOCAL")]
+    assert "set firewall ipv4 name WAN_LOCAL rule 10 description 'Edited'" in config
+
+
+# ===========================================================================
+# iter_config / iter_config_text
+# ===========================================================================
+def test_iter_config_matches_generate_config(
+    mock_session, patch_read, example_user_data
+):
+    """iter_config yields exactly the lines returned by generate_config."""
+    patch_read(example_user_data)
+
+    message, config = generate_config(mock_session)
+
+    assert list(iter_config(mock_session)) == config
+
+
+def test_iter_config_lines_from_document(
+    mock_session, patch_read, example_user_data
+):
+    """iter_config_lines generates the same lines from a document in hand."""
+    patch_read(example_user_data)
+
+    assert list(iter_config_lines(copy.deepcopy(example_user_data))) == list(
+        iter_config(mock_session)
+    )
+
+
+def test_iter_config_is_lazy(mock_session, monkeypatch):
+    """Nothing is read until the generator is consumed."""
+    calls = []
+    monkeypatch.setattr(
+        "package.generate_config.read_user_data_file",
+        lambda *args, **kwargs: calls.append(args) or {},
+    )
+
+    lines = iter_config(mock_session)
+    assert calls == []
+
+    assert next(lines).startswith("Empty rule set.")
+    assert len(calls) == 1
+
+
+def test_iter_config_text_matches_download(
+    mock_session, patch_read, example_user_data
+):
+    """Joined chunks equal the configuration text, one command per line."""
+    patch_read(example_user_data)
+
+    message, config = generate_config(mock_session)
+    text = "".join(iter_config_text(mock_session))
+
+    assert text == message.replace("<br>", "\n")
+    assert text == "".join(f"{line}\n" for line in config)
+
+
+def test_iter_config_text_chunks(mock_session, patch_read, example_user_data):
+    """Output is batched into chunks of about chunk_size characters."""
+    patch_read(example_user_data)
+
+    chunks = list(iter_config_text(mock_session, chunk_size=256))
+
+    assert len(chunks) > 1
+    assert all(len(chunk) >= 256 for chunk in chunks[:-1])
+    assert all(chunk.endswith("\n") for chunk in chunks)
@@ -0,0 +1,236 @@
+"""
+Tests for package/import_functions.py
+
+Covers: parse_firewall_commands, fetch_firewall_commands,
+        import_firewall_config.
+"""
+
+import time
+from unittest.mock import patch
+
+import pytest
+
+from package.config_delta_functions import parse_command
+from package.generate_config import iter_config_lines
+from package.import_functions import (
+    IMPORT_COMMAND,
+    fetch_firewall_commands,
+    import_firewall_config,
+    parse_firewall_commands,
+)
+
+
+def _commands(user_data):
+    """Set commands generated for a firewall document, as sorted tokens."""
+    lines = "\n".join(iter_config_lines(user_data)).splitlines()
+    return sorted(command for command in map(parse_command, lines) if command)
+
+
+class TestParseFirewallCommands:
+    def test_round_trip(self, example_user_data):
+        example_user_data.pop("_id", None)
+        generated = "\n".join(iter_config_lines(example_user_data)).splitlines()
+
+        user_data = parse_firewall_commands(generated)
+
+        assert "extra-items" not in user_data
+        assert _commands(user_data) == _commands(example_user_data)
+
+    def test_groups_and_flowtables(self):
+        user_data = parse_firewall_commands(
+            [
+                "set firewall flowtable FT interface 'eth0'",
+                "set firewall flowtable FT interface 'eth1'",
+                "set firewall flowtable FT description 'Fast path'",
+                "set firewall flowtable FT offload 'software'",
+                "set firewall group address-group SERVERS address '10.0.0.1'",
+                "set firewall group address-group SERVERS description 'Servers'",
+                "set firewall group ipv6-network-group LAN6 network 'fd00::/64'",
+            ]
+        )
+        assert user_data["flowtables"] == [
+            {"name": "FT", "description": "Fast path", "interfaces": ["eth0", "eth1"]}
+        ]
+        assert user_data["ipv4"]["groups"]["SERVERS"] == {
+            "group_desc": "Servers",
+            "group_type": "address-group",
+            "group_value": ["10.0.0.1"],
+        }
+        assert user_data["ipv6"]["groups"]["LAN6"]["group_type"] == "network-group"
+
+    def test_filters(self):
+        user_data = parse_firewall_commands(
+            [
+                "set firewall ipv4 input filter default-action 'drop'",
+                "set firewall ipv4 input filter enable-default-log",
+                "set firewall ipv4 input filter rule 20 action 'jump'",
+                "set firewall ipv4 input filter rule 20 inbound-interface name 'eth0'",
+                "set firewall ipv4 input filter rule 20 jump-target 'WAN_IN'",
+                "set firewall ipv4 input filter rule 5 action 'accept'",
+                "set firewall ipv4 input filter rule 5 disable",
+            ]
+        )
+        input_filter = user_data["ipv4"]["filters"]["input"]
+        assert input_filter["default-action"] == "drop"
+        assert input_filter["log"] is True
+        assert input_filter["rule-order"] == ["5", "20"]
+        assert input_filter["rules"]["20"] == {
+            "ip_version": "ipv4",
+            "filter": "input",
+            "description": "",
+            "action": "jump",
+            "interface": "eth0",
+            "direction": "inbound",
+            "fw_chain": "WAN_IN",
+        }
+        assert input_filter["rules"]["5"]["rule_disable"] is True
+
+    def test_chains(self):
+        user_data = parse_firewall_commands(
+            [
+                "set firewall ipv6 name WAN6_IN default-action 'drop'",
+                "set firewall ipv6 name WAN6_IN rule 10 action 'accept'",
+                "set firewall ipv6 name WAN6_IN rule 10 destination group port-group 'WEB'",
+                "set firewall ipv6 name WAN6_IN rule 10 protocol 'ipv6-icmp'",
+                "set firewall ipv6 name WAN6_IN rule 10 source group network-group 'LAN6'",
+                "set firewall ipv6 name WAN6_IN rule 10 state 'established'",
+            ]
+        )
+        chain = user_data["ipv6"]["chains"]["WAN6_IN"]
+        assert chain["default"] == {"description": "", "default_action": "drop"}
+        assert chain["rule-order"] == ["10"]
+        assert chain["10"]["dest_port"] == "WEB"
+        assert chain["10"]["dest_port_type"] == "port_group"
+        assert chain["10"]["source_address"] == "LAN6"
+        assert chain["10"]["source_address_type"] == "network_group"
+        assert chain["10"]["protocol"] == "icmp"
+        assert chain["10"]["state_est"] is True
+
+    def test_unmapped_lines_are_extra_items(self):
+        lines = [
+            "set firewall global-options all-ping 'enable'",
+            "set firewall ipv4 name WAN_IN rule 10 action 'accept'",
+            "set firewall ipv4 name WAN_IN rule 10 destination address '10.0.0.1'",
+            "set firewall ipv4 name WAN_IN rule 10 destination address '10.0.0.2'",
+            "set firewall ipv4 name WAN_IN rule 20 destination fqdn 'example.com'",
+            "set firewall ipv4 forward filter rule 5 action 'accept'",
+            "set firewall ipv4 forward filter rule 5 inbound-interface name 'eth1'",
+        ]
+        user_data = parse_firewall_commands(["", "# comment", "commit"] + lines)
+
+        assert user_data["extra-items"] == [
+            lines[0],
+            lines[3],
+            lines[4],
+            "set firewall ipv4 forward filter rule 5 inbound-interface name 'eth1'",
+        ]
+        # Lines that were not mapped do not create empty rules
+        assert user_data["ipv4"]["chains"]["WAN_IN"]["rule-order"] == ["10"]
+        # Regenerating the configuration sets every imported command
+        assert set(map(parse_command, lines)) <= set(_commands(user_data))
+
+    def test_50k_lines_in_seconds(self):
+        lines = []
+        for n in range(5000):
+            rule = f"set firewall ipv4 name CHAIN_{n % 50} rule {n}"
+            lines += [
+                f"{rule} action 'accept'",
+                f"{rule} description 'Rule {n}'",
+                f"{rule} destination address '10.0.{n % 256}.0/24'",
+                f"{rule} destination port '{1024 + n}'",
+                f"{rule} protocol 'tcp'",
+                f"{rule} source group network-group 'NET_{n % 20}'",
+                f"{rule} state 'established'",
+                f"{rule} state 'related'",
+                f"{rule} log",
+                f"set firewall group network-group NET_{n % 20} network '10.{n % 256}.0.0/16'",
+            ]
+
+        start = time.perf_counter()
+        user_data = parse_firewall_commands(lines)
+        assert time.perf_counter() - start < 5
+
+        assert len(lines) == 50000
+        assert "extra-items" not in user_data
+        assert (
+            sum(
+                len(chain["rule-order"])
+                for chain in user_data["ipv4"]["chains"].values()
+            )
+            == 5000
+        )
+
+
+class TestFetchFirewallCommands:
+    def test_runs_import_command(self, mock_session):
+        connection_string = {"hostname": "10.0.0.1", "port": "22"}
+        with patch(
+            "package.import_functions.operational_command",
+            return_value="set firewall a\nset firewall b\n",
+        ) as mock_command:
+            lines = fetch_firewall_commands(connection_string, mock_session)
+
+        assert lines == ["set firewall a", "set firewall b"]
+        mock_command.assert_called_once_with(
+            connection_string, mock_session, IMPORT_COMMAND
+        )
+
+
+class TestImportFirewallConfig:
+    @pytest.fixture(autouse=True)
+    def file_list(self):
+        with patch(
+            "package.import_functions.list_user_files", return_value=["existing"]
+        ) as mock_list:
+            yield mock_list
+
+    def test_single_write(self, app, mock_session):
+        lines = ["set firewall ipv4 name WAN_IN rule 10 action 'accept'"]
+        with patch(
+            "package.import_functions.write_user_data_file"
+        ) as mock_write, app.test_request_context():
+            import_firewall_config(mock_session, "imported", lines, "10.0.0.1", 2222)
+
+        mock_write.assert_called_once()
+        filename, user_data = mock_write.call_args.args
+        assert filename == "data/testuser/imported"
+        assert user_data["version"] == "1"
+        assert user_data["system"] == {"hostname": "10.0.0.1", "port": "2222"}
+        assert user_data["ipv4"]["chains"]["WAN_IN"]["rule-order"] == ["10"]
+
+    def test_pasted_commands_have_no_hostname(self, app, mock_session, mock_read_write):
+        capture = mock_read_write("package.import_functions", {})
+        with app.test_request_context():
+            import_firewall_config(mock_session, "imported", [])
+
+        assert capture.written_data == {
+            "version": "1",
+            "system": {"hostname": "None", "port": "None"},
+        }
+
+    def test_existing_name_requires_overwrite(self, app, mock_session):
+        with patch(
+            "package.import_functions.write_user_data_file"
+        ) as mock_write, app.test_request_context():
+            assert import_firewall_config(mock_session, "existing", []) is False
+
+        mock_write.assert_not_called()
+
+    def test_overwrite_snapshots_existing(self, app, mock_session):
+        existing = {"version": "1", "extra-items": ["set firewall hand built"]}
+        with patch(
+            "package.import_functions.read_user_data_file", return_value=existing
+        ), patch(
+            "package.import_functions.write_user_data_file"
+        ) as mock_write, app.test_request_context():
+            assert import_firewall_config(
+                mock_session, "existing", [], overwrite=True
+            )
+
+        snapshot, current = mock_write.call_args_list
+        filename, data, snapshot_name = snapshot.args
+        assert filename == "data/testuser/existing"
+        assert data == dict(existing, tag="Before import")
+        assert snapshot_name != "current"
+        assert current.args[0] == "data/testuser/existing"
+        assert "extra-items" not in current.args[1]
@@ -1,6 +1,9 @@
+import copy
+
 import pytest
 from werkzeug.datastructures import ImmutableMultiDict
 
+from package.data_file_functions import apply_user_data_update
 from package.interface_functions import (
     add_interface_to_data,
     delete_interface_from_data,
@@ -23,11 +26,16 @@ def mock_user_data(monkeypatch):
     def mock_read(*args):
         return test_data.copy()
 
-    def mock_write(*args):
-        test_data.update(args[1])
+    def mock_update(filename, **fields):
+        apply_user_data_update(test_data, **fields)
+        return True
+
+    def mock_mutate(filename, build_update):
+        return mock_update(filename, **build_update(copy.deepcopy(test_data)))
 
     monkeypatch.setattr("package.interface_functions.read_user_data_file", mock_read)
-    monkeypatch.setattr("package.interface_functions.write_user_data_file", mock_write)
+    monkeypatch.setattr("package.interface_functions.update_user_data_file", mock_update)
+    monkeypatch.setattr("package.interface_functions.mutate_user_data_file", mock_mutate)
 
     return test_data
 
@@ -120,3 +128,23 @@ def test_delete_nonexistent_interface(app, mock_session, mock_user_data):
         interface_list = list_interfaces(mock_session)
 
         assert len(interface_list) == 2
+
+
+def test_add_new_interface_is_pushed(app, mock_session, monkeypatch):
+    updates = []
+    monkeypatch.setattr(
+        "package.interface_functions.mutate_user_data_file",
+        lambda filename, build_update: updates.append(
+            build_update({"interfaces": [{"name": "eth0", "description": ""}]})
+        ),
+    )
+
+    with app.test_request_context():
+        form_data = ImmutableMultiDict(
+            [("interface_name", "eth1"), ("interface_desc", "New")]
+        )
+        add_interface_to_data(mock_session, type("Request", (), {"form": form_data}))
+
+    assert updates == [
+        {"push_fields": {("interfaces",): {"name": "eth1", "description": "New"}}}
+    ]
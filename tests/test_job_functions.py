@@ -0,0 +1,176 @@
+"""
+Tests for package/job_functions.py
+
+Covers: submit_device_job, get_device_job (against tests/fake_napalm.FakeVyOSDriver
+        and a mongomock job store).
+"""
+
+import os
+import time
+from unittest.mock import patch
+
+import mongomock
+import pytest
+
+from package.job_functions import get_device_job, submit_device_job
+
+
+@pytest.fixture
+def job_store(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr("package.data_file_functions._get_mongo_client", lambda: client)
+    monkeypatch.setattr("package.data_file_functions._jobs_indexed", False)
+    monkeypatch.setenv("MONGODB_DATABASE", "test_db")
+    monkeypatch.delenv("JOB_MONGO_DATABASE", raising=False)
+    with patch("package.napalm_ssh_functions.telemetry_commit"), patch(
+        "package.napalm_ssh_functions.telemetry_diff"
+    ), patch("package.napalm_ssh_functions.telemetry_rule_usage"):
+        yield client["test_db_jobs"]["device_jobs"]
+
+
+@pytest.fixture
+def device_session(tmp_path):
+    with open(tmp_path / "fw1.conf", "w") as f:
+        f.write("set firewall\n")
+    return {
+        "data_dir": str(tmp_path),
+        "username": "testuser",
+        "firewall_name": "fw1",
+        "hostname": "10.0.0.1",
+        "port": "22",
+    }
+
+
+@pytest.fixture
+def credentials():
+    return {"hostname": "10.0.0.1", "port": "22", "username": "vyos", "password": "pw"}
+
+
+def wait_for_job(job_id, username="testuser", timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = get_device_job(job_id, username)
+        if job["status"] in ("done", "error"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+class TestSubmitDeviceJob:
+    def test_commit(self, job_store, fake_napalm, device_session, credentials):
+        fake_napalm.devices["10.0.0.1"] = {"diff": "+set firewall\n"}
+
+        job = wait_for_job(submit_device_job("Commit", credentials, device_session))
+
+        assert job["status"] == "done"
+        assert job["message"] == "+set firewall\nCommit successful."
+        assert job["error"] is None
+        assert job["firewall"] == "fw1"
+        assert job["finished"] is not None
+        assert fake_napalm.committed == ["10.0.0.1"]
+
+    def test_returns_before_device_finishes(
+        self, job_store, fake_napalm, device_session, credentials
+    ):
+        fake_napalm.devices["10.0.0.1"] = {"delay": 0.3}
+
+        started = time.monotonic()
+        job_id = submit_device_job("View Diffs", credentials, device_session)
+
+        assert time.monotonic() - started < 0.3
+        assert get_device_job(job_id, "testuser")["status"] in ("queued", "running")
+        assert wait_for_job(job_id)["status"] == "done"
+
+    def test_device_error(self, job_store, fake_napalm, device_session, credentials):
+        fake_napalm.devices["10.0.0.1"] = {"error": ConnectionError("refused")}
+
+        job = wait_for_job(submit_device_job("View Diffs", credentials, device_session))
+
+        assert job["status"] == "error"
+        assert job["message"] == "refused"
+        assert job["error"] == "Error in diff.  Inspect output and correct errors."
+
+    def test_pushes_own_command_file(
+        self, job_store, fake_napalm, device_session, credentials
+    ):
+        fake_napalm.devices["10.0.0.1"] = {"delay": 0.2}
+
+        job_id = submit_device_job(
+            "Commit",
+            credentials,
+            device_session,
+            command_list=iter(["set firewall a"]),
+            delete=True,
+        )
+        # A later submit or edit rewrites the shared command file.
+        with open(f"{device_session['data_dir']}/fw1.conf", "w") as f:
+            f.write("set firewall b\n")
+        wait_for_job(job_id)
+
+        assert fake_napalm.candidates["10.0.0.1"].endswith(
+            "delete firewall\nset firewall a\n"
+        )
+        assert sorted(os.listdir(device_session["data_dir"])) == ["fw1.conf"]
+
+    def test_operational_command(self, job_store, device_session, credentials):
+        with patch(
+            "package.napalm_ssh_functions.operational_command",
+            return_value="output",
+        ) as mock_command:
+            job = wait_for_job(
+                submit_device_job(
+                    "Run Operational Command",
+                    credentials,
+                    device_session,
+                    "show firewall",
+                )
+            )
+
+        assert job["message"] == "output"
+        assert mock_command.call_args.args[2] == "show firewall"
+
+    def test_collection_profile(self, job_store, device_session, credentials):
+        results = [
+            {"command": "show firewall", "output": "fw", "error": None, "seconds": 0.5}
+        ]
+        with patch(
+            "package.napalm_ssh_functions.operational_commands",
+            return_value=results,
+        ) as mock_commands:
+            job = wait_for_job(
+                submit_device_job(
+                    "Run Collection Profile",
+                    credentials,
+                    device_session,
+                    ["show firewall"],
+                )
+            )
+
+        assert job["status"] == "done"
+        assert job["message"] == "### show firewall (0.50s)\nfw\n"
+        assert mock_commands.call_args.args[2] == ["show firewall"]
+
+    def test_credentials_not_stored(
+        self, job_store, fake_napalm, device_session, credentials
+    ):
+        job_id = submit_device_job("View Diffs", credentials, device_session)
+        wait_for_job(job_id)
+
+        assert "pw" not in str(job_store.find_one({"_id": job_id}))
+
+    def test_unknown_action(self, job_store, device_session, credentials):
+        with pytest.raises(ValueError):
+            submit_device_job("Reboot", credentials, device_session)
+
+
+class TestGetDeviceJob:
+    def test_other_users_job_not_found(
+        self, job_store, fake_napalm, device_session, credentials
+    ):
+        job_id = submit_device_job("View Diffs", credentials, device_session)
+        wait_for_job(job_id)
+
+        assert get_device_job(job_id, "otheruser") is None
+
+    def test_unknown_job(self, job_store):
+        assert get_device_job("missing", "testuser") is None
@@ -1,12 +1,28 @@
+import io
+import socket
 from unittest.mock import Mock, patch
 
+import paramiko
 import pytest
 
+from package.connection_pool_functions import (
+    napalm_pool_clear,
+    napalm_pool_get,
+    napalm_pool_key,
+    napalm_pool_size,
+)
 from package.napalm_ssh_functions import (
     assemble_paramiko_driver_string,
     commit_to_firewall,
+    device_action,
+    format_command_batch,
+    load_private_key,
     get_diffs_from_firewall,
+    operational_command,
+    operational_commands,
     run_operational_command,
+    sse_event,
+    stream_operational_command,
 )
 from package.napalm_ssh_functions import test_connection as _test_connection
 
@@ -14,6 +30,13 @@ from package.napalm_ssh_functions import test_connection as _test_connection
 # Uses mock_session from conftest.py; also define specialized fixtures.
 
 
+@pytest.fixture(autouse=True)
+def clear_napalm_pool():
+    napalm_pool_clear()
+    yield
+    napalm_pool_clear()
+
+
 @pytest.fixture
 def connection_string():
     return {
@@ -56,9 +79,8 @@ def test_assemble_paramiko_driver_string_password(connection_string, session):
         ssh_instance = Mock()
         mock_ssh.return_value = ssh_instance
 
-        ssh, tmp_key = assemble_paramiko_driver_string(connection_string, session)
+        ssh = assemble_paramiko_driver_string(connection_string, session)
 
-        assert tmp_key is None
         ssh_instance.set_missing_host_key_policy.assert_called_once()
         ssh_instance.connect.assert_called_with(
             connection_string["hostname"],
@@ -71,32 +93,75 @@ def test_assemble_paramiko_driver_string_password(connection_string, session):
 def test_assemble_paramiko_driver_string_with_key(connection_string_with_key, session):
     with (
         patch("paramiko.SSHClient") as mock_ssh,
-        patch("package.napalm_ssh_functions.decrypt_file") as mock_decrypt,
+        patch("package.napalm_ssh_functions.load_private_key") as mock_load,
     ):
         ssh_instance = Mock()
         mock_ssh.return_value = ssh_instance
-        mock_decrypt.return_value = "/tmp/decrypted_key"
+        pkey = Mock()
+        mock_load.return_value = pkey
 
-        ssh, tmp_key = assemble_paramiko_driver_string(
-            connection_string_with_key, session
-        )
+        ssh = assemble_paramiko_driver_string(connection_string_with_key, session)
 
-        assert tmp_key == "/tmp/decrypted_key"
         ssh_instance.connect.assert_called_with(
             connection_string_with_key["hostname"],
             port=connection_string_with_key["port"],
             username=connection_string_with_key["username"],
-            key_filename="/tmp/decrypted_key",
+            pkey=pkey,
         )
 
 
+# Test load_private_key
+@pytest.fixture
+def encrypted_key(tmp_path):
+    from cryptography.fernet import Fernet
+
+    passphrase = Fernet.generate_key()
+    private_key = paramiko.RSAKey.generate(1024)
+    key_text = io.StringIO()
+    private_key.write_private_key(key_text)
+    (tmp_path / "test_key.pem").write_bytes(
+        Fernet(passphrase).encrypt(key_text.getvalue().encode("utf-8"))
+    )
+
+    connection_string = {
+        "hostname": "192.168.1.1",
+        "port": 22,
+        "username": "admin",
+        "password": passphrase.decode("utf-8"),
+        "ssh_key_name": "test_key.pem",
+    }
+    return connection_string, {"data_dir": str(tmp_path)}, private_key
+
+
+def test_load_private_key_in_memory(encrypted_key):
+    connection_string, session, private_key = encrypted_key
+
+    with patch("package.data_file_functions.open", wraps=open) as mock_open:
+        pkey = load_private_key(connection_string, session)
+
+    assert pkey == private_key
+    assert all(call.args[1] == "rb" for call in mock_open.call_args_list)
+
+
+def test_load_private_key_rejects_unknown_key(encrypted_key, tmp_path):
+    from cryptography.fernet import Fernet
+
+    connection_string, session, _ = encrypted_key
+    (tmp_path / "test_key.pem").write_bytes(
+        Fernet(connection_string["password"].encode("utf-8")).encrypt(b"not a key")
+    )
+
+    with pytest.raises(paramiko.SSHException):
+        load_private_key(connection_string, session)
+
+
 # Test commit_to_firewall
 def test_commit_to_firewall_success(connection_string, session):
     with patch(
         "package.napalm_ssh_functions.assemble_napalm_driver_string"
     ) as mock_assemble:
         mock_driver = Mock()
-        mock_assemble.return_value = (mock_driver, None)
+        mock_assemble.return_value = mock_driver
         mock_driver.compare_config.return_value = "Config differences"
         mock_driver.commit_config.return_value = None
 
@@ -107,7 +172,9 @@ def test_commit_to_firewall_success(connection_string, session):
         mock_driver.open.assert_called_once()
         mock_driver.load_merge_candidate.assert_called_once()
         mock_driver.commit_config.assert_called_once()
-        mock_driver.close.assert_called_once()
+        # The session is kept open in the pool
+        mock_driver.close.assert_not_called()
+        assert napalm_pool_size() == 1
 
 
 def test_commit_to_firewall_no_changes(connection_string, session):
@@ -115,7 +182,7 @@ def test_commit_to_firewall_no_changes(connection_string, session):
         "package.napalm_ssh_functions.assemble_napalm_driver_string"
     ) as mock_assemble:
         mock_driver = Mock()
-        mock_assemble.return_value = (mock_driver, None)
+        mock_assemble.return_value = mock_driver
         mock_driver.compare_config.return_value = ""
 
         result = commit_to_firewall(connection_string, session)
@@ -130,7 +197,7 @@ def test_get_diffs_from_firewall_with_changes(connection_string, session):
         "package.napalm_ssh_functions.assemble_napalm_driver_string"
     ) as mock_assemble:
         mock_driver = Mock()
-        mock_assemble.return_value = (mock_driver, None)
+        mock_assemble.return_value = mock_driver
         mock_driver.compare_config.return_value = "Config differences"
 
         result = get_diffs_from_firewall(connection_string, session)
@@ -139,7 +206,8 @@ def test_get_diffs_from_firewall_with_changes(connection_string, session):
         mock_driver.open.assert_called_once()
         mock_driver.load_merge_candidate.assert_called_once()
         mock_driver.discard_config.assert_called_once()
-        mock_driver.close.assert_called_once()
+        mock_driver.close.assert_not_called()
+        assert napalm_pool_size() == 1
 
 
 # Test run_operational_command
@@ -153,7 +221,7 @@ def test_run_operational_command_success(connection_string, session, op_command)
         mock_stdout.read.return_value = b"Firewall usage stats"
         mock_stderr.read.return_value = b""
         mock_ssh.exec_command.return_value = (Mock(), mock_stdout, mock_stderr)
-        mock_assemble.return_value = (mock_ssh, None)
+        mock_assemble.return_value = mock_ssh
 
         result = run_operational_command(connection_string, session, op_command)
 
@@ -162,21 +230,100 @@ def test_run_operational_command_success(connection_string, session, op_command)
         mock_ssh.close.assert_called_once()
 
 
-# Test cleanup of temporary key files
-def test_temporary_key_cleanup(connection_string_with_key, session):
-    with (
-        patch(
-            "package.napalm_ssh_functions.assemble_napalm_driver_string"
-        ) as mock_assemble,
-        patch("os.remove") as mock_remove,
-    ):
-        mock_driver = Mock()
-        mock_assemble.return_value = (mock_driver, "/tmp/temp_key")
-        mock_driver.compare_config.return_value = ""
+def test_operational_command_closes_on_error(connection_string, session):
+    with patch(
+        "package.napalm_ssh_functions.assemble_paramiko_driver_string"
+    ) as mock_assemble:
+        mock_ssh = Mock()
+        mock_ssh.exec_command.side_effect = paramiko.SSHException("Channel closed")
+        mock_assemble.return_value = mock_ssh
+
+        with pytest.raises(paramiko.SSHException):
+            operational_command(connection_string, session, "show firewall")
+
+        mock_ssh.close.assert_called_once()
+
+
+# Test operational_commands
+def test_operational_commands_one_session(connection_string, session):
+    outputs = {"show firewall": b"rules", "show interfaces": b"eth0"}
+
+    def exec_command(command):
+        stdout = Mock()
+        stdout.read.return_value = next(
+            output for name, output in outputs.items() if f"run {name}\n" in command
+        )
+        return Mock(), stdout, Mock()
+
+    with patch(
+        "package.napalm_ssh_functions.assemble_paramiko_driver_string"
+    ) as mock_assemble:
+        mock_ssh = Mock()
+        mock_ssh.exec_command.side_effect = exec_command
+        mock_assemble.return_value = mock_ssh
 
-        commit_to_firewall(connection_string_with_key, session)
+        results = operational_commands(
+            connection_string, session, ["show firewall", "show interfaces"]
+        )
+
+        mock_assemble.assert_called_once()
+        mock_ssh.close.assert_called_once()
+        assert [r["command"] for r in results] == ["show firewall", "show interfaces"]
+        assert [r["output"] for r in results] == ["rules", "eth0"]
+        assert all(r["error"] is None and r["seconds"] >= 0 for r in results)
+
+
+def test_operational_commands_failed_command(connection_string, session):
+    stdout = Mock()
+    stdout.read.return_value = b"eth0"
+    with patch(
+        "package.napalm_ssh_functions.assemble_paramiko_driver_string"
+    ) as mock_assemble:
+        mock_ssh = Mock()
+        mock_ssh.exec_command.side_effect = [
+            paramiko.SSHException("Channel closed"),
+            (Mock(), stdout, Mock()),
+        ]
+        mock_assemble.return_value = mock_ssh
+
+        results = operational_commands(
+            connection_string, session, ["show firewall", "show interfaces"]
+        )
+
+        assert results[0]["error"] == "Channel closed"
+        assert results[1]["output"] == "eth0"
+
+
+def test_format_command_batch():
+    results = [
+        {
+            "command": "show firewall",
+            "output": "rules\n",
+            "error": None,
+            "seconds": 0.5,
+        },
+        {"command": "show interfaces", "output": "", "error": "Closed", "seconds": 0},
+    ]
+
+    assert format_command_batch(results) == (
+        "### show firewall (0.50s)\nrules\n\n### show interfaces (0.00s)\nClosed\n"
+    )
+
+
+def test_device_action_collection_profile(connection_string, session):
+    results = [
+        {"command": "show firewall", "output": "rules", "error": None, "seconds": 1}
+    ]
+    with patch(
+        "package.napalm_ssh_functions.operational_commands", return_value=results
+    ) as mock_commands, patch("package.napalm_ssh_functions.telemetry_rule_usage"):
+        message, error = device_action(
+            "Run Collection Profile", connection_string, session, ["show firewall"]
+        )
 
-        mock_remove.assert_called_once_with("/tmp/temp_key")
+    assert error is None
+    assert message == "### show firewall (1.00s)\nrules\n"
+    mock_commands.assert_called_once_with(connection_string, session, ["show firewall"])
 
 
 # Test assemble_napalm_driver_string
@@ -187,9 +334,8 @@ def test_assemble_napalm_driver_string_password(connection_string, session):
 
         from package.napalm_ssh_functions import assemble_napalm_driver_string
 
-        driver, tmp_key = assemble_napalm_driver_string(connection_string, session)
+        driver = assemble_napalm_driver_string(connection_string, session)
 
-        assert tmp_key is None
         mock_get_driver.assert_called_with("vyos")
         mock_driver_class.assert_called_with(
             hostname="192.168.1.1",
@@ -202,29 +348,24 @@ def test_assemble_napalm_driver_string_password(connection_string, session):
 def test_assemble_napalm_driver_string_with_key(connection_string_with_key, session):
     with (
         patch("package.napalm_ssh_functions.get_network_driver") as mock_get_driver,
-        patch("package.napalm_ssh_functions.decrypt_file") as mock_decrypt,
+        patch("package.napalm_ssh_functions.load_private_key") as mock_load,
     ):
         mock_driver_class = Mock()
+        mock_driver_class.return_value.netmiko_optional_args = {"port": 22}
         mock_get_driver.return_value = mock_driver_class
-        mock_decrypt.return_value = "/tmp/decrypted_key"
+        pkey = Mock()
+        mock_load.return_value = pkey
 
         from package.napalm_ssh_functions import assemble_napalm_driver_string
 
-        driver, tmp_key = assemble_napalm_driver_string(
-            connection_string_with_key, session
-        )
+        driver = assemble_napalm_driver_string(connection_string_with_key, session)
 
-        assert tmp_key == "/tmp/decrypted_key"
-        mock_decrypt.assert_called_once()
+        assert driver.netmiko_optional_args == {"port": 22, "pkey": pkey}
         mock_driver_class.assert_called_with(
             hostname="192.168.1.1",
             username="admin",
             password="",
-            optional_args={
-                "port": 22,
-                "conn_timeout": 120,
-                "key_file": "/tmp/decrypted_key",
-            },
+            optional_args={"port": 22, "conn_timeout": 120},
         )
 
 
@@ -232,29 +373,37 @@ def test_assemble_napalm_driver_string_with_key(connection_string_with_key, sess
 def test_test_connection_success(app):
     session = {"hostname": "127.0.0.1", "port": "22"}
     with app.test_request_context():
-        with patch("package.napalm_ssh_functions.socket.socket") as mock_socket:
-            mock_sock_instance = Mock()
-            mock_socket.return_value = mock_sock_instance
-
+        with patch(
+            "package.napalm_ssh_functions.check_reachability", return_value=True
+        ) as mock_check:
             result = _test_connection(session)
 
             assert result is True
-            mock_sock_instance.connect.assert_called_once_with(("127.0.0.1", 22))
+            mock_check.assert_called_once_with("127.0.0.1", "22")
 
 
 def test_test_connection_failure(app):
     session = {"hostname": "192.168.1.1", "port": "22"}
     with app.test_request_context():
-        with patch("socket.socket") as mock_socket:
-            mock_sock_instance = Mock()
-            mock_socket.return_value = mock_sock_instance
-            mock_sock_instance.connect.side_effect = Exception("Connection refused")
-
+        with patch(
+            "package.napalm_ssh_functions.check_reachability", return_value=False
+        ):
             result = _test_connection(session)
 
             assert result is False
 
 
+def test_test_connection_not_probed_yet(app):
+    session = {"hostname": "192.168.1.1", "port": "22"}
+    with app.test_request_context():
+        with patch(
+            "package.napalm_ssh_functions.check_reachability", return_value=None
+        ):
+            result = _test_connection(session)
+
+            assert result is None
+
+
 def test_commit_to_firewall_driver_error(app, connection_string, session):
     with app.test_request_context():
         with patch(
@@ -298,10 +447,283 @@ def test_get_diffs_no_changes(connection_string, session):
         "package.napalm_ssh_functions.assemble_napalm_driver_string"
     ) as mock_assemble:
         mock_driver = Mock()
-        mock_assemble.return_value = (mock_driver, None)
+        mock_assemble.return_value = mock_driver
         mock_driver.compare_config.return_value = ""
 
         result = get_diffs_from_firewall(connection_string, session)
 
         assert result == "No configuration changes to commit."
         mock_driver.discard_config.assert_called_once()
+
+
+# Test the NAPALM connection pool
+def test_diff_then_commit_reuses_session(connection_string, session):
+    with patch(
+        "package.napalm_ssh_functions.assemble_napalm_driver_string"
+    ) as mock_assemble:
+        mock_driver = Mock()
+        mock_driver.is_alive.return_value = {"is_alive": True}
+        mock_driver.compare_config.return_value = "Config differences"
+        mock_driver.commit_config.return_value = None
+        mock_assemble.return_value = mock_driver
+
+        get_diffs_from_firewall(connection_string, session)
+        result = commit_to_firewall(connection_string, session)
+
+        assert "Commit successful" in result
+        mock_assemble.assert_called_once()
+        mock_driver.open.assert_called_once()
+        assert mock_driver.load_merge_candidate.call_count == 2
+
+
+def test_dead_pooled_session_is_replaced(connection_string, session):
+    with patch(
+        "package.napalm_ssh_functions.assemble_napalm_driver_string"
+    ) as mock_assemble:
+        dead, fresh = Mock(), Mock()
+        dead.is_alive.return_value = {"is_alive": False}
+        dead.compare_config.return_value = ""
+        fresh.compare_config.return_value = ""
+        mock_assemble.side_effect = [dead, fresh]
+
+        get_diffs_from_firewall(connection_string, session)
+        get_diffs_from_firewall(connection_string, session)
+
+        dead.close.assert_called_once()
+        fresh.open.assert_called_once()
+        assert mock_assemble.call_count == 2
+
+
+def test_failed_session_is_not_pooled(app, connection_string, session):
+    with app.test_request_context(), patch(
+        "package.napalm_ssh_functions.telemetry_commit"
+    ), patch(
+        "package.napalm_ssh_functions.assemble_napalm_driver_string"
+    ) as mock_assemble:
+        mock_driver = Mock()
+        mock_driver.load_merge_candidate.side_effect = Exception("Load failed")
+        mock_assemble.return_value = mock_driver
+
+        result = commit_to_firewall(connection_string, session)
+
+        assert result == "Load failed"
+        mock_driver.close.assert_called_once()
+        assert napalm_pool_size() == 0
+
+
+def test_pool_is_keyed_by_credentials(connection_string, session):
+    other = {**connection_string, "password": "other"}
+
+    assert napalm_pool_key(connection_string) == napalm_pool_key(
+        dict(connection_string)
+    )
+    assert napalm_pool_key(connection_string) != napalm_pool_key(other)
+    assert "secret" not in "".join(napalm_pool_key(connection_string))
+
+    with patch(
+        "package.napalm_ssh_functions.assemble_napalm_driver_string"
+    ) as mock_assemble:
+        mock_assemble.side_effect = [
+            Mock(compare_config=Mock(return_value="")) for _ in range(2)
+        ]
+        get_diffs_from_firewall(connection_string, session)
+        get_diffs_from_firewall(other, session)
+
+        assert mock_assemble.call_count == 2
+        assert napalm_pool_size() == 2
+
+
+# Test stream_operational_command
+@pytest.fixture
+def streamed_channel():
+    """Patches the Paramiko client; set channel.recv.side_effect to the
+    chunks (or exceptions) the command returns."""
+    with (
+        patch(
+            "package.napalm_ssh_functions.assemble_paramiko_driver_string"
+        ) as mock_assemble,
+        patch("package.napalm_ssh_functions.telemetry_rule_usage"),
+    ):
+        mock_ssh = Mock()
+        stdout = Mock()
+        mock_ssh.exec_command.return_value = (Mock(), stdout, Mock())
+        mock_assemble.return_value = mock_ssh
+        yield mock_ssh, stdout.channel
+
+
+def test_stream_operational_command_yields_chunks(
+    connection_string, session, streamed_channel
+):
+    mock_ssh, channel = streamed_channel
+    # "é" split across two chunks
+    channel.recv.side_effect = [b"rule 10 ", socket.timeout(), b"\xc3", b"\xa9\n", b""]
+
+    events = list(
+        stream_operational_command(connection_string, session, "show firewall")
+    )
+
+    assert events == [
+        ("output", "rule 10 "),
+        ("output", "\u00e9\n"),
+        ("done", ""),
+    ]
+    mock_ssh.close.assert_called_once()
+
+
+def test_stream_operational_command_byte_cap(
+    connection_string, session, streamed_channel
+):
+    mock_ssh, channel = streamed_channel
+    channel.recv.side_effect = [b"abcd", b"efgh", b"ijkl"]
+
+    events = list(
+        stream_operational_command(
+            connection_string, session, "monitor log", max_bytes=6
+        )
+    )
+
+    assert events == [
+        ("output", "abcd"),
+        ("output", "ef"),
+        ("truncated", "Output stopped after 6 bytes."),
+    ]
+    mock_ssh.close.assert_called_once()
+
+
+def test_stream_operational_command_time_cap(
+    connection_string, session, streamed_channel
+):
+    _, channel = streamed_channel
+    channel.recv.side_effect = socket.timeout()
+
+    events = list(
+        stream_operational_command(
+            connection_string, session, "monitor log", max_seconds=0.05
+        )
+    )
+
+    assert events == [("truncated", "Output stopped after 0.05 seconds.")]
+
+
+def test_stream_operational_command_closed_by_caller(
+    connection_string, session, streamed_channel
+):
+    mock_ssh, channel = streamed_channel
+    channel.recv.return_value = b"line\n"
+
+    events = stream_operational_command(connection_string, session, "monitor log")
+    assert next(events) == ("output", "line\n")
+    events.close()
+
+    mock_ssh.close.assert_called_once()
+
+
+def test_stream_operational_command_error(connection_string, session):
+    with (
+        patch(
+            "package.napalm_ssh_functions.assemble_paramiko_driver_string",
+            side_effect=Exception("Connection failed"),
+        ),
+        patch("package.napalm_ssh_functions.telemetry_rule_usage"),
+    ):
+        events = list(
+            stream_operational_command(connection_string, session, "show firewall")
+        )
+
+    assert events == [("error", "Connection failed")]
+
+
+def test_sse_event():
+    assert sse_event("output", "a\r\nb\n") == (
+        "event: output\ndata: a\ndata: b\ndata: \n\n"
+    )
+
+
+# Test push_config with delta
+@pytest.fixture
+def delta_session(tmp_path):
+    with open(tmp_path / "fw1.conf", "w") as f:
+        f.write(
+            "#\n# Delete all firewall before setting new values\ndelete firewall\n"
+            "set firewall ipv4 name X default-action 'drop'\n"
+            "set firewall ipv4 name X rule 10 action 'accept'\n"
+        )
+    return {
+        "data_dir": str(tmp_path),
+        "firewall_name": "fw1",
+        "hostname": "10.0.0.1",
+        "port": "22",
+    }
+
+
+def test_push_config_delta(connection_string, delta_session, fake_napalm):
+    from package.napalm_ssh_functions import push_config
+
+    fake_napalm.devices["192.168.1.1"] = {
+        "running": "set firewall ipv4 name X default-action 'drop'\n"
+        "set firewall ipv4 name X rule 20 action 'drop'\n"
+        "set system host-name 'fw1'\n",
+        "diff": "changed",
+    }
+
+    assert push_config(connection_string, delta_session, delta=True) == "changed"
+    assert fake_napalm.candidates["192.168.1.1"] == (
+        "delete firewall ipv4 name X rule 20\n"
+        "set firewall ipv4 name X rule 10 action accept\n"
+    )
+    assert napalm_pool_size() == 1
+
+
+def test_push_config_delta_deletes_device_only_rule(
+    connection_string, delta_session, fake_napalm
+):
+    from package.napalm_ssh_functions import RUNNING_CONFIG_COMMAND, push_config
+
+    fake_napalm.devices["192.168.1.1"] = {
+        "running": "set firewall ipv4 name X default-action 'drop'\n"
+        "set firewall ipv4 name X rule 10 action 'accept'\n"
+        "set firewall ipv4 name X rule 99 action 'accept'\n"
+        "set firewall ipv4 name X rule 99 source address '10.0.0.99'\n",
+        "diff": "changed",
+    }
+
+    push_config(connection_string, delta_session, delta=True)
+
+    # The curly-brace get_config output is not used for the delta
+    assert fake_napalm.candidates["192.168.1.1"] == (
+        "delete firewall ipv4 name X rule 99\n"
+    )
+    driver = napalm_pool_get(napalm_pool_key(connection_string))
+    assert driver.device.commands == [RUNNING_CONFIG_COMMAND]
+
+
+def test_push_config_delta_without_running_commands(
+    connection_string, delta_session, fake_napalm
+):
+    from package.napalm_ssh_functions import push_config
+
+    fake_napalm.devices["192.168.1.1"] = {
+        "running": "firewall {\n    ipv4 {\n    }\n}\n",
+        "diff": "changed",
+    }
+
+    push_config(connection_string, delta_session, delta=True)
+
+    # Falls back to the full file, including its 'delete firewall'
+    with open(f"{delta_session['data_dir']}/fw1.conf") as f:
+        assert fake_napalm.candidates["192.168.1.1"] == f.read()
+
+
+def test_push_config_delta_unchanged(connection_string, delta_session, fake_napalm):
+    from package.napalm_ssh_functions import push_config
+
+    fake_napalm.devices["192.168.1.1"] = {
+        "running": "set firewall ipv4 name X default-action drop\n"
+        "set firewall ipv4 name X rule 10 action accept\n",
+    }
+
+    result = push_config(connection_string, delta_session, commit=True, delta=True)
+
+    assert result == "No configuration changes to commit."
+    assert fake_napalm.candidates == {}
+    assert fake_napalm.committed == []
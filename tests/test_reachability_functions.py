@@ -0,0 +1,121 @@
+"""
+Tests for package/reachability_functions.py
+
+Covers: probe_host, probe_hosts, check_reachability and the reachability
+        monitor, against listening and closed local sockets.
+"""
+
+import socket
+import time
+
+import pytest
+
+import package.reachability_functions as reachability_functions
+from package.cache_functions import reachability_cache_clear, reachability_cache_get
+from package.reachability_functions import (
+    check_reachability,
+    probe_host,
+    probe_hosts,
+    stop_reachability_monitor,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_monitor(monkeypatch):
+    monkeypatch.setenv("REACHABILITY_INTERVAL", "1")
+    monkeypatch.setenv("REACHABILITY_PROBE_TIMEOUT", "1")
+    reachability_cache_clear()
+    yield
+    stop_reachability_monitor()
+    reachability_cache_clear()
+
+
+@pytest.fixture
+def listening_port():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield str(server.getsockname()[1])
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    port = str(server.getsockname()[1])
+    server.close()
+    return port
+
+
+def _wait_for_result(hostname, port, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        cached = reachability_cache_get(hostname, port)
+        if cached is not None:
+            return cached[0]
+        time.sleep(0.05)
+    return None
+
+
+class TestProbeHost:
+    def test_listening(self, listening_port):
+        assert probe_host("127.0.0.1", listening_port) is True
+
+    def test_closed(self, closed_port):
+        assert probe_host("127.0.0.1", closed_port) is False
+
+    def test_invalid_port(self):
+        assert probe_host("127.0.0.1", "None") is False
+
+
+class TestProbeHosts:
+    def test_caches_results(self, listening_port, closed_port):
+        probe_hosts([("127.0.0.1", listening_port), ("127.0.0.1", closed_port)])
+
+        assert reachability_cache_get("127.0.0.1", listening_port)[0] is True
+        assert reachability_cache_get("127.0.0.1", closed_port)[0] is False
+
+
+class TestCheckReachability:
+    def test_returns_without_waiting(self, listening_port, monkeypatch):
+        def slow_probe(hostname, port, timeout=None):
+            time.sleep(0.5)
+            return True
+
+        monkeypatch.setattr(reachability_functions, "probe_host", slow_probe)
+
+        started = time.monotonic()
+        assert check_reachability("127.0.0.1", listening_port) is None
+        assert time.monotonic() - started < 0.5
+
+        assert _wait_for_result("127.0.0.1", listening_port) is True
+        assert check_reachability("127.0.0.1", listening_port) is True
+
+    def test_monitor_reprobes(self, listening_port, monkeypatch):
+        calls = []
+
+        def counting_probe(hostname, port, timeout=None):
+            calls.append((hostname, port))
+            return True
+
+        monkeypatch.setattr(reachability_functions, "probe_host", counting_probe)
+
+        check_reachability("127.0.0.1", listening_port)
+        deadline = time.monotonic() + 5
+        while len(calls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert len(calls) >= 3
+        assert set(calls) == {("127.0.0.1", listening_port)}
+
+    def test_monitor_drops_unchecked_hosts(self, closed_port, monkeypatch):
+        monkeypatch.setenv("REACHABILITY_WATCH_TTL", "0")
+
+        check_reachability("127.0.0.1", closed_port)
+        assert _wait_for_result("127.0.0.1", closed_port) is False
+
+        deadline = time.monotonic() + 5
+        while reachability_functions._watched and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert reachability_functions._watched == {}
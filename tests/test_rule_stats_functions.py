@@ -0,0 +1,297 @@
+"""
+Tests for package/rule_stats_functions.py
+
+Covers: parse_firewall_statistics, record_rule_counters, downsample_rule_hits,
+        rank_rules_by_hits, never_hit_rules, collect_rule_hits and the
+        rule counter collector, against a mongomock rule hit store.
+"""
+
+import time
+from unittest.mock import patch
+
+import mongomock
+import pytest
+
+from package.rule_stats_functions import (
+    STATISTICS_COMMAND,
+    collect_rule_hits,
+    downsample_rule_hits,
+    never_hit_rules,
+    parse_firewall_statistics,
+    rank_rules_by_hits,
+    record_rule_counters,
+    rule_hit_collector_status,
+    start_rule_hit_collector,
+    stop_rule_hit_collector,
+)
+
+STATISTICS = """Rule Information
+
+---------------------------------
+ipv4 Firewall "forward filter"
+
+Rule     Packets    Bytes    Action    Source    Destination    Inbound-Interface    Outbound-interface
+-------  ---------  -------  --------  --------  -------------  -------------------  --------------------
+20       {hits}         1200     jump      any       any            eth0                 any
+default  N/A        N/A      accept    any       any            any                  any
+
+---------------------------------
+ipv4 Firewall "name WAN_IN"
+
+Rule     Packets    Bytes    Action    Source    Destination    Inbound-Interface    Outbound-interface
+-------  ---------  -------  --------  --------  -------------  -------------------  --------------------
+10       0          0        accept    any       any            any                  any
+default  3          180      drop      any       any            any                  any
+"""
+
+# Start of yesterday, so buckets and hours line up with round numbers and
+#   buckets are not expired by the TTL index.
+DAY = int(time.time()) // 86400 * 86400 - 86400
+
+FORWARD = "ipv4 forward filter rule 20"
+WAN = "ipv4 name WAN_IN rule 10"
+
+
+@pytest.fixture
+def rule_store(monkeypatch):
+    """Provide a mongomock client patched into data_file_functions."""
+    client = mongomock.MongoClient()
+    monkeypatch.setattr("package.data_file_functions._get_mongo_client", lambda: client)
+    monkeypatch.setattr("package.data_file_functions._rule_stats_indexed", False)
+    monkeypatch.setenv("MONGODB_DATABASE", "test_db")
+    monkeypatch.delenv("RULE_STATS_MONGO_DATABASE", raising=False)
+    return client["test_db_rule_stats"]
+
+
+def _record(firewall, samples, username="testuser"):
+    """Records (offset, {rule: (packets, bytes)}) counters read on DAY."""
+    for offset, counters in samples:
+        record_rule_counters(username, firewall, counters, DAY + offset)
+
+
+class TestParseFirewallStatistics:
+    def test_rules_and_defaults(self):
+        assert parse_firewall_statistics(STATISTICS.format(hits=15)) == {
+            FORWARD: (15, 1200),
+            WAN: (0, 0),
+            "ipv4 name WAN_IN default-action": (3, 180),
+        }
+
+    def test_no_rulesets(self):
+        assert parse_firewall_statistics("Rule  Packets  Bytes\n10  1  2\n") == {}
+
+
+class TestRecordRuleCounters:
+    def test_first_read_is_baseline(self, rule_store):
+        assert record_rule_counters("testuser", "fw1", {WAN: (5, 500)}, DAY) is None
+        assert rule_store["rule_hit_buckets"].count_documents({}) == 0
+        assert rule_store["rule_hit_counters"].count_documents({}) == 1
+
+    def test_columnar_bucket(self, rule_store):
+        _record(
+            "fw1",
+            [
+                (0, {WAN: (5, 500)}),
+                (300, {WAN: (8, 800)}),
+                (600, {WAN: (8, 800), FORWARD: (2, 100)}),
+            ],
+        )
+
+        bucket = rule_store["rule_hit_buckets"].find_one()
+        assert bucket["resolution"] == "raw"
+        assert (bucket["start"], bucket["end"]) == (DAY, DAY + 3600)
+        assert bucket["times"] == [300, 600]
+        assert bucket["rules"] == [WAN, FORWARD]
+        assert bucket["packets"] == [[3, 0], [0, 2]]
+        assert bucket["bytes"] == [[300, 0], [0, 100]]
+
+    def test_counter_reset(self, rule_store):
+        _record("fw1", [(0, {WAN: (50, 5000)})])
+        increases = record_rule_counters("testuser", "fw1", {WAN: (4, 400)}, DAY + 60)
+        assert increases == {WAN: (4, 400)}
+
+    def test_new_bucket_per_hour(self, rule_store, monkeypatch):
+        monkeypatch.setenv("RULE_STATS_BUCKET_SECONDS", "3600")
+        _record(
+            "fw1", [(0, {WAN: (0, 0)}), (300, {WAN: (1, 1)}), (3900, {WAN: (2, 2)})]
+        )
+        assert rule_store["rule_hit_buckets"].count_documents({}) == 2
+
+
+class TestDownsampleRuleHits:
+    def test_merges_into_hourly(self, rule_store):
+        _record(
+            "fw1",
+            [
+                (0, {WAN: (0, 0)}),
+                (300, {WAN: (1, 10)}),
+                (600, {WAN: (3, 30)}),
+                (3900, {WAN: (7, 70)}),
+            ],
+        )
+        since = DAY - 1
+
+        before = rank_rules_by_hits("testuser", since)
+        assert downsample_rule_hits("testuser", before=DAY + 2 * 3600) == 2
+
+        buckets = list(rule_store["rule_hit_buckets"].find())
+        assert len(buckets) == 1
+        assert buckets[0]["resolution"] == "hourly"
+        assert (buckets[0]["start"], buckets[0]["end"]) == (DAY, DAY + 86400)
+        assert buckets[0]["times"] == [0, 3600]
+        assert buckets[0]["packets"] == [[3, 4]]
+        # Totals are unchanged by downsampling.
+        assert rank_rules_by_hits("testuser", since) == before
+
+    def test_keeps_recent_buckets(self, rule_store):
+        _record("fw1", [(0, {WAN: (0, 0)}), (300, {WAN: (1, 10)})])
+        assert downsample_rule_hits("testuser", before=DAY + 1800) == 0
+        assert rule_store["rule_hit_buckets"].find_one()["resolution"] == "raw"
+
+
+class TestRankRulesByHits:
+    def test_ranks_across_fleet(self, rule_store):
+        _record("fw1", [(0, {WAN: (0, 0)}), (300, {WAN: (10, 100)})])
+        _record("fw2", [(0, {WAN: (0, 0)}), (300, {WAN: (20, 200)})])
+
+        assert rank_rules_by_hits("testuser", DAY) == [
+            {"firewall": "fw2", "rule": WAN, "packets": 20, "bytes": 200},
+            {"firewall": "fw1", "rule": WAN, "packets": 10, "bytes": 100},
+        ]
+        assert len(rank_rules_by_hits("testuser", DAY, limit=1)) == 1
+        assert (
+            rank_rules_by_hits("testuser", DAY, firewalls=["fw1"])[0]["packets"] == 10
+        )
+        assert rank_rules_by_hits("otheruser", DAY) == []
+
+    def test_window(self, rule_store):
+        _record(
+            "fw1",
+            [(0, {WAN: (0, 0)}), (300, {WAN: (1, 1)}), (600, {WAN: (3, 3)})],
+        )
+        assert rank_rules_by_hits("testuser", DAY + 301)[0]["packets"] == 2
+        assert rank_rules_by_hits("testuser", DAY, until=DAY + 301)[0]["packets"] == 1
+
+
+class TestNeverHitRules:
+    def test_lists_unused_rules(self, rule_store):
+        _record(
+            "fw1",
+            [
+                (0, {WAN: (0, 0), FORWARD: (0, 0)}),
+                (300, {WAN: (0, 0), FORWARD: (5, 50)}),
+            ],
+        )
+        _record(
+            "fw2",
+            [
+                (0, {WAN: (0, 0), FORWARD: (0, 0)}),
+                (300, {WAN: (0, 0), FORWARD: (0, 0)}),
+            ],
+        )
+
+        assert never_hit_rules("testuser", DAY) == [
+            {"rule": FORWARD, "firewalls": ["fw2"], "fleet_wide": False},
+            {"rule": WAN, "firewalls": ["fw1", "fw2"], "fleet_wide": True},
+        ]
+
+    def test_deleted_rules_not_listed(self, rule_store):
+        _record(
+            "fw1",
+            [
+                (0, {WAN: (0, 0), FORWARD: (0, 0)}),
+                (300, {WAN: (0, 0), FORWARD: (0, 0)}),
+                (600, {WAN: (0, 0)}),
+            ],
+        )
+        assert [row["rule"] for row in never_hit_rules("testuser", DAY)] == [WAN]
+
+
+class TestCollectRuleHits:
+    def test_collects_configured_firewalls(self, rule_store, mock_session):
+        targets = [
+            {
+                "firewall": "fw1",
+                "hostname": "10.0.0.1",
+                "port": "22",
+                "configured": True,
+            },
+            {
+                "firewall": "fw2",
+                "hostname": "None",
+                "port": "None",
+                "configured": False,
+            },
+            {
+                "firewall": "fw3",
+                "hostname": "10.0.0.3",
+                "port": "22",
+                "configured": True,
+            },
+        ]
+
+        def command(connection_string, session, op_command):
+            assert op_command == STATISTICS_COMMAND
+            if connection_string["hostname"] == "10.0.0.3":
+                raise OSError("unreachable")
+            return STATISTICS.format(hits=15)
+
+        with patch(
+            "package.rule_stats_functions.list_fleet_targets", return_value=targets
+        ), patch(
+            "package.rule_stats_functions.operational_command", side_effect=command
+        ) as mock_command:
+            results = collect_rule_hits({"username": "vyos"}, mock_session)
+
+        assert [(r["firewall"], r["status"]) for r in results] == [
+            ("fw1", "ok"),
+            ("fw3", "error"),
+        ]
+        assert results[0]["rules"] == 3
+        assert results[1]["message"] == "unreachable"
+        assert mock_command.call_count == 2
+        assert rule_store["rule_hit_counters"].count_documents({}) == 1
+
+
+class TestRuleHitCollector:
+    @pytest.fixture(autouse=True)
+    def reset_collector(self, monkeypatch):
+        monkeypatch.setenv("RULE_STATS_INTERVAL", "1")
+        yield
+        stop_rule_hit_collector()
+
+    def _wait_for_collections(self, calls, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(calls) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def test_collects_on_schedule(self, mock_session):
+        calls = []
+
+        def collect(connection_string, session):
+            calls.append(session["username"])
+            return [{"firewall": "fw1", "status": "ok", "message": "ok"}]
+
+        with patch(
+            "package.rule_stats_functions.collect_rule_hits", side_effect=collect
+        ):
+            start_rule_hit_collector({"username": "vyos"}, mock_session)
+            self._wait_for_collections(calls, 2)
+
+            status = rule_hit_collector_status("testuser")
+            assert status["collecting"] is True
+            assert status["time"] is not None
+            assert status["results"][0]["firewall"] == "fw1"
+
+            stop_rule_hit_collector("testuser")
+            assert rule_hit_collector_status("testuser")["collecting"] is False
+
+        assert len(calls) >= 2
+        assert set(calls) == {"testuser"}
+
+    def test_not_collecting(self):
+        assert rule_hit_collector_status("testuser") == {
+            "collecting": False,
+            "time": None,
+            "results": [],
+        }
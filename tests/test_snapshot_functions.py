@@ -0,0 +1,491 @@
+"""
+Tests for package/snapshot_functions.py
+
+Covers: make_patch, apply_patch, snapshot_content, read_snapshot,
+        read_snapshot_series, write_snapshot, tag_snapshot_document, delete_snapshot,
+        migrate_snapshots and the keyframe cache.
+"""
+
+import copy
+
+import bson
+import mongomock
+import pytest
+
+from package.cache_functions import keyframe_cache_clear, keyframe_cache_get
+from package.data_file_functions import USER_COLLECTION_INDEXES
+from package.snapshot_functions import (
+    apply_patch,
+    delete_snapshot,
+    make_patch,
+    migrate_snapshots,
+    read_snapshot,
+    read_snapshot_series,
+    snapshot_content,
+    tag_snapshot_document,
+    write_snapshot,
+)
+
+# ---------------------------------------------------------------------------
+# Fixtures
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture(autouse=True)
+def clear_keyframe_cache():
+    keyframe_cache_clear()
+    yield
+    keyframe_cache_clear()
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient()["test_db"]["testuser"]
+
+
+def make_config(rules):
+    """Configuration with a number of rules and a padding group, so deltas of
+    one rule are much smaller than the configuration."""
+    return {
+        "version": "1",
+        "system": {"hostname": "fw1", "port": 22},
+        "ipv4": {
+            "chains": {
+                "filter": {
+                    "WAN_LOCAL": {
+                        "default": {"default_action": "drop"},
+                        "rule-order": list(range(10, 10 * rules + 10, 10)),
+                        "rules": {
+                            str(n): {"description": f"rule {n}", "action": "accept"}
+                            for n in range(10, 10 * rules + 10, 10)
+                        },
+                    }
+                }
+            },
+            "groups": {
+                "network-group": {
+                    "LAN": {"network": [f"10.{n}.0.0/16" for n in range(50)]}
+                }
+            },
+        },
+    }
+
+
+def same_document(a, b):
+    """Equal including key order, as generate_config emits in key order."""
+    return bson.encode(a) == bson.encode(b)
+
+
+# ---------------------------------------------------------------------------
+# make_patch / apply_patch
+# ---------------------------------------------------------------------------
+
+
+class TestPatch:
+    def test_round_trip(self):
+        old = make_config(3)
+        new = make_config(4)
+        new["ipv4"]["groups"]["network-group"]["LAN"]["description"] = "lan"
+        del new["system"]["port"]
+
+        patch = make_patch(old, new)
+        assert same_document(apply_patch(copy.deepcopy(old), patch), new)
+
+    def test_identical_is_empty(self):
+        assert make_patch(make_config(2), make_config(2)) == []
+
+    def test_escapes_pointer_characters(self):
+        old = {"groups": {"10.0.0.0/8": {"a~b": 1}}}
+        new = {"groups": {"10.0.0.0/8": {"a~b": 2}}}
+
+        patch = make_patch(old, new)
+        assert patch == [
+            {"op": "replace", "path": "/groups/10.0.0.0~18/a~0b", "value": 2}
+        ]
+        assert apply_patch(copy.deepcopy(old), patch) == new
+
+    def test_bool_and_int_differ(self):
+        patch = make_patch({"log": 1}, {"log": True})
+        assert apply_patch({"log": 1}, patch)["log"] is True
+
+    def test_preserves_key_order(self):
+        old = {"ipv4": {"a": 1}, "ipv6": {"b": 1}}
+        new = {"ipv6": {"b": 1}, "ipv4": {"a": 2}}
+
+        result = apply_patch(copy.deepcopy(old), make_patch(old, new))
+        assert list(result) == ["ipv6", "ipv4"]
+        assert result == new
+
+    def test_lists_replaced_whole(self):
+        patch = make_patch({"order": [10, 20]}, {"order": [20, 10]})
+        assert patch == [{"op": "replace", "path": "/order", "value": [20, 10]}]
+
+    def test_replace_of_missing_key_raises(self):
+        with pytest.raises(KeyError):
+            apply_patch({}, [{"op": "replace", "path": "/a", "value": 1}])
+
+
+class TestSnapshotContent:
+    def test_strips_identifying_and_store_fields(self):
+        doc = {
+            "_id": 1,
+            "firewall": "fw1",
+            "snapshot": "s1",
+            "tag": "t",
+            "seq": 1,
+            "depth": 0,
+            "keyframe": True,
+            "rev": 2,
+            "version": "1",
+        }
+        assert snapshot_content(doc) == {"version": "1"}
+
+
+# ---------------------------------------------------------------------------
+# Store
+# ---------------------------------------------------------------------------
+
+
+class TestWriteReadSnapshot:
+    def test_first_snapshot_is_keyframe(self, collection):
+        write_snapshot(collection, "fw1", "s1", make_config(1))
+
+        doc = collection.find_one({"snapshot": "s1"})
+        assert doc["keyframe"] is True
+        assert doc["seq"] == 1
+        assert doc["ipv4"] == make_config(1)["ipv4"]
+
+    def test_small_change_is_delta(self, collection):
+        write_snapshot(collection, "fw1", "s1", make_config(1))
+        write_snapshot(collection, "fw1", "s2", make_config(2))
+
+        doc = collection.find_one({"snapshot": "s2"})
+        assert "delta" in doc
+        assert "ipv4" not in doc
+        assert doc["seq"] == 2
+
+    def test_series_reads_back(self, collection):
+        for n in range(1, 26):
+            write_snapshot(collection, "fw1", f"s{n}", make_config(n))
+
+        for n in range(1, 26):
+            snapshot = read_snapshot(collection, "fw1", f"s{n}")
+            assert snapshot["firewall"] == "fw1"
+            assert snapshot["snapshot"] == f"s{n}"
+            assert same_document(snapshot_content(snapshot), make_config(n))
+
+    def test_keyframe_interval(self, collection, monkeypatch):
+        monkeypatch.setenv("SNAPSHOT_KEYFRAME_INTERVAL", "5")
+        for n in range(1, 13):
+            write_snapshot(collection, "fw1", f"s{n}", make_config(n))
+
+        keyframes = [d["seq"] for d in collection.find({"keyframe": True})]
+        assert keyframes == [1, 6, 11]
+
+    def test_large_change_is_keyframe(self, collection):
+        write_snapshot(collection, "fw1", "s1", {"version": "1", "a": "x"})
+        write_snapshot(collection, "fw1", "s2", {"version": "1", "b": "y" * 100})
+
+        assert collection.find_one({"snapshot": "s2"})["keyframe"] is True
+
+    def test_tag_is_stored(self, collection):
+        write_snapshot(collection, "fw1", "s1", {**make_config(1), "tag": "before"})
+
+        snapshot = read_snapshot(collection, "fw1", "s1")
+        assert snapshot["tag"] == "before"
+        assert "tag" not in snapshot_content(snapshot)
+
+    def test_firewalls_are_separate_series(self, collection):
+        write_snapshot(collection, "fw1", "s1", make_config(1))
+        write_snapshot(collection, "fw2", "s1", make_config(3))
+        write_snapshot(collection, "fw2", "s2", make_config(4))
+
+        assert collection.find_one({"firewall": "fw2", "snapshot": "s1"})["seq"] == 1
+        assert same_document(
+            snapshot_content(read_snapshot(collection, "fw2", "s2")), make_config(4)
+        )
+
+    def test_concurrent_writer_takes_sequence(self, collection):
+        collection.create_index(
+            [("firewall", 1), ("seq", 1)],
+            partialFilterExpression={"seq": {"$exists": True}},
+            unique=True,
+        )
+        write_snapshot(collection, "fw1", "s1", make_config(1))
+
+        class RacingCollection:
+            """Lets another writer append s2 right after the latest snapshot
+            is read for s3."""
+
+            raced = False
+
+            def __getattr__(self, name):
+                return getattr(collection, name)
+
+            def find_one(self, *args, **kwargs):
+                doc = collection.find_one(*args, **kwargs)
+                if "sort" in kwargs and not self.raced:
+                    self.raced = True
+                    write_snapshot(collection, "fw1", "s2", make_config(2))
+                return doc
+
+        write_snapshot(RacingCollection(), "fw1", "s3", make_config(3))
+
+        seqs = {d["snapshot"]: d["seq"] for d in collection.find({"firewall": "fw1"})}
+        assert seqs == {"s1": 1, "s2": 2, "s3": 3}
+        for n in (2, 3):
+            assert same_document(
+                snapshot_content(read_snapshot(collection, "fw1", f"s{n}")),
+                make_config(n),
+            )
+
+    def test_read_missing(self, collection):
+        assert read_snapshot(collection, "fw1", "nope") is None
+
+    def test_keyframe_is_cached(self, collection):
+        write_snapshot(collection, "fw1", "s1", make_config(1))
+        write_snapshot(collection, "fw1", "s2", make_config(2))
+        keyframe = collection.find_one({"snapshot": "s1"})
+
+        read_snapshot(collection, "fw1", "s2")
+        assert keyframe_cache_get(
+            ("testuser", str(keyframe["_id"]))
+        ) == snapshot_content(keyframe)
+
+    def test_rewrite_middle_snapshot_rebases_next(self, collection):
+        for n in range(1, 4):
+            write_snapshot(collection, "fw1", f"s{n}", make_config(n))
+
+        changed = make_config(2)
+        changed["system"]["hostname"] = "renamed"
+        write_snapshot(collection, "fw1", "s2", changed)
+
+        assert collection.count_documents({"firewall": "fw1"}) == 3
+        assert same_document(
+            snapshot_content(read_snapshot(collection, "fw1", "s2")), changed
+        )
+        assert same_document(
+            snapshot_content(read_snapshot(collection, "fw1", "s3")), make_config(3)
+        )
+
+    def test_legacy_snapshot_rewritten_in_place(self, collection):
+        collection.insert_one({"firewall": "fw1", "snapshot": "old", "tag": "t"})
+
+        write_snapshot(collection, "fw1", "old", make_config(1))
+
+        doc = collection.find_one({"snapshot": "old"})
+        assert "seq" not in doc
+        assert doc["tag"] == "t"
+        assert doc["ipv4"] == make_config(1)["ipv4"]
+
+
+class TestReadSnapshotSeries:
+    def test_matches_read_snapshot(self, collection):
+        for n in range(1, 26):
+            data = make_config(n)
+            if n % 7 == 0:
+                data["tag"] = f"tag {n}"
+            write_snapshot(collection, "fw1", f"s{n}", data)
+        write_snapshot(collection, "fw2", "other", make_config(30))
+
+        series = read_snapshot_series(collection, "fw1")
+
+        assert [snapshot["snapshot"] for snapshot in series] == [
+            f"s{n}" for n in range(1, 26)
+        ]
+        for snapshot in series:
+            expected = read_snapshot(collection, "fw1", snapshot["snapshot"])
+            assert snapshot == expected
+            assert same_document(snapshot_content(snapshot), snapshot_content(expected))
+
+    def test_last(self, collection):
+        for n in range(1, 16):
+            write_snapshot(collection, "fw1", f"s{n}", make_config(n))
+
+        series = read_snapshot_series(collection, "fw1", last=3)
+
+        assert [snapshot["snapshot"] for snapshot in series] == ["s13", "s14", "s15"]
+        assert same_document(snapshot_content(series[0]), make_config(13))
+        assert read_snapshot_series(collection, "fw1", last=0) == []
+        assert read_snapshot_series(collection, "fw1", last=50)[0]["snapshot"] == "s1"
+
+    def test_one_query_stopping_at_keyframe(self, collection, monkeypatch):
+        for n in range(1, 16):
+            write_snapshot(collection, "fw1", f"s{n}", make_config(n))
+        fetched = []
+        find = collection.find
+
+        def counting_find(*args, **kwargs):
+            cursor = find(*args, **kwargs)
+            fetched.append(cursor)
+            return cursor
+
+        monkeypatch.setattr(collection, "find", counting_find)
+        monkeypatch.setattr(collection, "find_one", None)
+
+        read_snapshot_series(collection, "fw1", last=3)
+
+        # s11 is the keyframe s13..s15 are rebuilt from
+        assert len(fetched) == 1
+        assert collection.find_one is None
+
+    def test_legacy_documents(self, collection):
+        collection.insert_one({"firewall": "fw1", "snapshot": "old", **make_config(1)})
+
+        series = read_snapshot_series(collection, "fw1")
+
+        assert [snapshot["snapshot"] for snapshot in series] == ["old"]
+        assert same_document(snapshot_content(series[0]), make_config(1))
+
+    def test_empty(self, collection):
+        assert read_snapshot_series(collection, "fw1") == []
+
+
+class TestTagSnapshotDocument:
+    def test_sets_tag_only(self, collection):
+        write_snapshot(collection, "fw1", "s1", make_config(1))
+        write_snapshot(collection, "fw1", "s2", make_config(2))
+        before = collection.find_one({"snapshot": "s2"})
+
+        assert tag_snapshot_document(collection, "fw1", "s2", "release") is True
+
+        after = collection.find_one({"snapshot": "s2"})
+        assert after["tag"] == "release"
+        assert after["delta"] == before["delta"]
+
+    def test_missing(self, collection):
+        assert tag_snapshot_document(collection, "fw1", "nope", "x") is False
+
+
+class TestDeleteSnapshot:
+    def write_series(self, collection, count):
+        for n in range(1, count + 1):
+            write_snapshot(collection, "fw1", f"s{n}", make_config(n))
+
+    def test_delete_delta_rebases_next(self, collection):
+        self.write_series(collection, 4)
+
+        assert delete_snapshot(collection, "fw1", "s2") == 1
+
+        assert read_snapshot(collection, "fw1", "s2") is None
+        for n in (1, 3, 4):
+            assert same_document(
+                snapshot_content(read_snapshot(collection, "fw1", f"s{n}")),
+                make_config(n),
+            )
+
+    def test_delete_keyframe_promotes_next(self, collection):
+        self.write_series(collection, 3)
+
+        delete_snapshot(collection, "fw1", "s1")
+
+        assert collection.find_one({"snapshot": "s2"})["keyframe"] is True
+        for n in (2, 3):
+            assert same_document(
+                snapshot_content(read_snapshot(collection, "fw1", f"s{n}")),
+                make_config(n),
+            )
+
+    def test_delete_cached_keyframe(self, collection):
+        self.write_series(collection, 3)
+        read_snapshot(collection, "fw1", "s3")
+        keyframe = collection.find_one({"snapshot": "s1"})
+
+        delete_snapshot(collection, "fw1", "s1")
+
+        assert keyframe_cache_get(("testuser", str(keyframe["_id"]))) is None
+        assert same_document(
+            snapshot_content(read_snapshot(collection, "fw1", "s3")), make_config(3)
+        )
+
+    def test_delete_latest(self, collection):
+        self.write_series(collection, 2)
+
+        delete_snapshot(collection, "fw1", "s2")
+        write_snapshot(collection, "fw1", "s3", make_config(3))
+
+        assert same_document(
+            snapshot_content(read_snapshot(collection, "fw1", "s3")), make_config(3)
+        )
+
+    def test_delete_legacy(self, collection):
+        collection.insert_one({"firewall": "fw1", "snapshot": "old", "version": "1"})
+
+        assert delete_snapshot(collection, "fw1", "old") == 1
+        assert collection.count_documents({}) == 0
+
+    def test_delete_missing(self, collection):
+        assert delete_snapshot(collection, "fw1", "nope") == 0
+
+
+class TestMigrateSnapshots:
+    def test_migrates_full_documents(self, collection):
+        collection.insert_one({"_id": "fw1", **make_config(9)})
+        for n in range(1, 6):
+            collection.insert_one(
+                {"firewall": "fw1", "snapshot": f"s{n}", "rev": 1, **make_config(n)}
+            )
+
+        assert migrate_snapshots(collection) == 5
+
+        docs = list(collection.find({"snapshot": {"$exists": True}}).sort("seq", 1))
+        assert [d["seq"] for d in docs] == [1, 2, 3, 4, 5]
+        assert docs[0]["keyframe"] is True
+        assert all("delta" in d for d in docs[1:])
+        for n in range(1, 6):
+            assert same_document(
+                snapshot_content(read_snapshot(collection, "fw1", f"s{n}")),
+                make_config(n),
+            )
+        # The current document is not a snapshot.
+        assert "seq" not in collection.find_one({"_id": "fw1"})
+
+    def test_keeps_tags(self, collection):
+        collection.insert_one(
+            {"firewall": "fw1", "snapshot": "s1", "tag": "gold", **make_config(1)}
+        )
+
+        migrate_snapshots(collection)
+
+        assert read_snapshot(collection, "fw1", "s1")["tag"] == "gold"
+
+    def test_is_idempotent(self, collection):
+        for n in range(1, 4):
+            collection.insert_one(
+                {"firewall": "fw1", "snapshot": f"s{n}", **make_config(n)}
+            )
+        migrate_snapshots(collection)
+
+        assert migrate_snapshots(collection) == 0
+
+    def test_mixed_series(self, collection):
+        # Snapshots a and b are in the delta store, c was written as a full
+        #   document by an older replica, then d was appended after b.
+        for keys, options in USER_COLLECTION_INDEXES:
+            collection.create_index(keys, **options)
+        write_snapshot(collection, "fw1", "a", make_config(1))
+        write_snapshot(collection, "fw1", "b", make_config(2))
+        collection.insert_one({"firewall": "fw1", "snapshot": "c", **make_config(3)})
+        write_snapshot(collection, "fw1", "d", make_config(4))
+
+        assert migrate_snapshots(collection) == 4
+
+        docs = list(collection.find({"snapshot": {"$exists": True}}).sort("seq", 1))
+        assert [d["snapshot"] for d in docs] == ["a", "b", "c", "d"]
+        assert [d["seq"] for d in docs] == [4, 5, 6, 7]
+        for n, name in enumerate("abcd", start=1):
+            assert same_document(
+                snapshot_content(read_snapshot(collection, "fw1", name)),
+                make_config(n),
+            )
+
+    def test_appends_after_migration(self, collection):
+        collection.insert_one({"firewall": "fw1", "snapshot": "s1", **make_config(1)})
+        migrate_snapshots(collection)
+
+        write_snapshot(collection, "fw1", "s2", make_config(2))
+
+        assert collection.find_one({"snapshot": "s2"})["seq"] == 2
+        assert same_document(
+            snapshot_content(read_snapshot(collection, "fw1", "s2")), make_config(2)
+        )